@@ -0,0 +1,109 @@
+"""Per-call overhead of the native bindings.
+
+Compares the direct CPython bindings in ``singler._core`` with the ctypes
+bindings in ``singler._cpphelpers`` for the same native functions, using a
+small reference so that the time is dominated by the binding itself. Also
+reports the time to convert the markers to and from the native
+representation, which involves one call per pair of labels for the per-pair
+accessors.
+
+Usage::
+
+    python benchmarks/bindings.py [--labels 20] [--iterations 5000]
+"""
+
+import argparse
+import time
+
+import numpy
+import singler
+from mattress import tatamize
+from singler import _core
+from singler import _cpphelpers as lib
+from singler._Markers import _Markers
+from singler._utils import _row_pointers
+
+
+def _time(fun, iterations):
+    fun()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fun()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--labels", type=int, default=20, help="number of labels in the reference")
+    parser.add_argument("--genes", type=int, default=50, help="number of genes in the reference")
+    parser.add_argument("--iterations", type=int, default=5000, help="number of calls to time")
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(42)
+    ref = rng.random((args.genes, args.labels * 2))
+    labels = [str(i % args.labels) for i in range(args.labels * 2)]
+    features = [str(i) for i in range(args.genes)]
+    built = singler.build_single_reference(ref, labels, features, approximate=False, num_threads=1)
+
+    subset = built.marker_subset(indices_only=True)
+    mat = tatamize(rng.random((args.genes, 1)))
+    scores = numpy.ndarray((built.num_labels(), 1), dtype=numpy.float64)
+    best = numpy.ndarray(1, dtype=numpy.int32)
+    delta = numpy.ndarray(1, dtype=numpy.float64)
+    top_labels = numpy.ndarray((1, 0), dtype=numpy.int32)
+    top_scores = numpy.ndarray((1, 0), dtype=numpy.float64)
+    common = dict(
+        quantile=0.8,
+        use_fine_tune=False,
+        fine_tune_threshold=0.05,
+        nthreads=1,
+        best=best,
+        delta=delta,
+        tile_size=0,
+        pin_threads=False,
+        top_k=0,
+        top_labels=top_labels,
+        top_scores=top_scores,
+        num_candidates=0,
+        monitor=None,
+    )
+
+    def with_ctypes():
+        ptrs = _row_pointers(scores, 0)
+        lib.classify_single_reference(
+            mat.ptr, subset, built._ptr, scores=ptrs.ctypes.data, centroids=numpy.ndarray(0), **common
+        )
+
+    def with_extension():
+        _core.classify_single_reference(mat.ptr, subset, built._ptr, scores=scores, centroids=None, **common)
+
+    print("classify_single_reference(), 1 cell:")
+    print("  ctypes:    %8.1f us" % (_time(with_ctypes, args.iterations) * 1e6))
+    print("  extension: %8.1f us" % (_time(with_extension, args.iterations) * 1e6))
+
+    markers = _Markers.from_dict(built.markers, built.labels, features)
+    nl = built.num_labels()
+
+    def per_pair_ctypes():
+        for i in range(nl):
+            for j in range(nl):
+                output = numpy.ndarray(lib.get_nmarkers_for_pair(markers._ptr, i, j), dtype=numpy.int32)
+                lib.get_markers_for_pair(markers._ptr, i, j, output)
+
+    def per_pair_extension():
+        for i in range(nl):
+            for j in range(nl):
+                markers.get(i, j)
+
+    def round_trip():
+        _Markers.from_dict(built.markers, built.labels, features).to_dict(built.labels, features)
+
+    iterations = max(1, args.iterations // 100)
+    print("markers for all %d pairs of labels:" % (nl * nl))
+    print("  get per pair, ctypes:    %8.3f ms" % (_time(per_pair_ctypes, iterations) * 1e3))
+    print("  get per pair, extension: %8.3f ms" % (_time(per_pair_extension, iterations) * 1e3))
+    print("  from_dict() + to_dict(): %8.3f ms" % (_time(round_trip, iterations) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
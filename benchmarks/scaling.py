@@ -0,0 +1,109 @@
+"""Scaling of classify_single_reference() with the number of threads.
+
+Times the classification of a random test matrix against a random reference
+for each combination of the number of threads, the tile size and whether the
+worker threads are pinned, and reports the speed-up over a single thread with
+the default schedule. With ``--concurrent``, several classifications are run
+at the same time from different Python threads, e.g., to check that pinned
+workers of concurrent calls are placed on different CPUs; the reported time is
+then the wall time for all concurrent calls to finish.
+
+Usage::
+
+    python benchmarks/scaling.py [--threads 1,2,4,8] [--tile-sizes none,auto,256] [--concurrent 2]
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy
+import singler
+
+
+def _int_list(x):
+    return [int(y) for y in x.split(",")]
+
+
+def _tile_list(x):
+    return [None if y == "none" else (y if y == "auto" else int(y)) for y in x.split(",")]
+
+
+def _time(fun, concurrent, repeats):
+    def run():
+        for _ in range(repeats):
+            fun()
+
+    fun()
+    start = time.perf_counter()
+    if concurrent == 1:
+        run()
+    else:
+        workers = [threading.Thread(target=run) for _ in range(concurrent)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cells", type=int, default=20000, help="number of cells in the test matrix")
+    parser.add_argument("--genes", type=int, default=5000, help="number of genes")
+    parser.add_argument("--labels", type=int, default=20, help="number of labels in the reference")
+    parser.add_argument("--profiles", type=int, default=5, help="number of reference profiles per label")
+    parser.add_argument(
+        "--threads",
+        type=_int_list,
+        default=[1, 2, 4, 8, 16, 32],
+        help="comma-separated numbers of threads, capped at the number of available CPUs",
+    )
+    parser.add_argument(
+        "--tile-sizes",
+        type=_tile_list,
+        default=[None, "auto", 256],
+        help="comma-separated tile sizes, where 'none' uses the default schedule and 'auto' sizes tiles to the cache",
+    )
+    parser.add_argument("--concurrent", type=int, default=1, help="number of concurrent calls")
+    parser.add_argument("--repeats", type=int, default=3, help="number of timed calls per setting")
+    args = parser.parse_args()
+
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    threads = sorted(set(min(t, available) for t in args.threads))
+
+    rng = numpy.random.default_rng(42)
+    ref = rng.random((args.genes, args.labels * args.profiles))
+    labels = [str(i % args.labels) for i in range(ref.shape[1])]
+    features = [str(i) for i in range(args.genes)]
+    built = singler.build_single_reference(ref, labels, features, num_threads=available)
+    test = rng.random((args.genes, args.cells))
+
+    print(
+        "%d cells, %d labels, %d markers, %d concurrent call(s), %d CPUs available"
+        % (args.cells, args.labels, built.num_markers(), args.concurrent, available)
+    )
+    print("%8s %6s %5s %10s %8s" % ("threads", "tile", "pin", "time (s)", "speedup"))
+
+    baseline = None
+    for nt in threads:
+        for tile in args.tile_sizes:
+            for pin in [False, True]:
+                if pin and nt == 1:
+                    continue
+
+                def fun():
+                    singler.classify_single_reference(
+                        test, features, built, tile_size=tile, pin_threads=pin, num_threads=nt
+                    )
+
+                elapsed = _time(fun, args.concurrent, args.repeats)
+                if baseline is None:
+                    baseline = elapsed
+                tile_name = "none" if tile is None else str(tile)
+                print("%8d %6s %5s %10.3f %8.2f" % (nt, tile_name, "yes" if pin else "no", elapsed, baseline / elapsed))
+
+
+if __name__ == "__main__":
+    main()
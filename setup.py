@@ -23,6 +23,12 @@ if __name__ == "__main__":
                         "src/singler/lib/build_integrated_references.cpp",
                         "src/singler/lib/classify_single_reference.cpp",
                         "src/singler/lib/classify_integrated_references.cpp",
+                        "src/singler/lib/ranked_test_matrix.cpp",
+                        "src/singler/lib/aggregate_by_cluster.cpp",
+                        "src/singler/lib/sweep_single_reference.cpp",
+                        "src/singler/lib/simd.cpp",
+                        "src/singler/lib/compare_neighbor_search.cpp",
+                        "src/singler/lib/extension.cpp",
                     ],
                     include_dirs=[assorthead.includes()] + mattress.includes(),
                     language="c++",
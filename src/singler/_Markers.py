@@ -1,7 +1,8 @@
 from typing import Any, Sequence
 
-from numpy import array, int32, ndarray
+from numpy import asarray, concatenate, cumsum, frombuffer, int32, ndarray
 
+from . import _core
 from . import _cpphelpers as lib
 
 
@@ -16,23 +17,11 @@ class _Markers:
     def num_labels(self) -> int:
         return self._num_labels
 
-    def _check(self, i: int):
-        if i < 0 or i >= self._num_labels:
-            raise IndexError("label " + str(i) + " out of range for marker list")
-
     def get(self, first: int, second: int):
-        self._check(first)
-        self._check(second)
-        n = lib.get_nmarkers_for_pair(self._ptr, first, second)
-        output = ndarray(n, dtype=int32)
-        lib.get_markers_for_pair(self._ptr, first, second, output)
-        return output
+        return frombuffer(_core.get_markers_for_pair(self._ptr, first, second), dtype=int32)
 
     def set(self, first: int, second: int, markers: Sequence):
-        self._check(first)
-        self._check(second)
-        out = array(markers, dtype=int32, copy=False)
-        lib.set_markers_for_pair(self._ptr, first, second, len(out), out)
+        _core.set_markers_for_pair(self._ptr, first, second, asarray(markers, dtype=int32))
 
     def to_dict(
         self, labels: Sequence, features: Sequence
@@ -42,11 +31,21 @@ class _Markers:
                 "length of 'labels' should be equal to the number of labels"
             )
 
+        # Fetching the markers for all pairs at once, rather than one call per pair.
+        nl = self._num_labels
+        counts = ndarray((nl, nl), dtype=int32)
+        _core.count_markers(self._ptr, counts)
+        values = ndarray(int(counts.sum()), dtype=int32)
+        _core.get_markers(self._ptr, values)
+        ends = cumsum(counts).tolist()
+        values = values.tolist()
+
         markers = {}
         for i, x in enumerate(labels):
             current = {}
             for j, y in enumerate(labels):
-                current[y] = [features[k] for k in self.get(i, j)]
+                p = i * nl + j
+                current[y] = [features[k] for k in values[ends[p] - counts[i, j] : ends[p]]]
             markers[x] = current
 
         return markers
@@ -64,6 +63,9 @@ class _Markers:
 
         instance = cls(lib.create_markers(len(labels)))
 
+        nl = len(labels)
+        counts = ndarray((nl, nl), dtype=int32)
+        collected = []
         for outer_i, outer_k in enumerate(labels):
             for inner_i, inner_k in enumerate(labels):
                 current = markers[outer_k][inner_k]
@@ -73,6 +75,10 @@ class _Markers:
                     if x in fmapping:  # just skipping features that aren't present.
                         mapped.append(fmapping[x])
 
-                instance.set(outer_i, inner_i, mapped)
+                counts[outer_i, inner_i] = len(mapped)
+                collected.append(asarray(mapped, dtype=int32))
 
+        # Setting the markers for all pairs at once, rather than one call per pair.
+        values = concatenate(collected) if len(collected) else ndarray(0, dtype=int32)
+        _core.set_markers(instance._ptr, counts, values)
         return instance
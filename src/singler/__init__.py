@@ -1,25 +1,116 @@
+import importlib
 import sys
+import types
+from typing import TYPE_CHECKING
 
-if sys.version_info[:2] >= (3, 8):
-    # TODO: Import directly (no need for conditional) when `python_requires = >= 3.8`
-    from importlib.metadata import PackageNotFoundError, version  # pragma: no cover
-else:
-    from importlib_metadata import PackageNotFoundError, version  # pragma: no cover
-
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = __name__
-    __version__ = version(dist_name)
-except PackageNotFoundError:  # pragma: no cover
-    __version__ = "unknown"
-finally:
-    del version, PackageNotFoundError
-
-
-from .annotate_integrated import annotate_integrated
-from .annotate_single import annotate_single
-from .build_integrated_references import IntegratedReferences, build_integrated_references
-from .build_single_reference import build_single_reference
-from .classify_integrated_references import classify_integrated_references
-from .classify_single_reference import classify_single_reference
-from .get_classic_markers import get_classic_markers, number_of_classic_markers
+
+def _get_version() -> str:
+    # importlib.metadata is relatively slow to import, so this is only called
+    # when __version__ is first accessed.
+    if sys.version_info[:2] >= (3, 8):
+        # TODO: Import directly (no need for conditional) when `python_requires = >= 3.8`
+        from importlib.metadata import PackageNotFoundError, version  # pragma: no cover
+    else:
+        from importlib_metadata import PackageNotFoundError, version  # pragma: no cover
+
+    try:
+        # Change here if project is renamed and does not equal the package name
+        dist_name = __name__
+        return version(dist_name)
+    except PackageNotFoundError:  # pragma: no cover
+        return "unknown"
+
+
+# Submodules are only imported when one of their functions or classes is first
+# accessed, so that 'import singler' does not load the native library or the
+# heavier dependencies like biocframe and summarizedexperiment.
+_lazy_exports = {
+    "aggregate_by_cluster": "aggregate_by_cluster",
+    "annotate_hierarchical": "annotate_hierarchical",
+    "annotate_integrated": "annotate_integrated",
+    "annotate_single": "annotate_single",
+    "annotate_integrated_async": "asynchronous",
+    "annotate_single_async": "asynchronous",
+    "classify_integrated_references_async": "asynchronous",
+    "classify_single_reference_async": "asynchronous",
+    "IntegratedReferences": "build_integrated_references",
+    "IntegratedReferencesMismatchError": "build_integrated_references",
+    "build_integrated_references": "build_integrated_references",
+    "integrated_references_key": "build_integrated_references",
+    "build_single_reference": "build_single_reference",
+    "classify_integrated_references": "classify_integrated_references",
+    "classify_single_reference": "classify_single_reference",
+    "classify_single_reference_sharded": "classify_single_reference_sharded",
+    "classify_single_reference_sweep": "classify_single_reference_sweep",
+    "evaluate_approximate_search": "evaluate_approximate_search",
+    "get_classic_markers": "get_classic_markers",
+    "number_of_classic_markers": "get_classic_markers",
+    "RankedTestMatrix": "rank_test_matrix",
+    "rank_test_matrix": "rank_test_matrix",
+    "ArrowResultSink": "result_sinks",
+    "ParquetResultSink": "result_sinks",
+    "ResultSink": "result_sinks",
+    "ZarrResultSink": "result_sinks",
+    "get_simd_instruction_set": "simd",
+    "set_simd_instruction_set": "simd",
+    "get_thread_budget": "thread_budget",
+    "thread_budget": "thread_budget",
+}
+
+__all__ = sorted(_lazy_exports)
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name == "__version__":
+            value = _get_version()
+            types.ModuleType.__setattr__(self, name, value)
+            return value
+        if name not in _lazy_exports:
+            raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
+        module = importlib.import_module("." + _lazy_exports[name], __name__)
+        value = getattr(module, name)
+        types.ModuleType.__setattr__(self, name, value)
+        return value
+
+    def __setattr__(self, name, value):
+        # Importing a submodule binds it as an attribute of this package, which
+        # would shadow any function of the same name, e.g., classify_single_reference.
+        if name in _lazy_exports and isinstance(value, types.ModuleType):
+            return
+        types.ModuleType.__setattr__(self, name, value)
+
+    def __dir__(self):
+        return sorted(set(types.ModuleType.__dir__(self)) | set(_lazy_exports))
+
+
+sys.modules[__name__].__class__ = _LazyModule
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .aggregate_by_cluster import aggregate_by_cluster
+    from .annotate_hierarchical import annotate_hierarchical
+    from .annotate_integrated import annotate_integrated
+    from .annotate_single import annotate_single
+    from .asynchronous import (
+        annotate_integrated_async,
+        annotate_single_async,
+        classify_integrated_references_async,
+        classify_single_reference_async,
+    )
+    from .build_integrated_references import (
+        IntegratedReferences,
+        IntegratedReferencesMismatchError,
+        build_integrated_references,
+        integrated_references_key,
+    )
+    from .build_single_reference import build_single_reference
+    from .classify_integrated_references import classify_integrated_references
+    from .classify_single_reference import classify_single_reference
+    from .classify_single_reference_sharded import classify_single_reference_sharded
+    from .classify_single_reference_sweep import classify_single_reference_sweep
+    from .evaluate_approximate_search import evaluate_approximate_search
+    from .get_classic_markers import get_classic_markers, number_of_classic_markers
+    from .rank_test_matrix import RankedTestMatrix, rank_test_matrix
+    from .result_sinks import ArrowResultSink, ParquetResultSink, ResultSink, ZarrResultSink
+    from .simd import get_simd_instruction_set, set_simd_instruction_set
+    from .thread_budget import get_thread_budget, thread_budget
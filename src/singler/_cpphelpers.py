@@ -40,6 +40,27 @@ def _np2ct(x, expected, contiguous=True):
             raise ValueError('only contiguous NumPy arrays are supported')
     return x.ctypes.data
 
+lib.py_add_to_ranked_test_matrix.restype = None
+lib.py_add_to_ranked_test_matrix.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_aggregate_by_cluster.restype = None
+lib.py_aggregate_by_cluster.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
 lib.py_build_integrated_references.restype = ct.c_void_p
 lib.py_build_integrated_references.argtypes = [
     ct.c_int32,
@@ -59,7 +80,12 @@ lib.py_build_single_reference.argtypes = [
     ct.c_void_p,
     ct.c_void_p,
     ct.c_void_p,
-    ct.c_uint8,
+    ct.c_int32,
+    ct.c_int32,
+    ct.c_double,
+    ct.c_int32,
+    ct.c_int32,
+    ct.c_int32,
     ct.c_int32,
     ct.POINTER(ct.c_int32),
     ct.POINTER(ct.c_char_p)
@@ -79,6 +105,21 @@ lib.py_classify_integrated_references.argtypes = [
     ct.POINTER(ct.c_char_p)
 ]
 
+lib.py_classify_integrated_references_ranked.restype = None
+lib.py_classify_integrated_references_ranked.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_double,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
 lib.py_classify_single_reference.restype = None
 lib.py_classify_single_reference.argtypes = [
     ct.c_void_p,
@@ -91,6 +132,51 @@ lib.py_classify_single_reference.argtypes = [
     ct.c_void_p,
     ct.c_void_p,
     ct.c_void_p,
+    ct.c_int32,
+    ct.c_uint8,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_classify_single_reference_ranked.restype = None
+lib.py_classify_single_reference_ranked.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_double,
+    ct.c_uint8,
+    ct.c_double,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_uint8,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_compare_neighbor_search.restype = None
+lib.py_compare_neighbor_search.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_double,
+    ct.c_int32,
+    ct.c_void_p,
     ct.POINTER(ct.c_int32),
     ct.POINTER(ct.c_char_p)
 ]
@@ -102,6 +188,21 @@ lib.py_create_markers.argtypes = [
     ct.POINTER(ct.c_char_p)
 ]
 
+lib.py_create_ranked_test_matrix.restype = ct.c_void_p
+lib.py_create_ranked_test_matrix.argtypes = [
+    ct.c_int32,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_deserialize_integrated_references.restype = ct.c_void_p
+lib.py_deserialize_integrated_references.argtypes = [
+    ct.c_int64,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
 lib.py_find_classic_markers.restype = ct.c_void_p
 lib.py_find_classic_markers.argtypes = [
     ct.c_int32,
@@ -109,6 +210,7 @@ lib.py_find_classic_markers.argtypes = [
     ct.c_void_p,
     ct.c_int32,
     ct.c_int32,
+    ct.c_void_p,
     ct.POINTER(ct.c_int32),
     ct.POINTER(ct.c_char_p)
 ]
@@ -127,6 +229,13 @@ lib.py_free_markers.argtypes = [
     ct.POINTER(ct.c_char_p)
 ]
 
+lib.py_free_ranked_test_matrix.restype = None
+lib.py_free_ranked_test_matrix.argtypes = [
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
 lib.py_free_single_reference.restype = None
 lib.py_free_single_reference.argtypes = [
     ct.c_void_p,
@@ -134,6 +243,30 @@ lib.py_free_single_reference.argtypes = [
     ct.POINTER(ct.c_char_p)
 ]
 
+lib.py_get_centroids_from_single_reference.restype = None
+lib.py_get_centroids_from_single_reference.argtypes = [
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_get_integrated_universe.restype = None
+lib.py_get_integrated_universe.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_get_integrated_universe_size.restype = ct.c_int32
+lib.py_get_integrated_universe_size.argtypes = [
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
 lib.py_get_markers_for_pair.restype = None
 lib.py_get_markers_for_pair.argtypes = [
     ct.c_void_p,
@@ -174,6 +307,26 @@ lib.py_get_nsubset_from_single_reference.argtypes = [
     ct.POINTER(ct.c_char_p)
 ]
 
+lib.py_get_ranked_test_matrix_ncol.restype = ct.c_int32
+lib.py_get_ranked_test_matrix_ncol.argtypes = [
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_get_serialized_integrated_references_size.restype = ct.c_int64
+lib.py_get_serialized_integrated_references_size.argtypes = [
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_get_simd_instruction_set.restype = ct.c_int32
+lib.py_get_simd_instruction_set.argtypes = [
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
 lib.py_get_subset_from_single_reference.restype = None
 lib.py_get_subset_from_single_reference.argtypes = [
     ct.c_void_p,
@@ -189,6 +342,14 @@ lib.py_number_of_classic_markers.argtypes = [
     ct.POINTER(ct.c_char_p)
 ]
 
+lib.py_serialize_integrated_references.restype = None
+lib.py_serialize_integrated_references.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
 lib.py_set_markers_for_pair.restype = None
 lib.py_set_markers_for_pair.argtypes = [
     ct.c_void_p,
@@ -200,23 +361,131 @@ lib.py_set_markers_for_pair.argtypes = [
     ct.POINTER(ct.c_char_p)
 ]
 
+lib.py_set_simd_instruction_set.restype = ct.c_uint8
+lib.py_set_simd_instruction_set.argtypes = [
+    ct.c_int32,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_simd_dot.restype = ct.c_double
+lib.py_simd_dot.argtypes = [
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_simd_dot_float.restype = ct.c_float
+lib.py_simd_dot_float.argtypes = [
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_simd_squared_distance.restype = ct.c_double
+lib.py_simd_squared_distance.argtypes = [
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_simd_squared_distance_float.restype = ct.c_float
+lib.py_simd_squared_distance_float.argtypes = [
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_specialize_single_reference.restype = ct.c_void_p
+lib.py_specialize_single_reference.argtypes = [
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_int32,
+    ct.c_double,
+    ct.c_int32,
+    ct.c_int32,
+    ct.c_int32,
+    ct.c_int32,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_subset_ranked_test_matrix.restype = ct.c_void_p
+lib.py_subset_ranked_test_matrix.argtypes = [
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+lib.py_sweep_single_reference.restype = None
+lib.py_sweep_single_reference.argtypes = [
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_uint8,
+    ct.c_int32,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.c_void_p,
+    ct.POINTER(ct.c_int32),
+    ct.POINTER(ct.c_char_p)
+]
+
+def add_to_ranked_test_matrix(ptr, mat, subset, nthreads):
+    return _catch_errors(lib.py_add_to_ranked_test_matrix)(ptr, mat, _np2ct(subset, np.int32), nthreads)
+
+def aggregate_by_cluster(mat, clusters, nclusters, output, nthreads):
+    return _catch_errors(lib.py_aggregate_by_cluster)(mat, _np2ct(clusters, np.int32), nclusters, _np2ct(output, np.float64), nthreads)
+
 def build_integrated_references(test_nrow, test_features, nrefs, references, labels, ref_ids, prebuilt, nthreads):
     return _catch_errors(lib.py_build_integrated_references)(test_nrow, _np2ct(test_features, np.int32), nrefs, references, labels, ref_ids, prebuilt, nthreads)
 
-def build_single_reference(ref, labels, markers, approximate, nthreads):
-    return _catch_errors(lib.py_build_single_reference)(ref, _np2ct(labels, np.int32), markers, approximate, nthreads)
+def build_single_reference(ref, labels, markers, index_type, num_trees, search_mult, num_links, ef_construction, ef_search, nthreads):
+    return _catch_errors(lib.py_build_single_reference)(ref, _np2ct(labels, np.int32), markers, index_type, num_trees, search_mult, num_links, ef_construction, ef_search, nthreads)
 
 def classify_integrated_references(mat, assigned, prebuilt, quantile, scores, best, delta, nthreads):
     return _catch_errors(lib.py_classify_integrated_references)(mat, assigned, prebuilt, quantile, scores, _np2ct(best, np.int32), _np2ct(delta, np.float64), nthreads)
 
-def classify_single_reference(mat, subset, prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, best, delta):
-    return _catch_errors(lib.py_classify_single_reference)(mat, _np2ct(subset, np.int32), prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, _np2ct(best, np.int32), _np2ct(delta, np.float64))
+def classify_integrated_references_ranked(ranked, positions, assigned, prebuilt, quantile, scores, best, delta, nthreads):
+    return _catch_errors(lib.py_classify_integrated_references_ranked)(ranked, _np2ct(positions, np.int32), assigned, prebuilt, quantile, scores, _np2ct(best, np.int32), _np2ct(delta, np.float64), nthreads)
+
+def classify_single_reference(mat, subset, prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, best, delta, tile_size, pin_threads, top_k, top_labels, top_scores, num_candidates, centroids, monitor):
+    return _catch_errors(lib.py_classify_single_reference)(mat, _np2ct(subset, np.int32), prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, _np2ct(best, np.int32), _np2ct(delta, np.float64), tile_size, pin_threads, top_k, _np2ct(top_labels, np.int32), _np2ct(top_scores, np.float64), num_candidates, _np2ct(centroids, np.float64), monitor)
+
+def classify_single_reference_ranked(ranked, positions, prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, best, delta, tile_size, pin_threads, top_k, top_labels, top_scores, num_candidates, centroids, monitor):
+    return _catch_errors(lib.py_classify_single_reference_ranked)(ranked, _np2ct(positions, np.int32), prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, _np2ct(best, np.int32), _np2ct(delta, np.float64), tile_size, pin_threads, top_k, _np2ct(top_labels, np.int32), _np2ct(top_scores, np.float64), num_candidates, _np2ct(centroids, np.float64), monitor)
+
+def compare_neighbor_search(mat, subset, exact, approximate, quantile, nthreads, recall):
+    return _catch_errors(lib.py_compare_neighbor_search)(mat, _np2ct(subset, np.int32), exact, approximate, quantile, nthreads, _np2ct(recall, np.float64))
 
 def create_markers(nlabels):
     return _catch_errors(lib.py_create_markers)(nlabels)
 
-def find_classic_markers(nref, labels, ref, de_n, nthreads):
-    return _catch_errors(lib.py_find_classic_markers)(nref, labels, ref, de_n, nthreads)
+def create_ranked_test_matrix(nrow):
+    return _catch_errors(lib.py_create_ranked_test_matrix)(nrow)
+
+def deserialize_integrated_references(size, buffer):
+    return _catch_errors(lib.py_deserialize_integrated_references)(size, _np2ct(buffer, np.int32))
+
+def find_classic_markers(nref, labels, ref, de_n, nthreads, monitor):
+    return _catch_errors(lib.py_find_classic_markers)(nref, labels, ref, de_n, nthreads, monitor)
 
 def free_integrated_references(ptr):
     return _catch_errors(lib.py_free_integrated_references)(ptr)
@@ -224,9 +493,21 @@ def free_integrated_references(ptr):
 def free_markers(ptr):
     return _catch_errors(lib.py_free_markers)(ptr)
 
+def free_ranked_test_matrix(ptr):
+    return _catch_errors(lib.py_free_ranked_test_matrix)(ptr)
+
 def free_single_reference(ptr):
     return _catch_errors(lib.py_free_single_reference)(ptr)
 
+def get_centroids_from_single_reference(ptr, nthreads, buffer):
+    return _catch_errors(lib.py_get_centroids_from_single_reference)(ptr, nthreads, _np2ct(buffer, np.float64))
+
+def get_integrated_universe(ptr, buffer):
+    return _catch_errors(lib.py_get_integrated_universe)(ptr, _np2ct(buffer, np.int32))
+
+def get_integrated_universe_size(ptr):
+    return _catch_errors(lib.py_get_integrated_universe_size)(ptr)
+
 def get_markers_for_pair(ptr, label1, label2, buffer):
     return _catch_errors(lib.py_get_markers_for_pair)(ptr, label1, label2, _np2ct(buffer, np.int32))
 
@@ -242,11 +523,47 @@ def get_nmarkers_for_pair(ptr, label1, label2):
 def get_nsubset_from_single_reference(ptr):
     return _catch_errors(lib.py_get_nsubset_from_single_reference)(ptr)
 
+def get_ranked_test_matrix_ncol(ptr):
+    return _catch_errors(lib.py_get_ranked_test_matrix_ncol)(ptr)
+
+def get_serialized_integrated_references_size(ptr):
+    return _catch_errors(lib.py_get_serialized_integrated_references_size)(ptr)
+
+def get_simd_instruction_set():
+    return _catch_errors(lib.py_get_simd_instruction_set)()
+
 def get_subset_from_single_reference(ptr, buffer):
     return _catch_errors(lib.py_get_subset_from_single_reference)(ptr, _np2ct(buffer, np.int32))
 
 def number_of_classic_markers(num_labels):
     return _catch_errors(lib.py_number_of_classic_markers)(num_labels)
 
+def serialize_integrated_references(ptr, buffer):
+    return _catch_errors(lib.py_serialize_integrated_references)(ptr, _np2ct(buffer, np.int32))
+
 def set_markers_for_pair(ptr, label1, label2, n, values):
     return _catch_errors(lib.py_set_markers_for_pair)(ptr, label1, label2, n, _np2ct(values, np.int32))
+
+def set_simd_instruction_set(choice):
+    return _catch_errors(lib.py_set_simd_instruction_set)(choice)
+
+def simd_dot(n, x, y):
+    return _catch_errors(lib.py_simd_dot)(n, _np2ct(x, np.float64), _np2ct(y, np.float64))
+
+def simd_dot_float(n, x, y):
+    return _catch_errors(lib.py_simd_dot_float)(n, _np2ct(x, np.float32), _np2ct(y, np.float32))
+
+def simd_squared_distance(n, x, y):
+    return _catch_errors(lib.py_simd_squared_distance)(n, _np2ct(x, np.float64), _np2ct(y, np.float64))
+
+def simd_squared_distance_float(n, x, y):
+    return _catch_errors(lib.py_simd_squared_distance_float)(n, _np2ct(x, np.float32), _np2ct(y, np.float32))
+
+def specialize_single_reference(ptr, num_keep, keep, index_type, num_trees, search_mult, num_links, ef_construction, ef_search, nthreads):
+    return _catch_errors(lib.py_specialize_single_reference)(ptr, num_keep, _np2ct(keep, np.int32), index_type, num_trees, search_mult, num_links, ef_construction, ef_search, nthreads)
+
+def subset_ranked_test_matrix(ptr, ncells, cells):
+    return _catch_errors(lib.py_subset_ranked_test_matrix)(ptr, ncells, _np2ct(cells, np.int32))
+
+def sweep_single_reference(mat, subset, prebuilt, nquantiles, quantiles, nthresholds, thresholds, use_fine_tune, nthreads, scores, best, delta, monitor):
+    return _catch_errors(lib.py_sweep_single_reference)(mat, _np2ct(subset, np.int32), prebuilt, nquantiles, _np2ct(quantiles, np.float64), nthresholds, _np2ct(thresholds, np.float64), use_fine_tune, nthreads, scores, best, delta, monitor)
@@ -1,3 +1,8 @@
+import ctypes as ct
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Sequence, Tuple
 
 import biocutils as ut
@@ -6,6 +11,8 @@ from delayedarray import DelayedArray
 from mattress import TatamiNumericPointer, tatamize
 from summarizedexperiment import SummarizedExperiment
 
+from .thread_budget import _resolve_num_threads
+
 
 def _factorize(x: Sequence) -> Tuple[list, np.ndarray]:
     _factor = ut.Factor.from_sequence(x, sort_levels=False)
@@ -66,13 +73,7 @@ def _stable_union(*args) -> list:
     return output
 
 
-def _clean_matrix(x, features, assay_type, check_missing, num_threads):
-    if isinstance(x, TatamiNumericPointer):
-        # Assume the pointer was previously generated from _clean_matrix,
-        # so it's 2-dimensional, matches up with features and it's already
-        # clean of NaNs... so we no-op and just return it directly.
-        return x, features
-
+def _unpack_experiment(x, features, assay_type):
     if isinstance(x, SummarizedExperiment):
         if features is None:
             features = x.get_row_names()
@@ -82,6 +83,20 @@ def _clean_matrix(x, features, assay_type, check_missing, num_threads):
 
         x = x.assay(assay_type)
 
+    return x, features
+
+
+def _clean_matrix(x, features, assay_type, check_missing, num_threads):
+    if isinstance(x, TatamiNumericPointer):
+        # Assume the pointer was previously generated from _clean_matrix,
+        # so it's 2-dimensional, matches up with features and it's already
+        # clean of NaNs... so we no-op and just return it directly.
+        return x, features
+
+    x, features = _unpack_experiment(x, features, assay_type)
+    if _is_chunked_array(x):
+        x = _realize_chunked(x)
+
     curshape = x.shape
     if len(curshape) != 2:
         raise ValueError("each entry of 'ref' should be a 2-dimensional array")
@@ -95,7 +110,7 @@ def _clean_matrix(x, features, assay_type, check_missing, num_threads):
     if not check_missing:
         return ptr, features
 
-    retain = ptr.row_nan_counts(num_threads=num_threads) == 0
+    retain = ptr.row_nan_counts(num_threads=_resolve_num_threads(num_threads)) == 0
     if retain.all():
         return ptr, features
 
@@ -104,8 +119,18 @@ def _clean_matrix(x, features, assay_type, check_missing, num_threads):
         if k:
             new_features.append(features[i])
 
-    sub = DelayedArray(ptr)[retain, :]  # avoid re-tatamizing 'x'.
-    return tatamize(sub), new_features
+    sub = _subset_pointer(ptr, 0, np.where(retain)[0])  # avoid re-tatamizing 'x'.
+    return sub, new_features
+
+
+def _estimate_nbytes(x, assay_type) -> int:
+    x, _ = _unpack_experiment(x, [], assay_type)
+    if _is_compressed_sparse(x):
+        return x.data.nbytes + x.indices.nbytes + x.indptr.nbytes
+    if isinstance(x, np.ndarray):
+        return x.nbytes
+    # Otherwise, assume a dense double-precision matrix.
+    return int(np.prod(x.shape)) * 8
 
 
 def _restrict_features(ptr, features, restrict_to):
@@ -117,5 +142,244 @@ def _restrict_features(ptr, features, restrict_to):
                 keep.append(i)
                 new_features.append(x)
         features = new_features
-        ptr = tatamize(DelayedArray(ptr)[keep, :])
+        ptr = _subset_pointer(ptr, 0, keep)
     return ptr, features
+
+
+def _is_compressed_sparse(x) -> bool:
+    # scipy is an optional dependency, but it must have already been imported
+    # if 'x' is one of its matrices, so there's no need to import it here.
+    sparse = sys.modules.get("scipy.sparse")
+    return sparse is not None and sparse.issparse(x) and x.format in ("csr", "csc")
+
+
+def _mask_sparse_missing(x, features):
+    # Only the structural non-zeros can be NaN, so we only need to scan those.
+    bad = np.isnan(x.data[: x.indptr[-1]])
+    if not bad.any():
+        return features
+
+    if x.format == "csr":
+        rows = np.repeat(np.arange(x.shape[0]), np.diff(x.indptr))[bad]
+    else:
+        rows = x.indices[: x.indptr[-1]][bad]
+
+    # Features set to None are ignored by _create_map(), which is equivalent
+    # to removing the affected rows in _clean_matrix().
+    features = list(features)
+    for r in np.unique(rows):
+        features[r] = None
+    return features
+
+
+# Number of elements in each dense block of marker rows for sparse test data.
+_MARKER_BLOCK_ELEMENTS = 2**22
+
+
+def _sparse_marker_blocks(x, rows):
+    # Yields dense column-major blocks of the marker rows of a CSR/CSC matrix,
+    # so that each cell's markers are contiguous when they are ranked.
+    markers = x[rows, :]
+    if markers.format != "csc":
+        markers = markers.tocsc()
+
+    block_size = max(1, _MARKER_BLOCK_ELEMENTS // max(1, len(rows)))
+    for start, end in _column_chunks(markers.shape[1], block_size):
+        yield start, end, markers[:, start:end].toarray(order="F")
+
+
+# Number of elements in each block of columns read from an on-disk matrix.
+_READ_BLOCK_ELEMENTS = 2**24
+
+
+def _is_chunked_array(x) -> bool:
+    # Duck-typed check for on-disk arrays like h5py.Dataset or zarr.Array,
+    # which can only be accessed by reading slices into memory.
+    return (
+        not isinstance(x, np.ndarray)
+        and hasattr(x, "chunks")
+        and hasattr(x, "dtype")
+        and len(getattr(x, "shape", ())) == 2
+    )
+
+
+def _chunked_block_size(x) -> int:
+    # Blocks are rounded to a multiple of the on-disk chunk width, so that
+    # each chunk is only read and decompressed once.
+    width = max(1, _READ_BLOCK_ELEMENTS // max(1, x.shape[0]))
+    chunks = x.chunks
+    if chunks is None:
+        return width
+
+    chunk_width = chunks[1]
+    if isinstance(chunk_width, tuple):  # e.g., dask arrays.
+        chunk_width = max(chunk_width)
+    return max(chunk_width, width - width % chunk_width)
+
+
+def _chunked_column_blocks(x, block_size, prefetch=1):
+    # Yields dense blocks of columns, along with the start and end of each
+    # block. The next blocks are read in a background thread so that disk
+    # I/O overlaps with the processing of the current block.
+    def read(start, end):
+        return np.asarray(x[:, start:end])
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            for start, end in _column_chunks(x.shape[1], block_size):
+                pending.append((start, end, executor.submit(read, start, end)))
+                if len(pending) > prefetch:
+                    start, end, future = pending.popleft()
+                    yield start, end, future.result()
+
+            while len(pending):
+                start, end, future = pending.popleft()
+                yield start, end, future.result()
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+
+def _mask_chunked_missing(x, features):
+    # Same as _mask_sparse_missing(), but for on-disk matrices that are
+    # scanned in blocks of columns to avoid loading them into memory.
+    bad = np.zeros(x.shape[0], dtype=bool)
+    for _, _, block in _chunked_column_blocks(x, _chunked_block_size(x)):
+        bad |= np.isnan(block).any(axis=1)
+    if not bad.any():
+        return features
+
+    features = list(features)
+    for r in np.where(bad)[0]:
+        features[r] = None
+    return features
+
+
+def _realize_chunked(x):
+    output = np.ndarray(x.shape, dtype=x.dtype, order="F")
+    for start, end, block in _chunked_column_blocks(x, _chunked_block_size(x)):
+        output[:, start:end] = block
+    return output
+
+
+def _column_chunks(ncol, chunk_size):
+    if chunk_size is None or ncol == 0:
+        return [(0, ncol)]
+    if chunk_size <= 0:
+        raise ValueError("'chunk_size' should be positive")
+    return [(start, min(ncol, start + chunk_size)) for start in range(0, ncol, chunk_size)]
+
+
+def _subset_columns(ptr, start, end):
+    return _subset_pointer(ptr, 1, range(start, end))
+
+
+def _subset_pointer(ptr, dim, indices):
+    indices = np.asarray(indices, dtype=np.int32)
+    full = ptr.nrow() if dim == 0 else ptr.ncol()
+    n = len(indices)
+    if n == 0:
+        # tatamize() treats an empty subset as a no-op.
+        return tatamize(np.zeros((0, ptr.ncol()) if dim == 0 else (ptr.nrow(), 0)))
+
+    is_prefix = indices[-1] == n - 1 and (indices == np.arange(n)).all()
+    if is_prefix and n == full:
+        return ptr
+
+    def take(x, sub):
+        return DelayedArray(x)[sub, :] if dim == 0 else DelayedArray(x)[:, sub]
+
+    if not is_prefix:
+        return tatamize(take(ptr, indices))
+
+    # tatamize() treats any subset of the form 0, 1, ..., n-1 as a no-op, so
+    # a leading block of rows or columns would be silently ignored. We work
+    # around this by swapping the first two entries and then swapping them back.
+    swapped = np.arange(max(n, 2))
+    swapped[[0, 1]] = [1, 0]
+    return tatamize(take(take(ptr, swapped), swapped if n > 1 else [1]))
+
+
+_MonitorCallback = ct.CFUNCTYPE(ct.c_int32, ct.c_int32, ct.c_int32)
+
+
+class _Monitor:
+    def __init__(self, progress, cancel):
+        self._progress = progress
+        self._cancel = cancel
+        self.error = None
+        self._callback = _MonitorCallback(self._run)  # keep a reference for the duration of the call.
+
+    def _run(self, done, total):
+        try:
+            if self._progress is not None:
+                self._progress(done, total)
+        except Exception as e:
+            self.error = e
+            return 1
+        return int(self._cancel is not None and self._cancel.is_set())
+
+    @property
+    def ptr(self):
+        return ct.cast(self._callback, ct.c_void_p)
+
+
+@contextmanager
+def _monitor(progress, cancel):
+    if progress is None and cancel is None:
+        yield None
+        return
+
+    mon = _Monitor(progress, cancel)
+    try:
+        yield mon.ptr
+    except RuntimeError:
+        # Re-raise any exception from 'progress' that caused the native code to stop.
+        if mon.error is not None:
+            raise mon.error
+        raise
+
+
+def _row_pointers(x: np.ndarray, offset: int) -> np.ndarray:
+    # Pointers to the 'offset'-th element of each row of a matrix with contiguous rows.
+    start = x.ctypes.data + offset * x.itemsize
+    return start + np.arange(x.shape[0], dtype=np.uintp) * np.uintp(x.strides[0])
+
+
+def _check_out(out, allowed: Sequence):
+    if out is None:
+        return
+    for name in out:
+        if name not in allowed:
+            raise ValueError("unknown output buffer '" + str(name) + "', should be one of " + str(list(allowed)))
+
+
+def _output_buffer(out, name: str, shape: tuple, dtype, c_contiguous: bool = False) -> np.ndarray:
+    # Preallocated buffers (including memmaps) are written to directly by the
+    # native code, so each row must be contiguous in memory.
+    if out is None or out.get(name) is None:
+        return np.ndarray(shape, dtype=dtype)
+
+    x = out[name]
+    expected = "'out[\"" + name + "\"]'"
+    if not isinstance(x, np.ndarray) or x.dtype != dtype or x.shape != shape:
+        raise ValueError(
+            expected + " should be a NumPy array of type " + str(np.dtype(dtype)) + " and shape " + str(shape)
+        )
+    if not x.flags.writeable:
+        raise ValueError(expected + " should be writeable")
+    if c_contiguous:
+        if not x.flags.c_contiguous:
+            raise ValueError(expected + " should be C-contiguous")
+    elif x.size and x.strides[-1] != x.itemsize:
+        raise ValueError(expected + " should be contiguous along its last dimension")
+    return x
+
+
+def _slice_out(out, start: int, end: int):
+    # Views of the output buffers for a chunk of cells, e.g., for the asynchronous
+    # functions. Cells are in the columns of the 'scores' and in the rows otherwise.
+    if out is None:
+        return None
+    return {k: (v[:, start:end] if k == "scores" else v[start:end]) for k, v in out.items()}
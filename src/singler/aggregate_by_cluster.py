@@ -0,0 +1,89 @@
+from typing import Any, Literal, Optional, Sequence, Tuple, Union
+
+from mattress import tatamize
+from numpy import array, bincount, float64, int32, ndarray, zeros
+
+from . import _cpphelpers as lib
+from ._utils import _chunked_block_size, _chunked_column_blocks, _is_chunked_array, _unpack_experiment
+from .thread_budget import _uses_thread_budget
+
+
+@_uses_thread_budget
+def aggregate_by_cluster(
+    test_data: Any,
+    clusters: Sequence,
+    assay_type: Union[str, int] = 0,
+    method: Literal["sum", "mean"] = "sum",
+    num_threads: Optional[int] = None,
+) -> Tuple[ndarray, list]:
+    """Aggregate the expression values of a test dataset for all cells in
+    each cluster. The aggregated profiles can then be classified with
+    :py:meth:`~singler.classify_single_reference.classify_single_reference`,
+    which is much faster than classifying each cell when only cluster-level
+    labels are of interest.
+
+    Args:
+        test_data:
+            A matrix-like object where each row is a feature and each column
+            is a test sample (usually a single cell), containing expression values.
+            This can be any input that is supported by
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`,
+            including SciPy sparse matrices and on-disk arrays.
+
+            Alternatively, a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
+            containing such a matrix in one of its assays.
+
+        clusters:
+            Sequence of length equal to the number of columns of
+            ``test_data``, containing the cluster assignment for each column.
+
+        assay_type:
+            Assay containing the expression matrix,
+            if `test_data` is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        method:
+            Whether to compute the sum or the mean of the expression values
+            for each cluster. This has no effect on the classification as
+            only the ranking within each aggregated profile is used.
+
+        num_threads:
+            Number of threads to use.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+    Returns:
+        Tuple where the first element is a NumPy array with one row per
+        feature and one column per cluster, containing the aggregated
+        expression values; and the second element is a list of the sorted
+        unique clusters, corresponding to the columns of the array.
+    """
+    test_data, _ = _unpack_experiment(test_data, [], assay_type)
+    if len(clusters) != test_data.shape[1]:
+        raise ValueError("length of 'clusters' should be equal to the number of columns of 'test_data'")
+
+    if method not in ("sum", "mean"):
+        raise ValueError("'method' should be either 'sum' or 'mean'")
+
+    levels = sorted(set(clusters))
+    mapping = {x: i for i, x in enumerate(levels)}
+    codes = array([mapping[x] for x in clusters], dtype=int32)
+    nclusters = len(levels)
+
+    output = zeros((test_data.shape[0], nclusters), dtype=float64)
+    if not _is_chunked_array(test_data):
+        ptr = tatamize(test_data)
+        lib.aggregate_by_cluster(ptr.ptr, codes, nclusters, output, num_threads)
+    else:
+        # On-disk matrices are aggregated in blocks of columns.
+        partial = ndarray(output.shape, dtype=float64)
+        for start, end, block in _chunked_column_blocks(test_data, _chunked_block_size(test_data)):
+            block_ptr = tatamize(block)
+            lib.aggregate_by_cluster(block_ptr.ptr, codes[start:end], nclusters, partial, num_threads)
+            output += partial
+
+    if method == "mean":
+        output /= bincount(codes, minlength=nclusters)
+
+    return output, levels
@@ -0,0 +1,241 @@
+from typing import Any, Optional, Sequence, Union
+
+from biocframe import BiocFrame
+from numpy import array, float64, full, int32, nan
+from summarizedexperiment import SummarizedExperiment
+
+from ._utils import _clean_matrix, _restrict_features, _subset_pointer
+from .annotate_single import _resolve_reference, _resolve_test
+from .build_single_reference import SinglePrebuiltReference, build_single_reference
+from .classify_single_reference import classify_single_reference
+from .rank_test_matrix import rank_test_matrix
+from .thread_budget import _uses_thread_budget
+
+
+@_uses_thread_budget
+def annotate_hierarchical(
+    test_data: Any,
+    ref_data: Any,
+    ref_labels: Sequence[Union[Sequence, str]],
+    test_features: Optional[Union[Sequence, str]] = None,
+    ref_features: Optional[Union[Sequence, str]] = None,
+    build_args: dict = {},
+    classify_args: dict = {},
+    num_threads: Optional[int] = None,
+) -> BiocFrame:
+    """Annotate a single-cell expression dataset against a reference with
+    multiple levels of labels, e.g., the main and fine labels of a
+    ``celldex`` reference. Each cell is first classified against the
+    labels of the coarsest level. At each subsequent level, each cell is
+    only classified against the labels of the reference profiles that were
+    assigned the same label as the cell at the previous level, using markers
+    that were chosen among those profiles. This is much faster than
+    classifying each cell against all labels of the finer levels, and the
+    markers are more relevant for distinguishing between similar labels.
+
+    The test dataset is only ranked once for the markers of all levels,
+    see :py:meth:`~singler.rank_test_matrix.rank_test_matrix`.
+
+    Args:
+        test_data:
+            A matrix-like object representing the test dataset, where rows are
+            features and columns are samples (usually cells). Entries should be expression
+            values; only the ranking within each column will be used.
+
+            Alternatively, a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
+            containing such a matrix in one of its assays. Non-default assay
+            types can be specified in ``classify_args``.
+
+        test_features:
+            Sequence of length equal to the number of rows in
+            ``test_data``, containing the feature identifier for each row.
+
+            Alternatively, if ``test_data`` is a ``SummarizedExperiment``, ``test_features``
+            may be a string speciying the column name in `row_data` that contains the
+            features. It can also be set to `None`, to use the `row_names` of
+            the experiment as features.
+
+        ref_data:
+            A matrix-like object representing the reference dataset, where rows
+            are features and columns are samples. Entries should be expression values,
+            usually log-transformed (see comments for the ``ref`` argument in
+            :py:meth:`~singler.build_single_reference.build_single_reference`).
+
+            Alternatively, a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
+            containing such a matrix in one of its assays. Non-default assay
+            types can be specified in ``build_args``.
+
+        ref_labels:
+            Sequence of levels of labels, from the coarsest to the finest.
+            If ``ref_data`` is a matrix-like object, each level should be a
+            sequence of length equal to the number of columns of
+            ``ref_data``, containing the label associated with each column.
+
+            Alternatively, if ``ref_data`` is a ``SummarizedExperiment``,
+            each level may be a string specifying the label type to use,
+            e.g., ``["label.main", "label.fine"]``.
+
+        ref_features:
+            If ``ref_data`` is a matrix-like object, ``ref_features`` should be
+            a sequence of length equal to the number of rows of ``ref_data``,
+            containing the feature identifier associated with each row.
+
+            Alternatively, if ``ref_data`` is a ``SummarizedExperiment``,
+            ``ref_features`` may be a string speciying the column name in `column_data`
+            that contains the features. It can also be set to `None`, to use the
+            `row_names` of the experiment as features.
+
+        build_args:
+            Further arguments to pass to
+            :py:meth:`~singler.build_single_reference.build_single_reference`
+            for the reference at each level.
+
+        classify_args:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`
+            at each level.
+
+        num_threads:
+            Number of threads to use for the various steps.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+    Returns:
+        A data frame containing the labelling results for the finest level,
+        see :py:meth:`~singler.classify_single_reference.classify_single_reference`
+        for details. Scores are NaN for labels that were not considered for
+        a cell, and the ``delta`` is NaN for cells that only had one
+        candidate label. The metadata contains ``levels``, a list of such
+        data frames for each level from the coarsest to the finest.
+    """
+    if len(ref_labels) == 0:
+        raise ValueError("'ref_labels' should contain at least one level of labels")
+
+    test_data, test_features, test_features_set = _resolve_test(test_data, test_features)
+
+    original = ref_data
+    ref_data, first, ref_features = _resolve_reference(
+        ref_data=ref_data,
+        ref_labels=ref_labels[0],
+        ref_features=ref_features,
+        build_args=build_args,
+    )
+
+    all_levels = [first]
+    for lab in ref_labels[1:]:
+        if isinstance(original, SummarizedExperiment) and isinstance(lab, str):
+            lab = original.get_column_data().column(lab)
+        if len(lab) != len(first):
+            raise ValueError("each entry of 'ref_labels' should have the same length")
+        all_levels.append(list(lab))
+
+    # Cleaning and restricting the reference once for all levels.
+    ref_ptr, ref_features = _clean_matrix(
+        ref_data,
+        ref_features,
+        assay_type=0,
+        check_missing=build_args.get("check_missing", True),
+        num_threads=num_threads,
+    )
+    ref_ptr, ref_features = _restrict_features(ref_ptr, ref_features, test_features_set)
+    if ref_ptr.ncol() != len(first):
+        raise ValueError("each entry of 'ref_labels' should have length equal to the number of columns of 'ref_data'")
+
+    build_args = dict(build_args)
+    for x in ["assay_type", "check_missing", "restrict_to"]:
+        build_args.pop(x, None)
+
+    # Each level has one reference for each label of the previous level.
+    all_nodes = []
+    for i, level in enumerate(all_levels):
+        if i == 0:
+            groups = {None: list(range(len(level)))}
+        else:
+            groups = _group_indices(all_levels[i - 1])
+        all_nodes.append(_build_level(ref_ptr, ref_features, level, groups, build_args, num_threads))
+
+    references = []
+    for nodes in all_nodes:
+        references += [x for x in nodes.values() if isinstance(x, SinglePrebuiltReference)]
+
+    ranked = rank_test_matrix(
+        test_data,
+        test_features,
+        references,
+        assay_type=classify_args.get("assay_type", 0),
+        check_missing=classify_args.get("check_missing", True),
+        num_threads=num_threads,
+    )
+    nc = ranked.num_cells()
+
+    results = []
+    cell_groups = {None: list(range(nc))}
+    for level, nodes in zip(all_levels, all_nodes):
+        best = [None] * nc
+        delta = full(nc, nan, dtype=float64)
+        scores = {}
+        for lab in sorted(set(level)):
+            scores[lab] = full(nc, nan, dtype=float64)
+
+        for parent, cells in cell_groups.items():
+            node = nodes[parent]
+            cells = array(cells, dtype=int32)
+            if not isinstance(node, SinglePrebuiltReference):
+                # Only one possible label, so there is no need to classify.
+                for c in cells:
+                    best[c] = node
+                continue
+
+            current = ranked if len(cells) == nc else ranked._subset_cells(cells)
+            res = classify_single_reference(current, None, node, **classify_args, num_threads=num_threads)
+            for c, b in zip(cells, res.column("best")):
+                best[c] = b
+            delta[cells] = res.column("delta")
+            res_scores = res.column("scores")
+            for lab in res_scores.column_names:
+                scores[lab][cells] = res_scores.column(lab)
+
+        results.append(
+            BiocFrame({"best": best, "scores": BiocFrame(scores, number_of_rows=nc), "delta": delta})
+        )
+        cell_groups = _group_indices(best)
+
+    output = results[-1]
+    output.metadata = {"levels": results}
+    return output
+
+
+def _group_indices(labels: Sequence) -> dict:
+    groups = {}
+    for i, x in enumerate(labels):
+        if x in groups:
+            groups[x].append(i)
+        else:
+            groups[x] = [i]
+    return groups
+
+
+def _build_level(ref_ptr, ref_features, labels, groups, build_args, num_threads) -> dict:
+    nodes = {}
+    for parent, columns in groups.items():
+        sub_labels = [labels[c] for c in columns]
+        choices = set(sub_labels)
+        if len(choices) == 1:
+            nodes[parent] = sub_labels[0]
+            continue
+
+        if len(columns) == ref_ptr.ncol():
+            sub_ptr = ref_ptr
+        else:
+            sub_ptr = _subset_pointer(ref_ptr, 1, columns)
+
+        nodes[parent] = build_single_reference(
+            sub_ptr,
+            ref_labels=sub_labels,
+            ref_features=ref_features,
+            **build_args,
+            num_threads=num_threads,
+        )
+    return nodes
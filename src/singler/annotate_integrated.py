@@ -1,15 +1,24 @@
+import os
 from typing import Any, Optional, Sequence, Tuple, Union
 
 from biocframe import BiocFrame
 
-from ._utils import _clean_matrix
+from ._utils import _clean_matrix, _is_chunked_array, _mask_chunked_missing, _unpack_experiment
 from .annotate_single import _resolve_reference
-from .build_integrated_references import build_integrated_references
+from .build_integrated_references import (
+    IntegratedReferences,
+    IntegratedReferencesMismatchError,
+    build_integrated_references,
+)
 from .build_single_reference import build_single_reference
 from .classify_integrated_references import classify_integrated_references
 from .classify_single_reference import classify_single_reference
+from .rank_test_matrix import rank_test_matrix
+from .result_sinks import ResultSink
+from .thread_budget import _uses_thread_budget
 
 
+@_uses_thread_budget
 def annotate_integrated(
     test_data: Any,
     ref_data_list: Sequence[Union[Any, str]],
@@ -24,8 +33,10 @@ def annotate_integrated(
     classify_single_args: dict = {},
     build_integrated_args: dict = {},
     classify_integrated_args: dict = {},
-    num_threads: int = 1,
-) -> Tuple[list[BiocFrame], BiocFrame]:
+    integrated_cache: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    sink: Optional[ResultSink] = None,
+) -> Tuple[list[BiocFrame], Optional[BiocFrame]]:
     """Annotate a single-cell expression dataset based on the correlation
     of each cell to profiles in multiple labelled references, where the
     annotation from each reference is then integrated across references.
@@ -123,8 +134,30 @@ def annotate_integrated(
             Further arguments to pass to
             :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
 
+        integrated_cache:
+            Path to a file for caching the integrated references.
+            If this file exists and was created for the same test features,
+            references and ``ref_names`` in ``build_integrated_args``, the
+            integrated references are loaded from it instead of being rebuilt.
+            The other ``build_integrated_args`` are not checked as they have no
+            effect here, since the references are already cleaned according to
+            ``ref_assay_type`` and ``ref_check_missing``. Otherwise, the integrated references are built and
+            saved to this path. Errors in reading an existing file, e.g., if
+            it is corrupted, are raised rather than triggering a rebuild.
+            If None, no caching is performed.
+
         num_threads:
             Number of threads to use for the various steps.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        sink:
+            A :py:class:`~singler.result_sinks.ResultSink` to which the
+            integrated results are written in chunks of cells, see
+            :py:meth:`~singler.classify_integrated_references.classify_integrated_references`
+            for details. Unless ``scores`` is specified in ``classify_single_args``,
+            the per-reference results only contain the ``best`` label and
+            ``delta`` for each cell, as the scores are not needed for integration.
 
     Returns:
         Tuple where the first element contains per-reference results (i.e. a
@@ -133,30 +166,15 @@ def annotate_integrated(
         and the second element contains integrated results across references
         (i.e., a BiocFrame from
         :py:meth:`~singler.classify_integrated_references.classify_integrated_references`).
+        If ``sink`` is provided, the second element is None.
     """
-    nrefs = len(ref_data_list)
+    ref_labels_list, ref_features_list = _normalize_reference_lists(ref_data_list, ref_labels_list, ref_features_list)
 
-    if isinstance(ref_labels_list, str):
-        ref_labels_list = [ref_labels_list] * nrefs
-    elif ref_labels_list is None:
-        ref_labels_list = [None] * nrefs
-
-    if nrefs != len(ref_labels_list):
-        raise ValueError("'ref_data_list' and 'ref_labels_list' must be the same length")
-
-    if isinstance(ref_features_list, str):
-        ref_features_list = [ref_features_list] * nrefs
-    elif ref_features_list is None:
-        ref_features_list = [None] * nrefs
-
-    if nrefs != len(ref_features_list):
-        raise ValueError("'ref_data_list' and 'ref_features_list' must be the same length")
-
-    test_ptr, test_features = _clean_matrix(
+    test_ptr, test_features = _prepare_test_for_integration(
         test_data,
         test_features,
-        assay_type=test_assay_type,
-        check_missing=test_check_missing,
+        test_assay_type=test_assay_type,
+        test_check_missing=test_check_missing,
         num_threads=num_threads,
     )
 
@@ -164,52 +182,121 @@ def annotate_integrated(
     all_ref_labels = []
     all_ref_features = []
     all_built = []
-    all_results = []
-    test_features_set = set(test_features)
+    test_features_set = _usable_features(test_features)
 
-    for r in range(nrefs):
-        curref_mat, curref_labels, curref_features = _resolve_reference(
+    for r in range(len(ref_data_list)):
+        curref_ptr, curref_labels, curref_features, curbuilt = _build_reference_for_integration(
             ref_data=ref_data_list[r],
             ref_labels=ref_labels_list[r],
             ref_features=ref_features_list[r],
-            build_args=build_single_args,
-        )
-
-        curref_ptr, curref_features = _clean_matrix(
-            curref_mat,
-            curref_features,
-            assay_type=ref_assay_type,
-            check_missing=ref_check_missing,
+            ref_assay_type=ref_assay_type,
+            ref_check_missing=ref_check_missing,
+            test_features_set=test_features_set,
+            build_single_args=build_single_args,
             num_threads=num_threads,
         )
 
-        curbuilt = build_single_reference(
-            ref_data=curref_ptr,
-            ref_labels=curref_labels,
-            ref_features=curref_features,
-            restrict_to=test_features_set,
-            **build_single_args,
-            num_threads=num_threads,
-        )
+        all_ref_data.append(curref_ptr)
+        all_ref_labels.append(curref_labels)
+        all_ref_features.append(curref_features)
+        all_built.append(curbuilt)
 
+    ibuilt = _load_or_build_integrated(
+        test_features,
+        all_ref_data,
+        all_ref_labels,
+        all_ref_features,
+        all_built,
+        build_integrated_args=build_integrated_args,
+        integrated_cache=integrated_cache,
+        num_threads=num_threads,
+    )
+
+    # Ranking the test data once for all references, rather than in each classification.
+    ranked = rank_test_matrix(
+        test_ptr,
+        test_features,
+        all_built + [ibuilt],
+        check_missing=test_check_missing,
+        num_threads=num_threads,
+    )
+
+    classify_single_args = _classify_single_args_for_integration(classify_single_args, classify_integrated_args, sink)
+    all_results = []
+    for curbuilt in all_built:
         res = classify_single_reference(
-            test_data,
+            ranked,
             test_features=test_features,
             ref_prebuilt=curbuilt,
             **classify_single_args,
             num_threads=num_threads,
         )
+        all_results.append(_attach_markers(res, curbuilt))
 
-        all_ref_data.append(curref_ptr)
-        all_ref_labels.append(curref_labels)
-        all_ref_features.append(curref_features)
-        all_built.append(curbuilt)
-        all_results.append(res)
+    ires = classify_integrated_references(
+        test_data=ranked,
+        results=all_results,
+        integrated_prebuilt=ibuilt,
+        **classify_integrated_args,
+        num_threads=num_threads,
+        sink=sink,
+    )
+
+    return all_results, ires
+
+
+# The steps below are shared with annotate_integrated_async(), which calls
+# them on an executor with 'num_threads = None', so every step that uses
+# threads leases them from the budget.
+
+
+@_uses_thread_budget
+def _prepare_test_for_integration(test_data, test_features, test_assay_type, test_check_missing, num_threads=None):
+    test_data, test_features = _unpack_experiment(test_data, test_features, test_assay_type)
+    if _is_chunked_array(test_data):
+        # On-disk matrices are streamed by rank_test_matrix(), so we don't load them into memory.
+        # Rows with NaNs are still excluded from the features used to build the references,
+        # as they would be removed by _clean_matrix() for in-memory matrices.
+        if test_check_missing:
+            test_features = _mask_chunked_missing(test_data, test_features)
+        return test_data, test_features
 
-        res.metadata = {
-            "markers": curbuilt.markers,
-            "unique_markers": curbuilt.marker_subset(),
-        }
+    return _clean_matrix(
+        test_data,
+        test_features,
+        assay_type=test_assay_type,
+        check_missing=test_check_missing,
+        num_threads=num_threads,
+    )
+
+
+def _usable_features(test_features):
+    test_features_set = set(test_features)
+    test_features_set.discard(None)
+    return test_features_set
+
+
+@_uses_thread_budget
+def _load_or_build_integrated(
+    test_features,
+    all_ref_data,
+    all_ref_labels,
+    all_ref_features,
+    all_built,
+    build_integrated_args,
+    integrated_cache,
+    num_threads=None,
+):
+    if integrated_cache is not None and os.path.exists(integrated_cache):
+        try:
+            return IntegratedReferences.load(
+                integrated_cache,
+                test_features=test_features,
+                ref_prebuilt_list=all_built,
+                ref_names=build_integrated_args.get("ref_names"),
+            )
+        except IntegratedReferencesMismatchError:
+            pass  # built from different inputs, so we rebuild and overwrite it.
 
     ibuilt = build_integrated_references(
         test_features=test_features,
@@ -220,13 +307,80 @@ def annotate_integrated(
         **build_integrated_args,
         num_threads=num_threads,
     )
+    if integrated_cache is not None:
+        ibuilt.save(integrated_cache)
+    return ibuilt
 
-    ires = classify_integrated_references(
-        test_data=test_ptr,
-        results=all_results,
-        integrated_prebuilt=ibuilt,
-        **classify_integrated_args,
+
+def _classify_single_args_for_integration(classify_single_args, classify_integrated_args, sink):
+    if sink is not None and not classify_integrated_args.get("reuse_single_scores", False):
+        return {"scores": "none", **classify_single_args}
+    return classify_single_args
+
+
+def _attach_markers(res, built):
+    res.metadata = {
+        "markers": built.markers,
+        "unique_markers": built.marker_subset(),
+    }
+    return res
+
+
+def _normalize_reference_lists(ref_data_list, ref_labels_list, ref_features_list):
+    nrefs = len(ref_data_list)
+
+    if isinstance(ref_labels_list, str):
+        ref_labels_list = [ref_labels_list] * nrefs
+    elif ref_labels_list is None:
+        ref_labels_list = [None] * nrefs
+
+    if nrefs != len(ref_labels_list):
+        raise ValueError("'ref_data_list' and 'ref_labels_list' must be the same length")
+
+    if isinstance(ref_features_list, str):
+        ref_features_list = [ref_features_list] * nrefs
+    elif ref_features_list is None:
+        ref_features_list = [None] * nrefs
+
+    if nrefs != len(ref_features_list):
+        raise ValueError("'ref_data_list' and 'ref_features_list' must be the same length")
+
+    return ref_labels_list, ref_features_list
+
+
+@_uses_thread_budget
+def _build_reference_for_integration(
+    ref_data,
+    ref_labels,
+    ref_features,
+    ref_assay_type,
+    ref_check_missing,
+    test_features_set,
+    build_single_args,
+    num_threads=None,
+):
+    curref_mat, curref_labels, curref_features = _resolve_reference(
+        ref_data=ref_data,
+        ref_labels=ref_labels,
+        ref_features=ref_features,
+        build_args=build_single_args,
+    )
+
+    curref_ptr, curref_features = _clean_matrix(
+        curref_mat,
+        curref_features,
+        assay_type=ref_assay_type,
+        check_missing=ref_check_missing,
         num_threads=num_threads,
     )
 
-    return all_results, ires
+    curbuilt = build_single_reference(
+        ref_data=curref_ptr,
+        ref_labels=curref_labels,
+        ref_features=curref_features,
+        restrict_to=test_features_set,
+        **build_single_args,
+        num_threads=num_threads,
+    )
+
+    return curref_ptr, curref_labels, curref_features, curbuilt
@@ -4,8 +4,11 @@ from typing import Any, Optional, Sequence, Union
 from biocframe import BiocFrame
 from summarizedexperiment import SummarizedExperiment
 
+from .aggregate_by_cluster import aggregate_by_cluster
 from .build_single_reference import build_single_reference
 from .classify_single_reference import classify_single_reference
+from .result_sinks import ResultSink
+from .thread_budget import _uses_thread_budget
 
 
 def _resolve_reference(ref_data, ref_labels, ref_features, build_args):
@@ -42,6 +45,7 @@ def _resolve_reference(ref_data, ref_labels, ref_features, build_args):
     return ref_data, ref_labels, ref_features
 
 
+@_uses_thread_budget
 def annotate_single(
     test_data: Any,
     ref_data: Any,
@@ -50,8 +54,11 @@ def annotate_single(
     ref_features: Optional[Union[Sequence, str]] = None,
     build_args: dict = {},
     classify_args: dict = {},
-    num_threads: int = 1,
-) -> BiocFrame:
+    num_threads: Optional[int] = None,
+    clusters: Optional[Sequence] = None,
+    per_cell: bool = False,
+    sink: Optional[ResultSink] = None,
+) -> Optional[BiocFrame]:
     """Annotate a single-cell expression dataset based on the correlation
     of each cell to profiles in a labelled reference.
 
@@ -116,6 +123,25 @@ def annotate_single(
 
         num_threads:
             Number of threads to use for the various steps.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        clusters:
+            Sequence of length equal to the number of columns of
+            ``test_data``, containing the cluster assignment for each column.
+            If provided, the expression values are summed across all cells
+            in each cluster with
+            :py:meth:`~singler.aggregate_by_cluster.aggregate_by_cluster`,
+            and each cluster is labelled instead of each cell.
+
+        per_cell:
+            Whether to also classify each cell, if ``clusters`` is provided.
+
+        sink:
+            A :py:class:`~singler.result_sinks.ResultSink` to which the
+            results are written in chunks of cells, see
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`
+            for details. This cannot be used with ``clusters``.
 
     Returns:
         A data frame containing the labelling results, see
@@ -123,8 +149,84 @@ def annotate_single(
         for details. The metadata also contains a ``markers`` dictionary,
         specifying the markers that were used for each pairwise comparison
         between labels; and a list of ``unique_markers`` across all labels.
+
+        If ``clusters`` is provided, each row instead corresponds to a
+        cluster, and the row names are the sorted unique clusters. The
+        metadata also contains ``cell_labels``, a list of the label for each
+        cell based on its cluster; and if ``per_cell = True``, ``per_cell``,
+        a data frame containing the results for each cell.
+
+        If ``sink`` is provided, None is returned instead.
     """
+    if sink is not None and clusters is not None:
+        raise ValueError("'sink' cannot be used with 'clusters'")
+
+    test_data, test_features, built = _build_reference_for_test(
+        test_data=test_data,
+        ref_data=ref_data,
+        ref_labels=ref_labels,
+        test_features=test_features,
+        ref_features=ref_features,
+        build_args=build_args,
+        num_threads=num_threads,
+    )
+
+    if sink is not None:
+        classify_single_reference(
+            test_data,
+            test_features=test_features,
+            ref_prebuilt=built,
+            **classify_args,
+            num_threads=num_threads,
+            sink=sink,
+        )
+        return None
+
+    if clusters is None:
+        output = classify_single_reference(
+            test_data,
+            test_features=test_features,
+            ref_prebuilt=built,
+            **classify_args,
+            num_threads=num_threads,
+        )
+    else:
+        aggregated, levels = aggregate_by_cluster(
+            test_data,
+            clusters,
+            assay_type=classify_args.get("assay_type", 0),
+            num_threads=num_threads,
+        )
+        output = classify_single_reference(
+            aggregated,
+            test_features=test_features,
+            ref_prebuilt=built,
+            **classify_args,
+            num_threads=num_threads,
+        )
+        output = output.set_row_names([str(x) for x in levels])
+
+    output.metadata = {
+        "markers": built.markers,
+        "unique_markers": built.marker_subset(),
+    }
 
+    if clusters is not None:
+        by_cluster = dict(zip(levels, output.column("best")))
+        output.metadata["cell_labels"] = [by_cluster[x] for x in clusters]
+        if per_cell:
+            output.metadata["per_cell"] = classify_single_reference(
+                test_data,
+                test_features=test_features,
+                ref_prebuilt=built,
+                **classify_args,
+                num_threads=num_threads,
+            )
+
+    return output
+
+
+def _resolve_test(test_data, test_features):
     if isinstance(test_data, SummarizedExperiment):
         if test_features is None:
             test_features = test_data.get_row_names()
@@ -141,6 +243,12 @@ def annotate_single(
         print("modifying test data")
         test_data = test_data[_idxs,]
 
+    return test_data, test_features, test_features_set
+
+
+def _build_reference_for_test(test_data, ref_data, ref_labels, test_features, ref_features, build_args, num_threads):
+    test_data, test_features, test_features_set = _resolve_test(test_data, test_features)
+
     ref_data, ref_labels, ref_features = _resolve_reference(
         ref_data=ref_data,
         ref_labels=ref_labels,
@@ -157,16 +265,4 @@ def annotate_single(
         num_threads=num_threads,
     )
 
-    output = classify_single_reference(
-        test_data,
-        test_features=test_features,
-        ref_prebuilt=built,
-        **classify_args,
-        num_threads=num_threads,
-    )
-
-    output.metadata = {
-        "markers": built.markers,
-        "unique_markers": built.marker_subset(),
-    }
-    return output
+    return test_data, test_features, built
@@ -0,0 +1,506 @@
+import asyncio
+from concurrent.futures import Executor
+from functools import partial
+from typing import Any, Callable, Optional, Sequence, Tuple, Union
+
+from biocframe import BiocFrame
+
+from ._utils import _slice_out
+from .annotate_integrated import (
+    _attach_markers,
+    _build_reference_for_integration,
+    _classify_single_args_for_integration,
+    _load_or_build_integrated,
+    _normalize_reference_lists,
+    _prepare_test_for_integration,
+    _usable_features,
+)
+from .annotate_single import _build_reference_for_test
+from .build_integrated_references import IntegratedReferences
+from .build_single_reference import SinglePrebuiltReference
+from .classify_integrated_references import _column_blocks as _integrated_column_blocks
+from .classify_integrated_references import _combine_integrated_results, classify_integrated_references
+from .classify_single_reference import _column_blocks as _single_column_blocks
+from .classify_single_reference import _combine_single_results, classify_single_reference
+from .rank_test_matrix import rank_test_matrix
+from .result_sinks import ResultSink
+
+
+async def _run(executor: Optional[Executor], fun: Callable, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(fun, *args, **kwargs))
+
+
+async def classify_single_reference_async(
+    test_data: Any,
+    test_features: Sequence,
+    ref_prebuilt: SinglePrebuiltReference,
+    assay_type: Union[str, int] = 0,
+    check_missing: bool = True,
+    chunk_size: Optional[int] = 10000,
+    executor: Optional[Executor] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    **kwargs,
+) -> BiocFrame:
+    """Asynchronous version of
+    :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+    The test dataset is split into chunks of columns, each of which is
+    classified on ``executor`` without blocking the event loop.
+
+    Args:
+        test_data:
+            Test dataset, see
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+        test_features:
+            Features of the test dataset, see
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+        ref_prebuilt:
+            A pre-built reference created with
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+
+        assay_type:
+            Assay containing the expression matrix,
+            if `test_data` is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        check_missing:
+            Whether to check for and remove rows with missing (NaN) values
+            from ``test_data``.
+
+        chunk_size:
+            Number of columns of ``test_data`` to classify in each chunk.
+            Cancellation of the task takes effect between chunks.
+            If None, all columns are classified in a single chunk.
+
+        executor:
+            Executor on which to run the native code.
+            If None, the default executor of the running event loop is used.
+
+        progress:
+            Function to be called after each chunk is classified.
+            This should accept the number of classified columns and the total number of columns.
+
+        kwargs:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+            If ``out`` is supplied, each chunk is written into the
+            corresponding slice of the output buffers. If ``sink`` is
+            supplied, each chunk is written to the sink in order.
+
+    Returns:
+        Same as :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+    """
+    # The test data is cleaned on the executor with threads leased from the
+    # budget, as in classify_single_reference(), and blocks of on-disk data
+    # are also read on the executor as they are classified.
+    nc, test_features, check_missing, blocks = await _run(
+        executor,
+        _single_column_blocks,
+        test_data,
+        test_features,
+        assay_type,
+        check_missing,
+        chunk_size,
+        num_threads=kwargs.get("num_threads"),
+    )
+
+    out = kwargs.pop("out", None)
+    collected = []
+    while True:
+        chunk = await _run(executor, next, blocks, None)
+        if chunk is None:
+            break
+        start, end, block = chunk
+        res = await _run(
+            executor,
+            classify_single_reference,
+            block,
+            test_features=test_features,
+            ref_prebuilt=ref_prebuilt,
+            check_missing=check_missing,
+            out=_slice_out(out, start, end),
+            **kwargs,
+        )
+        collected.append(res)
+        if progress is not None:
+            progress(end, nc)
+
+    if kwargs.get("sink") is not None:
+        return None
+    return _combine_single_results(collected)
+
+
+async def classify_integrated_references_async(
+    test_data: Any,
+    results: list[Union[BiocFrame, Sequence]],
+    integrated_prebuilt: IntegratedReferences,
+    assay_type: Union[str, int] = 0,
+    chunk_size: Optional[int] = 10000,
+    executor: Optional[Executor] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    **kwargs,
+) -> BiocFrame:
+    """Asynchronous version of
+    :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
+    The test dataset is split into chunks of columns, each of which is
+    classified on ``executor`` without blocking the event loop.
+
+    Args:
+        test_data:
+            Test dataset, see
+            :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
+
+        results:
+            List of classification results for each reference, see
+            :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
+
+        integrated_prebuilt:
+            Integrated reference object, constructed with
+            :py:meth:`~singler.build_integrated_references.build_integrated_references`.
+
+        assay_type:
+            Assay containing the expression matrix,
+            if `test_data` is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        chunk_size:
+            Number of columns of ``test_data`` to classify in each chunk.
+            Cancellation of the task takes effect between chunks.
+            If None, all columns are classified in a single chunk.
+
+        executor:
+            Executor on which to run the native code.
+            If None, the default executor of the running event loop is used.
+
+        progress:
+            Function to be called after each chunk is classified.
+            This should accept the number of classified columns and the total number of columns.
+
+        kwargs:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
+            If ``out`` is supplied, each chunk is written into the
+            corresponding slice of the output buffers. If ``sink`` is
+            supplied, each chunk is written to the sink in order.
+
+    Returns:
+        Same as :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
+    """
+    nc, blocks = await _run(
+        executor,
+        _integrated_column_blocks,
+        test_data,
+        results,
+        assay_type,
+        kwargs.get("reuse_single_scores", False),
+        chunk_size,
+    )
+
+    out = kwargs.pop("out", None)
+    collected = []
+    while True:
+        chunk = await _run(executor, next, blocks, None)
+        if chunk is None:
+            break
+        start, end, block, block_results = chunk
+        res = await _run(
+            executor,
+            classify_integrated_references,
+            block,
+            results=block_results,
+            integrated_prebuilt=integrated_prebuilt,
+            out=_slice_out(out, start, end),
+            **kwargs,
+        )
+        collected.append(res)
+        if progress is not None:
+            progress(end, nc)
+
+    if kwargs.get("sink") is not None:
+        return None
+    return _combine_integrated_results(collected)
+
+
+async def annotate_single_async(
+    test_data: Any,
+    ref_data: Any,
+    ref_labels: Optional[Union[Sequence, str]],
+    test_features: Optional[Union[Sequence, str]] = None,
+    ref_features: Optional[Union[Sequence, str]] = None,
+    build_args: dict = {},
+    classify_args: dict = {},
+    num_threads: Optional[int] = None,
+    chunk_size: Optional[int] = 10000,
+    executor: Optional[Executor] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> BiocFrame:
+    """Asynchronous version of :py:meth:`~singler.annotate_single.annotate_single`.
+    The reference is built on ``executor``, after which classification is
+    performed with :py:meth:`~classify_single_reference_async`.
+
+    Args:
+        test_data:
+            Test dataset, see :py:meth:`~singler.annotate_single.annotate_single`.
+
+        ref_data:
+            Reference dataset, see :py:meth:`~singler.annotate_single.annotate_single`.
+
+        ref_labels:
+            Reference labels, see :py:meth:`~singler.annotate_single.annotate_single`.
+
+        test_features:
+            Test features, see :py:meth:`~singler.annotate_single.annotate_single`.
+
+        ref_features:
+            Reference features, see :py:meth:`~singler.annotate_single.annotate_single`.
+
+        build_args:
+            Further arguments to pass to
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+
+        classify_args:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+        num_threads:
+            Number of threads to use for the various steps.
+            If None, each step takes threads from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        chunk_size:
+            Number of columns of ``test_data`` to classify in each chunk,
+            see :py:meth:`~classify_single_reference_async`.
+
+        executor:
+            Executor on which to run the native code.
+            If None, the default executor of the running event loop is used.
+
+        progress:
+            Function to be called after each chunk is classified,
+            see :py:meth:`~classify_single_reference_async`.
+
+    Returns:
+        Same as :py:meth:`~singler.annotate_single.annotate_single`.
+    """
+    test_data, test_features, built = await _run(
+        executor,
+        _build_reference_for_test,
+        test_data=test_data,
+        ref_data=ref_data,
+        ref_labels=ref_labels,
+        test_features=test_features,
+        ref_features=ref_features,
+        build_args=build_args,
+        num_threads=num_threads,
+    )
+
+    output = await classify_single_reference_async(
+        test_data,
+        test_features=test_features,
+        ref_prebuilt=built,
+        chunk_size=chunk_size,
+        executor=executor,
+        progress=progress,
+        **classify_args,
+        num_threads=num_threads,
+    )
+
+    output.metadata = {
+        "markers": built.markers,
+        "unique_markers": built.marker_subset(),
+    }
+    return output
+
+
+async def annotate_integrated_async(
+    test_data: Any,
+    ref_data_list: Sequence[Union[Any, str]],
+    test_features: Optional[Union[Sequence, str]] = None,
+    ref_labels_list: Optional[Union[Optional[str], Sequence[Union[Sequence, str]]]] = None,
+    ref_features_list: Optional[Union[Optional[str], Sequence[Union[Sequence, str]]]] = None,
+    test_assay_type: Union[str, int] = 0,
+    test_check_missing: bool = True,
+    ref_assay_type: Union[str, int] = "logcounts",
+    ref_check_missing: bool = True,
+    build_single_args: dict = {},
+    classify_single_args: dict = {},
+    build_integrated_args: dict = {},
+    classify_integrated_args: dict = {},
+    integrated_cache: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    chunk_size: Optional[int] = 10000,
+    executor: Optional[Executor] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    sink: Optional[ResultSink] = None,
+) -> Tuple[list[BiocFrame], Optional[BiocFrame]]:
+    """Asynchronous version of :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+    All references are built on ``executor``, and each classification is
+    performed in chunks with :py:meth:`~classify_single_reference_async` and
+    :py:meth:`~classify_integrated_references_async`.
+
+    Args:
+        test_data:
+            Test dataset, see :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+
+        ref_data_list:
+            Reference datasets, see :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+
+        test_features:
+            Test features, see :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+
+        ref_labels_list:
+            Reference labels, see :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+
+        ref_features_list:
+            Reference features, see :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+
+        test_assay_type:
+            Assay of ``test_data`` containing the expression matrix, if ``test_data`` is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        test_check_missing:
+            Whether to check for and remove missing (i.e., NaN) values from the test dataset.
+
+        ref_assay_type:
+            Assay containing the expression matrix for any entry of ``ref_data_list`` that is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        ref_check_missing:
+            Whether to check for and remove missing (i.e., NaN) values from the reference datasets.
+
+        build_single_args:
+            Further arguments to pass to
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+
+        classify_single_args:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+        build_integrated_args:
+            Further arguments to pass to
+            :py:meth:`~singler.build_integrated_references.build_integrated_references`.
+
+        classify_integrated_args:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
+
+        integrated_cache:
+            Path to a file in which to cache the integrated references,
+            see :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+
+        num_threads:
+            Number of threads to use for the various steps.
+            If None, each step takes threads from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        chunk_size:
+            Number of columns of ``test_data`` to classify in each chunk,
+            see :py:meth:`~classify_single_reference_async`.
+
+        executor:
+            Executor on which to run the native code.
+            If None, the default executor of the running event loop is used.
+
+        progress:
+            Function to be called after each chunk is classified in each step,
+            see :py:meth:`~classify_single_reference_async`.
+
+        sink:
+            Sink to which the integrated results are written,
+            see :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+
+    Returns:
+        Same as :py:meth:`~singler.annotate_integrated.annotate_integrated`.
+    """
+    ref_labels_list, ref_features_list = _normalize_reference_lists(ref_data_list, ref_labels_list, ref_features_list)
+
+    # Each step is shared with annotate_integrated() and leases threads from
+    # the budget on the executor if 'num_threads = None'.
+    test_ptr, test_features = await _run(
+        executor,
+        _prepare_test_for_integration,
+        test_data,
+        test_features,
+        test_assay_type=test_assay_type,
+        test_check_missing=test_check_missing,
+        num_threads=num_threads,
+    )
+
+    all_ref_data = []
+    all_ref_labels = []
+    all_ref_features = []
+    all_built = []
+    test_features_set = _usable_features(test_features)
+
+    for r in range(len(ref_data_list)):
+        curref_ptr, curref_labels, curref_features, curbuilt = await _run(
+            executor,
+            _build_reference_for_integration,
+            ref_data=ref_data_list[r],
+            ref_labels=ref_labels_list[r],
+            ref_features=ref_features_list[r],
+            ref_assay_type=ref_assay_type,
+            ref_check_missing=ref_check_missing,
+            test_features_set=test_features_set,
+            build_single_args=build_single_args,
+            num_threads=num_threads,
+        )
+
+        all_ref_data.append(curref_ptr)
+        all_ref_labels.append(curref_labels)
+        all_ref_features.append(curref_features)
+        all_built.append(curbuilt)
+
+    ibuilt = await _run(
+        executor,
+        _load_or_build_integrated,
+        test_features,
+        all_ref_data,
+        all_ref_labels,
+        all_ref_features,
+        all_built,
+        build_integrated_args=build_integrated_args,
+        integrated_cache=integrated_cache,
+        num_threads=num_threads,
+    )
+
+    ranked = await _run(
+        executor,
+        rank_test_matrix,
+        test_ptr,
+        test_features,
+        all_built + [ibuilt],
+        check_missing=test_check_missing,
+        num_threads=num_threads,
+    )
+
+    classify_single_args = _classify_single_args_for_integration(classify_single_args, classify_integrated_args, sink)
+    all_results = []
+    for curbuilt in all_built:
+        res = await classify_single_reference_async(
+            ranked,
+            test_features=test_features,
+            ref_prebuilt=curbuilt,
+            chunk_size=chunk_size,
+            executor=executor,
+            progress=progress,
+            **classify_single_args,
+            num_threads=num_threads,
+        )
+        all_results.append(_attach_markers(res, curbuilt))
+
+    ires = await classify_integrated_references_async(
+        test_data=ranked,
+        results=all_results,
+        integrated_prebuilt=ibuilt,
+        chunk_size=chunk_size,
+        executor=executor,
+        progress=progress,
+        **classify_integrated_args,
+        num_threads=num_threads,
+        sink=sink,
+    )
+
+    return all_results, ires
@@ -1,22 +1,43 @@
+import hashlib
 from typing import Sequence, Optional, Union
-from numpy import array, ndarray, int32, uintp
+
+import numpy
+from numpy import arange, array, ndarray, int32, uintp, zeros
 
 import biocutils as ut
+from delayedarray import DelayedArray, extract_dense_array
+from mattress import tatamize
 
 from .build_single_reference import SinglePrebuiltReference
 from . import _cpphelpers as lib
-from ._utils import _stable_union, _factorize, _clean_matrix
+from ._utils import _stable_union, _factorize, _clean_matrix, _create_map, _estimate_nbytes
+from .thread_budget import _uses_thread_budget
+
+
+class IntegratedReferencesMismatchError(ValueError):
+    """Raised by :py:meth:`~IntegratedReferences.load` when the saved
+    integrated references were built from different test features or
+    prebuilt references than those supplied."""
 
 
 class IntegratedReferences:
     """Object containing integrated references, typically constructed by
-    :py:meth:`~singler.build_integrated_references.build_integrated_references`."""
+    :py:meth:`~singler.build_integrated_references.build_integrated_references`.
+    This can be saved to file with :py:meth:`~save` and restored with
+    :py:meth:`~load`, e.g., to avoid rebuilding the integrated references for
+    the same test features and references.
 
-    def __init__(self, ptr, ref_names, ref_labels, test_features):
+    Like :py:class:`~singler.build_single_reference.SinglePrebuiltReference`,
+    the same object can be used for classification in multiple Python
+    threads at the same time."""
+
+    def __init__(self, ptr, ref_names, ref_labels, test_features, peak_bytes=None, key=None):
         self._ptr = ptr
         self._names = ref_names
         self._labels = ref_labels
         self._features = test_features
+        self._peak_bytes = peak_bytes
+        self._key = key
 
     def __del__(self):
         lib.free_integrated_references(self._ptr)
@@ -41,7 +62,179 @@ class IntegratedReferences:
         """Sequence containing the names of the test features."""
         return self._features
 
+    @property
+    def peak_reference_bytes(self) -> Union[int, None]:
+        """Estimated peak number of bytes occupied by the reference expression
+        values during construction, i.e., the largest reference that was loaded
+        plus the marker rows retained from all previously processed references.
+        Alternatively None, if this was not recorded."""
+        return self._peak_bytes
+
+    @property
+    def key(self) -> Union[str, None]:
+        """Key that identifies the test features and the component references,
+        see :py:meth:`~integrated_references_key`. Alternatively None, if
+        this is not known."""
+        return self._key
+
+    def marker_subset(self, indices_only: bool = False) -> Union[ndarray, list]:
+        """
+        Args:
+            indices_only:
+                Whether to return the markers as indices
+                into :py:attr:`~test_features`, or as a list of feature identifiers.
+
+        Returns:
+            If ``indices_only = False``, a list of feature identifiers for the
+            union of markers across all references.
+
+            If ``indices_only = True``, a NumPy array containing the integer indices of
+            features in ``test_features`` that were chosen as markers.
+        """
+        buffer = ndarray(lib.get_integrated_universe_size(self._ptr), dtype=int32)
+        lib.get_integrated_universe(self._ptr, buffer)
+        if indices_only:
+            return buffer
+        else:
+            return [self._features[i] for i in buffer]
+
+    def save(self, path: str):
+        """Save the integrated references to a NumPy ``.npz`` file.
+
+        Args:
+            path:
+                Path to the output file.
+        """
+        contents = ndarray(lib.get_serialized_integrated_references_size(self._ptr), dtype=int32)
+        lib.serialize_integrated_references(self._ptr, contents)
+
+        # Features are set to None when they have missing values in the test
+        # dataset. These are stored separately, as object arrays cannot be loaded
+        # without pickling.
+        missing = numpy.array([f is None for f in self._features], dtype=bool)
+        arrays = {
+            "contents": contents,
+            "test_features": numpy.array(["" if f is None else f for f in self._features]),
+            "num_references": numpy.array(len(self._labels)),
+        }
+        if missing.any():
+            arrays["test_features_missing"] = missing
+        for i, lab in enumerate(self._labels):
+            arrays["labels_" + str(i)] = numpy.array(lab)
+        if self._names is not None:
+            arrays["reference_names"] = numpy.array(self._names)
+        if self._key is not None:
+            arrays["key"] = numpy.array(self._key)
+
+        with open(path, "wb") as handle:
+            numpy.savez(handle, **arrays)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        test_features: Optional[Sequence] = None,
+        ref_prebuilt_list: Optional[list[SinglePrebuiltReference]] = None,
+        ref_names: Optional[Sequence[str]] = None,
+    ) -> "IntegratedReferences":
+        """Load integrated references from a file created by :py:meth:`~save`.
+
+        Args:
+            path:
+                Path to the file.
+
+            test_features:
+                Sequence of features for the test dataset.
+                If supplied with ``ref_prebuilt_list``, this is used to check
+                that the saved references were built for the same inputs.
+
+            ref_prebuilt_list:
+                List of prebuilt references that were used to construct the
+                integrated references, see
+                :py:meth:`~singler.build_integrated_references.build_integrated_references`.
+
+            ref_names:
+                Sequence of names for the references, see
+                :py:meth:`~singler.build_integrated_references.build_integrated_references`.
+
+        Returns:
+            The integrated references.
+
+        Raises:
+            IntegratedReferencesMismatchError:
+                If ``test_features`` and ``ref_prebuilt_list`` are supplied
+                and do not match the inputs used to build the saved references.
+        """
+        with numpy.load(path, allow_pickle=False) as handle:
+            key = str(handle["key"]) if "key" in handle else None
+            if test_features is not None and ref_prebuilt_list is not None:
+                expected = integrated_references_key(test_features, ref_prebuilt_list, ref_names)
+                if key != expected:
+                    raise IntegratedReferencesMismatchError(
+                        "integrated references in '" + path + "' were built from different inputs"
+                    )
+
+            contents = numpy.ascontiguousarray(handle["contents"], dtype=int32)
+            nrefs = int(handle["num_references"])
+            labels = [ut.StringList(handle["labels_" + str(i)].tolist()) for i in range(nrefs)]
+            names = handle["reference_names"].tolist() if "reference_names" in handle else None
+            features = handle["test_features"].tolist()
+            if "test_features_missing" in handle:
+                for i in numpy.where(handle["test_features_missing"])[0]:
+                    features[i] = None
+
+        ptr = lib.deserialize_integrated_references(len(contents), contents)
+        return cls(ptr, names, labels, features, key=key)
+
+
+def integrated_references_key(
+    test_features: Sequence,
+    ref_prebuilt_list: list[SinglePrebuiltReference],
+    ref_names: Optional[Sequence[str]] = None,
+) -> str:
+    """Compute a key for the integrated references of a test dataset, e.g., to
+    determine whether saved references can be re-used.
+
+    Args:
+        test_features:
+            Sequence of features for the test dataset.
+
+        ref_prebuilt_list:
+            List of prebuilt references, see
+            :py:meth:`~singler.build_integrated_references.build_integrated_references`.
+
+        ref_names:
+            Sequence of names for the references.
+
+    Returns:
+        Hexadecimal digest of the test features, the reference names, and the
+        features, labels and markers of each prebuilt reference. The expression
+        values of each reference are not considered, as these are assumed to be
+        the same as those used to build the corresponding prebuilt reference.
+    """
+    digest = hashlib.sha256()
+
+    def update(*values):
+        for v in values:
+            digest.update(repr(v).encode())
+            digest.update(b"\0")
+
+    update("test_features", len(test_features), *test_features)
+    update("ref_names", ref_names is not None)
+    if ref_names is not None:
+        update(*ref_names)
+
+    for ref in ref_prebuilt_list:
+        update("features", len(ref.features), *ref.features)
+        update("labels", len(ref.labels), *ref.labels)
+        for first, inner in ref.markers.items():
+            for second, current in inner.items():
+                update("markers", first, second, len(current), *current)
+
+    return digest.hexdigest()
 
+
+@_uses_thread_budget
 def build_integrated_references(
     test_features: Sequence,
     ref_data_list: dict,
@@ -51,7 +244,7 @@ def build_integrated_references(
     ref_names: Optional[Sequence[str]] = None,
     assay_type: Union[str, int] = "logcounts",
     check_missing: bool = True,
-    num_threads: int = 1,
+    num_threads: Optional[int] = None,
 ) -> IntegratedReferences:
     """Build a set of integrated references for classification of a test dataset.
 
@@ -63,6 +256,12 @@ def build_integrated_references(
             List of reference datasets, where each entry is equivalent to ``ref_data`` in
             :py:meth:`~singler.build_single_reference.build_single_reference`.
 
+            Alternatively, each entry may be a function that accepts no
+            arguments and returns the reference dataset. This is called when
+            the reference is processed, so only one reference needs to be
+            loaded at any given time; after processing, only the rows for the
+            markers are retained.
+
         ref_labels_list:
             List of reference labels, where each entry is equivalent to ``ref_labels`` in
             :py:meth:`~singler.build_single_reference.build_single_reference`.
@@ -90,27 +289,60 @@ def build_integrated_references(
 
         num_threads:
             Number of threads.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
 
     Returns:
         Integrated references for classification with
         :py:meth:`~singler.classify_integrated_references.classify_integrated_references`.
+        The estimated peak memory usage of the reference datasets is reported in
+        :py:attr:`~singler.build_integrated_references.IntegratedReferences.peak_reference_bytes`.
     """
     nrefs = len(ref_data_list)
     if nrefs != len(ref_features_list):
         raise ValueError(
             "'ref_features_list' and 'ref_data_list' should have the same length"
         )
+    if nrefs != len(ref_labels_list):
+        raise ValueError(
+            "'ref_labels_list' and 'ref_data_list' should have the same length"
+        )
+    if nrefs != len(ref_prebuilt_list):
+        raise ValueError(
+            "'ref_prebuilt_list' and 'ref_data_list' should have the same length"
+        )
+
+    if ref_names is not None:
+        if nrefs != len(ref_names):
+            raise ValueError(
+                "'ref_names' and 'ref_data_list' should have the same length"
+            )
+        elif nrefs != len(set(ref_names)):
+            raise ValueError("'ref_names' should contain unique names")
 
     universe = _stable_union(test_features, *ref_features_list)
     original_test_features = test_features
     test_features = array(ut.match(test_features, universe), dtype=int32)
 
+    # Only the markers that are present in the test dataset are ever used,
+    # so we can identify them before loading any of the reference matrices.
+    present = set(x for x in original_test_features if x is not None)
+    used = set()
+    for x in ref_prebuilt_list:
+        for y in x.marker_subset():
+            if y in present:
+                used.add(y)
+
     converted_ref_data = []
     ref_data_ptrs = ndarray(nrefs, dtype=uintp)
     converted_feature_data = []
     ref_features_ptrs = ndarray(nrefs, dtype=uintp)
+    retained_bytes = 0
+    peak_bytes = 0
 
     for i, x in enumerate(ref_data_list):
+        if callable(x):
+            x = x()
         curptr, curfeatures = _clean_matrix(
             x,
             ref_features_list[i],
@@ -118,17 +350,22 @@ def build_integrated_references(
             check_missing=check_missing,
             num_threads=num_threads,
         )
+        peak_bytes = max(peak_bytes, retained_bytes + _estimate_nbytes(x, assay_type))
+
+        # Each reference is reduced to its marker rows and then released, so
+        # that only one full reference needs to be in memory at any time.
+        curptr, curfeatures, nbytes = _retain_marker_rows(
+            curptr, curfeatures, ref_prebuilt_list[i].features, used
+        )
+        del x
         converted_ref_data.append(curptr)
         ref_data_ptrs[i] = curptr.ptr
+        retained_bytes += nbytes
 
         ind = array(ut.match(curfeatures, universe), dtype=int32)
         converted_feature_data.append(ind)
         ref_features_ptrs[i] = ind.ctypes.data
 
-    if nrefs != len(ref_labels_list):
-        raise ValueError(
-            "'ref_labels_list' and 'ref_data_list' should have the same length"
-        )
     converted_label_levels = []
     converted_label_indices = []
     ref_labels_ptrs = ndarray(nrefs, dtype=uintp)
@@ -139,22 +376,10 @@ def build_integrated_references(
         converted_label_indices.append(ind)
         ref_labels_ptrs[i] = ind.ctypes.data
 
-    if nrefs != len(ref_prebuilt_list):
-        raise ValueError(
-            "'ref_prebuilt_list' and 'ref_data_list' should have the same length"
-        )
     ref_prebuilt_ptrs = ndarray(nrefs, dtype=uintp)
     for i, x in enumerate(ref_prebuilt_list):
         ref_prebuilt_ptrs[i] = x._ptr
 
-    if ref_names is not None:
-        if nrefs != len(ref_names):
-            raise ValueError(
-                "'ref_names' and 'ref_data_list' should have the same length"
-            )
-        elif nrefs != len(set(ref_names)):
-            raise ValueError("'ref_names' should contain unique names")
-
     output = lib.build_integrated_references(
         len(test_features),
         test_features,
@@ -167,5 +392,37 @@ def build_integrated_references(
     )
 
     return IntegratedReferences(
-        output, ref_names, converted_label_levels, original_test_features
+        output,
+        ref_names,
+        converted_label_levels,
+        original_test_features,
+        peak_bytes=peak_bytes,
+        key=integrated_references_key(original_test_features, ref_prebuilt_list, ref_names),
     )
+
+
+def _retain_marker_rows(ptr, features, prebuilt_features, used):
+    # Copies the rows for the used markers into a compact matrix, and returns
+    # a view with one row per feature of the prebuilt reference, as the marker
+    # indices refer to those features (e.g., after 'restrict_to=' in
+    # build_single_reference). The IntegratedBuilder only extracts the rows
+    # for used markers, so the remaining rows can map to any row of the copy.
+    mapping = _create_map(features)
+    sources = []
+    for f in prebuilt_features:
+        if f not in mapping:
+            raise KeyError("failed to find gene '" + str(f) + "' in the reference dataset")
+        sources.append(mapping[f] if f in used else None)
+
+    keep = sorted(set(r for r in sources if r is not None))
+    if len(keep) == 0 and len(features):
+        keep = [0]
+    position = dict((r, i) for i, r in enumerate(keep))
+
+    compact = extract_dense_array(ptr, (keep, range(ptr.ncol())))
+    row_map = zeros(len(sources), dtype=int32)
+    for i, r in enumerate(sources):
+        if r is not None:
+            row_map[i] = position[r]
+
+    return tatamize(DelayedArray(compact)[row_map, :]), prebuilt_features, compact.nbytes
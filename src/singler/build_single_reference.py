@@ -7,12 +7,18 @@ from . import _cpphelpers as lib
 from ._Markers import _Markers
 from ._utils import _clean_matrix, _factorize, _restrict_features
 from .get_classic_markers import _get_classic_markers_raw
+from .thread_budget import _uses_thread_budget
 
 
 class SinglePrebuiltReference:
     """A prebuilt reference object, typically created by
     :py:meth:`~singler.build_single_reference.build_single_reference`. This is intended for advanced users only and
     should not be serialized.
+
+    The native reference is never modified after it is built, so the same
+    object can be used for classification in multiple Python threads at the
+    same time. The global interpreter lock is released during the native
+    parts of the classification, so these threads run in parallel.
     """
 
     def __init__(
@@ -21,11 +27,17 @@ class SinglePrebuiltReference:
         labels: Sequence,
         features: Sequence,
         markers: dict[Any, dict[Any, Sequence]],
+        index_options: Optional[dict] = None,
     ):
         self._ptr = ptr
         self._features = features
         self._labels = labels
         self._markers = markers
+        if index_options is None:
+            index_options = _resolve_index_options(True, {})
+        self._index_options = index_options
+        self._cached_test_rows = None
+        self._cached_centroids = None
 
     def __del__(self):
         lib.free_single_reference(self._ptr)
@@ -61,6 +73,30 @@ class SinglePrebuiltReference:
         """
         return self._labels
 
+    @property
+    def approximate(self) -> Union[bool, str]:
+        """
+        Returns:
+            False if an exact neighbor search is used for classification,
+            otherwise the name of the approximate search algorithm,
+            see ``approximate`` in
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+        """
+        return _INDEX_TYPES[self._index_options["index_type"]]
+
+    @property
+    def approximate_args(self) -> dict:
+        """
+        Returns:
+            Parameters of the approximate search algorithm, including the
+            defaults for any parameters that were not specified in
+            ``approximate_args``. This is empty for an exact search.
+        """
+        method = self.approximate
+        if method is False:
+            return {}
+        return {k: self._index_options[k] for k in _INDEX_DEFAULTS[method]}
+
     @property
     def markers(self) -> dict[Any, dict[Any, Sequence]]:
         """
@@ -90,7 +126,95 @@ class SinglePrebuiltReference:
         else:
             return [self._features[i] for i in buffer]
 
+    @_uses_thread_budget
+    def specialize(self, test_features: Sequence, num_threads: Optional[int] = None) -> "SinglePrebuiltReference":
+        """Specialize this reference to a test dataset by dropping all markers
+        that are not present in its features. This allows a reference to be
+        built once with all of its features, and then used to classify test
+        datasets with different sets of features. It is much faster than
+        rebuilding the reference with ``restrict_to``, as the marker
+        detection is not repeated and the ranks of the remaining markers are
+        derived from the existing ranks.
+
+        Note that the markers for each pairwise comparison are not replaced,
+        so some comparisons may have fewer markers than in a reference that
+        was built with ``restrict_to``. It may be helpful to build the
+        reference with more markers, e.g., a larger ``num_de`` in
+        ``marker_args``, to compensate.
+
+        Args:
+            test_features:
+                Sequence of identifiers for each feature in the test dataset.
+
+            num_threads:
+                Number of threads to use.
+                If None, threads are taken from the library-wide budget,
+                see :py:meth:`~singler.thread_budget.thread_budget`.
 
+        Returns:
+            A reference that only uses the markers in ``test_features``.
+            This is the same object if all markers are already present.
+        """
+        present = set(test_features)
+        subset = self.marker_subset()
+        keep = array([i for i, x in enumerate(subset) if x in present], dtype=int32)
+        if len(keep) == len(subset):
+            return self
+        if len(keep) == 0:
+            raise ValueError("none of the markers in the reference are present in 'test_features'")
+
+        markers = {}
+        for lab, inner in self._markers.items():
+            markers[lab] = {}
+            for lab2, current in inner.items():
+                markers[lab][lab2] = [x for x in current if x in present]
+
+        return SinglePrebuiltReference(
+            lib.specialize_single_reference(self._ptr, len(keep), keep, **self._index_options, nthreads=num_threads),
+            labels=self._labels,
+            features=self._features,
+            markers=markers,
+            index_options=self._index_options,
+        )
+
+
+_INDEX_TYPES = [False, "annoy", "hnsw"]
+
+_INDEX_DEFAULTS = {
+    "annoy": {"num_trees": 50, "search_mult": -1.0},
+    "hnsw": {"num_links": 16, "ef_construction": 200, "ef_search": 10},
+}
+
+
+def _resolve_index_options(approximate: Union[bool, str], approximate_args: dict) -> dict:
+    if approximate is True:
+        approximate = "annoy"
+    if approximate is not False and approximate not in _INDEX_DEFAULTS:
+        raise ValueError("'approximate' should be a boolean, 'annoy' or 'hnsw'")
+
+    options = {"index_type": _INDEX_TYPES.index(approximate)}
+    for defaults in _INDEX_DEFAULTS.values():
+        options.update(defaults)
+
+    if approximate is not False:
+        allowed = _INDEX_DEFAULTS[approximate]
+        for k, v in approximate_args.items():
+            if k not in allowed:
+                raise ValueError("unknown argument '" + k + "' in 'approximate_args' for '" + approximate + "'")
+            if k == "search_mult":
+                if v == 0:
+                    raise ValueError(
+                        "'search_mult' in 'approximate_args' should be positive, or negative for the default"
+                    )
+                options[k] = float(v)
+            elif v <= 0:
+                raise ValueError("'" + k + "' in 'approximate_args' should be positive")
+            else:
+                options[k] = int(v)
+    return options
+
+
+@_uses_thread_budget
 def build_single_reference(
     ref_data: Any,
     ref_labels: Sequence,
@@ -101,8 +225,9 @@ def build_single_reference(
     markers: Optional[dict[Any, dict[Any, Sequence]]] = None,
     marker_method: Literal["classic"] = "classic",
     marker_args: dict = {},
-    approximate: bool = True,
-    num_threads: int = 1,
+    approximate: Union[bool, Literal["annoy", "hnsw"]] = True,
+    approximate_args: dict = {},
+    num_threads: Optional[int] = None,
 ) -> SinglePrebuiltReference:
     """Build a single reference dataset in preparation for classification.
 
@@ -114,6 +239,8 @@ def build_single_reference(
             and log-transformed in preparation for marker prioritization via
             differential expression analyses. Otherwise, any expression values
             are acceptable as only the ranking within each column is used.
+            On-disk arrays like a ``h5py.Dataset`` or ``zarr.Array`` are
+            read into memory in blocks of columns.
 
             Alternatively, a
             :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
@@ -160,16 +287,49 @@ def build_single_reference(
 
         approximate:
             Whether to use an approximate neighbor search to compute scores
-            during classification.
+            during classification. This may also be a string specifying the
+            algorithm, either ``"annoy"`` (Annoy, the default if True) or
+            ``"hnsw"`` (hierarchical navigable small worlds). If False, an
+            exact search is performed.
+
+            The accuracy and speed of the approximate search can be
+            evaluated with
+            :py:meth:`~singler.evaluate_approximate_search.evaluate_approximate_search`.
+
+        approximate_args:
+            Parameters for the approximate search algorithm, ignored if
+            ``approximate = False``. For Annoy, this may contain:
+
+            - ``num_trees``, the number of trees (default 50). More trees
+              improve accuracy at the cost of a larger reference.
+            - ``search_mult``, the number of nodes to inspect during the
+              search, as a multiple of the number of neighbors. Larger values
+              improve accuracy at the cost of speed. If negative (the
+              default), this is set to ``num_trees``.
+
+            For HNSW, this may contain:
+
+            - ``num_links``, the number of bidirectional links for each node
+              in the graph (default 16). More links improve accuracy at the
+              cost of a larger reference and slower building.
+            - ``ef_construction``, the size of the candidate list when
+              building the graph (default 200).
+            - ``ef_search``, the size of the candidate list during the search
+              (default 10, or the number of neighbors if greater). Larger
+              values improve accuracy at the cost of speed.
 
         num_threads:
             Number of threads to use for reference building.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
 
     Returns:
         The pre-built reference, ready for use in downstream methods like
         :py:meth:`~singler.classify_single_reference.classify_single_reference`.
     """
 
+    index_options = _resolve_index_options(approximate, approximate_args)
+
     ref_ptr, ref_features = _clean_matrix(
         ref_data,
         ref_features,
@@ -203,10 +363,11 @@ def build_single_reference(
             ref_ptr.ptr,
             labels=labind,
             markers=mrk._ptr,
-            approximate=approximate,
+            **index_options,
             nthreads=num_threads,
         ),
         labels=lablev,
         features=ref_features,
         markers=markers,
+        index_options=index_options,
     )
@@ -1,23 +1,40 @@
-from typing import Any, Sequence, Union
+from typing import Any, Optional, Sequence, Union
 
 import biocutils as ut
 from biocframe import BiocFrame
 from mattress import TatamiNumericPointer, tatamize
-from numpy import array, float64, int32, ndarray, uintp
+from numpy import arange, asfortranarray, column_stack, concatenate, float64, int32, nan, ndarray, vstack
 from summarizedexperiment import SummarizedExperiment
 
-from . import _cpphelpers as lib
+from . import _core
+from ._utils import (
+    _check_out,
+    _chunked_block_size,
+    _chunked_column_blocks,
+    _column_chunks,
+    _is_chunked_array,
+    _output_buffer,
+    _slice_out,
+    _subset_columns,
+)
 from .build_integrated_references import IntegratedReferences
+from .rank_test_matrix import RankedTestMatrix
+from .result_sinks import ResultSink
+from .thread_budget import _uses_thread_budget
 
 
+@_uses_thread_budget
 def classify_integrated_references(
     test_data: Any,
     results: list[Union[BiocFrame, Sequence]],
     integrated_prebuilt: IntegratedReferences,
     assay_type: Union[str, int] = 0,
     quantile: float = 0.8,
-    num_threads: int = 1,
-) -> BiocFrame:
+    reuse_single_scores: bool = False,
+    num_threads: Optional[int] = None,
+    out: Optional[dict] = None,
+    sink: Optional[ResultSink] = None,
+) -> Optional[BiocFrame]:
     """Integrate classification results across multiple references for a single test dataset.
 
     Args:
@@ -26,11 +43,18 @@ def classify_integrated_references(
             is a test sample (usually a single cell), containing expression values.
             Normalized and/or transformed expression values are also acceptable as only
             the ranking is used within this function.
+            On-disk arrays like a ``h5py.Dataset`` or ``zarr.Array`` are
+            processed in blocks of columns, where the next block is read
+            in the background while the current block is scored.
 
             Alternatively, a
             :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
             containing such a matrix in one of its assays.
 
+            Alternatively, a
+            :py:class:`~singler.rank_test_matrix.RankedTestMatrix` created from
+            the test dataset with ``integrated_prebuilt`` as one of its references.
+
         results:
             List of classification results generated by running
             :py:meth:`~singler.classify_single_reference.classify_single_reference`
@@ -51,8 +75,47 @@ def classify_integrated_references(
             Larger values increase sensitivity of matches at the expense of
             similarity to the average behavior of each label.
 
+        reuse_single_scores:
+            Whether to compare references based on the scores for the assigned
+            labels in ``results``, instead of recomputing the scores with the
+            union of markers for the assigned labels across references. This
+            skips the scoring pass over ``test_data``, which may be None, but
+            each reference's scores are computed from a different set of
+            markers and are less comparable. If True, each entry of
+            ``results`` should be a data frame containing the ``scores``.
+
         num_threads:
             Number of threads to use during classification.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        out:
+            Dictionary of preallocated NumPy arrays in which to store the
+            results, e.g., to re-use buffers across batches or to write
+            directly into a larger ``numpy.memmap``. This may contain:
+
+            - ``best``, an int32 array of length equal to the number of cells,
+              to store the index of the best reference.
+            - ``delta``, a float64 array of length equal to the number of cells.
+            - ``scores``, a float64 array with one row per reference and one
+              column per cell. Each row should be contiguous, e.g., a slice of
+              columns from a larger array.
+
+            Missing entries are allocated as usual. The returned data frame
+            contains views of the supplied arrays, except for ``best``
+            if the references are named.
+
+        sink:
+            A :py:class:`~singler.result_sinks.ResultSink` to which the
+            results are written, e.g., a
+            :py:class:`~singler.result_sinks.ParquetResultSink`.
+            If provided, the cells are classified in chunks of
+            ``sink.chunk_size`` and the results of each chunk are written
+            to ``sink`` before the next chunk is classified.
+            The ``best_label`` is written as integer codes into the unique
+            labels across all references, and the ``best_reference`` is
+            written as integer codes into the reference names, if available.
+            The sink is not closed by this function.
 
     Returns:
         A data frame containing the ``best_label`` across all
@@ -61,42 +124,68 @@ def classify_integrated_references(
         integer index; the ``scores`` for each reference, as a nested
         BiocFrame; and the ``delta`` from the best to the second-best
         reference. Each row corresponds to a column of ``test``.
+
+        If ``sink`` is provided, None is returned instead.
     """
+    _check_out(out, ["best", "delta", "scores"])
+    if sink is not None:
+        if out is not None:
+            raise ValueError("'out' and 'sink' cannot both be specified")
+        _classify_into_sink(
+            sink,
+            test_data,
+            results,
+            integrated_prebuilt,
+            assay_type=assay_type,
+            quantile=quantile,
+            reuse_single_scores=reuse_single_scores,
+            num_threads=num_threads,
+        )
+        return None
+
     # Don't use _clean_matrix; the features are fixed so no filtering is possible at this point.
     if not isinstance(test_data, TatamiNumericPointer):
         if isinstance(test_data, SummarizedExperiment):
             test_data = test_data.assay(assay_type)
 
-    test_ptr = tatamize(test_data)
-    if test_ptr.nrow() != len(integrated_prebuilt.test_features):
-        raise ValueError(
-            "number of rows in 'test_data' should equal number of features in 'integrated_prebuilt'"
-        )
-    nc = test_ptr.ncol()
+    ranked = isinstance(test_data, RankedTestMatrix)
+    # On-disk matrices are streamed in blocks of columns, see below.
+    chunked = _is_chunked_array(test_data)
+    if reuse_single_scores:
+        nc = len(results[0]) if len(results) else 0
+    elif ranked:
+        positions = test_data._positions(integrated_prebuilt.marker_subset())
+        nc = test_data.num_cells()
+    else:
+        if chunked:
+            nr, nc = test_data.shape
+        else:
+            test_ptr = tatamize(test_data)
+            nr, nc = test_ptr.nrow(), test_ptr.ncol()
+
+        if nr != len(integrated_prebuilt.test_features):
+            raise ValueError(
+                "number of rows in 'test_data' should equal number of features in 'integrated_prebuilt'"
+            )
 
     all_labels = integrated_prebuilt.reference_labels
     nrefs = len(all_labels)
-    coerced_labels = []
-
     all_refs = integrated_prebuilt.reference_names
     has_names = all_refs is not None
     if not has_names:
         all_refs = [str(i) for i in range(nrefs)]
 
-    scores = {}
-    score_ptrs = ndarray((nrefs,), dtype=uintp)
-    assign_ptrs = ndarray((nrefs,), dtype=uintp)
-
     if len(all_refs) != len(results):
         raise ValueError(
             "length of 'results' should equal number of references in 'integrated_prebuilt'"
         )
 
-    for i, r in enumerate(all_refs):
-        current = ndarray((nc,), dtype=float64)
-        scores[r] = current
-        score_ptrs[i] = current.ctypes.data
+    score_matrix = _output_buffer(out, "scores", (nrefs, nc), float64)
+    scores = dict(zip(all_refs, score_matrix))
+    coerced_labels = ndarray((nrefs, nc), dtype=int32)
+    best_per_ref = []
 
+    for i, r in enumerate(all_refs):
         curlabs = results[i]
         if isinstance(curlabs, BiocFrame):
             curlabs = curlabs.column("best")
@@ -105,29 +194,48 @@ def classify_integrated_references(
                 "each entry of 'results' should have results for all cells in 'test_data'"
             )
 
-        ind = array(ut.match(curlabs, all_labels[i]), dtype=int32)
-        coerced_labels.append(ind)
-        assign_ptrs[i] = ind.ctypes.data
-
-    best = ndarray((nc,), dtype=int32)
-    delta = ndarray((nc,), dtype=float64)
-    lib.classify_integrated_references(
-        test_ptr.ptr,
-        assign_ptrs.ctypes.data,
-        integrated_prebuilt._ptr,
-        quantile,
-        score_ptrs.ctypes.data,
-        best,
-        delta,
-        num_threads,
-    )
+        coerced_labels[i] = ut.match(curlabs, all_labels[i])
+        best_per_ref.append(curlabs)
 
-    best_label = []
-    for i, b in enumerate(best):
-        if isinstance(results[b], BiocFrame):
-            best_label.append(results[b].column("best")[i])
+    best = _output_buffer(out, "best", (nc,), int32)
+    delta = _output_buffer(out, "delta", (nc,), float64)
+
+    def run(mat, start, end):
+        if ranked:
+            _core.classify_integrated_references_ranked(
+                mat._ptr,
+                positions,
+                coerced_labels[:, start:end],
+                integrated_prebuilt._ptr,
+                quantile,
+                score_matrix[:, start:end],
+                best[start:end],
+                delta[start:end],
+                num_threads,
+            )
         else:
-            best_label.append(results[b][i])
+            _core.classify_integrated_references(
+                mat.ptr,
+                coerced_labels[:, start:end],
+                integrated_prebuilt._ptr,
+                quantile,
+                score_matrix[:, start:end],
+                best[start:end],
+                delta[start:end],
+                num_threads,
+            )
+
+    if reuse_single_scores:
+        _integrate_single_scores(results, all_labels, coerced_labels, score_matrix, best, delta)
+    elif ranked:
+        run(test_data, 0, nc)
+    elif not chunked:
+        run(test_ptr, 0, nc)
+    else:
+        for start, end, block in _chunked_column_blocks(test_data, _chunked_block_size(test_data)):
+            run(tatamize(asfortranarray(block)), start, end)
+
+    best_label = [best_per_ref[b][i] for i, b in enumerate(best)]
 
     if has_names:
         best = [all_refs[b] for b in best]
@@ -141,3 +249,144 @@ def classify_integrated_references(
             "delta": delta,
         }
     )
+
+
+def _column_blocks(test_data, results, assay_type, reuse_single_scores, chunk_size):
+    # Splits the test data and the per-reference results into blocks of cells
+    # that can be classified separately. The test data is not needed when
+    # re-using the scores from the per-reference results.
+    if isinstance(test_data, SummarizedExperiment):
+        test_data = test_data.assay(assay_type)
+
+    if reuse_single_scores:
+        nc = len(results[0]) if len(results) else 0
+        blocks = ((start, end, None) for start, end in _column_chunks(nc, chunk_size))
+    elif isinstance(test_data, RankedTestMatrix):
+        nc = test_data.num_cells()
+        blocks = (
+            (start, end, test_data if end - start == nc else test_data._subset_cells(arange(start, end)))
+            for start, end in _column_chunks(nc, chunk_size)
+        )
+    elif _is_chunked_array(test_data):
+        nc = test_data.shape[1]
+        blocks = (
+            (start, end, asfortranarray(block)) for start, end, block in _chunked_column_blocks(test_data, chunk_size)
+        )
+    else:
+        test_ptr = test_data if isinstance(test_data, TatamiNumericPointer) else tatamize(test_data)
+        nc = test_ptr.ncol()
+        blocks = ((start, end, _subset_columns(test_ptr, start, end)) for start, end in _column_chunks(nc, chunk_size))
+
+    if reuse_single_scores:
+        return nc, ((start, end, block, [r[start:end, :] for r in results]) for start, end, block in blocks)
+
+    # Only the assigned labels are needed, so the scores are not sliced.
+    results = [r.column("best") if isinstance(r, BiocFrame) else r for r in results]
+    return nc, ((start, end, block, [r[start:end] for r in results]) for start, end, block in blocks)
+
+
+def _classify_into_sink(sink, test_data, results, integrated_prebuilt, assay_type, reuse_single_scores, **kwargs):
+    # Blocks of cells are classified into the same set of buffers, which are
+    # passed to the sink before they are overwritten by the next block.
+    chunk_size = sink.chunk_size
+    nc, blocks = _column_blocks(test_data, results, assay_type, reuse_single_scores, chunk_size)
+
+    all_refs = integrated_prebuilt.reference_names
+    has_names = all_refs is not None
+    nrefs = len(integrated_prebuilt.reference_labels)
+    if not has_names:
+        all_refs = [str(i) for i in range(nrefs)]
+
+    # Assigned labels are stored as codes into the unique labels across references.
+    unique_labels = []
+    label_codes = {}
+    for labels in integrated_prebuilt.reference_labels:
+        for lab in labels:
+            if lab not in label_codes:
+                label_codes[lab] = len(unique_labels)
+                unique_labels.append(lab)
+
+    levels = {"best_label": unique_labels}
+    if has_names:
+        levels["best_reference"] = all_refs
+
+    buffer_size = min(nc, chunk_size)
+    buffers = {
+        "best": ndarray((buffer_size,), dtype=int32),
+        "scores": ndarray((nrefs, buffer_size), dtype=float64),
+        "delta": ndarray((buffer_size,), dtype=float64),
+    }
+    best_label = ndarray((buffer_size,), dtype=int32)
+
+    for start, end, block, block_results in blocks:
+        out = _slice_out(buffers, 0, end - start)
+        res = classify_integrated_references(
+            block,
+            block_results,
+            integrated_prebuilt,
+            reuse_single_scores=reuse_single_scores,
+            out=out,
+            **kwargs,
+        )
+
+        current = best_label[: end - start]
+        current[:] = [label_codes[lab] for lab in res.column("best_label")]
+        sink.write(
+            {
+                "best_label": current,
+                "best_reference": out["best"],
+                "scores": dict(zip(all_refs, out["scores"])),
+                "delta": out["delta"],
+            },
+            levels,
+        )
+
+
+def _integrate_single_scores(results, all_labels, coerced_labels, scores, best, delta):
+    cells = arange(len(best))
+    for i, res in enumerate(results):
+        if not isinstance(res, BiocFrame) or not res.has_column("scores"):
+            raise ValueError("each entry of 'results' should contain 'scores' if 'reuse_single_scores = True'")
+
+        # Pulling out the score for each cell's assigned label in this reference.
+        current = res.column("scores")
+        per_label = column_stack([current.column(lab) for lab in all_labels[i]])
+        scores[i][:] = per_label[cells, coerced_labels[i]]
+
+    stacked = vstack(scores)
+    best[:] = stacked.argmax(axis=0)
+    if len(scores) > 1:
+        stacked.sort(axis=0)
+        delta[:] = stacked[-1, :] - stacked[-2, :]
+    else:
+        delta[:] = nan
+
+
+def _combine_integrated_results(chunks: list[BiocFrame]) -> BiocFrame:
+    if len(chunks) == 1:
+        return chunks[0]
+
+    best_label = []
+    for c in chunks:
+        best_label += c.column("best_label")
+
+    # Reference indices are stored as NumPy arrays, names as lists.
+    best_reference = [c.column("best_reference") for c in chunks]
+    if isinstance(best_reference[0], ndarray):
+        best_reference = concatenate(best_reference)
+    else:
+        best_reference = [b for current in best_reference for b in current]
+
+    scores = {}
+    for r in chunks[0].column("scores").column_names:
+        scores[r] = concatenate([c.column("scores").column(r) for c in chunks])
+
+    scores_df = BiocFrame(scores, number_of_rows=len(best_label))
+    return BiocFrame(
+        {
+            "best_label": best_label,
+            "best_reference": best_reference,
+            "scores": scores_df,
+            "delta": concatenate([c.column("delta") for c in chunks]),
+        }
+    )
@@ -1,13 +1,37 @@
-from typing import Any, Sequence, Union
+from operator import itemgetter
+from typing import Any, Callable, Literal, Optional, Sequence, Union
 
 from biocframe import BiocFrame
-from numpy import float64, int32, ndarray, uintp
+from mattress import tatamize
+from numpy import arange, asfortranarray, concatenate, float64, int32, ndarray
 
+from . import _core
 from . import _cpphelpers as lib
-from ._utils import _clean_matrix, _create_map
+from ._utils import (
+    _check_out,
+    _chunked_block_size,
+    _chunked_column_blocks,
+    _clean_matrix,
+    _column_chunks,
+    _create_map,
+    _is_chunked_array,
+    _is_compressed_sparse,
+    _mask_chunked_missing,
+    _mask_sparse_missing,
+    _monitor,
+    _output_buffer,
+    _slice_out,
+    _sparse_marker_blocks,
+    _subset_columns,
+    _unpack_experiment,
+)
 from .build_single_reference import SinglePrebuiltReference
+from .rank_test_matrix import RankedTestMatrix
+from .result_sinks import ResultSink
+from .thread_budget import _uses_thread_budget
 
 
+@_uses_thread_budget
 def classify_single_reference(
     test_data: Any,
     test_features: Sequence,
@@ -17,8 +41,18 @@ def classify_single_reference(
     quantile: float = 0.8,
     use_fine_tune: bool = True,
     fine_tune_threshold: float = 0.05,
-    num_threads: int = 1,
-) -> BiocFrame:
+    num_threads: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel: Optional[Any] = None,
+    tile_size: Optional[Union[int, Literal["auto"]]] = None,
+    pin_threads: bool = False,
+    drop_missing_markers: bool = False,
+    scores: Literal["all", "topk", "none"] = "all",
+    top_k: int = 5,
+    out: Optional[dict] = None,
+    sink: Optional[ResultSink] = None,
+    num_candidates: Optional[int] = None,
+) -> Optional[BiocFrame]:
     """Classify a test dataset against a reference by assigning labels from the latter to each column of the former
     using the SingleR algorithm.
 
@@ -28,14 +62,22 @@ def classify_single_reference(
             is a test sample (usually a single cell), containing expression values.
             Normalized and transformed expression values are also acceptable as only
             the ranking is used within this function.
+            On-disk arrays like a ``h5py.Dataset`` or ``zarr.Array`` are
+            processed in blocks of columns, where the next block is read
+            in the background while the current block is scored.
 
             Alternatively, a
             :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
             containing such a matrix in one of its assays.
 
+            Alternatively, a
+            :py:class:`~singler.rank_test_matrix.RankedTestMatrix` created from
+            the test dataset with ``ref_prebuilt`` as one of its references.
+
         test_features:
             Sequence of identifiers for each feature in the test
             dataset, i.e., row in ``test_data``.
+            Ignored if ``test_data`` is a ``RankedTestMatrix``.
 
             If ``test_data`` is a ``SummarizedExperiment``, ``test_features`` 
             may be a string speciying the column name in `row_data`that contains the
@@ -70,38 +112,360 @@ def classify_single_reference(
 
         num_threads:
             Number of threads to use during classification.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        progress:
+            Function to be called after each block of cells is classified.
+            This should accept the number of classified cells and the total number of cells.
+            It is always called from the thread that called this function.
+
+        cancel:
+            Object with an ``is_set()`` method, typically a
+            :py:class:`~threading.Event`. This is checked after each block of
+            cells; if set, classification stops and a ``RuntimeError`` is raised.
+
+        tile_size:
+            Number of cells in each tile of work that is dynamically assigned
+            to the threads. If ``"auto"``, this is chosen so that the marker
+            values for each tile fit in the per-core cache. If None, the cells
+            are split into one contiguous range per thread, unless
+            ``pin_threads = True`` in which case ``"auto"`` is used.
+            Smaller tiles improve load balancing across many threads, e.g.,
+            on multi-socket machines.
+
+        pin_threads:
+            Whether to pin each thread to its own CPU for the duration of the
+            classification. Threads are placed on the CPUs that are least
+            used by the pinned threads of concurrent calls, i.e., on
+            consecutive CPUs if no other call is running, which usually keeps
+            them on the same socket.
+
+        drop_missing_markers:
+            Whether to ignore markers of ``ref_prebuilt`` that are missing
+            from ``test_features``, by specializing the reference with
+            :py:meth:`~singler.build_single_reference.SinglePrebuiltReference.specialize`.
+            If False, an error is raised for missing markers. When classifying
+            multiple datasets with the same features, it is more efficient
+            to call ``specialize()`` once and re-use its result.
+
+        scores:
+            Which scores to report. If ``"all"``, the scores for all labels
+            are reported. If ``"topk"``, only the ``top_k`` highest scores
+            are reported for each cell, which avoids storing a full matrix of
+            scores when there are many cells and labels. If ``"none"``, no
+            scores are reported.
+
+        top_k:
+            Number of highest scores to report for each cell when
+            ``scores = "topk"``. This is capped at the number of labels.
+
+        out:
+            Dictionary of preallocated NumPy arrays in which to store the
+            results, e.g., to re-use buffers across batches or to write
+            directly into a larger ``numpy.memmap``. This may contain:
+
+            - ``best``, an int32 array of length equal to the number of cells,
+              to store the index of the best label in ``ref_prebuilt.labels``.
+            - ``delta``, a float64 array of length equal to the number of cells.
+            - ``scores``, a float64 array with one row per label and one
+              column per cell, if ``scores = "all"``. Each row should be
+              contiguous, e.g., a slice of columns from a larger array.
+            - ``top_labels`` and ``top_scores``, C-contiguous int32 and float64
+              arrays with one row per cell and ``top_k`` columns, if ``scores = "topk"``.
+
+            Missing entries are allocated as usual. The returned data frame
+            contains views of the supplied arrays, except for ``best``.
+
+        sink:
+            A :py:class:`~singler.result_sinks.ResultSink` to which the
+            results are written, e.g., a
+            :py:class:`~singler.result_sinks.ParquetResultSink`.
+            If provided, the cells are classified in chunks of
+            ``sink.chunk_size`` and the results of each chunk are written
+            to ``sink`` before the next chunk is classified.
+            The ``best`` label is written as integer codes into
+            ``ref_prebuilt.labels``. The sink is not closed by this function.
+
+        num_candidates:
+            Number of candidate labels to score for each cell. If specified,
+            the labels are first ranked by the correlation of each cell to
+            the centroid of each label's reference profiles, which is cheap to
+            compute. Only the top ``num_candidates`` labels are then scored
+            from their nearest reference profiles and considered during
+            fine-tuning. This is much faster for references with many labels,
+            at the cost of occasionally missing the best label if it is not
+            among the candidates. The scores for all other labels are
+            reported as NaN. If None or not less than the number of labels,
+            all labels are scored.
 
     Returns:
         A data frame containing the ``best`` label, the ``scores``
         for each label (as a nested BiocFrame), and the ``delta`` from the best
         to the second-best label.  Each row corresponds to a column of ``test``.
+
+        If ``scores = "topk"``, the ``scores`` column is replaced by
+        ``top_labels``, a 2-dimensional NumPy array where each row contains
+        the indices of the ``top_k`` highest-scoring labels in ``ref_prebuilt.labels``,
+        in decreasing order of their scores; and ``top_scores``, an array of
+        the same shape containing the corresponding scores. The scores are
+        computed before fine-tuning. If ``scores = "none"``, the ``scores``
+        column is omitted.
+
+        If ``sink`` is provided, None is returned instead.
     """
-    mat_ptr, test_features = _clean_matrix(
-        test_data,
-        test_features,
-        assay_type=assay_type,
-        check_missing=check_missing,
-        num_threads=num_threads,
+    if sink is not None:
+        if out is not None:
+            raise ValueError("'out' and 'sink' cannot both be specified")
+        _classify_into_sink(
+            sink,
+            test_data,
+            test_features,
+            ref_prebuilt,
+            assay_type=assay_type,
+            check_missing=check_missing,
+            drop_missing_markers=drop_missing_markers,
+            scores=scores,
+            top_k=top_k,
+            num_threads=num_threads,
+            progress=progress,
+            quantile=quantile,
+            use_fine_tune=use_fine_tune,
+            fine_tune_threshold=fine_tune_threshold,
+            cancel=cancel,
+            tile_size=tile_size,
+            pin_threads=pin_threads,
+            num_candidates=num_candidates,
+        )
+        return None
+
+    tile_size = _resolve_tile_size(tile_size)
+    top_k = _resolve_top_k(scores, top_k, ref_prebuilt.num_labels())
+    num_candidates = _resolve_num_candidates(num_candidates, ref_prebuilt.num_labels())
+    _check_out(out, _OUTPUT_BUFFERS[scores])
+    if isinstance(test_data, RankedTestMatrix):
+        if drop_missing_markers:
+            ref_prebuilt = ref_prebuilt.specialize(test_data.features, num_threads=num_threads)
+        return _classify_ranked(
+            test_data,
+            ref_prebuilt,
+            quantile=quantile,
+            use_fine_tune=use_fine_tune,
+            fine_tune_threshold=fine_tune_threshold,
+            num_threads=num_threads,
+            progress=progress,
+            cancel=cancel,
+            tile_size=tile_size,
+            pin_threads=pin_threads,
+            scores=scores,
+            top_k=top_k,
+            out=out,
+            num_candidates=num_candidates,
+        )
+
+    test_data, test_features = _unpack_experiment(test_data, test_features, assay_type)
+    sparse = _is_compressed_sparse(test_data)
+    chunked = _is_chunked_array(test_data)
+
+    if sparse or chunked:
+        # Skip the tatami conversion of the entire matrix, as we only need the markers.
+        if test_data.shape[0] != len(test_features):
+            raise ValueError(
+                "number of rows of 'x' should be equal to the length of 'features'"
+            )
+        if check_missing:
+            # Features with missing values are masked before specialization,
+            # so that their markers are dropped or reported as missing.
+            if sparse:
+                test_features = _mask_sparse_missing(test_data, test_features)
+            else:
+                test_features = _mask_chunked_missing(test_data, test_features)
+        nc = test_data.shape[1]
+    else:
+        mat_ptr, test_features = _clean_matrix(
+            test_data,
+            test_features,
+            assay_type=assay_type,
+            check_missing=check_missing,
+            num_threads=num_threads,
+        )
+        nc = mat_ptr.ncol()
+
+    if drop_missing_markers:
+        ref_prebuilt = ref_prebuilt.specialize(test_features, num_threads=num_threads)
+
+    best = _output_buffer(out, "best", (nc,), int32)
+    delta = _output_buffer(out, "delta", (nc,), float64)
+    score_matrix, top_labels, top_scores = _allocate_scores(scores, ref_prebuilt.num_labels(), nc, top_k, out)
+
+    ref_subset = ref_prebuilt.marker_subset(indices_only=True)
+    ref_features = ref_prebuilt.features
+    subset = _map_markers(ref_prebuilt, ref_subset, test_features)
+    centroids = _label_centroids(ref_prebuilt, num_candidates, num_threads)
+
+    def run(mat, run_subset, start, end, run_progress):
+        with _monitor(run_progress, cancel) as monitor:
+            _core.classify_single_reference(
+                mat.ptr,
+                run_subset,
+                ref_prebuilt._ptr,
+                quantile=quantile,
+                use_fine_tune=use_fine_tune,
+                fine_tune_threshold=fine_tune_threshold,
+                nthreads=num_threads,
+                scores=None if score_matrix is None else score_matrix[:, start:end],
+                best=best[start:end],
+                delta=delta[start:end],
+                tile_size=tile_size,
+                pin_threads=pin_threads,
+                top_k=top_k,
+                top_labels=top_labels[start:end],
+                top_scores=top_scores[start:end],
+                num_candidates=num_candidates,
+                centroids=centroids,
+                monitor=monitor,
+            )
+
+    if not (sparse or chunked):
+        run(mat_ptr, subset, 0, nc, progress)
+    else:
+        if sparse:
+            # Densify the marker rows for blocks of cells, so that the scorer
+            # extracts contiguous columns instead of searching each sparse column.
+            blocks = _sparse_marker_blocks(test_data, subset)
+        else:
+            # On-disk matrices are read in blocks of columns while the previous block is scored.
+            blocks = (
+                (start, end, asfortranarray(block[subset, :]))
+                for start, end, block in _chunked_column_blocks(test_data, _chunked_block_size(test_data))
+            )
+
+        identity = arange(len(subset), dtype=int32)
+        for start, end, block in blocks:
+            block_progress = None
+            if progress is not None:
+                block_progress = lambda done, total, start=start: progress(start + done, nc)
+            run(tatamize(block), identity, start, end, block_progress)
+
+    return _format_results(ref_prebuilt.labels, best, delta, score_matrix, top_labels, top_scores)
+
+
+@_uses_thread_budget
+def _column_blocks(test_data, test_features, assay_type, check_missing, chunk_size, num_threads=None):
+    # Splits the test data into blocks of cells that can be classified
+    # separately with the returned features and 'check_missing'. Missing
+    # values are masked or removed for all cells, not just those in each block.
+    if isinstance(test_data, RankedTestMatrix):
+        nc = test_data.num_cells()
+        blocks = (
+            (start, end, test_data if end - start == nc else test_data._subset_cells(arange(start, end)))
+            for start, end in _column_chunks(nc, chunk_size)
+        )
+        return nc, test_data.features, check_missing, blocks
+
+    test_data, test_features = _unpack_experiment(test_data, test_features, assay_type)
+    nc = test_data.shape[1]
+    if _is_chunked_array(test_data):
+        if check_missing:
+            test_features = _mask_chunked_missing(test_data, test_features)
+        blocks = _chunked_column_blocks(test_data, chunk_size)
+    elif _is_compressed_sparse(test_data):
+        if check_missing:
+            test_features = _mask_sparse_missing(test_data, test_features)
+        blocks = ((start, end, test_data[:, start:end]) for start, end in _column_chunks(nc, chunk_size))
+    else:
+        mat_ptr, test_features = _clean_matrix(
+            test_data,
+            test_features,
+            assay_type=assay_type,
+            check_missing=check_missing,
+            num_threads=num_threads,
+        )
+        blocks = (
+            (start, end, _subset_columns(mat_ptr, start, end)) for start, end in _column_chunks(nc, chunk_size)
+        )
+    return nc, test_features, False, blocks
+
+
+def _classify_into_sink(
+    sink,
+    test_data,
+    test_features,
+    ref_prebuilt,
+    assay_type,
+    check_missing,
+    drop_missing_markers,
+    scores,
+    top_k,
+    num_threads,
+    progress,
+    **kwargs,
+):
+    # Blocks of cells are classified into the same set of buffers, which are
+    # passed to the sink before they are overwritten by the next block.
+    chunk_size = sink.chunk_size
+    nc, test_features, check_missing, blocks = _column_blocks(
+        test_data, test_features, assay_type, check_missing, chunk_size, num_threads
     )
+    if drop_missing_markers:
+        ref_prebuilt = ref_prebuilt.specialize(test_features, num_threads=num_threads)
 
+    all_labels = ref_prebuilt.labels
     nl = ref_prebuilt.num_labels()
-    nc = mat_ptr.ncol()
+    buffer_size = min(nc, chunk_size)
+    score_matrix, top_labels, top_scores = _allocate_scores(
+        scores, nl, buffer_size, _resolve_top_k(scores, top_k, nl)
+    )
+    buffers = {"best": ndarray((buffer_size,), dtype=int32), "delta": ndarray((buffer_size,), dtype=float64)}
+    levels = {"best": all_labels}
+    if score_matrix is not None:
+        buffers["scores"] = score_matrix
+    elif top_labels.shape[1]:
+        buffers["top_labels"] = top_labels
+        buffers["top_scores"] = top_scores
+        levels["top_labels"] = all_labels
 
-    best = ndarray((nc,), dtype=int32)
-    delta = ndarray((nc,), dtype=float64)
+    for start, end, block in blocks:
+        out = _slice_out(buffers, 0, end - start)
+        block_progress = None
+        if progress is not None:
+            block_progress = lambda done, total, start=start: progress(start + done, nc)
 
-    scores = {}
-    all_labels = ref_prebuilt.labels
-    score_ptrs = ndarray((nl,), dtype=uintp)
-    for i in range(nl):
-        current = ndarray((nc,), dtype=float64)
-        scores[all_labels[i]] = current
-        score_ptrs[i] = current.ctypes.data
+        classify_single_reference(
+            block,
+            test_features,
+            ref_prebuilt,
+            check_missing=check_missing,
+            scores=scores,
+            top_k=top_k,
+            num_threads=num_threads,
+            progress=block_progress,
+            out=out,
+            **kwargs,
+        )
 
-    mapping = _create_map(test_features)
+        columns = {"best": out["best"]}
+        if "scores" in out:
+            columns["scores"] = dict(zip(all_labels, out["scores"]))
+        for col in ["top_labels", "top_scores", "delta"]:
+            if col in out:
+                columns[col] = out[col]
+        sink.write(columns, levels)
 
-    ref_subset = ref_prebuilt.marker_subset(indices_only=True)
+
+def _map_markers(ref_prebuilt, ref_subset, test_features) -> ndarray:
+    # Mapping the test features is the main per-call cost for small batches,
+    # so the rows for the most recent 'test_features' are cached in the
+    # reference. The cached rows are only re-used if they still contain the
+    # expected features, in case 'test_features' was modified in place.
     ref_features = ref_prebuilt.features
+    cached = ref_prebuilt._cached_test_rows
+    if cached is not None and cached[0] is test_features:
+        _, subset, getter, expected = cached
+        if getter is None or getter(test_features) == expected:
+            return subset
+
+    mapping = _create_map(test_features)
     subset = ndarray((len(ref_subset),), dtype=int32)
     for i, y in enumerate(ref_subset):
         x = ref_features[y]
@@ -109,20 +473,159 @@ def classify_single_reference(
             raise KeyError("failed to find gene '" + str(x) + "' in the test dataset")
         subset[i] = mapping[x]
 
-    lib.classify_single_reference(
-        mat_ptr.ptr,
-        subset,
-        ref_prebuilt._ptr,
-        quantile=quantile,
-        use_fine_tune=use_fine_tune,
-        fine_tune_threshold=fine_tune_threshold,
-        nthreads=num_threads,
-        scores=score_ptrs.ctypes.data,
-        best=best,
-        delta=delta,
-    )
+    # itemgetter() returns a scalar for a single index, so this is also the expected value.
+    getter = itemgetter(*subset.tolist()) if len(subset) else None
+    expected = getter(test_features) if getter is not None else None
+    ref_prebuilt._cached_test_rows = (test_features, subset, getter, expected)
+    return subset
 
-    scores_df = BiocFrame(scores, number_of_rows=nc)
-    return BiocFrame(
-        {"best": [all_labels[b] for b in best], "scores": scores_df, "delta": delta}
-    )
+
+def _resolve_tile_size(tile_size) -> int:
+    # Converted to the native convention: zero for none, negative for automatic.
+    if tile_size is None:
+        return 0
+    if tile_size == "auto":
+        return -1
+    if isinstance(tile_size, str) or tile_size <= 0:
+        raise ValueError("'tile_size' should be a positive integer, 'auto' or None")
+    return int(tile_size)
+
+
+def _resolve_top_k(scores, top_k, nlabels) -> int:
+    # Converted to the native convention: zero if the top scores are not requested.
+    if scores not in ("all", "topk", "none"):
+        raise ValueError("'scores' should be one of 'all', 'topk' or 'none'")
+    if scores != "topk":
+        return 0
+    if top_k <= 0:
+        raise ValueError("'top_k' should be a positive integer")
+    return min(int(top_k), nlabels)
+
+
+def _resolve_num_candidates(num_candidates, nlabels) -> int:
+    # Converted to the native convention: zero if all labels are scored.
+    if num_candidates is None:
+        return 0
+    if num_candidates <= 0:
+        raise ValueError("'num_candidates' should be a positive integer or None")
+    if num_candidates >= nlabels:
+        return 0
+    return int(num_candidates)
+
+
+def _label_centroids(ref_prebuilt, num_candidates, num_threads) -> Optional[ndarray]:
+    # The centroids only depend on the reference, so they are computed once
+    # and cached in the reference for all subsequent classifications.
+    if not num_candidates:
+        return None
+    cached = ref_prebuilt._cached_centroids
+    if cached is None:
+        cached = ndarray((ref_prebuilt.num_labels(), ref_prebuilt.num_markers()), dtype=float64)
+        lib.get_centroids_from_single_reference(ref_prebuilt._ptr, num_threads, cached)
+        ref_prebuilt._cached_centroids = cached
+    return cached
+
+
+_OUTPUT_BUFFERS = {
+    "all": ["best", "delta", "scores"],
+    "topk": ["best", "delta", "top_labels", "top_scores"],
+    "none": ["best", "delta"],
+}
+
+
+def _allocate_scores(scores, nlabels, ncells, top_k, out=None) -> tuple:
+    score_matrix = None
+    if scores == "all":
+        score_matrix = _output_buffer(out, "scores", (nlabels, ncells), float64)
+    if top_k:
+        top_labels = _output_buffer(out, "top_labels", (ncells, top_k), int32, c_contiguous=True)
+        top_scores = _output_buffer(out, "top_scores", (ncells, top_k), float64, c_contiguous=True)
+    else:
+        top_labels = ndarray((ncells, 0), dtype=int32)
+        top_scores = ndarray((ncells, 0), dtype=float64)
+    return score_matrix, top_labels, top_scores
+
+
+def _format_results(all_labels, best, delta, score_matrix, top_labels, top_scores) -> BiocFrame:
+    nc = len(best)
+    output = {"best": [all_labels[b] for b in best]}
+    if score_matrix is not None:
+        output["scores"] = BiocFrame(dict(zip(all_labels, score_matrix)), number_of_rows=nc)
+    elif top_labels.shape[1]:
+        output["top_labels"] = top_labels
+        output["top_scores"] = top_scores
+    output["delta"] = delta
+    return BiocFrame(output, number_of_rows=nc)
+
+
+def _classify_ranked(
+    ranked,
+    ref_prebuilt,
+    quantile,
+    use_fine_tune,
+    fine_tune_threshold,
+    num_threads,
+    progress,
+    cancel,
+    tile_size=0,
+    pin_threads=False,
+    scores="all",
+    top_k=0,
+    out=None,
+    num_candidates=0,
+):
+    positions = ranked._positions(ref_prebuilt.marker_subset())
+    nc = ranked.num_cells()
+    nl = ref_prebuilt.num_labels()
+
+    best = _output_buffer(out, "best", (nc,), int32)
+    delta = _output_buffer(out, "delta", (nc,), float64)
+    score_matrix, top_labels, top_scores = _allocate_scores(scores, nl, nc, top_k, out)
+    centroids = _label_centroids(ref_prebuilt, num_candidates, num_threads)
+
+    with _monitor(progress, cancel) as monitor:
+        _core.classify_single_reference_ranked(
+            ranked._ptr,
+            positions,
+            ref_prebuilt._ptr,
+            quantile=quantile,
+            use_fine_tune=use_fine_tune,
+            fine_tune_threshold=fine_tune_threshold,
+            nthreads=num_threads,
+            scores=score_matrix,
+            best=best,
+            delta=delta,
+            tile_size=tile_size,
+            pin_threads=pin_threads,
+            top_k=top_k,
+            top_labels=top_labels,
+            top_scores=top_scores,
+            num_candidates=num_candidates,
+            centroids=centroids,
+            monitor=monitor,
+        )
+
+    return _format_results(ref_prebuilt.labels, best, delta, score_matrix, top_labels, top_scores)
+
+
+def _combine_single_results(chunks: list[BiocFrame]) -> BiocFrame:
+    if len(chunks) == 1:
+        return chunks[0]
+
+    best = []
+    for c in chunks:
+        best += c.column("best")
+
+    output = {"best": best}
+    columns = chunks[0].column_names
+    if "scores" in columns:
+        scores = {}
+        for lab in chunks[0].column("scores").column_names:
+            scores[lab] = concatenate([c.column("scores").column(lab) for c in chunks])
+        output["scores"] = BiocFrame(scores, number_of_rows=len(best))
+
+    for col in ["top_labels", "top_scores", "delta"]:
+        if col in columns:
+            output[col] = concatenate([c.column(col) for c in chunks])
+
+    return BiocFrame(output, number_of_rows=len(best))
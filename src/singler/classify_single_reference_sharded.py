@@ -0,0 +1,187 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional, Sequence, Union
+
+import numpy
+from biocframe import BiocFrame
+from summarizedexperiment import SummarizedExperiment
+
+from ._utils import _column_chunks
+from .build_single_reference import SinglePrebuiltReference
+from .classify_single_reference import _combine_single_results, classify_single_reference
+from .thread_budget import _available_cpus
+
+# Prebuilt references cannot be pickled, so each worker process builds its own
+# copy on first use and caches it for all subsequent shards of the same job.
+# Only the most recently used references are kept, so that long-lived workers
+# do not accumulate references from previous calls, while concurrent jobs on
+# the same executor do not keep evicting each other's references.
+_MAX_WORKER_REFERENCES = 4
+_worker_references = OrderedDict()
+_worker_building = {}
+_worker_lock = threading.Lock()
+
+
+def _get_worker_reference(key: str, ref_builder: Callable[[], SinglePrebuiltReference]) -> SinglePrebuiltReference:
+    with _worker_lock:
+        if key in _worker_references:
+            _worker_references.move_to_end(key)
+            return _worker_references[key]
+        key_lock = _worker_building.setdefault(key, threading.Lock())
+
+    # The reference is built outside of the global lock so that shards of
+    # other jobs are not blocked, while the per-job lock ensures that it is
+    # only built once in each process.
+    with key_lock:
+        with _worker_lock:
+            ref = _worker_references.get(key)
+        if ref is not None:
+            return ref
+
+        try:
+            ref = ref_builder()
+        except BaseException:
+            with _worker_lock:
+                _worker_building.pop(key, None)
+            raise
+
+        # The per-job lock is only discarded once the reference is cached, so
+        # that a shard arriving in between does not build it a second time.
+        with _worker_lock:
+            _worker_references[key] = ref
+            _worker_building.pop(key, None)
+            while len(_worker_references) > _MAX_WORKER_REFERENCES:
+                _worker_references.popitem(last=False)
+        return ref
+
+
+def _classify_shard(key, ref_builder, shard, test_features, classify_args) -> BiocFrame:
+    ref = _get_worker_reference(key, ref_builder)
+    return classify_single_reference(shard, test_features=test_features, ref_prebuilt=ref, **classify_args)
+
+
+def _release_worker_reference(key: str):
+    with _worker_lock:
+        _worker_references.pop(key, None)
+
+
+def classify_single_reference_sharded(
+    test_data: Any,
+    test_features: Optional[Union[Sequence, str]],
+    ref_builder: Callable[[], SinglePrebuiltReference],
+    executor: Executor,
+    assay_type: Union[str, int] = 0,
+    shard_size: Optional[int] = None,
+    num_shards: Optional[int] = None,
+    **kwargs,
+) -> BiocFrame:
+    """Classify a test dataset by splitting its columns into shards that are
+    classified in parallel on an executor, e.g., a
+    :py:class:`~concurrent.futures.ProcessPoolExecutor` or any other
+    :py:class:`~concurrent.futures.Executor` that dispatches work to
+    multiple hosts. Results for all shards are merged into a single data frame.
+
+    Args:
+        test_data:
+            A matrix-like object where each row is a feature and each column
+            is a test sample (usually a single cell), containing expression values.
+            This should support slicing of columns with ``test_data[:, start:end]``,
+            e.g., a NumPy array, a SciPy sparse matrix or a
+            :py:class:`~delayedarray.DelayedArray.DelayedArray`.
+            Each shard must be picklable if ``executor`` runs in other processes.
+
+            Alternatively, a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
+            containing such a matrix in one of its assays.
+
+        test_features:
+            Sequence of identifiers for each feature in the test dataset.
+            If ``test_data`` is a ``SummarizedExperiment``, this may be a string
+            specifying the column of the row data containing the features,
+            or None to use the row names.
+
+        ref_builder:
+            Picklable function that accepts no arguments and returns a
+            :py:class:`~singler.build_single_reference.SinglePrebuiltReference`,
+            e.g., a :py:func:`~functools.partial` of
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+            This is called once in each worker, and the reference is re-used
+            for all shards of this call that are processed by that worker.
+            Each worker keeps the references of its most recent calls, which
+            are freed when they are evicted by later calls or when the worker
+            exits. References in the calling process, e.g., for a
+            :py:class:`~concurrent.futures.ThreadPoolExecutor`, are freed
+            when this function returns.
+
+        executor:
+            Executor to run the classification of each shard.
+
+        assay_type:
+            Assay containing the expression matrix,
+            if `test_data` is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        shard_size:
+            Number of columns in each shard.
+            If None, this is determined from ``num_shards``.
+
+        num_shards:
+            Number of shards to create, only used if ``shard_size = None``.
+            If None, this defaults to the executor's ``max_workers`` attribute,
+            if present; otherwise, to the number of CPUs available to this
+            process, e.g., for the executors in :py:mod:`concurrent.futures`.
+
+        kwargs:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`
+            in each worker. Unless specified, ``num_threads`` is set to 1.
+            ``out`` is not supported as the workers may not share memory
+            with the calling process.
+
+    Returns:
+        Same as :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+    """
+    if "out" in kwargs:
+        raise ValueError("'out' is not supported for sharded classification")
+
+    if isinstance(test_data, SummarizedExperiment):
+        if test_features is None:
+            test_features = test_data.get_row_names()
+        elif isinstance(test_features, str):
+            test_features = test_data.get_row_data().column(test_features)
+        test_data = test_data.assay(assay_type)
+
+    if test_features is None:
+        raise ValueError("'test_features' cannot be `None`.")
+    test_features = list(test_features)
+
+    nc = test_data.shape[1]
+    if shard_size is None:
+        if num_shards is None:
+            num_shards = getattr(executor, "max_workers", None)
+            if num_shards is None:
+                num_shards = _available_cpus()
+        shard_size = max(1, -(-nc // num_shards))  # ceiling division.
+
+    # Workers in other processes cannot share the thread budget of this
+    # process, so each shard is classified with a single thread by default.
+    kwargs.setdefault("num_threads", 1)
+
+    key = uuid.uuid4().hex
+    futures = []
+    for start, end in _column_chunks(nc, shard_size):
+        shard = test_data[:, start:end]
+        if isinstance(shard, numpy.ndarray):
+            shard = numpy.ascontiguousarray(shard)
+        futures.append(executor.submit(_classify_shard, key, ref_builder, shard, test_features, kwargs))
+
+    try:
+        collected = [f.result() for f in futures]
+    finally:
+        for f in futures:
+            f.cancel()
+        _release_worker_reference(key)
+
+    return _combine_single_results(collected)
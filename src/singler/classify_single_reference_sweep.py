@@ -0,0 +1,178 @@
+from typing import Any, Callable, Literal, Optional, Sequence, Union
+
+from biocframe import BiocFrame
+from numpy import array, float64, int32, ndarray, uintp, zeros
+
+from . import _cpphelpers as lib
+from ._utils import _clean_matrix, _monitor, _row_pointers
+from .build_single_reference import SinglePrebuiltReference
+from .classify_single_reference import _map_markers
+from .thread_budget import _uses_thread_budget
+
+
+@_uses_thread_budget
+def classify_single_reference_sweep(
+    test_data: Any,
+    test_features: Sequence,
+    ref_prebuilt: SinglePrebuiltReference,
+    quantiles: Sequence[float],
+    fine_tune_thresholds: Sequence[float] = [0.05],
+    assay_type: Union[str, int] = 0,
+    check_missing: bool = True,
+    use_fine_tune: bool = True,
+    scores: Literal["all", "none"] = "all",
+    num_threads: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel: Optional[Any] = None,
+) -> dict[tuple, BiocFrame]:
+    """Classify a test dataset against a reference for multiple combinations
+    of the ``quantile`` and ``fine_tune_threshold`` parameters of
+    :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+    This is much faster than calling ``classify_single_reference()`` for
+    each combination, as the expensive parts are shared across combinations:
+
+    - Each cell is ranked once.
+    - The correlations to the nearest reference profiles of each label are
+      computed once, for the smallest quantile. The scores for all other
+      quantiles are derived from the same correlations.
+    - During fine-tuning, the correlations for each set of candidate labels
+      are cached for each cell. These correlations do not depend on the
+      quantile or threshold, so they are re-used whenever another
+      combination considers the same set of labels for the same cell.
+
+    Results are the same as those of ``classify_single_reference()`` for
+    each combination, unless ``ref_prebuilt`` was built with
+    ``approximate = True``, in which case the search for more neighbors
+    may yield slightly different scores.
+
+    Args:
+        test_data:
+            A matrix-like object where each row is a feature and each column
+            is a test sample (usually a single cell), containing expression values.
+            Alternatively, a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
+            containing such a matrix in one of its assays.
+
+        test_features:
+            Sequence of identifiers for each feature in the test
+            dataset, i.e., row in ``test_data``. If ``test_data`` is a
+            ``SummarizedExperiment``, this may be a string or None,
+            see :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+        ref_prebuilt:
+            A pre-built reference created with
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+
+        quantiles:
+            Sequence of quantiles of the correlation distribution to
+            use for computing the score for each label.
+
+        fine_tune_thresholds:
+            Sequence of thresholds to use for fine-tuning. Ignored if
+            ``use_fine_tune = False``, in which case the results are the
+            same for all thresholds.
+
+        assay_type:
+            Assay containing the expression matrix,
+            if `test_data` is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        check_missing:
+            Whether to check for and remove rows with missing (NaN) values
+            from ``test_data``.
+
+        use_fine_tune:
+            Whether fine-tuning should be performed.
+
+        scores:
+            Whether to report the scores for all labels (``"all"``) or no
+            scores (``"none"``). The scores only depend on the quantile, so
+            the results for the same quantile share the same score arrays.
+
+        num_threads:
+            Number of threads to use.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        progress:
+            Function to be called after each block of cells is classified,
+            see :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+        cancel:
+            Object with an ``is_set()`` method to request cancellation,
+            see :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+    Returns:
+        Dictionary where each key is a tuple containing a quantile and a
+        threshold, and each value is a data frame of results for that
+        combination, see
+        :py:meth:`~singler.classify_single_reference.classify_single_reference`
+        for details.
+    """
+    if len(quantiles) == 0 or len(fine_tune_thresholds) == 0:
+        raise ValueError("'quantiles' and 'fine_tune_thresholds' should contain at least one value")
+    for q in quantiles:
+        if q < 0 or q > 1:
+            raise ValueError("each entry of 'quantiles' should lie in [0, 1]")
+    if scores not in ("all", "none"):
+        raise ValueError("'scores' should be either 'all' or 'none'")
+
+    mat_ptr, test_features = _clean_matrix(
+        test_data,
+        test_features,
+        assay_type=assay_type,
+        check_missing=check_missing,
+        num_threads=num_threads,
+    )
+    nc = mat_ptr.ncol()
+    subset = _map_markers(ref_prebuilt, ref_prebuilt.marker_subset(indices_only=True), test_features)
+
+    quantiles = array(quantiles, dtype=float64)
+    fine_tune_thresholds = array(fine_tune_thresholds, dtype=float64)
+    nq = len(quantiles)
+    nt = len(fine_tune_thresholds)
+    all_labels = ref_prebuilt.labels
+    nl = len(all_labels)
+
+    best = ndarray((nq * nt, nc), dtype=int32)
+    delta = ndarray((nq * nt, nc), dtype=float64)
+    if scores == "all":
+        score_matrix = ndarray((nq, nl, nc), dtype=float64)
+        score_ptrs = _row_pointers(score_matrix.reshape((nq * nl, nc)), 0)
+    else:
+        score_ptrs = zeros((nq * nl,), dtype=uintp)
+    best_ptrs = _row_pointers(best, 0)
+    delta_ptrs = _row_pointers(delta, 0)
+
+    with _monitor(progress, cancel) as monitor:
+        lib.sweep_single_reference(
+            mat_ptr.ptr,
+            subset,
+            ref_prebuilt._ptr,
+            nquantiles=nq,
+            quantiles=quantiles,
+            nthresholds=nt,
+            thresholds=fine_tune_thresholds,
+            use_fine_tune=use_fine_tune,
+            nthreads=num_threads,
+            scores=score_ptrs.ctypes.data,
+            best=best_ptrs.ctypes.data,
+            delta=delta_ptrs.ctypes.data,
+            monitor=monitor,
+        )
+
+    output = {}
+    for i, q in enumerate(quantiles):
+        scores_df = None
+        if scores == "all":
+            scores_df = BiocFrame(dict(zip(all_labels, score_matrix[i])), number_of_rows=nc)
+
+        for j, t in enumerate(fine_tune_thresholds):
+            s = i * nt + j
+            current = {"best": [all_labels[b] for b in best[s]]}
+            if scores_df is not None:
+                current["scores"] = scores_df
+            current["delta"] = delta[s]
+            output[(float(q), float(t))] = BiocFrame(current, number_of_rows=nc)
+
+    return output
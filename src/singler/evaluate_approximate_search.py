@@ -0,0 +1,204 @@
+import time
+from typing import Any, Optional, Sequence
+
+from biocframe import BiocFrame
+from numpy import absolute, array, array_equal, float64, mean, ndarray, random, sort
+
+from . import _cpphelpers as lib
+from ._utils import _clean_matrix, _subset_pointer
+from .build_single_reference import build_single_reference
+from .classify_single_reference import _map_markers, classify_single_reference
+from .thread_budget import _uses_thread_budget
+
+
+@_uses_thread_budget
+def evaluate_approximate_search(
+    test_data: Any,
+    test_features: Sequence,
+    ref_data: Any,
+    ref_labels: Sequence,
+    ref_features: Sequence,
+    settings: Sequence[dict],
+    num_cells: int = 1000,
+    seed: int = 42,
+    build_args: dict = {},
+    classify_args: dict = {},
+    num_threads: Optional[int] = None,
+) -> BiocFrame:
+    """Evaluate the accuracy and speed of different settings for the
+    approximate neighbor search in
+    :py:meth:`~singler.build_single_reference.build_single_reference`,
+    by comparing them to an exact search on a random sample of cells from
+    the test dataset. This can be used to choose a setting with a known
+    recall before classifying the full dataset.
+
+    Args:
+        test_data:
+            A matrix-like object where each row is a feature and each column
+            is a test sample (usually a single cell), containing expression
+            values. Alternatively, a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
+            containing such a matrix in one of its assays, see ``assay_type``
+            in ``classify_args``.
+
+        test_features:
+            Sequence of identifiers for each feature in the test dataset.
+
+        ref_data:
+            A matrix-like object containing the reference dataset,
+            see :py:meth:`~singler.build_single_reference.build_single_reference`.
+
+        ref_labels:
+            Sequence of labels for each reference profile.
+
+        ref_features:
+            Sequence of identifiers for each feature in the reference.
+
+        settings:
+            Sequence of dictionaries, each of which specifies a setting to
+            evaluate. Each dictionary may contain ``approximate`` and
+            ``approximate_args``, to be passed to
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+
+        num_cells:
+            Number of cells to sample from ``test_data`` for the evaluation.
+            All cells are used if this is greater than the number of cells.
+
+        seed:
+            Seed for sampling the cells.
+
+        build_args:
+            Further arguments to pass to
+            :py:meth:`~singler.build_single_reference.build_single_reference`.
+            The markers are only identified once, for the exact reference,
+            and re-used for all settings.
+
+        classify_args:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+            The scores for all labels are always computed.
+
+        num_threads:
+            Number of threads to use.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+    Returns:
+        A data frame with one row for the exact search, followed by one row
+        for each entry of ``settings``. This contains the columns:
+
+        - ``approximate``, the algorithm for the neighbor search, or False
+          for the exact search.
+        - ``approximate_args``, a dictionary of all parameters of the
+          algorithm, including the defaults for unspecified parameters.
+        - ``build_time``, the time in seconds to build the reference, not
+          including the marker detection.
+        - ``classify_time``, the time in seconds to classify the sampled
+          cells.
+        - ``recall``, the average proportion of the nearest reference
+          profiles from the exact search that were also found by the
+          approximate search, across all sampled cells and labels. The
+          number of neighbors is determined from ``quantile`` in
+          ``classify_args``, as this is used to compute the score for each
+          label.
+        - ``agreement``, the proportion of sampled cells that are assigned
+          the same label as in the exact search.
+        - ``score_error``, the mean absolute difference from the scores of
+          the exact search, across all sampled cells and labels.
+    """
+    for s in settings:
+        for k in s:
+            if k not in ("approximate", "approximate_args"):
+                raise ValueError("unknown argument '" + k + "' in 'settings'")
+
+    build_args = dict(build_args)
+    for k in ["approximate", "approximate_args"]:
+        build_args.pop(k, None)
+    classify_args = dict(classify_args)
+    for k in ["scores", "top_k", "out", "sink"]:
+        classify_args.pop(k, None)
+
+    test_ptr, test_features = _clean_matrix(
+        test_data,
+        test_features,
+        assay_type=classify_args.pop("assay_type", 0),
+        check_missing=classify_args.pop("check_missing", True),
+        num_threads=num_threads,
+    )
+    nc = test_ptr.ncol()
+    if num_cells < nc:
+        chosen = sort(random.default_rng(seed).choice(nc, num_cells, replace=False))
+        test_ptr = _subset_pointer(test_ptr, 1, chosen)
+        nc = num_cells
+
+    def run(approximate, approximate_args):
+        start = time.perf_counter()
+        built = build_single_reference(
+            ref_data,
+            ref_labels,
+            ref_features,
+            **build_args,
+            approximate=approximate,
+            approximate_args=approximate_args,
+            num_threads=num_threads,
+        )
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        res = classify_single_reference(test_ptr, test_features, built, **classify_args, num_threads=num_threads)
+        return built, res, build_time, time.perf_counter() - start
+
+    # Markers are only detected once. The exact reference is then rebuilt
+    # with these markers so that its time is comparable to the other settings.
+    if build_args.get("markers") is None:
+        build_args["markers"] = build_single_reference(
+            ref_data, ref_labels, ref_features, **build_args, approximate=False, num_threads=num_threads
+        ).markers
+    exact, exact_res, build_time, classify_time = run(False, {})
+
+    exact_subset = exact.marker_subset(indices_only=True)
+    test_subset = _map_markers(exact, exact_subset, test_features)
+    exact_scores = exact_res.column("scores")
+
+    collected = {
+        "approximate": [False],
+        "approximate_args": [{}],
+        "build_time": [build_time],
+        "classify_time": [classify_time],
+        "recall": [1.0],
+        "agreement": [1.0],
+        "score_error": [0.0],
+    }
+
+    for s in settings:
+        built, res, build_time, classify_time = run(s.get("approximate", True), s.get("approximate_args", {}))
+        if not array_equal(built.marker_subset(indices_only=True), exact_subset):
+            raise ValueError("approximate and exact references should have the same markers")
+
+        recall = ndarray((nc,), dtype=float64)
+        lib.compare_neighbor_search(
+            test_ptr.ptr,
+            test_subset,
+            exact._ptr,
+            built._ptr,
+            quantile=classify_args.get("quantile", 0.8),
+            nthreads=num_threads,
+            recall=recall,
+        )
+
+        scores = res.column("scores")
+        errors = [absolute(scores.column(lab) - exact_scores.column(lab)) for lab in exact.labels]
+
+        collected["approximate"].append(built.approximate)
+        collected["approximate_args"].append(built.approximate_args)
+        collected["build_time"].append(build_time)
+        collected["classify_time"].append(classify_time)
+        collected["recall"].append(mean(recall) if nc else 1.0)
+        collected["agreement"].append(
+            mean(array(res.column("best")) == array(exact_res.column("best"))) if nc else 1.0
+        )
+        collected["score_error"].append(mean(errors) if nc else 0.0)
+
+    for k in ["build_time", "classify_time", "recall", "agreement", "score_error"]:
+        collected[k] = array(collected[k], dtype=float64)
+    return BiocFrame(collected)
@@ -1,6 +1,5 @@
-from typing import Any, Optional, Sequence, Union
+from typing import Any, Callable, Optional, Sequence, Union
 
-import delayedarray
 from mattress import tatamize
 from numpy import int32, ndarray, uintp
 
@@ -9,14 +8,17 @@ from ._Markers import _Markers
 from ._utils import (
     _clean_matrix,
     _create_map,
+    _monitor,
     _restrict_features,
     _stable_intersect,
     _stable_union,
+    _subset_pointer,
 )
+from .thread_budget import _uses_thread_budget
 
 
 def _get_classic_markers_raw(
-    ref_ptrs, ref_labels, ref_features, num_de=None, num_threads=1
+    ref_ptrs, ref_labels, ref_features, num_de=None, num_threads=1, progress=None, cancel=None
 ):
     nrefs = len(ref_ptrs)
 
@@ -51,8 +53,7 @@ def _get_classic_markers_raw(
                 survivors.append(j)
                 remap[common_features_map[f]] = len(survivors) - 1
 
-        da = delayedarray.DelayedArray(x)[survivors, :]
-        ptr = tatamize(da)
+        ptr = _subset_pointer(x, 0, survivors)
         med, lev = ptr.row_medians_by_group(ref_labels[i], num_threads=num_threads)
         tmp_labels.append(lev)
 
@@ -81,19 +82,22 @@ def _get_classic_markers_raw(
     elif num_de <= 0:
         raise ValueError("'num_de' should be positive")
 
-    raw_markers = _Markers(
-        lib.find_classic_markers(
-            nref=nrefs,
-            labels=labels2_ptrs.ctypes.data,
-            ref=ref2_ptrs.ctypes.data,
-            de_n=num_de,
-            nthreads=num_threads,
+    with _monitor(progress, cancel) as monitor:
+        raw_markers = _Markers(
+            lib.find_classic_markers(
+                nref=nrefs,
+                labels=labels2_ptrs.ctypes.data,
+                ref=ref2_ptrs.ctypes.data,
+                de_n=num_de,
+                nthreads=num_threads,
+                monitor=monitor,
+            )
         )
-    )
 
     return raw_markers, common_labels, common_features
 
 
+@_uses_thread_budget
 def get_classic_markers(
     ref_data: Union[Any, list[Any]],
     ref_labels: Union[Sequence, list[Sequence]],
@@ -102,7 +106,9 @@ def get_classic_markers(
     check_missing: bool = True,
     restrict_to: Optional[Union[set, dict]] = None,
     num_de: Optional[int] = None,
-    num_threads: int = 1,
+    num_threads: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel: Optional[Any] = None,
 ) -> dict[Any, dict[Any, list]]:
     """Compute markers from a reference using the classic SingleR algorithm. This is typically done for reference
     datasets derived from replicated bulk transcriptomic experiments.
@@ -151,6 +157,18 @@ def get_classic_markers(
 
         num_threads:
             Number of threads to use for the calculations.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+        progress:
+            Function to be called after each block of pairwise comparisons between labels.
+            This should accept the number of completed comparisons and the total number of comparisons.
+            It is always called from the thread that called this function.
+
+        cancel:
+            Object with an ``is_set()`` method, typically a
+            :py:class:`~threading.Event`. This is checked after each block of
+            comparisons; if set, the marker search stops and a ``RuntimeError`` is raised.
 
     Returns:
         A dictionary of dictionary of lists
@@ -193,6 +211,8 @@ def get_classic_markers(
         ref_features=ref_features,
         num_de=num_de,
         num_threads=num_threads,
+        progress=progress,
+        cancel=cancel,
     )
 
     return raw_markers.to_dict(common_labels, common_features)
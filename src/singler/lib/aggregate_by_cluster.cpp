@@ -0,0 +1,10 @@
+#include "utils.h" // must be before all other includes.
+
+#include <cstdint>
+
+//[[export]]
+void aggregate_by_cluster(void* mat, const int32_t* clusters /** numpy */, int32_t nclusters, double* output /** numpy */, int32_t nthreads) {
+    // On output, 'output' is a row-major matrix where each column is a cluster.
+    const auto& ptr = reinterpret_cast<const Mattress*>(mat)->ptr;
+    tatami::row_sums_by_group(ptr.get(), clusters, nclusters, output, nthreads);
+}
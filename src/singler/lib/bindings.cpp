@@ -17,24 +17,46 @@ static char* copy_error_message(const char* original) {
     return copy;
 }
 
+void add_to_ranked_test_matrix(void*, void*, const int32_t*, int32_t);
+
+void aggregate_by_cluster(void*, const int32_t*, int32_t, double*, int32_t);
+
 void* build_integrated_references(int32_t, const int32_t*, int32_t, const uintptr_t*, const uintptr_t*, const uintptr_t*, const uintptr_t*, int32_t);
 
-void* build_single_reference(void*, const int32_t*, void*, uint8_t, int32_t);
+void* build_single_reference(void*, const int32_t*, void*, int32_t, int32_t, double, int32_t, int32_t, int32_t, int32_t);
 
 void classify_integrated_references(void*, const uintptr_t*, void*, double, uintptr_t*, int32_t*, double*, int32_t);
 
-void classify_single_reference(void*, const int32_t*, void*, double, uint8_t, double, int32_t, const uintptr_t*, int32_t*, double*);
+void classify_integrated_references_ranked(void*, const int32_t*, const uintptr_t*, void*, double, uintptr_t*, int32_t*, double*, int32_t);
+
+void classify_single_reference(void*, const int32_t*, void*, double, uint8_t, double, int32_t, const uintptr_t*, int32_t*, double*, int32_t, uint8_t, int32_t, int32_t*, double*, int32_t, const double*, void*);
+
+void classify_single_reference_ranked(void*, const int32_t*, void*, double, uint8_t, double, int32_t, const uintptr_t*, int32_t*, double*, int32_t, uint8_t, int32_t, int32_t*, double*, int32_t, const double*, void*);
+
+void compare_neighbor_search(void*, const int32_t*, void*, void*, double, int32_t, double*);
 
 void* create_markers(int32_t);
 
-void* find_classic_markers(int32_t, const uintptr_t*, const uintptr_t*, int32_t, int32_t);
+void* create_ranked_test_matrix(int32_t);
+
+void* deserialize_integrated_references(int64_t, const int32_t*);
+
+void* find_classic_markers(int32_t, const uintptr_t*, const uintptr_t*, int32_t, int32_t, void*);
 
 void free_integrated_references(void*);
 
 void free_markers(void*);
 
+void free_ranked_test_matrix(void*);
+
 void free_single_reference(void*);
 
+void get_centroids_from_single_reference(void*, int32_t, double*);
+
+void get_integrated_universe(void*, int32_t*);
+
+int32_t get_integrated_universe_size(void*);
+
 void get_markers_for_pair(void*, int32_t, int32_t, int32_t*);
 
 int32_t get_nlabels_from_markers(void*);
@@ -45,18 +67,66 @@ int32_t get_nmarkers_for_pair(void*, int32_t, int32_t);
 
 int32_t get_nsubset_from_single_reference(void*);
 
+int32_t get_ranked_test_matrix_ncol(void*);
+
+int64_t get_serialized_integrated_references_size(void*);
+
+int32_t get_simd_instruction_set();
+
 void get_subset_from_single_reference(void*, int32_t*);
 
 int32_t number_of_classic_markers(int32_t);
 
+void serialize_integrated_references(void*, int32_t*);
+
 void set_markers_for_pair(void*, int32_t, int32_t, int32_t, const int32_t*);
 
+uint8_t set_simd_instruction_set(int32_t);
+
+double simd_dot(int32_t, const double*, const double*);
+
+float simd_dot_float(int32_t, const float*, const float*);
+
+double simd_squared_distance(int32_t, const double*, const double*);
+
+float simd_squared_distance_float(int32_t, const float*, const float*);
+
+void* specialize_single_reference(void*, int32_t, const int32_t*, int32_t, int32_t, double, int32_t, int32_t, int32_t, int32_t);
+
+void* subset_ranked_test_matrix(void*, int32_t, const int32_t*);
+
+void sweep_single_reference(void*, const int32_t*, void*, int32_t, const double*, int32_t, const double*, uint8_t, int32_t, const uintptr_t*, const uintptr_t*, const uintptr_t*, void*);
+
 extern "C" {
 
 PYAPI void free_error_message(char** msg) {
     delete [] *msg;
 }
 
+PYAPI void py_add_to_ranked_test_matrix(void* ptr, void* mat, const int32_t* subset, int32_t nthreads, int32_t* errcode, char** errmsg) {
+    try {
+        add_to_ranked_test_matrix(ptr, mat, subset, nthreads);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
+PYAPI void py_aggregate_by_cluster(void* mat, const int32_t* clusters, int32_t nclusters, double* output, int32_t nthreads, int32_t* errcode, char** errmsg) {
+    try {
+        aggregate_by_cluster(mat, clusters, nclusters, output, nthreads);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
 PYAPI void* py_build_integrated_references(int32_t test_nrow, const int32_t* test_features, int32_t nrefs, const uintptr_t* references, const uintptr_t* labels, const uintptr_t* ref_ids, const uintptr_t* prebuilt, int32_t nthreads, int32_t* errcode, char** errmsg) {
     void* output = NULL;
     try {
@@ -71,10 +141,10 @@ PYAPI void* py_build_integrated_references(int32_t test_nrow, const int32_t* tes
     return output;
 }
 
-PYAPI void* py_build_single_reference(void* ref, const int32_t* labels, void* markers, uint8_t approximate, int32_t nthreads, int32_t* errcode, char** errmsg) {
+PYAPI void* py_build_single_reference(void* ref, const int32_t* labels, void* markers, int32_t index_type, int32_t num_trees, double search_mult, int32_t num_links, int32_t ef_construction, int32_t ef_search, int32_t nthreads, int32_t* errcode, char** errmsg) {
     void* output = NULL;
     try {
-        output = build_single_reference(ref, labels, markers, approximate, nthreads);
+        output = build_single_reference(ref, labels, markers, index_type, num_trees, search_mult, num_links, ef_construction, ef_search, nthreads);
     } catch(std::exception& e) {
         *errcode = 1;
         *errmsg = copy_error_message(e.what());
@@ -97,9 +167,45 @@ PYAPI void py_classify_integrated_references(void* mat, const uintptr_t* assigne
     }
 }
 
-PYAPI void py_classify_single_reference(void* mat, const int32_t* subset, void* prebuilt, double quantile, uint8_t use_fine_tune, double fine_tune_threshold, int32_t nthreads, const uintptr_t* scores, int32_t* best, double* delta, int32_t* errcode, char** errmsg) {
+PYAPI void py_classify_integrated_references_ranked(void* ranked, const int32_t* positions, const uintptr_t* assigned, void* prebuilt, double quantile, uintptr_t* scores, int32_t* best, double* delta, int32_t nthreads, int32_t* errcode, char** errmsg) {
+    try {
+        classify_integrated_references_ranked(ranked, positions, assigned, prebuilt, quantile, scores, best, delta, nthreads);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
+PYAPI void py_classify_single_reference(void* mat, const int32_t* subset, void* prebuilt, double quantile, uint8_t use_fine_tune, double fine_tune_threshold, int32_t nthreads, const uintptr_t* scores, int32_t* best, double* delta, int32_t tile_size, uint8_t pin_threads, int32_t top_k, int32_t* top_labels, double* top_scores, int32_t num_candidates, const double* centroids, void* monitor, int32_t* errcode, char** errmsg) {
     try {
-        classify_single_reference(mat, subset, prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, best, delta);
+        classify_single_reference(mat, subset, prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, best, delta, tile_size, pin_threads, top_k, top_labels, top_scores, num_candidates, centroids, monitor);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
+PYAPI void py_classify_single_reference_ranked(void* ranked, const int32_t* positions, void* prebuilt, double quantile, uint8_t use_fine_tune, double fine_tune_threshold, int32_t nthreads, const uintptr_t* scores, int32_t* best, double* delta, int32_t tile_size, uint8_t pin_threads, int32_t top_k, int32_t* top_labels, double* top_scores, int32_t num_candidates, const double* centroids, void* monitor, int32_t* errcode, char** errmsg) {
+    try {
+        classify_single_reference_ranked(ranked, positions, prebuilt, quantile, use_fine_tune, fine_tune_threshold, nthreads, scores, best, delta, tile_size, pin_threads, top_k, top_labels, top_scores, num_candidates, centroids, monitor);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
+PYAPI void py_compare_neighbor_search(void* mat, const int32_t* subset, void* exact, void* approximate, double quantile, int32_t nthreads, double* recall, int32_t* errcode, char** errmsg) {
+    try {
+        compare_neighbor_search(mat, subset, exact, approximate, quantile, nthreads, recall);
     } catch(std::exception& e) {
         *errcode = 1;
         *errmsg = copy_error_message(e.what());
@@ -123,10 +229,38 @@ PYAPI void* py_create_markers(int32_t nlabels, int32_t* errcode, char** errmsg)
     return output;
 }
 
-PYAPI void* py_find_classic_markers(int32_t nref, const uintptr_t* labels, const uintptr_t* ref, int32_t de_n, int32_t nthreads, int32_t* errcode, char** errmsg) {
+PYAPI void* py_create_ranked_test_matrix(int32_t nrow, int32_t* errcode, char** errmsg) {
+    void* output = NULL;
+    try {
+        output = create_ranked_test_matrix(nrow);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI void* py_deserialize_integrated_references(int64_t size, const int32_t* buffer, int32_t* errcode, char** errmsg) {
+    void* output = NULL;
+    try {
+        output = deserialize_integrated_references(size, buffer);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI void* py_find_classic_markers(int32_t nref, const uintptr_t* labels, const uintptr_t* ref, int32_t de_n, int32_t nthreads, void* monitor, int32_t* errcode, char** errmsg) {
     void* output = NULL;
     try {
-        output = find_classic_markers(nref, labels, ref, de_n, nthreads);
+        output = find_classic_markers(nref, labels, ref, de_n, nthreads, monitor);
     } catch(std::exception& e) {
         *errcode = 1;
         *errmsg = copy_error_message(e.what());
@@ -161,6 +295,18 @@ PYAPI void py_free_markers(void* ptr, int32_t* errcode, char** errmsg) {
     }
 }
 
+PYAPI void py_free_ranked_test_matrix(void* ptr, int32_t* errcode, char** errmsg) {
+    try {
+        free_ranked_test_matrix(ptr);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
 PYAPI void py_free_single_reference(void* ptr, int32_t* errcode, char** errmsg) {
     try {
         free_single_reference(ptr);
@@ -173,6 +319,44 @@ PYAPI void py_free_single_reference(void* ptr, int32_t* errcode, char** errmsg)
     }
 }
 
+PYAPI void py_get_centroids_from_single_reference(void* ptr, int32_t nthreads, double* buffer, int32_t* errcode, char** errmsg) {
+    try {
+        get_centroids_from_single_reference(ptr, nthreads, buffer);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
+PYAPI void py_get_integrated_universe(void* ptr, int32_t* buffer, int32_t* errcode, char** errmsg) {
+    try {
+        get_integrated_universe(ptr, buffer);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
+PYAPI int32_t py_get_integrated_universe_size(void* ptr, int32_t* errcode, char** errmsg) {
+    int32_t output = 0;
+    try {
+        output = get_integrated_universe_size(ptr);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
 PYAPI void py_get_markers_for_pair(void* ptr, int32_t label1, int32_t label2, int32_t* buffer, int32_t* errcode, char** errmsg) {
     try {
         get_markers_for_pair(ptr, label1, label2, buffer);
@@ -241,6 +425,48 @@ PYAPI int32_t py_get_nsubset_from_single_reference(void* ptr, int32_t* errcode,
     return output;
 }
 
+PYAPI int32_t py_get_ranked_test_matrix_ncol(void* ptr, int32_t* errcode, char** errmsg) {
+    int32_t output = 0;
+    try {
+        output = get_ranked_test_matrix_ncol(ptr);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI int64_t py_get_serialized_integrated_references_size(void* ptr, int32_t* errcode, char** errmsg) {
+    int64_t output = 0;
+    try {
+        output = get_serialized_integrated_references_size(ptr);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI int32_t py_get_simd_instruction_set(int32_t* errcode, char** errmsg) {
+    int32_t output = 0;
+    try {
+        output = get_simd_instruction_set();
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
 PYAPI void py_get_subset_from_single_reference(void* ptr, int32_t* buffer, int32_t* errcode, char** errmsg) {
     try {
         get_subset_from_single_reference(ptr, buffer);
@@ -267,6 +493,18 @@ PYAPI int32_t py_number_of_classic_markers(int32_t num_labels, int32_t* errcode,
     return output;
 }
 
+PYAPI void py_serialize_integrated_references(void* ptr, int32_t* buffer, int32_t* errcode, char** errmsg) {
+    try {
+        serialize_integrated_references(ptr, buffer);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
 PYAPI void py_set_markers_for_pair(void* ptr, int32_t label1, int32_t label2, int32_t n, const int32_t* values, int32_t* errcode, char** errmsg) {
     try {
         set_markers_for_pair(ptr, label1, label2, n, values);
@@ -279,4 +517,114 @@ PYAPI void py_set_markers_for_pair(void* ptr, int32_t label1, int32_t label2, in
     }
 }
 
+PYAPI uint8_t py_set_simd_instruction_set(int32_t choice, int32_t* errcode, char** errmsg) {
+    uint8_t output = 0;
+    try {
+        output = set_simd_instruction_set(choice);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI double py_simd_dot(int32_t n, const double* x, const double* y, int32_t* errcode, char** errmsg) {
+    double output = 0;
+    try {
+        output = simd_dot(n, x, y);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI float py_simd_dot_float(int32_t n, const float* x, const float* y, int32_t* errcode, char** errmsg) {
+    float output = 0;
+    try {
+        output = simd_dot_float(n, x, y);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI double py_simd_squared_distance(int32_t n, const double* x, const double* y, int32_t* errcode, char** errmsg) {
+    double output = 0;
+    try {
+        output = simd_squared_distance(n, x, y);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI float py_simd_squared_distance_float(int32_t n, const float* x, const float* y, int32_t* errcode, char** errmsg) {
+    float output = 0;
+    try {
+        output = simd_squared_distance_float(n, x, y);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI void* py_specialize_single_reference(void* ptr, int32_t num_keep, const int32_t* keep, int32_t index_type, int32_t num_trees, double search_mult, int32_t num_links, int32_t ef_construction, int32_t ef_search, int32_t nthreads, int32_t* errcode, char** errmsg) {
+    void* output = NULL;
+    try {
+        output = specialize_single_reference(ptr, num_keep, keep, index_type, num_trees, search_mult, num_links, ef_construction, ef_search, nthreads);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI void* py_subset_ranked_test_matrix(void* ptr, int32_t ncells, const int32_t* cells, int32_t* errcode, char** errmsg) {
+    void* output = NULL;
+    try {
+        output = subset_ranked_test_matrix(ptr, ncells, cells);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+    return output;
+}
+
+PYAPI void py_sweep_single_reference(void* mat, const int32_t* subset, void* prebuilt, int32_t nquantiles, const double* quantiles, int32_t nthresholds, const double* thresholds, uint8_t use_fine_tune, int32_t nthreads, const uintptr_t* scores, const uintptr_t* best, const uintptr_t* delta, void* monitor, int32_t* errcode, char** errmsg) {
+    try {
+        sweep_single_reference(mat, subset, prebuilt, nquantiles, quantiles, nthresholds, thresholds, use_fine_tune, nthreads, scores, best, delta, monitor);
+    } catch(std::exception& e) {
+        *errcode = 1;
+        *errmsg = copy_error_message(e.what());
+    } catch(...) {
+        *errcode = 1;
+        *errmsg = copy_error_message("unknown C++ exception");
+    }
+}
+
 }
@@ -1,6 +1,9 @@
 #include "utils.h" // must be before all other includes.
 
 #include <cstdint>
+#include <vector>
+#include <algorithm>
+#include <stdexcept>
 
 //[[export]]
 void* build_integrated_references(
@@ -36,3 +39,153 @@ void* build_integrated_references(
 void free_integrated_references(void* ptr) {
     delete reinterpret_cast<singlepp::IntegratedReferences*>(ptr);
 }
+
+/*
+ * Integrated references are serialized into a flat stream of 32-bit integers:
+ *
+ * - The format version, the size of the universe and the universe itself.
+ * - The number of references. For each reference:
+ *   - Whether availability should be checked, the number of available features and their (sorted) indices.
+ *   - The number of labels. For each label, the number of markers and their indices.
+ *   - For each label, the number of samples. For each sample, the length of its ranked vector and the (rank, index) pairs.
+ */
+namespace {
+
+constexpr int32_t integrated_format_version = 1;
+
+template<class Function_>
+void walk_integrated_references(const singlepp::IntegratedReferences& ref, Function_ fun) {
+    fun(integrated_format_version);
+    fun(ref.universe.size());
+    for (auto u : ref.universe) {
+        fun(u);
+    }
+
+    size_t nref = ref.num_references();
+    fun(nref);
+    for (size_t r = 0; r < nref; ++r) {
+        fun(ref.check_availability[r]);
+        std::vector<int> available(ref.available[r].begin(), ref.available[r].end());
+        std::sort(available.begin(), available.end());
+        fun(available.size());
+        for (auto a : available) {
+            fun(a);
+        }
+
+        const auto& markers = ref.markers[r];
+        fun(markers.size());
+        for (const auto& m : markers) {
+            fun(m.size());
+            for (auto x : m) {
+                fun(x);
+            }
+        }
+
+        for (const auto& ranked : ref.ranked[r]) {
+            fun(ranked.size());
+            for (const auto& sample : ranked) {
+                fun(sample.size());
+                for (const auto& p : sample) {
+                    fun(p.first);
+                    fun(p.second);
+                }
+            }
+        }
+    }
+}
+
+struct IntegratedReader {
+    IntegratedReader(int64_t n, const int32_t* p) : remaining(n), ptr(p) {}
+
+    int32_t next() {
+        if (remaining <= 0) {
+            throw std::runtime_error("unexpected end of the serialized integrated references");
+        }
+        --remaining;
+        return *(ptr++);
+    }
+
+    size_t next_size() {
+        auto n = next();
+        if (n < 0) {
+            throw std::runtime_error("invalid size in the serialized integrated references");
+        }
+        return n;
+    }
+
+    int64_t remaining;
+    const int32_t* ptr;
+};
+
+}
+
+//[[export]]
+int64_t get_serialized_integrated_references_size(void* ptr) {
+    int64_t total = 0;
+    walk_integrated_references(*reinterpret_cast<const singlepp::IntegratedReferences*>(ptr), [&](auto) -> void { ++total; });
+    return total;
+}
+
+//[[export]]
+void serialize_integrated_references(void* ptr, int32_t* buffer /** numpy */) {
+    walk_integrated_references(*reinterpret_cast<const singlepp::IntegratedReferences*>(ptr), [&](auto x) -> void { *(buffer++) = x; });
+}
+
+//[[export]]
+void* deserialize_integrated_references(int64_t size, const int32_t* buffer /** numpy */) {
+    IntegratedReader reader(size, buffer);
+    if (reader.next() != integrated_format_version) {
+        throw std::runtime_error("unsupported format version for the serialized integrated references");
+    }
+
+    auto output = new singlepp::IntegratedReferences;
+    try {
+        auto& universe = output->universe;
+        universe.resize(reader.next_size());
+        for (auto& u : universe) {
+            u = reader.next();
+        }
+
+        size_t nref = reader.next_size();
+        output->resize(nref);
+        for (size_t r = 0; r < nref; ++r) {
+            output->check_availability[r] = reader.next();
+            size_t navailable = reader.next_size();
+            auto& available = output->available[r];
+            for (size_t a = 0; a < navailable; ++a) {
+                available.insert(reader.next());
+            }
+
+            auto& markers = output->markers[r];
+            markers.resize(reader.next_size());
+            for (auto& m : markers) {
+                m.resize(reader.next_size());
+                for (auto& x : m) {
+                    x = reader.next();
+                }
+            }
+
+            auto& ranked = output->ranked[r];
+            ranked.resize(markers.size());
+            for (auto& current : ranked) {
+                current.resize(reader.next_size());
+                for (auto& sample : current) {
+                    sample.resize(reader.next_size());
+                    for (auto& p : sample) {
+                        p.first = reader.next();
+                        p.second = reader.next();
+                    }
+                }
+            }
+        }
+
+        if (reader.remaining) {
+            throw std::runtime_error("trailing values in the serialized integrated references");
+        }
+    } catch (...) {
+        delete output;
+        throw;
+    }
+
+    return output;
+}
@@ -1,22 +1,126 @@
 #include "utils.h" // must be before all other includes.
+#include "neighbor_index.h"
+#include "candidate_labels.h"
 
 #include <vector>
 #include <cstdint>
 #include <algorithm>
 
 //[[export]]
-void* build_single_reference(void* ref, const int32_t* labels /** numpy */, void* markers, uint8_t approximate, int32_t nthreads) {
-    singlepp::BasicBuilder builder;
-    builder.set_num_threads(nthreads);
-    builder.set_top(-1); // Use all available markers; assume subsetting was applied on the Python side.
-    builder.set_approximate(approximate);
-
-    auto marker_ptr = reinterpret_cast<const singlepp::Markers*>(markers);
+void* build_single_reference(
+    void* ref,
+    const int32_t* labels /** numpy */,
+    void* markers,
+    int32_t index_type,
+    int32_t num_trees,
+    double search_mult,
+    int32_t num_links,
+    int32_t ef_construction,
+    int32_t ef_search,
+    int32_t nthreads)
+{
+    auto markers2 = *reinterpret_cast<const singlepp::Markers*>(markers);
     const auto& ptr = reinterpret_cast<const Mattress*>(ref)->ptr;
     std::vector<int> labels2(labels, labels + ptr->ncol()); // need to copy as int may not be int32 and singlepp isn't templated on the labels (for now).
-    auto built = builder.run(ptr.get(), labels2.data(), *marker_ptr);
 
-    return new singlepp::BasicBuilder::Prebuilt(std::move(built));
+    singler::IndexOptions options(index_type, num_trees, search_mult, num_links, ef_construction, ef_search);
+
+    // Same as singlepp::BasicBuilder::run(), but using our own choice of
+    // neighbor search and distance kernels. We use all available markers
+    // here, assuming that subsetting was applied on the Python side.
+    auto subset = singlepp::subset_markers(markers2, -1);
+    auto subref = singlepp::build_indices(
+        ptr.get(),
+        labels2.data(),
+        subset,
+        [&](size_t nr, size_t nc, const double* data) -> std::shared_ptr<knncolle::Base<int, double> > {
+            return options.build(nr, nc, data);
+        },
+        nthreads
+    );
+
+    return new singlepp::BasicBuilder::Prebuilt(std::move(markers2), std::move(subset), std::move(subref));
+}
+
+//[[export]]
+void* specialize_single_reference(
+    void* ptr,
+    int32_t num_keep,
+    const int32_t* keep /** numpy */,
+    int32_t index_type,
+    int32_t num_trees,
+    double search_mult,
+    int32_t num_links,
+    int32_t ef_construction,
+    int32_t ef_search,
+    int32_t nthreads)
+{
+    const auto& original = *reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(ptr);
+
+    singler::IndexOptions options(index_type, num_trees, search_mult, num_links, ef_construction, ef_search);
+
+    // 'keep' contains sorted positions in the original subset that are to be retained.
+    size_t NS = original.subset.size();
+    std::vector<int> remapping(NS, -1);
+    std::vector<int> subset;
+    subset.reserve(num_keep);
+    for (int32_t k = 0; k < num_keep; ++k) {
+        remapping[keep[k]] = k;
+        subset.push_back(original.subset[keep[k]]);
+    }
+
+    singlepp::Markers markers(original.markers.size());
+    for (size_t i = 0; i < markers.size(); ++i) {
+        const auto& inner = original.markers[i];
+        markers[i].resize(inner.size());
+        for (size_t j = 0; j < inner.size(); ++j) {
+            auto& current = markers[i][j];
+            for (auto m : inner[j]) {
+                auto r = remapping[m];
+                if (r >= 0) {
+                    current.push_back(r);
+                }
+            }
+        }
+    }
+
+    // Dropping the missing markers from the existing ranks preserves the
+    // ordering of the remaining markers, so the reference matrix itself is
+    // not needed; we only need to recompute the scaled ranks for the index.
+    size_t nlabels = original.num_labels();
+    std::vector<singlepp::Reference> references(nlabels);
+    size_t NR = subset.size();
+
+    singler::parallelize([&](int, size_t start, size_t len) -> void {
+        singlepp::RankedVector<int, int> filtered;
+        filtered.reserve(NR);
+        std::vector<double> scaled;
+
+        for (size_t l = start, end = start + len; l < end; ++l) {
+            const auto& current = original.references[l];
+            auto& output = references[l];
+            size_t nprofiles = current.ranked.size();
+            output.ranked.resize(nprofiles);
+            scaled.resize(nprofiles * NR);
+
+            for (size_t p = 0; p < nprofiles; ++p) {
+                filtered.clear();
+                for (const auto& r : current.ranked[p]) {
+                    auto m = remapping[r.second];
+                    if (m >= 0) {
+                        filtered.emplace_back(r.first, m);
+                    }
+                }
+                singlepp::scaled_ranks(filtered, scaled.data() + p * NR);
+                output.ranked[p].reserve(NR);
+                singlepp::simplify_ranks(filtered, output.ranked[p]);
+            }
+
+            output.index = options.build(NR, nprofiles, scaled.data());
+        }
+    }, nlabels, nthreads);
+
+    return new singlepp::BasicBuilder::Prebuilt(std::move(markers), std::move(subset), std::move(references));
 }
 
 //[[export]]
@@ -35,6 +139,11 @@ void get_subset_from_single_reference(void* ptr, int32_t* buffer /** numpy */) {
     std::copy(sub.begin(), sub.end(), buffer);
 }
 
+//[[export]]
+void get_centroids_from_single_reference(void* ptr, int32_t nthreads, double* buffer /** numpy */) {
+    singler::compute_label_centroids(*reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(ptr), nthreads, buffer);
+}
+
 //[[export]]
 void free_single_reference(void* ptr) {
     delete reinterpret_cast<singlepp::BasicBuilder::Prebuilt*>(ptr);
@@ -0,0 +1,185 @@
+#ifndef CANDIDATE_LABELS_H
+#define CANDIDATE_LABELS_H
+
+#include "utils.h" // must be before raticate, singlepp includes.
+#include "simd.h"
+#include "top_scores.h"
+
+#include <vector>
+#include <cstdint>
+#include <cmath>
+#include <limits>
+#include <algorithm>
+#include <utility>
+
+namespace singler {
+
+// Computes the centroid of the scaled ranks of each label's reference
+// profiles. As each vector of scaled ranks is centered with a fixed norm, the
+// dot product of a test cell with a centroid is proportional to the mean
+// Spearman correlation to that label's profiles. 'output' should have space
+// for 'num_labels * num_markers' values, filled in label-major order.
+inline void compute_label_centroids(const singlepp::BasicBuilder::Prebuilt& built, int nthreads, double* output) {
+    const auto& ref = built.references;
+    const size_t num_subset = built.subset.size();
+
+    singler::parallelize([&](size_t, int start, int length) -> void {
+        std::vector<double> buffer(num_subset);
+        for (int l = start, end = start + length; l < end; ++l) {
+            auto centroid = output + static_cast<size_t>(l) * num_subset;
+            std::fill_n(centroid, num_subset, 0);
+
+            const auto& ranked = ref[l].ranked;
+            for (const auto& profile : ranked) {
+                singlepp::scaled_ranks(profile, buffer.data());
+                for (size_t g = 0; g < num_subset; ++g) {
+                    centroid[g] += buffer[g];
+                }
+            }
+
+            if (ranked.size()) {
+                for (size_t g = 0; g < num_subset; ++g) {
+                    centroid[g] /= ranked.size();
+                }
+            }
+        }
+    }, ref.size(), nthreads);
+}
+
+// Classifies a cell in two stages. The labels are first ranked by the dot
+// product of the cell with each label's centroid, and only the top
+// 'num_candidates' labels are scored with the neighbor search and considered
+// for fine-tuning. Each thread should use its own instance.
+class CandidateScorer {
+    const singlepp::BasicBuilder::Prebuilt& built;
+    const double* centroids;
+    size_t num_candidates;
+    double quantile;
+    bool use_fine_tune;
+    double fine_tune_threshold;
+
+    std::vector<int> search_k;
+    std::vector<std::pair<double, double> > coeffs;
+
+    std::vector<std::pair<double, int> > ordering;
+    std::vector<double> curscores;
+    std::vector<uint8_t> chosen;
+    std::vector<double> tuned;
+    singlepp::FineTuner ft;
+
+    // Same as the placeholder used by singlepp's fine-tuning. This is lower
+    // than any correlation so non-candidates are never in use for fine-tuning.
+    static constexpr double DUMMY = -1000;
+
+public:
+    CandidateScorer(
+        const singlepp::BasicBuilder::Prebuilt& built,
+        const double* centroids,
+        size_t num_candidates,
+        double quantile,
+        bool use_fine_tune,
+        double fine_tune_threshold) :
+        built(built),
+        centroids(centroids),
+        num_candidates(std::min(num_candidates, built.references.size())),
+        quantile(quantile),
+        use_fine_tune(use_fine_tune),
+        fine_tune_threshold(fine_tune_threshold)
+    {
+        // Same as singlepp::annotate_cells_simple().
+        const auto& ref = built.references;
+        const size_t NL = ref.size();
+        search_k.resize(NL);
+        coeffs.resize(NL);
+        for (size_t r = 0; r < NL; ++r) {
+            double denom = ref[r].index->nobs() - 1;
+            double prod = denom * (1 - quantile);
+            auto k = std::ceil(prod) + 1;
+            search_k[r] = k;
+            coeffs[r].first = static_cast<double>(k - 1) - prod;
+            coeffs[r].second = prod - static_cast<double>(k - 2);
+        }
+
+        ordering.resize(NL);
+        curscores.resize(NL);
+        chosen.resize(NL);
+    }
+
+    // 'vec' should contain the ranks of the markers in the test cell, and
+    // 'scaled' should contain the corresponding scaled ranks. Returns the
+    // best label and the delta, like singlepp::FineTuner::run().
+    std::pair<int, double> run(const singlepp::RankedVector<double, int>& vec, const double* scaled) {
+        const auto& ref = built.references;
+        const size_t NL = ref.size();
+        const size_t num_subset = built.subset.size();
+
+        for (size_t l = 0; l < NL; ++l) {
+            ordering[l].first = simd::dot(scaled, centroids + l * num_subset, num_subset);
+            ordering[l].second = l;
+        }
+        std::partial_sort(ordering.begin(), ordering.begin() + num_candidates, ordering.end(), [](const auto& left, const auto& right) -> bool {
+            return left.first > right.first || (left.first == right.first && left.second < right.second);
+        });
+
+        std::fill(curscores.begin(), curscores.end(), DUMMY);
+        std::fill(chosen.begin(), chosen.end(), 0);
+        for (size_t i = 0; i < num_candidates; ++i) {
+            auto r = ordering[i].second;
+            chosen[r] = 1;
+
+            size_t k = search_k[r];
+            auto current = ref[r].index->find_nearest_neighbors(scaled, k);
+            double last = current[k - 1].second;
+            last = 1 - 2 * last * last;
+            if (k == 1) {
+                curscores[r] = last;
+            } else {
+                double next = current[k - 2].second;
+                next = 1 - 2 * next * next;
+                curscores[r] = coeffs[r].first * next + coeffs[r].second * last;
+            }
+        }
+
+        if (num_candidates == 0) {
+            return std::make_pair(0, std::numeric_limits<double>::quiet_NaN());
+        } else if (num_candidates == 1) {
+            return std::make_pair(ordering[0].second, std::numeric_limits<double>::quiet_NaN());
+        }
+
+        if (!use_fine_tune) {
+            auto top = std::max_element(curscores.begin(), curscores.end());
+            int best = top - curscores.begin();
+            double topscore = *top;
+            *top = DUMMY;
+            double delta = topscore - *std::max_element(curscores.begin(), curscores.end());
+            *top = topscore;
+            return std::make_pair(best, delta);
+        }
+
+        // Fine-tuning modifies the scores, so we use a copy.
+        tuned = curscores;
+        return ft.run(vec, ref, built.markers, tuned, quantile, fine_tune_threshold);
+    }
+
+    // Score for label 'l' from the last call to run(), or NaN if 'l' was not a candidate.
+    double score(size_t l) const {
+        return chosen[l] ? curscores[l] : std::numeric_limits<double>::quiet_NaN();
+    }
+
+    // Collects the top scores from the last call to run(). If there are fewer
+    // candidates than 'collector.k', the remaining labels are reported with NaN scores.
+    void collect(TopScores& collector, int32_t* labels, double* scores) const {
+        collector.run(
+            [&](size_t l) -> double { return chosen[l] ? curscores[l] : -std::numeric_limits<double>::infinity(); },
+            labels,
+            scores
+        );
+        for (size_t i = num_candidates; i < collector.k; ++i) {
+            scores[i] = std::numeric_limits<double>::quiet_NaN();
+        }
+    }
+};
+
+}
+
+#endif
@@ -1,4 +1,6 @@
 #include "utils.h" // must be before raticate, singlepp includes.
+#include "top_scores.h"
+#include "candidate_labels.h"
 
 #include <vector>
 #include <cstdint>
@@ -15,7 +17,15 @@ void classify_single_reference(
     int32_t nthreads,
     const uintptr_t* scores /** void_p */,
     int32_t* best /** numpy */,
-    double* delta /** numpy */)
+    double* delta /** numpy */,
+    int32_t tile_size,
+    uint8_t pin_threads,
+    int32_t top_k,
+    int32_t* top_labels /** numpy */,
+    double* top_scores /** numpy */,
+    int32_t num_candidates,
+    const double* centroids /** numpy */,
+    void* monitor)
 {
     auto mptr = reinterpret_cast<const Mattress*>(mat);
     auto bptr = reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(prebuilt);
@@ -38,14 +48,111 @@ void classify_single_reference(
         score_ptrs.push_back(reinterpret_cast<double*>(scores[l]));
     }
 
-    runner.run(
-        mptr->ptr.get(),
-        *bptr,
-        subset_copy.data(),
-        best_copy.data(),
-        score_ptrs,
-        delta
-    );
+    // A negative 'tile_size' chooses the tile size from the cache size.
+    singler::Schedule sched;
+    sched.tile = std::max(tile_size, 0);
+    sched.task_bytes = bptr->subset.size() * sizeof(double);
+    sched.pin = pin_threads;
+    singler::ScheduleScope sched_scope(sched, tile_size != 0 || pin_threads);
+
+    singler::Monitor mon(monitor);
+    if (num_candidates > 0) {
+        // Two-stage classification with the label centroids, see candidate_labels.h.
+        singler::MonitorScope scope(mon);
+        singlepp::SubsetSorter subsorted(subset_copy);
+        const size_t num_subset = bptr->subset.size();
+
+        singler::parallelize([&](size_t, int start, int length) -> void {
+            auto wrk = tatami::consecutive_extractor<false, false>(mptr->ptr.get(), start, length, subsorted.extraction_subset());
+            singlepp::RankedVector<double, int> vec(num_subset);
+            std::vector<double> buffer(num_subset);
+            singler::CandidateScorer scorer(*bptr, centroids, num_candidates, quantile, use_fine_tune, fine_tune_threshold);
+            singler::TopScores collector(top_k, nlabels);
+
+            for (int c = start, end = start + length; c < end; ++c) {
+                auto ptr = wrk->fetch(c, buffer.data());
+                subsorted.fill_ranks(ptr, vec);
+                singlepp::scaled_ranks(vec, buffer.data());
+
+                auto chosen = scorer.run(vec, buffer.data());
+                best_copy[c] = chosen.first;
+                delta[c] = chosen.second;
+
+                for (size_t l = 0; l < nlabels; ++l) {
+                    if (score_ptrs[l]) {
+                        score_ptrs[l][c] = scorer.score(l);
+                    }
+                }
+                if (top_k) {
+                    scorer.collect(
+                        collector,
+                        top_labels + static_cast<size_t>(c) * collector.k,
+                        top_scores + static_cast<size_t>(c) * collector.k
+                    );
+                }
+            }
+        }, NC, nthreads);
+
+    } else if (!mon.active() && top_k == 0) {
+        runner.run(
+            mptr->ptr.get(),
+            *bptr,
+            subset_copy.data(),
+            best_copy.data(),
+            score_ptrs,
+            delta
+        );
+
+    } else {
+        // Classifying in blocks of cells so that we can report progress and check for cancellation.
+        // If only the top scores are requested, the scores for each block are stored in a buffer
+        // and reduced to the top scores for each cell, so the full score matrix is never stored.
+        size_t block = std::max(static_cast<size_t>(1000), static_cast<size_t>(nthreads) * 200);
+        std::vector<double> buffer;
+        if (top_k) {
+            buffer.resize(nlabels * std::min(block, NC));
+        }
+
+        for (size_t start = 0; start < NC; start += block) {
+            size_t len = std::min(block, NC - start);
+            auto sub = tatami::make_DelayedSubsetBlock<1>(mptr->ptr, static_cast<int>(start), static_cast<int>(len));
+
+            std::vector<double*> block_ptrs(nlabels);
+            for (size_t l = 0; l < nlabels; ++l) {
+                if (top_k) {
+                    block_ptrs[l] = buffer.data() + l * len;
+                } else if (score_ptrs[l]) {
+                    block_ptrs[l] = score_ptrs[l] + start;
+                } else {
+                    block_ptrs[l] = NULL;
+                }
+            }
+
+            runner.run(
+                sub.get(),
+                *bptr,
+                subset_copy.data(),
+                best_copy.data() + start,
+                block_ptrs,
+                delta + start
+            );
+
+            if (top_k) {
+                singler::TopScores collector(top_k, nlabels);
+                for (size_t c = 0; c < len; ++c) {
+                    collector.run(
+                        [&](size_t l) -> double { return block_ptrs[l][c]; },
+                        top_labels + (start + c) * collector.k,
+                        top_scores + (start + c) * collector.k
+                    );
+                }
+            }
+
+            if (mon.active() && mon.report(start + len, NC)) {
+                throw singler::Cancelled();
+            }
+        }
+    }
 
     std::copy(best_copy.begin(), best_copy.end(), best);
     return;
@@ -0,0 +1,76 @@
+#include "utils.h" // must be before raticate, singlepp includes.
+
+#include <vector>
+#include <cstdint>
+#include <cmath>
+#include <algorithm>
+#include <stdexcept>
+#include <iterator>
+
+//[[export]]
+void compare_neighbor_search(
+    void* mat,
+    const int32_t* subset /** numpy */,
+    void* exact,
+    void* approximate,
+    double quantile,
+    int32_t nthreads,
+    double* recall /** numpy */)
+{
+    auto mptr = reinterpret_cast<const Mattress*>(mat);
+    const auto& eref = reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(exact)->references;
+    const auto& aref = reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(approximate)->references;
+    const size_t num_subset = reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(exact)->subset.size();
+
+    const size_t NL = eref.size();
+    if (aref.size() != NL) {
+        throw std::runtime_error("references should have the same number of labels");
+    }
+
+    // Same number of neighbors as that used to compute the score for each
+    // label in singlepp::annotate_cells_simple().
+    std::vector<int> search_k(NL);
+    for (size_t r = 0; r < NL; ++r) {
+        if (eref[r].index->nobs() != aref[r].index->nobs() || static_cast<size_t>(aref[r].index->ndim()) != num_subset) {
+            throw std::runtime_error("references should contain the same profiles and markers for each label");
+        }
+        double denom = eref[r].index->nobs() - 1;
+        search_k[r] = std::ceil(denom * (1 - quantile)) + 1;
+    }
+
+    std::vector<int> subcopy(subset, subset + num_subset);
+    singlepp::SubsetSorter subsorted(subcopy);
+
+    singler::parallelize([&](size_t, int start, int length) -> void {
+        auto wrk = tatami::consecutive_extractor<false, false>(mptr->ptr.get(), start, length, subsorted.extraction_subset());
+        singlepp::RankedVector<double, int> vec(num_subset);
+        std::vector<double> buffer(num_subset);
+        std::vector<int> expected, observed, common;
+
+        for (int c = start, end = start + length; c < end; ++c) {
+            auto ptr = wrk->fetch(c, buffer.data());
+            subsorted.fill_ranks(ptr, vec);
+            singlepp::scaled_ranks(vec, buffer.data());
+
+            double total = 0;
+            for (size_t r = 0; r < NL; ++r) {
+                expected.clear();
+                for (const auto& x : eref[r].index->find_nearest_neighbors(buffer.data(), search_k[r])) {
+                    expected.push_back(x.first);
+                }
+                observed.clear();
+                for (const auto& x : aref[r].index->find_nearest_neighbors(buffer.data(), search_k[r])) {
+                    observed.push_back(x.first);
+                }
+
+                std::sort(expected.begin(), expected.end());
+                std::sort(observed.begin(), observed.end());
+                common.clear();
+                std::set_intersection(expected.begin(), expected.end(), observed.begin(), observed.end(), std::back_inserter(common));
+                total += static_cast<double>(common.size()) / expected.size();
+            }
+
+            recall[c] = (NL ? total / NL : 1);
+        }
+    }, mptr->ptr->ncol(), nthreads);
+}
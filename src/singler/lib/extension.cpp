@@ -0,0 +1,763 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include "utils.h" // must be before raticate, singlepp includes.
+
+#include <vector>
+#include <cstdint>
+#include <cstring>
+#include <stdexcept>
+#include <string>
+
+/*
+ * Direct CPython bindings for the entry points that are called most often,
+ * i.e., classification of small batches and the handling of markers. These
+ * accept NumPy arrays (or any other object supporting the buffer protocol)
+ * without the per-call marshalling of the ctypes bindings in _cpphelpers.py,
+ * and compute the pointers to the rows of the score matrices here.
+ *
+ * The same shared library is loaded by ctypes, so both sets of bindings
+ * operate on the same native objects and global state.
+ */
+
+void classify_single_reference(void*, const int32_t*, void*, double, uint8_t, double, int32_t, const uintptr_t*, int32_t*, double*, int32_t, uint8_t, int32_t, int32_t*, double*, int32_t, const double*, void*);
+
+void classify_single_reference_ranked(void*, const int32_t*, void*, double, uint8_t, double, int32_t, const uintptr_t*, int32_t*, double*, int32_t, uint8_t, int32_t, int32_t*, double*, int32_t, const double*, void*);
+
+void classify_integrated_references(void*, const uintptr_t*, void*, double, uintptr_t*, int32_t*, double*, int32_t);
+
+void classify_integrated_references_ranked(void*, const int32_t*, const uintptr_t*, void*, double, uintptr_t*, int32_t*, double*, int32_t);
+
+int32_t get_ranked_test_matrix_ncol(void*);
+
+namespace {
+
+// Owns a view of an object supporting the buffer protocol.
+class Buffer {
+public:
+    Buffer() {
+        view.obj = NULL;
+    }
+
+    ~Buffer() {
+        if (view.obj) {
+            PyBuffer_Release(&view);
+        }
+    }
+
+    Buffer(const Buffer&) = delete;
+    Buffer& operator=(const Buffer&) = delete;
+
+    // Only used when resizing a vector of empty buffers.
+    Buffer(Buffer&& other) noexcept : view(other.view) {
+        other.view.obj = NULL;
+    }
+
+    Py_buffer view;
+
+    // 'type' should be 'i' for 32-bit integers or 'd' for doubles. Sets a
+    // Python exception and returns false if the object is not compatible.
+    bool acquire(PyObject* obj, char type, int ndim, bool writable, const char* name) {
+        int flags = PyBUF_STRIDES | PyBUF_FORMAT;
+        if (writable) {
+            flags |= PyBUF_WRITABLE;
+        }
+        if (PyObject_GetBuffer(obj, &view, flags) != 0) {
+            return false;
+        }
+
+        size_t expected_size = (type == 'd' ? sizeof(double) : sizeof(int32_t));
+        if (view.ndim != ndim || static_cast<size_t>(view.itemsize) != expected_size || !check_format(view.format, type)) {
+            PyErr_Format(
+                PyExc_ValueError,
+                "'%s' should be a %d-dimensional array of %s",
+                name,
+                ndim,
+                (type == 'd' ? "float64" : "int32")
+            );
+            return false;
+        }
+
+        // The last dimension must be contiguous.
+        if (view.shape[ndim - 1] > 1 && view.strides[ndim - 1] != view.itemsize) {
+            PyErr_Format(PyExc_ValueError, "'%s' should be contiguous along its last dimension", name);
+            return false;
+        }
+        return true;
+    }
+
+    template<typename T>
+    T* data() const {
+        return static_cast<T*>(view.buf);
+    }
+
+    Py_ssize_t size(int dim = 0) const {
+        return view.shape[dim];
+    }
+
+    // Pointer to the start of each row of a 2-dimensional buffer.
+    std::vector<uintptr_t> rows() const {
+        std::vector<uintptr_t> output(view.shape[0]);
+        auto start = static_cast<char*>(view.buf);
+        for (Py_ssize_t r = 0; r < view.shape[0]; ++r) {
+            output[r] = reinterpret_cast<uintptr_t>(start + r * view.strides[0]);
+        }
+        return output;
+    }
+
+private:
+    static bool check_format(const char* format, char type) {
+        if (format == NULL) {
+            return false;
+        }
+        if (*format == '@' || *format == '=' || *format == '<') {
+            ++format;
+        }
+        if (type == 'd') {
+            return std::strcmp(format, "d") == 0;
+        } else {
+            // int32 is 'l' on platforms where a long has 32 bits.
+            return std::strcmp(format, "i") == 0 || std::strcmp(format, "l") == 0;
+        }
+    }
+};
+
+// Pointers are passed as integers, e.g., from mattress or the ctypes bindings,
+// or None for a null pointer. ctypes.c_void_p objects are also accepted.
+bool parse_pointer(PyObject* obj, void** output) {
+    if (obj == Py_None) {
+        *output = NULL;
+        return true;
+    }
+
+    PyObject* value = NULL;
+    if (!PyLong_Check(obj)) {
+        value = PyObject_GetAttrString(obj, "value");
+        if (value == NULL) {
+            PyErr_SetString(PyExc_TypeError, "expected an integer address or None");
+            return false;
+        }
+        obj = value;
+    }
+
+    if (obj == Py_None) {
+        *output = NULL;
+    } else {
+        *output = PyLong_AsVoidPtr(obj);
+    }
+    Py_XDECREF(value);
+    return !PyErr_Occurred();
+}
+
+int pointer_converter(PyObject* obj, void* output) {
+    return parse_pointer(obj, static_cast<void**>(output));
+}
+
+// Fills 'output' with pointers to 'nrows' rows of length 'ncols' from 'obj',
+// which may be None (i.e., all null pointers), a 2-dimensional array, or a
+// sequence of 1-dimensional arrays or None. The buffers are stored in 'held'
+// so that they remain valid until the native call has completed.
+bool parse_rows(PyObject* obj, char type, size_t nrows, size_t ncols, bool writable, const char* name, std::vector<Buffer>& held, std::vector<uintptr_t>& output) {
+    output.clear();
+    output.resize(nrows);
+    if (obj == Py_None) {
+        return true;
+    }
+
+    if (PyObject_CheckBuffer(obj)) {
+        held.resize(1);
+        auto& buffer = held.front();
+        if (!buffer.acquire(obj, type, 2, writable, name)) {
+            return false;
+        }
+        if (static_cast<size_t>(buffer.size(0)) != nrows || static_cast<size_t>(buffer.size(1)) != ncols) {
+            PyErr_Format(PyExc_ValueError, "'%s' should have shape (%zu, %zu)", name, nrows, ncols);
+            return false;
+        }
+        output = buffer.rows();
+        return true;
+    }
+
+    PyObject* seq = PySequence_Fast(obj, "expected None, an array or a sequence of arrays");
+    if (seq == NULL) {
+        return false;
+    }
+    if (static_cast<size_t>(PySequence_Fast_GET_SIZE(seq)) != nrows) {
+        Py_DECREF(seq);
+        PyErr_Format(PyExc_ValueError, "'%s' should contain %zu arrays", name, nrows);
+        return false;
+    }
+
+    held.resize(nrows);
+    for (size_t r = 0; r < nrows; ++r) {
+        PyObject* current = PySequence_Fast_GET_ITEM(seq, r);
+        if (current == Py_None) {
+            continue;
+        }
+        auto& buffer = held[r];
+        if (!buffer.acquire(current, type, 1, writable, name)) {
+            Py_DECREF(seq);
+            return false;
+        }
+        if (static_cast<size_t>(buffer.size()) != ncols) {
+            Py_DECREF(seq);
+            PyErr_Format(PyExc_ValueError, "each entry of '%s' should have length %zu", name, ncols);
+            return false;
+        }
+        output[r] = reinterpret_cast<uintptr_t>(buffer.view.buf);
+    }
+
+    Py_DECREF(seq);
+    return true;
+}
+
+bool check_length(const Buffer& buffer, size_t expected, const char* name) {
+    if (static_cast<size_t>(buffer.size()) != expected) {
+        PyErr_Format(PyExc_ValueError, "'%s' should have length %zu", name, expected);
+        return false;
+    }
+    return true;
+}
+
+// Runs the native function without the GIL, converting C++ exceptions into a
+// RuntimeError in the same manner as the ctypes bindings.
+template<class Function_>
+PyObject* run_native(Function_ fun) {
+    std::string msg;
+    bool failed = false;
+
+    Py_BEGIN_ALLOW_THREADS
+    try {
+        fun();
+    } catch (std::exception& e) {
+        failed = true;
+        msg = e.what();
+    } catch (...) {
+        failed = true;
+        msg = "unknown C++ exception";
+    }
+    Py_END_ALLOW_THREADS
+
+    if (failed) {
+        PyErr_SetString(PyExc_RuntimeError, msg.c_str());
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+struct SingleArgs {
+    void* test = NULL;
+    PyObject* subset = NULL;
+    void* prebuilt = NULL;
+    double quantile = 0.8;
+    int use_fine_tune = 1;
+    double fine_tune_threshold = 0.05;
+    int nthreads = 1;
+    PyObject* scores = Py_None;
+    PyObject* best = NULL;
+    PyObject* delta = NULL;
+    int tile_size = 0;
+    int pin_threads = 0;
+    int top_k = 0;
+    PyObject* top_labels = Py_None;
+    PyObject* top_scores = Py_None;
+    int num_candidates = 0;
+    PyObject* centroids = Py_None;
+    void* monitor = NULL;
+};
+
+template<bool ranked_>
+PyObject* classify_single(PyObject*, PyObject* args, PyObject* kwargs) {
+    static const char* keywords[] = {
+        (ranked_ ? "ranked" : "mat"),
+        (ranked_ ? "positions" : "subset"),
+        "prebuilt",
+        "quantile",
+        "use_fine_tune",
+        "fine_tune_threshold",
+        "nthreads",
+        "scores",
+        "best",
+        "delta",
+        "tile_size",
+        "pin_threads",
+        "top_k",
+        "top_labels",
+        "top_scores",
+        "num_candidates",
+        "centroids",
+        "monitor",
+        NULL
+    };
+
+    SingleArgs a;
+    if (!PyArg_ParseTupleAndKeywords(
+        args,
+        kwargs,
+        "O&OO&dpdiOOO|ipiOOiOO&",
+        const_cast<char**>(keywords),
+        pointer_converter, &a.test,
+        &a.subset,
+        pointer_converter, &a.prebuilt,
+        &a.quantile,
+        &a.use_fine_tune,
+        &a.fine_tune_threshold,
+        &a.nthreads,
+        &a.scores,
+        &a.best,
+        &a.delta,
+        &a.tile_size,
+        &a.pin_threads,
+        &a.top_k,
+        &a.top_labels,
+        &a.top_scores,
+        &a.num_candidates,
+        &a.centroids,
+        pointer_converter, &a.monitor
+    )) {
+        return NULL;
+    }
+
+    if (a.test == NULL || a.prebuilt == NULL) {
+        PyErr_SetString(PyExc_ValueError, "test data and prebuilt reference should not be null");
+        return NULL;
+    }
+
+    auto bptr = reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(a.prebuilt);
+    size_t nlabels = bptr->num_labels();
+    size_t nsubset = bptr->subset.size();
+
+    size_t NC;
+    if constexpr(ranked_) {
+        NC = get_ranked_test_matrix_ncol(a.test);
+    } else {
+        NC = reinterpret_cast<const Mattress*>(a.test)->ptr->ncol();
+    }
+
+    Buffer subset, best, delta, top_labels, top_scores, centroids;
+    if (!subset.acquire(a.subset, 'i', 1, false, (ranked_ ? "positions" : "subset")) || !check_length(subset, nsubset, "subset")) {
+        return NULL;
+    }
+    if (!best.acquire(a.best, 'i', 1, true, "best") || !check_length(best, NC, "best")) {
+        return NULL;
+    }
+    if (!delta.acquire(a.delta, 'd', 1, true, "delta") || !check_length(delta, NC, "delta")) {
+        return NULL;
+    }
+
+    if (a.top_k > 0) {
+        size_t k = std::min(static_cast<size_t>(a.top_k), nlabels);
+        if (!top_labels.acquire(a.top_labels, 'i', 2, true, "top_labels") || !top_scores.acquire(a.top_scores, 'd', 2, true, "top_scores")) {
+            return NULL;
+        }
+        for (auto current : { &top_labels, &top_scores }) {
+            if (!PyBuffer_IsContiguous(&(current->view), 'C') || static_cast<size_t>(current->size(0)) != NC || static_cast<size_t>(current->size(1)) != k) {
+                PyErr_Format(PyExc_ValueError, "top labels and scores should be C-contiguous arrays of shape (%zu, %zu)", NC, k);
+                return NULL;
+            }
+        }
+    }
+
+    if (a.num_candidates > 0) {
+        if (!centroids.acquire(a.centroids, 'd', 2, false, "centroids")) {
+            return NULL;
+        }
+        if (!PyBuffer_IsContiguous(&(centroids.view), 'C') || static_cast<size_t>(centroids.size(0)) != nlabels || static_cast<size_t>(centroids.size(1)) != nsubset) {
+            PyErr_Format(PyExc_ValueError, "'centroids' should be a C-contiguous array of shape (%zu, %zu)", nlabels, nsubset);
+            return NULL;
+        }
+    }
+
+    std::vector<Buffer> held;
+    std::vector<uintptr_t> score_ptrs;
+    if (!parse_rows(a.scores, 'd', nlabels, NC, true, "scores", held, score_ptrs)) {
+        return NULL;
+    }
+
+    return run_native([&]() -> void {
+        (ranked_ ? classify_single_reference_ranked : classify_single_reference)(
+            a.test,
+            subset.data<int32_t>(),
+            a.prebuilt,
+            a.quantile,
+            a.use_fine_tune,
+            a.fine_tune_threshold,
+            a.nthreads,
+            score_ptrs.data(),
+            best.data<int32_t>(),
+            delta.data<double>(),
+            a.tile_size,
+            a.pin_threads,
+            a.top_k,
+            top_labels.view.obj ? top_labels.data<int32_t>() : NULL,
+            top_scores.view.obj ? top_scores.data<double>() : NULL,
+            a.num_candidates,
+            centroids.view.obj ? centroids.data<double>() : NULL,
+            a.monitor
+        );
+    });
+}
+
+template<bool ranked_>
+PyObject* classify_integrated(PyObject*, PyObject* args, PyObject* kwargs) {
+    static const char* ranked_keywords[] = { "ranked", "positions", "assigned", "prebuilt", "quantile", "scores", "best", "delta", "nthreads", NULL };
+    static const char* keywords[] = { "mat", "assigned", "prebuilt", "quantile", "scores", "best", "delta", "nthreads", NULL };
+
+    void* test = NULL;
+    PyObject* positions_obj = Py_None;
+    PyObject* assigned_obj = NULL;
+    void* prebuilt = NULL;
+    double quantile = 0.8;
+    PyObject* scores_obj = NULL;
+    PyObject* best_obj = NULL;
+    PyObject* delta_obj = NULL;
+    int nthreads = 1;
+
+    int parsed;
+    if constexpr(ranked_) {
+        parsed = PyArg_ParseTupleAndKeywords(
+            args,
+            kwargs,
+            "O&OOO&dOOOi",
+            const_cast<char**>(ranked_keywords),
+            pointer_converter, &test,
+            &positions_obj,
+            &assigned_obj,
+            pointer_converter, &prebuilt,
+            &quantile,
+            &scores_obj,
+            &best_obj,
+            &delta_obj,
+            &nthreads
+        );
+    } else {
+        parsed = PyArg_ParseTupleAndKeywords(
+            args,
+            kwargs,
+            "O&OO&dOOOi",
+            const_cast<char**>(keywords),
+            pointer_converter, &test,
+            &assigned_obj,
+            pointer_converter, &prebuilt,
+            &quantile,
+            &scores_obj,
+            &best_obj,
+            &delta_obj,
+            &nthreads
+        );
+    }
+    if (!parsed) {
+        return NULL;
+    }
+
+    if (test == NULL || prebuilt == NULL) {
+        PyErr_SetString(PyExc_ValueError, "test data and integrated references should not be null");
+        return NULL;
+    }
+
+    auto bptr = reinterpret_cast<const singlepp::IntegratedReferences*>(prebuilt);
+    size_t nrefs = bptr->num_references();
+
+    Buffer positions, best, delta;
+    if constexpr(ranked_) {
+        if (!positions.acquire(positions_obj, 'i', 1, false, "positions") || !check_length(positions, bptr->universe.size(), "positions")) {
+            return NULL;
+        }
+    }
+
+    size_t NC;
+    if constexpr(ranked_) {
+        NC = get_ranked_test_matrix_ncol(test);
+    } else {
+        NC = reinterpret_cast<const Mattress*>(test)->ptr->ncol();
+    }
+    if (!best.acquire(best_obj, 'i', 1, true, "best") || !check_length(best, NC, "best")) {
+        return NULL;
+    }
+    if (!delta.acquire(delta_obj, 'd', 1, true, "delta") || !check_length(delta, NC, "delta")) {
+        return NULL;
+    }
+
+    std::vector<Buffer> held_assigned, held_scores;
+    std::vector<uintptr_t> assigned_ptrs, score_ptrs;
+    if (assigned_obj == Py_None || scores_obj == Py_None) {
+        PyErr_SetString(PyExc_ValueError, "'assigned' and 'scores' should be supplied for all references");
+        return NULL;
+    }
+    if (!parse_rows(assigned_obj, 'i', nrefs, NC, false, "assigned", held_assigned, assigned_ptrs)) {
+        return NULL;
+    }
+    if (!parse_rows(scores_obj, 'd', nrefs, NC, true, "scores", held_scores, score_ptrs)) {
+        return NULL;
+    }
+    for (size_t r = 0; r < nrefs; ++r) {
+        if (!assigned_ptrs[r] || !score_ptrs[r]) {
+            PyErr_SetString(PyExc_ValueError, "'assigned' and 'scores' should be supplied for all references");
+            return NULL;
+        }
+    }
+
+    return run_native([&]() -> void {
+        if constexpr(ranked_) {
+            classify_integrated_references_ranked(
+                test,
+                positions.data<int32_t>(),
+                assigned_ptrs.data(),
+                prebuilt,
+                quantile,
+                score_ptrs.data(),
+                best.data<int32_t>(),
+                delta.data<double>(),
+                nthreads
+            );
+        } else {
+            classify_integrated_references(
+                test,
+                assigned_ptrs.data(),
+                prebuilt,
+                quantile,
+                score_ptrs.data(),
+                best.data<int32_t>(),
+                delta.data<double>(),
+                nthreads
+            );
+        }
+    });
+}
+
+singlepp::Markers* parse_markers(PyObject* obj) {
+    void* ptr = NULL;
+    if (!parse_pointer(obj, &ptr)) {
+        return NULL;
+    }
+    if (ptr == NULL) {
+        PyErr_SetString(PyExc_ValueError, "markers should not be null");
+        return NULL;
+    }
+    return reinterpret_cast<singlepp::Markers*>(ptr);
+}
+
+std::vector<int>* parse_marker_pair(PyObject* args, PyObject** extra) {
+    PyObject* ptr_obj;
+    int first, second;
+    if (extra) {
+        if (!PyArg_ParseTuple(args, "OiiO", &ptr_obj, &first, &second, extra)) {
+            return NULL;
+        }
+    } else if (!PyArg_ParseTuple(args, "Oii", &ptr_obj, &first, &second)) {
+        return NULL;
+    }
+
+    auto mptr = parse_markers(ptr_obj);
+    if (mptr == NULL) {
+        return NULL;
+    }
+    auto& markers = *mptr;
+    int nlabels = markers.size();
+    for (auto i : { first, second }) {
+        if (i < 0 || i >= nlabels) {
+            PyErr_Format(PyExc_IndexError, "label %d out of range for marker list", i);
+            return NULL;
+        }
+    }
+    return &(markers[first][second]);
+}
+
+// Returns the markers for a pair of labels as a bytearray of 32-bit integers,
+// which can be wrapped in a NumPy array without another copy.
+PyObject* get_markers_for_pair(PyObject*, PyObject* args) {
+    auto current = parse_marker_pair(args, NULL);
+    if (current == NULL) {
+        return NULL;
+    }
+
+    PyObject* output = PyByteArray_FromStringAndSize(NULL, current->size() * sizeof(int32_t));
+    if (output == NULL) {
+        return NULL;
+    }
+    auto optr = reinterpret_cast<int32_t*>(PyByteArray_AS_STRING(output));
+    std::copy(current->begin(), current->end(), optr);
+    return output;
+}
+
+PyObject* set_markers_for_pair(PyObject*, PyObject* args) {
+    PyObject* values_obj;
+    auto current = parse_marker_pair(args, &values_obj);
+    if (current == NULL) {
+        return NULL;
+    }
+
+    Buffer values;
+    if (!values.acquire(values_obj, 'i', 1, false, "values")) {
+        return NULL;
+    }
+    auto vptr = values.data<int32_t>();
+    current->clear();
+    current->insert(current->end(), vptr, vptr + values.size());
+    Py_RETURN_NONE;
+}
+
+// Fills a (nlabels, nlabels) array with the number of markers for each pair of labels.
+PyObject* count_markers(PyObject*, PyObject* args) {
+    PyObject* ptr_obj;
+    PyObject* counts_obj;
+    if (!PyArg_ParseTuple(args, "OO", &ptr_obj, &counts_obj)) {
+        return NULL;
+    }
+
+    auto mptr = parse_markers(ptr_obj);
+    if (mptr == NULL) {
+        return NULL;
+    }
+    const auto& markers = *mptr;
+    size_t nlabels = markers.size();
+
+    Buffer counts;
+    if (!counts.acquire(counts_obj, 'i', 2, true, "counts")) {
+        return NULL;
+    }
+    if (!PyBuffer_IsContiguous(&(counts.view), 'C') || static_cast<size_t>(counts.size(0)) != nlabels || static_cast<size_t>(counts.size(1)) != nlabels) {
+        PyErr_Format(PyExc_ValueError, "'counts' should be a C-contiguous array of shape (%zu, %zu)", nlabels, nlabels);
+        return NULL;
+    }
+
+    auto cptr = counts.data<int32_t>();
+    for (size_t i = 0; i < nlabels; ++i) {
+        for (size_t j = 0; j < nlabels; ++j, ++cptr) {
+            *cptr = markers[i][j].size();
+        }
+    }
+    Py_RETURN_NONE;
+}
+
+// Concatenates the markers for all pairs of labels, in row-major order of the pairs.
+PyObject* get_markers(PyObject*, PyObject* args) {
+    PyObject* ptr_obj;
+    PyObject* values_obj;
+    if (!PyArg_ParseTuple(args, "OO", &ptr_obj, &values_obj)) {
+        return NULL;
+    }
+
+    auto mptr = parse_markers(ptr_obj);
+    if (mptr == NULL) {
+        return NULL;
+    }
+    const auto& markers = *mptr;
+
+    size_t total = 0;
+    for (const auto& first : markers) {
+        for (const auto& second : first) {
+            total += second.size();
+        }
+    }
+
+    Buffer values;
+    if (!values.acquire(values_obj, 'i', 1, true, "values") || !check_length(values, total, "values")) {
+        return NULL;
+    }
+
+    auto vptr = values.data<int32_t>();
+    for (const auto& first : markers) {
+        for (const auto& second : first) {
+            vptr = std::copy(second.begin(), second.end(), vptr);
+        }
+    }
+    Py_RETURN_NONE;
+}
+
+// Replaces the markers for all pairs of labels, where 'counts' and 'values' are as described above.
+PyObject* set_markers(PyObject*, PyObject* args) {
+    PyObject* ptr_obj;
+    PyObject* counts_obj;
+    PyObject* values_obj;
+    if (!PyArg_ParseTuple(args, "OOO", &ptr_obj, &counts_obj, &values_obj)) {
+        return NULL;
+    }
+
+    auto mptr = parse_markers(ptr_obj);
+    if (mptr == NULL) {
+        return NULL;
+    }
+    auto& markers = *mptr;
+    size_t nlabels = markers.size();
+
+    Buffer counts, values;
+    if (!counts.acquire(counts_obj, 'i', 2, false, "counts") || !values.acquire(values_obj, 'i', 1, false, "values")) {
+        return NULL;
+    }
+    if (!PyBuffer_IsContiguous(&(counts.view), 'C') || static_cast<size_t>(counts.size(0)) != nlabels || static_cast<size_t>(counts.size(1)) != nlabels) {
+        PyErr_Format(PyExc_ValueError, "'counts' should be a C-contiguous array of shape (%zu, %zu)", nlabels, nlabels);
+        return NULL;
+    }
+
+    auto cptr = counts.data<int32_t>();
+    size_t total = 0;
+    for (size_t i = 0, end = nlabels * nlabels; i < end; ++i) {
+        if (cptr[i] < 0) {
+            PyErr_SetString(PyExc_ValueError, "'counts' should be non-negative");
+            return NULL;
+        }
+        total += cptr[i];
+    }
+    if (!check_length(values, total, "values")) {
+        return NULL;
+    }
+
+    auto vptr = values.data<int32_t>();
+    for (size_t i = 0; i < nlabels; ++i) {
+        for (size_t j = 0; j < nlabels; ++j, ++cptr) {
+            auto& current = markers[i][j];
+            current.clear();
+            current.insert(current.end(), vptr, vptr + *cptr);
+            vptr += *cptr;
+        }
+    }
+    Py_RETURN_NONE;
+}
+
+PyMethodDef methods[] = {
+    {
+        "classify_single_reference",
+        reinterpret_cast<PyCFunction>(reinterpret_cast<void(*)(void)>(classify_single<false>)),
+        METH_VARARGS | METH_KEYWORDS,
+        "Classify a test matrix against a single prebuilt reference."
+    },
+    {
+        "classify_single_reference_ranked",
+        reinterpret_cast<PyCFunction>(reinterpret_cast<void(*)(void)>(classify_single<true>)),
+        METH_VARARGS | METH_KEYWORDS,
+        "Classify a ranked test matrix against a single prebuilt reference."
+    },
+    {
+        "classify_integrated_references",
+        reinterpret_cast<PyCFunction>(reinterpret_cast<void(*)(void)>(classify_integrated<false>)),
+        METH_VARARGS | METH_KEYWORDS,
+        "Classify a test matrix against integrated references."
+    },
+    {
+        "classify_integrated_references_ranked",
+        reinterpret_cast<PyCFunction>(reinterpret_cast<void(*)(void)>(classify_integrated<true>)),
+        METH_VARARGS | METH_KEYWORDS,
+        "Classify a ranked test matrix against integrated references."
+    },
+    { "get_markers_for_pair", get_markers_for_pair, METH_VARARGS, "Get the markers for a pair of labels." },
+    { "set_markers_for_pair", set_markers_for_pair, METH_VARARGS, "Set the markers for a pair of labels." },
+    { "count_markers", count_markers, METH_VARARGS, "Count the markers for all pairs of labels." },
+    { "get_markers", get_markers, METH_VARARGS, "Get the markers for all pairs of labels." },
+    { "set_markers", set_markers, METH_VARARGS, "Set the markers for all pairs of labels." },
+    { NULL, NULL, 0, NULL }
+};
+
+PyModuleDef module = {
+    PyModuleDef_HEAD_INIT,
+    "_core",
+    "Direct bindings to the native library for frequently called functions.",
+    -1,
+    methods
+};
+
+}
+
+PyMODINIT_FUNC PyInit__core() {
+    return PyModule_Create(&module);
+}
@@ -4,7 +4,7 @@
 #include <cstdint>
 
 //[[export]]
-void* find_classic_markers(int32_t nref, const uintptr_t* labels /** void_p */, const uintptr_t* ref /** void_p */, int32_t de_n, int32_t nthreads) {
+void* find_classic_markers(int32_t nref, const uintptr_t* labels /** void_p */, const uintptr_t* ref /** void_p */, int32_t de_n, int32_t nthreads, void* monitor) {
     std::vector<const tatami::Matrix<double, int>*> ref_ptrs;
     ref_ptrs.reserve(nref);
     std::vector<const int32_t*> lab_ptrs;
@@ -16,6 +16,10 @@ void* find_classic_markers(int32_t nref, const uintptr_t* labels /** void_p */,
         lab_ptrs.push_back(reinterpret_cast<const int32_t*>(labels[r]));
     }
 
+    // Progress is reported for each block of label pairs.
+    singler::Monitor mon(monitor);
+    singler::MonitorScope scope(mon);
+
     singlepp::ChooseClassicMarkers mrk;
     mrk.set_number(de_n).set_num_threads(nthreads);
     auto store = mrk.run(ref_ptrs, lab_ptrs);
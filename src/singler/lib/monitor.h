@@ -0,0 +1,306 @@
+#ifndef MONITOR_H
+#define MONITOR_H
+
+#include <algorithm>
+#include <atomic>
+#include <condition_variable>
+#include <cstdint>
+#include <mutex>
+#include <stdexcept>
+#include <string>
+#include <thread>
+#include <vector>
+
+#ifdef __linux__
+#include <pthread.h>
+#include <sched.h>
+#include <unistd.h>
+#endif
+
+namespace singler {
+
+// Called with the number of completed tasks and the total number of tasks.
+// A non-zero return value requests cancellation of the remaining tasks.
+typedef int32_t (*MonitorCallback)(int32_t, int32_t);
+
+struct Cancelled : public std::runtime_error {
+    Cancelled() : std::runtime_error("operation was cancelled") {}
+};
+
+struct Monitor {
+    Monitor(void* callback) : callback(reinterpret_cast<MonitorCallback>(callback)) {}
+
+    MonitorCallback callback;
+
+    bool active() const {
+        return callback != NULL;
+    }
+
+    // Returns true if the caller requested cancellation.
+    bool report(size_t done, size_t total) const {
+        return callback(done, total) != 0;
+    }
+};
+
+// The monitor for the native call that is currently running on this thread.
+// This is consulted by parallelize() to report progress for each block of tasks.
+inline thread_local const Monitor* active_monitor = NULL;
+
+struct MonitorScope {
+    MonitorScope(const Monitor& mon) : previous(active_monitor) {
+        if (mon.active()) {
+            active_monitor = &mon;
+        }
+    }
+
+    ~MonitorScope() {
+        active_monitor = previous;
+    }
+
+    const Monitor* previous;
+};
+
+// Scheduling of the tasks in parallelize(). By default, the tasks are split
+// into one contiguous range per worker; alternatively, they can be split into
+// small tiles that are dynamically assigned, and the workers can be pinned.
+struct Schedule {
+    // Number of tasks in each tile. If zero, this is chosen from 'task_bytes'.
+    size_t tile = 0;
+
+    // Number of bytes of input data for each task, e.g., the marker values
+    // for a single cell. Tiles are sized so that their input fits in cache.
+    size_t task_bytes = 0;
+
+    // Whether to pin each worker thread to its own CPU.
+    bool pin = false;
+
+    template<typename Index_>
+    Index_ tile_size(Index_ tasks, size_t threads) const {
+        size_t chosen = tile;
+        if (chosen == 0) {
+            // Keeping at least 4 tiles per worker for load balancing.
+            size_t cache = per_core_cache();
+            chosen = std::max(static_cast<size_t>(1), cache / std::max(static_cast<size_t>(1), task_bytes));
+            chosen = std::min(chosen, std::max(static_cast<size_t>(1), static_cast<size_t>(tasks) / (threads * 4)));
+        }
+        return std::max(static_cast<Index_>(1), static_cast<Index_>(std::min(chosen, static_cast<size_t>(tasks))));
+    }
+
+    static size_t per_core_cache() {
+#if defined(__linux__) && defined(_SC_LEVEL2_CACHE_SIZE)
+        long cache = sysconf(_SC_LEVEL2_CACHE_SIZE);
+        if (cache > 0) {
+            return cache;
+        }
+#endif
+        return 256 * 1024;
+    }
+};
+
+// The schedule for the native call that is currently running on this thread.
+inline thread_local const Schedule* active_schedule = NULL;
+
+struct ScheduleScope {
+    ScheduleScope(const Schedule& sched, bool active) : previous(active_schedule) {
+        if (active) {
+            active_schedule = &sched;
+        }
+    }
+
+    ~ScheduleScope() {
+        active_schedule = previous;
+    }
+
+    const Schedule* previous;
+};
+
+// Number of pinned workers on each of the CPUs available to the process,
+// across all native calls that are running at the same time. Each worker is
+// pinned to the least-used CPU, so that concurrent calls (e.g., from multiple
+// Python threads in the server) are placed on different CPUs rather than all
+// pinning their t-th worker to the t-th CPU. For a single call, consecutive
+// workers are placed on consecutive CPUs, which usually keeps them on the
+// same socket if there are enough CPUs.
+class PinnedCpus {
+    std::mutex lock;
+    std::vector<int> usage;
+
+public:
+    size_t acquire(size_t count) {
+        std::lock_guard<std::mutex> lck(lock);
+        if (usage.size() < count) {
+            usage.resize(count);
+        }
+        size_t chosen = std::min_element(usage.begin(), usage.begin() + count) - usage.begin();
+        ++usage[chosen];
+        return chosen;
+    }
+
+    void release(size_t slot) {
+        std::lock_guard<std::mutex> lck(lock);
+        --usage[slot];
+    }
+};
+
+inline PinnedCpus pinned_cpus;
+
+// Pins the calling thread to the least-used CPU that is available to it.
+// Returns the index of that CPU among the available CPUs, which should be
+// passed to pinned_cpus.release() once the thread is done; or -1 if the
+// thread could not be pinned.
+inline int pin_thread() {
+#ifdef __linux__
+    cpu_set_t allowed;
+    CPU_ZERO(&allowed);
+    if (sched_getaffinity(0, sizeof(allowed), &allowed) != 0) {
+        return -1;
+    }
+
+    int count = CPU_COUNT(&allowed);
+    if (count == 0) {
+        return -1;
+    }
+
+    int target = pinned_cpus.acquire(count);
+    for (int c = 0, seen = 0; c < CPU_SETSIZE; ++c) {
+        if (CPU_ISSET(c, &allowed)) {
+            if (seen == target) {
+                cpu_set_t chosen;
+                CPU_ZERO(&chosen);
+                CPU_SET(c, &chosen);
+                pthread_setaffinity_np(pthread_self(), sizeof(chosen), &chosen);
+                return target;
+            }
+            ++seen;
+        }
+    }
+    pinned_cpus.release(target);
+#endif
+    return -1;
+}
+
+// Drop-in replacement for tatami::parallelize(). If a monitor or schedule is
+// active, the tasks are split into blocks that are dynamically assigned to
+// the workers. With a monitor, the calling thread reports progress after
+// each block and stops handing out new blocks once cancellation is requested.
+template<class Function_, typename Index_>
+void parallelize(Function_ fun, Index_ tasks, size_t threads) {
+    const Monitor* mon = active_monitor;
+    const Schedule* sched = active_schedule;
+    if (mon == NULL && sched == NULL) {
+        tatami::parallelize(std::move(fun), tasks, threads);
+        return;
+    }
+
+    threads = std::max(static_cast<size_t>(1), std::min(threads, static_cast<size_t>(tasks)));
+    Index_ block;
+    if (sched) {
+        block = sched->tile_size(tasks, threads);
+    } else {
+        block = std::max(static_cast<Index_>(1), static_cast<Index_>(tasks / (threads * 16)));
+    }
+
+    if (threads <= 1) {
+        for (Index_ start = 0; start < tasks; start += block) {
+            Index_ len = std::min(block, static_cast<Index_>(tasks - start));
+            fun(0, start, len);
+            if (mon && mon->report(start + len, tasks)) {
+                throw Cancelled();
+            }
+        }
+        return;
+    }
+
+    bool pin = sched && sched->pin;
+
+    std::atomic<Index_> next(0);
+    std::atomic<bool> stop(false);
+    std::mutex lock;
+    std::condition_variable cv;
+    Index_ completed = 0;
+    size_t finished_workers = 0;
+    std::vector<std::string> errors(threads);
+
+    std::vector<std::thread> workers;
+    workers.reserve(threads);
+    for (size_t t = 0; t < threads; ++t) {
+        workers.emplace_back([&](size_t t) -> void {
+            int pinned = (pin ? pin_thread() : -1);
+
+            try {
+                while (!stop.load()) {
+                    Index_ start = next.fetch_add(block);
+                    if (start >= tasks) {
+                        break;
+                    }
+                    Index_ len = std::min(block, static_cast<Index_>(tasks - start));
+                    fun(t, start, len);
+
+                    std::lock_guard<std::mutex> lck(lock);
+                    completed += len;
+                    cv.notify_one();
+                }
+            } catch (std::exception& e) {
+                errors[t] = e.what();
+                stop.store(true);
+            } catch (...) {
+                errors[t] = "unknown error in thread " + std::to_string(t);
+                stop.store(true);
+            }
+
+            if (pinned >= 0) {
+                pinned_cpus.release(pinned);
+            }
+
+            std::lock_guard<std::mutex> lck(lock);
+            ++finished_workers;
+            cv.notify_one();
+        }, t);
+    }
+
+    // Only the calling thread invokes the callback, as it may not be thread-safe.
+    bool cancelled = false;
+    Index_ reported = 0;
+    while (true) {
+        Index_ current;
+        bool all_done;
+        {
+            std::unique_lock<std::mutex> lck(lock);
+            cv.wait(lck, [&]() -> bool { return completed != reported || finished_workers == threads; });
+            current = completed;
+            all_done = (finished_workers == threads);
+        }
+
+        if (current != reported && !cancelled && mon) {
+            reported = current;
+            if (mon->report(current, tasks)) {
+                cancelled = true;
+                stop.store(true);
+            }
+        } else {
+            reported = current;
+        }
+
+        if (all_done) {
+            break;
+        }
+    }
+
+    for (auto& wrk : workers) {
+        wrk.join();
+    }
+
+    for (const auto& e : errors) {
+        if (!e.empty()) {
+            throw std::runtime_error(e);
+        }
+    }
+
+    if (cancelled) {
+        throw Cancelled();
+    }
+}
+
+}
+
+#endif
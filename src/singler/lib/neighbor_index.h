@@ -0,0 +1,55 @@
+#ifndef NEIGHBOR_INDEX_H
+#define NEIGHBOR_INDEX_H
+
+#include "simd.h"
+
+#include <memory>
+#include <cstdint>
+#include <stdexcept>
+
+namespace singler {
+
+// Choice of neighbor search algorithm and its parameters for each label.
+// This is stored on the Python side and passed to the native functions that
+// (re)build a reference, as the singlepp references do not keep it.
+struct IndexOptions {
+    enum Type : int32_t {
+        EXACT = 0,
+        ANNOY = 1,
+        HNSW = 2
+    };
+
+    IndexOptions(int32_t type, int32_t num_trees, double search_mult, int32_t num_links, int32_t ef_construction, int32_t ef_search) :
+        type(type), num_trees(num_trees), search_mult(search_mult), num_links(num_links), ef_construction(ef_construction), ef_search(ef_search) {}
+
+    int32_t type;
+
+    // Annoy: number of trees, and the number of nodes to inspect during the
+    // search as a multiple of the number of neighbors (negative to use
+    // Annoy's default of the number of trees).
+    int32_t num_trees;
+    double search_mult;
+
+    // HNSW: number of bidirectional links per node, and the size of the
+    // dynamic candidate lists during construction and search.
+    int32_t num_links;
+    int32_t ef_construction;
+    int32_t ef_search;
+
+    std::shared_ptr<knncolle::Base<int, double> > build(int nr, int nc, const double* data) const {
+        switch (type) {
+            case EXACT:
+                return std::shared_ptr<knncolle::Base<int, double> >(new KmknnSimd<int, double>(nr, nc, data));
+            case ANNOY:
+                return std::shared_ptr<knncolle::Base<int, double> >(new AnnoySimd<int, double>(nr, nc, data, num_trees, search_mult));
+            case HNSW:
+                return std::shared_ptr<knncolle::Base<int, double> >(new HnswSimd<int, double>(nr, nc, data, num_links, ef_construction, ef_search));
+            default:
+                throw std::runtime_error("unknown neighbor search type");
+        }
+    }
+};
+
+}
+
+#endif
@@ -0,0 +1,373 @@
+#include "utils.h" // must be before raticate, singlepp includes.
+#include "top_scores.h"
+#include "candidate_labels.h"
+
+#include <vector>
+#include <cstdint>
+#include <cmath>
+#include <algorithm>
+#include <unordered_map>
+#include <unordered_set>
+
+namespace {
+
+// Per-cell ranks of the expression values for a subset of rows in the test
+// matrix. Each entry is sorted and contains the dense rank (i.e., tied values
+// have the same rank) and the position of the row in the subset. As only the
+// ordering and ties are used to compute scaled ranks, the ranks for any
+// further subset can be obtained by filtering without re-sorting.
+struct RankedTest {
+    RankedTest(size_t n) : nrow(n) {}
+    size_t nrow;
+    std::vector<singlepp::RankedVector<int, int> > ranked;
+};
+
+// Maps each position in the ranked rows to the indices of a target subset,
+// allowing for multiple targets per position (e.g., duplicated features).
+struct Lookup {
+    Lookup(size_t nrow, size_t ntargets, const int32_t* positions) : offsets(nrow + 1), targets(ntargets) {
+        for (size_t t = 0; t < ntargets; ++t) {
+            ++offsets[positions[t] + 1];
+        }
+        for (size_t p = 0; p < nrow; ++p) {
+            offsets[p + 1] += offsets[p];
+        }
+        std::vector<size_t> sofar(offsets.begin(), offsets.end() - 1);
+        for (size_t t = 0; t < ntargets; ++t) {
+            targets[sofar[positions[t]]++] = t;
+        }
+    }
+
+    template<typename Stat_>
+    void fill(const singlepp::RankedVector<int, int>& ranked, singlepp::RankedVector<Stat_, int>& output) const {
+        output.clear();
+        for (const auto& r : ranked) {
+            for (size_t i = offsets[r.second], end = offsets[r.second + 1]; i < end; ++i) {
+                output.emplace_back(r.first, targets[i]);
+            }
+        }
+    }
+
+    std::vector<size_t> offsets;
+    std::vector<int> targets;
+};
+
+}
+
+//[[export]]
+void* create_ranked_test_matrix(int32_t nrow) {
+    return new RankedTest(nrow);
+}
+
+//[[export]]
+void free_ranked_test_matrix(void* ptr) {
+    delete reinterpret_cast<RankedTest*>(ptr);
+}
+
+//[[export]]
+int32_t get_ranked_test_matrix_ncol(void* ptr) {
+    return reinterpret_cast<const RankedTest*>(ptr)->ranked.size();
+}
+
+//[[export]]
+void* subset_ranked_test_matrix(void* ptr, int32_t ncells, const int32_t* cells /** numpy */) {
+    auto rptr = reinterpret_cast<const RankedTest*>(ptr);
+    auto output = new RankedTest(rptr->nrow);
+    output->ranked.reserve(ncells);
+    for (int32_t c = 0; c < ncells; ++c) {
+        output->ranked.push_back(rptr->ranked[cells[c]]);
+    }
+    return output;
+}
+
+//[[export]]
+void add_to_ranked_test_matrix(void* ptr, void* mat, const int32_t* subset /** numpy */, int32_t nthreads) {
+    auto rptr = reinterpret_cast<RankedTest*>(ptr);
+    auto mptr = reinterpret_cast<const Mattress*>(mat);
+    const auto& tmat = mptr->ptr;
+
+    // Subset is assumed to be sorted and unique, see rank_test_matrix().
+    std::vector<int> subset_copy(subset, subset + rptr->nrow);
+    size_t existing = rptr->ranked.size();
+    size_t NC = tmat->ncol();
+    rptr->ranked.resize(existing + NC);
+
+    tatami::parallelize([&](size_t, int start, int length) -> void {
+        auto wrk = tatami::consecutive_extractor<false, false>(tmat.get(), start, length, subset_copy);
+        std::vector<double> buffer(subset_copy.size());
+        singlepp::RankedVector<double, int> vec;
+        vec.reserve(subset_copy.size());
+
+        for (int c = start, end = start + length; c < end; ++c) {
+            auto vals = wrk->fetch(c, buffer.data());
+            vec.clear();
+            for (size_t s = 0, nsub = subset_copy.size(); s < nsub; ++s) {
+                vec.emplace_back(vals[s], s);
+            }
+            std::sort(vec.begin(), vec.end());
+
+            auto& output = rptr->ranked[existing + c];
+            output.reserve(vec.size());
+            singlepp::simplify_ranks(vec, output);
+        }
+    }, NC, nthreads);
+}
+
+//[[export]]
+void classify_single_reference_ranked(
+    void* ranked,
+    const int32_t* positions /** numpy */,
+    void* prebuilt,
+    double quantile,
+    uint8_t use_fine_tune,
+    double fine_tune_threshold,
+    int32_t nthreads,
+    const uintptr_t* scores /** void_p */,
+    int32_t* best /** numpy */,
+    double* delta /** numpy */,
+    int32_t tile_size,
+    uint8_t pin_threads,
+    int32_t top_k,
+    int32_t* top_labels /** numpy */,
+    double* top_scores /** numpy */,
+    int32_t num_candidates,
+    const double* centroids /** numpy */,
+    void* monitor)
+{
+    auto rptr = reinterpret_cast<const RankedTest*>(ranked);
+    auto bptr = reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(prebuilt);
+    const auto& ref = bptr->references;
+    size_t num_subset = bptr->subset.size();
+    Lookup lookup(rptr->nrow, num_subset, positions);
+
+    // Same as singlepp::annotate_cells_simple(), other than the source of the ranks.
+    const size_t NL = ref.size();
+    std::vector<int> search_k(NL);
+    std::vector<std::pair<double, double> > coeffs(NL);
+    for (size_t r = 0; r < NL; ++r) {
+        double denom = ref[r].index->nobs() - 1;
+        double prod = denom * (1 - quantile);
+        auto k = std::ceil(prod) + 1;
+        search_k[r] = k;
+        coeffs[r].first = static_cast<double>(k - 1) - prod;
+        coeffs[r].second = prod - static_cast<double>(k - 2);
+    }
+
+    std::vector<double*> score_ptrs(NL);
+    for (size_t l = 0; l < NL; ++l) {
+        score_ptrs[l] = reinterpret_cast<double*>(scores[l]);
+    }
+
+    // A negative 'tile_size' chooses the tile size from the cache size.
+    singler::Schedule sched;
+    sched.tile = std::max(tile_size, 0);
+    sched.task_bytes = bptr->subset.size() * sizeof(double);
+    sched.pin = pin_threads;
+    singler::ScheduleScope sched_scope(sched, tile_size != 0 || pin_threads);
+
+    singler::Monitor mon(monitor);
+    singler::MonitorScope scope(mon);
+
+    singler::parallelize([&](size_t, int start, int length) -> void {
+        singlepp::RankedVector<double, int> vec;
+        vec.reserve(num_subset);
+        std::vector<double> buffer(num_subset);
+
+        singlepp::FineTuner ft;
+        std::vector<double> curscores(NL);
+        singler::TopScores collector(top_k, NL);
+        singler::CandidateScorer scorer(*bptr, centroids, std::max(num_candidates, 0), quantile, use_fine_tune, fine_tune_threshold);
+
+        for (int c = start, end = start + length; c < end; ++c) {
+            lookup.fill(rptr->ranked[c], vec);
+            singlepp::scaled_ranks(vec, buffer.data());
+
+            if (num_candidates > 0) {
+                auto chosen = scorer.run(vec, buffer.data());
+                best[c] = chosen.first;
+                delta[c] = chosen.second;
+                for (size_t r = 0; r < NL; ++r) {
+                    if (score_ptrs[r]) {
+                        score_ptrs[r][c] = scorer.score(r);
+                    }
+                }
+                if (top_k) {
+                    scorer.collect(
+                        collector,
+                        top_labels + static_cast<size_t>(c) * collector.k,
+                        top_scores + static_cast<size_t>(c) * collector.k
+                    );
+                }
+                continue;
+            }
+
+            curscores.resize(NL);
+            for (size_t r = 0; r < NL; ++r) {
+                size_t k = search_k[r];
+                auto current = ref[r].index->find_nearest_neighbors(buffer.data(), k);
+
+                double last = current[k - 1].second;
+                last = 1 - 2 * last * last;
+                if (k == 1) {
+                    curscores[r] = last;
+                } else {
+                    double next = current[k - 2].second;
+                    next = 1 - 2 * next * next;
+                    curscores[r] = coeffs[r].first * next + coeffs[r].second * last;
+                }
+
+                if (score_ptrs[r]) {
+                    score_ptrs[r][c] = curscores[r];
+                }
+            }
+
+            // Collected before fine-tuning, which modifies 'curscores'.
+            if (top_k) {
+                collector.run(
+                    [&](size_t l) -> double { return curscores[l]; },
+                    top_labels + static_cast<size_t>(c) * collector.k,
+                    top_scores + static_cast<size_t>(c) * collector.k
+                );
+            }
+
+            if (!use_fine_tune) {
+                auto top = std::max_element(curscores.begin(), curscores.end());
+                best[c] = top - curscores.begin();
+                if (curscores.size() > 1) {
+                    double topscore = *top;
+                    *top = -100;
+                    delta[c] = topscore - *std::max_element(curscores.begin(), curscores.end());
+                } else {
+                    delta[c] = std::numeric_limits<double>::quiet_NaN();
+                }
+            } else {
+                auto tuned = ft.run(vec, ref, bptr->markers, curscores, quantile, fine_tune_threshold);
+                best[c] = tuned.first;
+                delta[c] = tuned.second;
+            }
+        }
+    }, rptr->ranked.size(), nthreads);
+}
+
+//[[export]]
+void classify_integrated_references_ranked(
+    void* ranked,
+    const int32_t* positions /** numpy */,
+    const uintptr_t* assigned /** void_p */,
+    void* prebuilt,
+    double quantile,
+    uintptr_t* scores /** void_p */,
+    int32_t* best /** numpy */,
+    double* delta /** numpy */,
+    int32_t nthreads)
+{
+    auto rptr = reinterpret_cast<const RankedTest*>(ranked);
+    auto bptr = reinterpret_cast<const singlepp::IntegratedReferences*>(prebuilt);
+    const auto& built = *bptr;
+    size_t NU = built.universe.size();
+    Lookup lookup(rptr->nrow, NU, positions);
+
+    size_t nref = built.num_references();
+    std::vector<const int32_t*> assigned_ptrs(nref);
+    std::vector<double*> score_ptrs(nref);
+    for (size_t r = 0; r < nref; ++r) {
+        assigned_ptrs[r] = reinterpret_cast<const int32_t*>(assigned[r]);
+        score_ptrs[r] = reinterpret_cast<double*>(scores[r]);
+    }
+
+    // Same as singlepp::IntegratedScorer::run(), other than the source of the ranks.
+    tatami::parallelize([&](size_t, int start, int len) -> void {
+        singlepp::RankedVector<double, int> data_ranked, data_ranked2;
+        data_ranked.reserve(NU);
+        data_ranked2.reserve(NU);
+        singlepp::RankedVector<int, int> ref_ranked;
+        ref_ranked.reserve(NU);
+
+        std::vector<double> scaled_data(NU);
+        std::vector<double> scaled_ref(NU);
+        std::unordered_set<int> miniverse_tmp;
+        std::vector<int> miniverse;
+        std::unordered_map<int, int> mapping;
+        std::vector<double> all_correlations;
+
+        for (int i = start, end = start + len; i < end; ++i) {
+            miniverse_tmp.clear();
+            for (size_t r = 0; r < nref; ++r) {
+                const auto& markers = built.markers[r][assigned_ptrs[r][i]];
+                miniverse_tmp.insert(markers.begin(), markers.end());
+            }
+            miniverse.clear();
+            miniverse.insert(miniverse.end(), miniverse_tmp.begin(), miniverse_tmp.end());
+            std::sort(miniverse.begin(), miniverse.end());
+
+            // This contains the entire universe, but only the miniverse is retained by subset_ranks() below.
+            lookup.fill(rptr->ranked[i], data_ranked);
+
+            double best_score = -1000, next_best = -1000;
+            int best_ref = 0;
+
+            for (size_t r = 0; r < nref; ++r) {
+                mapping.clear();
+                if (built.check_availability[r]) {
+                    const auto& cur_available = built.available[r];
+                    int counter = 0;
+                    for (auto c : miniverse) {
+                        if (cur_available.find(c) != cur_available.end()) {
+                            mapping[c] = counter;
+                            ++counter;
+                        }
+                    }
+                } else {
+                    for (size_t s = 0; s < miniverse.size(); ++s) {
+                        mapping[miniverse[s]] = s;
+                    }
+                }
+
+                scaled_ref.resize(mapping.size());
+                scaled_data.resize(mapping.size());
+
+                data_ranked2.clear();
+                singlepp::subset_ranks(data_ranked, data_ranked2, mapping);
+                singlepp::scaled_ranks(data_ranked2, scaled_data.data());
+
+                const auto& best_ranked = built.ranked[r][assigned_ptrs[r][i]];
+                all_correlations.clear();
+                for (size_t s = 0; s < best_ranked.size(); ++s) {
+                    ref_ranked.clear();
+                    singlepp::subset_ranks(best_ranked[s], ref_ranked, mapping);
+                    singlepp::scaled_ranks(ref_ranked, scaled_ref.data());
+                    double cor = singlepp::distance_to_correlation(scaled_ref.size(), scaled_data, scaled_ref);
+                    all_correlations.push_back(cor);
+                }
+
+                double score = singlepp::correlations_to_scores(all_correlations, quantile);
+                if (score_ptrs[r]) {
+                    score_ptrs[r][i] = score;
+                }
+                if (score > best_score) {
+                    next_best = best_score;
+                    best_score = score;
+                    best_ref = r;
+                } else if (score > next_best) {
+                    next_best = score;
+                }
+            }
+
+            best[i] = best_ref;
+            if (nref > 1) {
+                delta[i] = best_score - next_best;
+            }
+        }
+    }, rptr->ranked.size(), nthreads);
+}
+
+//[[export]]
+int32_t get_integrated_universe_size(void* ptr) {
+    return reinterpret_cast<const singlepp::IntegratedReferences*>(ptr)->universe.size();
+}
+
+//[[export]]
+void get_integrated_universe(void* ptr, int32_t* buffer /** numpy */) {
+    const auto& universe = reinterpret_cast<const singlepp::IntegratedReferences*>(ptr)->universe;
+    std::copy(universe.begin(), universe.end(), buffer);
+}
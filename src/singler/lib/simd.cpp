@@ -0,0 +1,402 @@
+#include "utils.h" // must be before all other includes.
+#include "simd.h"
+
+#include <atomic>
+#include <cstdlib>
+#include <cstring>
+
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define SINGLER_SIMD_X86
+#include <immintrin.h>
+#endif
+
+#if defined(__aarch64__) || defined(_M_ARM64)
+#define SINGLER_SIMD_NEON
+#include <arm_neon.h>
+#endif
+
+namespace singler {
+
+namespace simd {
+
+namespace {
+
+// Portable fallback.
+
+template<typename T>
+T squared_distance_scalar(const T* x, const T* y, size_t n) {
+    T output = 0;
+    for (size_t i = 0; i < n; ++i) {
+        T diff = x[i] - y[i];
+        output += diff * diff;
+    }
+    return output;
+}
+
+template<typename T>
+T dot_scalar(const T* x, const T* y, size_t n) {
+    T output = 0;
+    for (size_t i = 0; i < n; ++i) {
+        output += x[i] * y[i];
+    }
+    return output;
+}
+
+// x86 (AVX2 and AVX-512).
+
+#ifdef SINGLER_SIMD_X86
+
+__attribute__((target("avx2,fma")))
+double hsum_avx2(__m256d x) {
+    __m128d half = _mm_add_pd(_mm256_castpd256_pd128(x), _mm256_extractf128_pd(x, 1));
+    return _mm_cvtsd_f64(_mm_add_sd(half, _mm_unpackhi_pd(half, half)));
+}
+
+__attribute__((target("avx2,fma")))
+float hsum_avx2(__m256 x) {
+    __m128 half = _mm_add_ps(_mm256_castps256_ps128(x), _mm256_extractf128_ps(x, 1));
+    half = _mm_add_ps(half, _mm_movehl_ps(half, half));
+    return _mm_cvtss_f32(_mm_add_ss(half, _mm_shuffle_ps(half, half, 1)));
+}
+
+// Two independent accumulators hide the latency of the fused multiply-add.
+__attribute__((target("avx2,fma")))
+double squared_distance_avx2(const double* x, const double* y, size_t n) {
+    __m256d acc0 = _mm256_setzero_pd(), acc1 = _mm256_setzero_pd();
+    size_t i = 0;
+    for (; i + 8 <= n; i += 8) {
+        __m256d d0 = _mm256_sub_pd(_mm256_loadu_pd(x + i), _mm256_loadu_pd(y + i));
+        __m256d d1 = _mm256_sub_pd(_mm256_loadu_pd(x + i + 4), _mm256_loadu_pd(y + i + 4));
+        acc0 = _mm256_fmadd_pd(d0, d0, acc0);
+        acc1 = _mm256_fmadd_pd(d1, d1, acc1);
+    }
+    for (; i + 4 <= n; i += 4) {
+        __m256d d0 = _mm256_sub_pd(_mm256_loadu_pd(x + i), _mm256_loadu_pd(y + i));
+        acc0 = _mm256_fmadd_pd(d0, d0, acc0);
+    }
+
+    return hsum_avx2(_mm256_add_pd(acc0, acc1)) + squared_distance_scalar(x + i, y + i, n - i);
+}
+
+__attribute__((target("avx2,fma")))
+float squared_distance_avx2(const float* x, const float* y, size_t n) {
+    __m256 acc0 = _mm256_setzero_ps(), acc1 = _mm256_setzero_ps();
+    size_t i = 0;
+    for (; i + 16 <= n; i += 16) {
+        __m256 d0 = _mm256_sub_ps(_mm256_loadu_ps(x + i), _mm256_loadu_ps(y + i));
+        __m256 d1 = _mm256_sub_ps(_mm256_loadu_ps(x + i + 8), _mm256_loadu_ps(y + i + 8));
+        acc0 = _mm256_fmadd_ps(d0, d0, acc0);
+        acc1 = _mm256_fmadd_ps(d1, d1, acc1);
+    }
+    for (; i + 8 <= n; i += 8) {
+        __m256 d0 = _mm256_sub_ps(_mm256_loadu_ps(x + i), _mm256_loadu_ps(y + i));
+        acc0 = _mm256_fmadd_ps(d0, d0, acc0);
+    }
+
+    return hsum_avx2(_mm256_add_ps(acc0, acc1)) + squared_distance_scalar(x + i, y + i, n - i);
+}
+
+__attribute__((target("avx2,fma")))
+double dot_avx2(const double* x, const double* y, size_t n) {
+    __m256d acc0 = _mm256_setzero_pd(), acc1 = _mm256_setzero_pd();
+    size_t i = 0;
+    for (; i + 8 <= n; i += 8) {
+        acc0 = _mm256_fmadd_pd(_mm256_loadu_pd(x + i), _mm256_loadu_pd(y + i), acc0);
+        acc1 = _mm256_fmadd_pd(_mm256_loadu_pd(x + i + 4), _mm256_loadu_pd(y + i + 4), acc1);
+    }
+    for (; i + 4 <= n; i += 4) {
+        acc0 = _mm256_fmadd_pd(_mm256_loadu_pd(x + i), _mm256_loadu_pd(y + i), acc0);
+    }
+    return hsum_avx2(_mm256_add_pd(acc0, acc1)) + dot_scalar(x + i, y + i, n - i);
+}
+
+__attribute__((target("avx2,fma")))
+float dot_avx2(const float* x, const float* y, size_t n) {
+    __m256 acc0 = _mm256_setzero_ps(), acc1 = _mm256_setzero_ps();
+    size_t i = 0;
+    for (; i + 16 <= n; i += 16) {
+        acc0 = _mm256_fmadd_ps(_mm256_loadu_ps(x + i), _mm256_loadu_ps(y + i), acc0);
+        acc1 = _mm256_fmadd_ps(_mm256_loadu_ps(x + i + 8), _mm256_loadu_ps(y + i + 8), acc1);
+    }
+    for (; i + 8 <= n; i += 8) {
+        acc0 = _mm256_fmadd_ps(_mm256_loadu_ps(x + i), _mm256_loadu_ps(y + i), acc0);
+    }
+    return hsum_avx2(_mm256_add_ps(acc0, acc1)) + dot_scalar(x + i, y + i, n - i);
+}
+
+// The tail is handled with a masked load, so no scalar loop is needed.
+__attribute__((target("avx512f")))
+double squared_distance_avx512(const double* x, const double* y, size_t n) {
+    __m512d acc0 = _mm512_setzero_pd(), acc1 = _mm512_setzero_pd();
+    size_t i = 0;
+    for (; i + 16 <= n; i += 16) {
+        __m512d d0 = _mm512_sub_pd(_mm512_loadu_pd(x + i), _mm512_loadu_pd(y + i));
+        __m512d d1 = _mm512_sub_pd(_mm512_loadu_pd(x + i + 8), _mm512_loadu_pd(y + i + 8));
+        acc0 = _mm512_fmadd_pd(d0, d0, acc0);
+        acc1 = _mm512_fmadd_pd(d1, d1, acc1);
+    }
+    for (; i < n; i += 8) {
+        __mmask8 mask = (n - i >= 8 ? 0xFF : static_cast<__mmask8>((1u << (n - i)) - 1));
+        __m512d d0 = _mm512_sub_pd(_mm512_maskz_loadu_pd(mask, x + i), _mm512_maskz_loadu_pd(mask, y + i));
+        acc0 = _mm512_fmadd_pd(d0, d0, acc0);
+    }
+    return _mm512_reduce_add_pd(_mm512_add_pd(acc0, acc1));
+}
+
+__attribute__((target("avx512f")))
+float squared_distance_avx512(const float* x, const float* y, size_t n) {
+    __m512 acc0 = _mm512_setzero_ps(), acc1 = _mm512_setzero_ps();
+    size_t i = 0;
+    for (; i + 32 <= n; i += 32) {
+        __m512 d0 = _mm512_sub_ps(_mm512_loadu_ps(x + i), _mm512_loadu_ps(y + i));
+        __m512 d1 = _mm512_sub_ps(_mm512_loadu_ps(x + i + 16), _mm512_loadu_ps(y + i + 16));
+        acc0 = _mm512_fmadd_ps(d0, d0, acc0);
+        acc1 = _mm512_fmadd_ps(d1, d1, acc1);
+    }
+    for (; i < n; i += 16) {
+        __mmask16 mask = (n - i >= 16 ? 0xFFFF : static_cast<__mmask16>((1u << (n - i)) - 1));
+        __m512 d0 = _mm512_sub_ps(_mm512_maskz_loadu_ps(mask, x + i), _mm512_maskz_loadu_ps(mask, y + i));
+        acc0 = _mm512_fmadd_ps(d0, d0, acc0);
+    }
+    return _mm512_reduce_add_ps(_mm512_add_ps(acc0, acc1));
+}
+
+__attribute__((target("avx512f")))
+double dot_avx512(const double* x, const double* y, size_t n) {
+    __m512d acc0 = _mm512_setzero_pd(), acc1 = _mm512_setzero_pd();
+    size_t i = 0;
+    for (; i + 16 <= n; i += 16) {
+        acc0 = _mm512_fmadd_pd(_mm512_loadu_pd(x + i), _mm512_loadu_pd(y + i), acc0);
+        acc1 = _mm512_fmadd_pd(_mm512_loadu_pd(x + i + 8), _mm512_loadu_pd(y + i + 8), acc1);
+    }
+    for (; i < n; i += 8) {
+        __mmask8 mask = (n - i >= 8 ? 0xFF : static_cast<__mmask8>((1u << (n - i)) - 1));
+        acc0 = _mm512_fmadd_pd(_mm512_maskz_loadu_pd(mask, x + i), _mm512_maskz_loadu_pd(mask, y + i), acc0);
+    }
+    return _mm512_reduce_add_pd(_mm512_add_pd(acc0, acc1));
+}
+
+__attribute__((target("avx512f")))
+float dot_avx512(const float* x, const float* y, size_t n) {
+    __m512 acc0 = _mm512_setzero_ps(), acc1 = _mm512_setzero_ps();
+    size_t i = 0;
+    for (; i + 32 <= n; i += 32) {
+        acc0 = _mm512_fmadd_ps(_mm512_loadu_ps(x + i), _mm512_loadu_ps(y + i), acc0);
+        acc1 = _mm512_fmadd_ps(_mm512_loadu_ps(x + i + 16), _mm512_loadu_ps(y + i + 16), acc1);
+    }
+    for (; i < n; i += 16) {
+        __mmask16 mask = (n - i >= 16 ? 0xFFFF : static_cast<__mmask16>((1u << (n - i)) - 1));
+        acc0 = _mm512_fmadd_ps(_mm512_maskz_loadu_ps(mask, x + i), _mm512_maskz_loadu_ps(mask, y + i), acc0);
+    }
+    return _mm512_reduce_add_ps(_mm512_add_ps(acc0, acc1));
+}
+
+#endif
+
+// ARM (NEON).
+
+#ifdef SINGLER_SIMD_NEON
+
+double squared_distance_neon(const double* x, const double* y, size_t n) {
+    float64x2_t acc0 = vdupq_n_f64(0), acc1 = vdupq_n_f64(0);
+    size_t i = 0;
+    for (; i + 4 <= n; i += 4) {
+        float64x2_t d0 = vsubq_f64(vld1q_f64(x + i), vld1q_f64(y + i));
+        float64x2_t d1 = vsubq_f64(vld1q_f64(x + i + 2), vld1q_f64(y + i + 2));
+        acc0 = vfmaq_f64(acc0, d0, d0);
+        acc1 = vfmaq_f64(acc1, d1, d1);
+    }
+    double output = vaddvq_f64(vaddq_f64(acc0, acc1));
+    return output + squared_distance_scalar(x + i, y + i, n - i);
+}
+
+float squared_distance_neon(const float* x, const float* y, size_t n) {
+    float32x4_t acc0 = vdupq_n_f32(0), acc1 = vdupq_n_f32(0);
+    size_t i = 0;
+    for (; i + 8 <= n; i += 8) {
+        float32x4_t d0 = vsubq_f32(vld1q_f32(x + i), vld1q_f32(y + i));
+        float32x4_t d1 = vsubq_f32(vld1q_f32(x + i + 4), vld1q_f32(y + i + 4));
+        acc0 = vfmaq_f32(acc0, d0, d0);
+        acc1 = vfmaq_f32(acc1, d1, d1);
+    }
+    float output = vaddvq_f32(vaddq_f32(acc0, acc1));
+    return output + squared_distance_scalar(x + i, y + i, n - i);
+}
+
+double dot_neon(const double* x, const double* y, size_t n) {
+    float64x2_t acc0 = vdupq_n_f64(0), acc1 = vdupq_n_f64(0);
+    size_t i = 0;
+    for (; i + 4 <= n; i += 4) {
+        acc0 = vfmaq_f64(acc0, vld1q_f64(x + i), vld1q_f64(y + i));
+        acc1 = vfmaq_f64(acc1, vld1q_f64(x + i + 2), vld1q_f64(y + i + 2));
+    }
+    return vaddvq_f64(vaddq_f64(acc0, acc1)) + dot_scalar(x + i, y + i, n - i);
+}
+
+float dot_neon(const float* x, const float* y, size_t n) {
+    float32x4_t acc0 = vdupq_n_f32(0), acc1 = vdupq_n_f32(0);
+    size_t i = 0;
+    for (; i + 8 <= n; i += 8) {
+        acc0 = vfmaq_f32(acc0, vld1q_f32(x + i), vld1q_f32(y + i));
+        acc1 = vfmaq_f32(acc1, vld1q_f32(x + i + 4), vld1q_f32(y + i + 4));
+    }
+    return vaddvq_f32(vaddq_f32(acc0, acc1)) + dot_scalar(x + i, y + i, n - i);
+}
+
+#endif
+
+// Dispatch.
+
+bool is_supported(InstructionSet choice) {
+    switch (choice) {
+        case SCALAR:
+            return true;
+#ifdef SINGLER_SIMD_X86
+        case AVX2:
+            return __builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma");
+        case AVX512:
+            return __builtin_cpu_supports("avx512f");
+#endif
+#ifdef SINGLER_SIMD_NEON
+        case NEON:
+            return true;
+#endif
+        default:
+            return false;
+    }
+}
+
+template<typename T>
+struct Kernels {
+    T (*squared_distance)(const T*, const T*, size_t);
+    T (*dot)(const T*, const T*, size_t);
+};
+
+template<typename T>
+Kernels<T> choose_kernels(InstructionSet choice) {
+    switch (choice) {
+#ifdef SINGLER_SIMD_X86
+        case AVX2:
+            return Kernels<T>{ squared_distance_avx2, dot_avx2 };
+        case AVX512:
+            return Kernels<T>{ squared_distance_avx512, dot_avx512 };
+#endif
+#ifdef SINGLER_SIMD_NEON
+        case NEON:
+            return Kernels<T>{ squared_distance_neon, dot_neon };
+#endif
+        default:
+            return Kernels<T>{ squared_distance_scalar<T>, dot_scalar<T> };
+    }
+}
+
+struct Dispatcher {
+    std::atomic<InstructionSet> chosen;
+    std::atomic<const Kernels<double>*> double_kernels;
+    std::atomic<const Kernels<float>*> float_kernels;
+    Kernels<double> all_double[4];
+    Kernels<float> all_float[4];
+
+    Dispatcher() {
+#ifdef SINGLER_SIMD_X86
+        __builtin_cpu_init();
+#endif
+        for (int i = 0; i < 4; ++i) {
+            all_double[i] = choose_kernels<double>(static_cast<InstructionSet>(i));
+            all_float[i] = choose_kernels<float>(static_cast<InstructionSet>(i));
+        }
+        set(SCALAR);
+
+        // The SINGLER_SIMD environment variable can be used to force a less
+        // capable instruction set, e.g., for debugging or benchmarking.
+        const char* env = std::getenv("SINGLER_SIMD");
+        if (env != NULL) {
+            if (std::strcmp(env, "avx512") == 0) {
+                set(AVX512);
+                return;
+            } else if (std::strcmp(env, "avx2") == 0) {
+                set(AVX2);
+                return;
+            } else if (std::strcmp(env, "neon") == 0) {
+                set(NEON);
+                return;
+            } else if (std::strcmp(env, "scalar") == 0) {
+                return;
+            }
+        }
+
+        set(AVX512) || set(AVX2) || set(NEON);
+    }
+
+    bool set(InstructionSet choice) {
+        if (!is_supported(choice)) {
+            return false;
+        }
+        double_kernels = all_double + choice;
+        float_kernels = all_float + choice;
+        chosen = choice;
+        return true;
+    }
+};
+
+Dispatcher dispatcher;
+
+}
+
+InstructionSet get_instruction_set() {
+    return dispatcher.chosen.load(std::memory_order_relaxed);
+}
+
+bool set_instruction_set(InstructionSet choice) {
+    return dispatcher.set(choice);
+}
+
+double squared_distance(const double* x, const double* y, size_t n) {
+    return dispatcher.double_kernels.load(std::memory_order_relaxed)->squared_distance(x, y, n);
+}
+
+float squared_distance(const float* x, const float* y, size_t n) {
+    return dispatcher.float_kernels.load(std::memory_order_relaxed)->squared_distance(x, y, n);
+}
+
+double dot(const double* x, const double* y, size_t n) {
+    return dispatcher.double_kernels.load(std::memory_order_relaxed)->dot(x, y, n);
+}
+
+float dot(const float* x, const float* y, size_t n) {
+    return dispatcher.float_kernels.load(std::memory_order_relaxed)->dot(x, y, n);
+}
+
+}
+
+}
+
+//[[export]]
+int32_t get_simd_instruction_set() {
+    return singler::simd::get_instruction_set();
+}
+
+//[[export]]
+uint8_t set_simd_instruction_set(int32_t choice) {
+    return singler::simd::set_instruction_set(static_cast<singler::simd::InstructionSet>(choice));
+}
+
+//[[export]]
+double simd_squared_distance(int32_t n, const double* x /** numpy */, const double* y /** numpy */) {
+    return singler::simd::squared_distance(x, y, n);
+}
+
+//[[export]]
+float simd_squared_distance_float(int32_t n, const float* x /** numpy */, const float* y /** numpy */) {
+    return singler::simd::squared_distance(x, y, n);
+}
+
+//[[export]]
+double simd_dot(int32_t n, const double* x /** numpy */, const double* y /** numpy */) {
+    return singler::simd::dot(x, y, n);
+}
+
+//[[export]]
+float simd_dot_float(int32_t n, const float* x /** numpy */, const float* y /** numpy */) {
+    return singler::simd::dot(x, y, n);
+}
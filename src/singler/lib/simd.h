@@ -0,0 +1,124 @@
+#ifndef SIMD_H
+#define SIMD_H
+
+#include "knncolle/knncolle.hpp"
+
+#include <cstddef>
+#include <cstdint>
+#include <cmath>
+#include <type_traits>
+
+namespace singler {
+
+namespace simd {
+
+// Instruction sets for the distance kernels. The best set supported by the
+// CPU is selected when the library is loaded, see simd.cpp.
+enum InstructionSet : int32_t {
+    SCALAR = 0,
+    AVX2 = 1,
+    AVX512 = 2,
+    NEON = 3
+};
+
+InstructionSet get_instruction_set();
+
+// Returns false if the instruction set is not supported by this CPU or build,
+// in which case the current kernels are left unchanged.
+bool set_instruction_set(InstructionSet choice);
+
+double squared_distance(const double* x, const double* y, size_t n);
+
+float squared_distance(const float* x, const float* y, size_t n);
+
+double dot(const double* x, const double* y, size_t n);
+
+float dot(const float* x, const float* y, size_t n);
+
+template<typename T>
+constexpr bool has_kernel = std::is_same<T, double>::value || std::is_same<T, float>::value;
+
+}
+
+// Drop-in replacement for knncolle::distances::Euclidean that uses the
+// dispatched kernels for the exact search. As the scaled ranks have a fixed
+// norm, the Euclidean distance is a monotonic transformation of the Spearman
+// correlation, so this is the innermost loop of the search for each label.
+struct SimdEuclidean {
+    template<typename DTYPE = double, typename XTYPE, typename YTYPE, typename ITYPE>
+    static DTYPE raw_distance(const XTYPE* x, const YTYPE* y, ITYPE n) {
+        if constexpr (std::is_same<XTYPE, YTYPE>::value && simd::has_kernel<XTYPE>) {
+            return simd::squared_distance(x, y, static_cast<size_t>(n));
+        } else {
+            return knncolle::distances::Euclidean::template raw_distance<ITYPE, DTYPE>(x, y, n);
+        }
+    }
+
+    template<typename DTYPE = double>
+    static DTYPE normalize(DTYPE raw) {
+        return std::sqrt(raw);
+    }
+};
+
+template<typename INDEX_t = int, typename DISTANCE_t = double>
+using KmknnSimd = knncolle::Kmknn<SimdEuclidean, INDEX_t, DISTANCE_t>;
+
+// Same for Annoy, which stores the scaled ranks in single precision. The
+// margins are also computed with our kernels when traversing the trees.
+struct SimdAnnoyEuclidean : public ::Annoy::Euclidean {
+    template<typename S, typename T>
+    static inline T distance(const Node<S, T>* x, const Node<S, T>* y, int f) {
+        if constexpr (simd::has_kernel<T>) {
+            return simd::squared_distance(x->v, y->v, static_cast<size_t>(f));
+        } else {
+            return ::Annoy::Euclidean::distance(x, y, f);
+        }
+    }
+
+    template<typename S, typename T>
+    static inline T margin(const Node<S, T>* n, const T* y, int f) {
+        if constexpr (simd::has_kernel<T>) {
+            return n->a + simd::dot(n->v, y, static_cast<size_t>(f));
+        } else {
+            return ::Annoy::Euclidean::margin(n, y, f);
+        }
+    }
+};
+
+template<typename INDEX_t = int, typename DISTANCE_t = double>
+using AnnoySimd = knncolle::Annoy<SimdAnnoyEuclidean, INDEX_t, DISTANCE_t>;
+
+// Same for HNSW, which also stores the scaled ranks in single precision.
+class SimdHnswEuclidean : public hnswlib::SpaceInterface<float> {
+    size_t data_size, dim;
+
+    static float distance(const void* x, const void* y, const void* n) {
+        return simd::squared_distance(static_cast<const float*>(x), static_cast<const float*>(y), *static_cast<const size_t*>(n));
+    }
+
+public:
+    SimdHnswEuclidean(size_t ndim) : data_size(ndim * sizeof(float)), dim(ndim) {}
+
+    size_t get_data_size() {
+        return data_size;
+    }
+
+    hnswlib::DISTFUNC<float> get_dist_func() {
+        return distance;
+    }
+
+    void* get_dist_func_param() {
+        return &dim;
+    }
+
+    static float normalize(float raw) {
+        return std::sqrt(raw);
+    }
+};
+
+template<typename INDEX_t = int, typename DISTANCE_t = double>
+using HnswSimd = knncolle::Hnsw<SimdHnswEuclidean, INDEX_t, DISTANCE_t>;
+
+}
+
+#endif
@@ -0,0 +1,254 @@
+#include "utils.h" // must be before raticate, singlepp includes.
+
+#include <vector>
+#include <cstdint>
+#include <cmath>
+#include <limits>
+#include <algorithm>
+#include <map>
+#include <unordered_map>
+
+namespace {
+
+// Same as singlepp::correlations_to_scores(), but for correlations that are
+// already sorted in increasing order, so they can be re-used for any quantile.
+double sorted_correlations_to_score(const std::vector<double>& correlations, double quantile) {
+    const size_t ncells = correlations.size();
+    if (ncells == 0) {
+        return std::numeric_limits<double>::quiet_NaN();
+    } else if (quantile == 1 || ncells == 1) {
+        return correlations.back();
+    }
+
+    const double denom = ncells - 1;
+    const double prod = denom * quantile;
+    const size_t left = std::floor(prod);
+    const size_t right = std::ceil(prod);
+    const double rightval = correlations[right];
+    if (right == left) {
+        return rightval;
+    }
+
+    const double leftval = correlations[left];
+    const double leftweight = right - prod;
+    const double rightweight = prod - left;
+    return rightval * rightweight + leftval * leftweight;
+}
+
+// Same as singlepp::FineTuner, except that the correlations for each set of
+// labels in use are cached for the current cell. The correlations only depend
+// on the labels in use, so they can be re-used across quantiles and thresholds.
+class CachedFineTuner {
+    std::vector<int> labels_in_use;
+
+    std::map<std::vector<int>, std::vector<std::vector<double> > > cache;
+
+    std::unordered_map<int, int> gene_subset;
+
+    std::vector<double> scaled_left, scaled_right;
+
+    singlepp::RankedVector<double, int> input_sub;
+
+    singlepp::RankedVector<int, int> ref_sub;
+
+    const std::vector<std::vector<double> >& correlations(
+        const singlepp::RankedVector<double, int>& input,
+        const std::vector<singlepp::Reference>& ref,
+        const singlepp::Markers& markers)
+    {
+        auto it = cache.find(labels_in_use);
+        if (it != cache.end()) {
+            return it->second;
+        }
+
+        gene_subset.clear();
+        gene_subset.reserve(input.size());
+        for (auto l : labels_in_use) {
+            for (auto l2 : labels_in_use){
+                for (auto c : markers[l][l2]) {
+                    if (gene_subset.find(c) == gene_subset.end()) {
+                        const int counter = gene_subset.size();
+                        gene_subset[c] = counter;
+                    }
+                }
+            }
+        }
+
+        input_sub.clear();
+        singlepp::subset_ranks(input, input_sub, gene_subset);
+        scaled_left.resize(gene_subset.size());
+        singlepp::scaled_ranks(input_sub, scaled_left.data());
+        scaled_right.resize(gene_subset.size());
+
+        std::vector<std::vector<double> > output(labels_in_use.size());
+        for (size_t i = 0; i < labels_in_use.size(); ++i) {
+            const auto& curref = ref[labels_in_use[i]];
+            size_t NC = curref.index->nobs();
+            auto& current = output[i];
+            current.reserve(NC);
+
+            for (size_t c = 0; c < NC; ++c) {
+                ref_sub.clear();
+                singlepp::subset_ranks(curref.ranked[c], ref_sub, gene_subset);
+                singlepp::scaled_ranks(ref_sub, scaled_right.data());
+                current.push_back(singlepp::distance_to_correlation(scaled_left.size(), scaled_left, scaled_right));
+            }
+            std::sort(current.begin(), current.end());
+        }
+
+        return cache.emplace(labels_in_use, std::move(output)).first->second;
+    }
+
+public:
+    void clear() {
+        cache.clear();
+    }
+
+    std::pair<int, double> run(
+        const singlepp::RankedVector<double, int>& input,
+        const std::vector<singlepp::Reference>& ref,
+        const singlepp::Markers& markers,
+        std::vector<double>& scores,
+        double quantile,
+        double threshold)
+    {
+        if (scores.size() <= 1) {
+            return std::make_pair(0, std::numeric_limits<double>::quiet_NaN());
+        }
+
+        auto candidate = singlepp::fill_labels_in_use(scores, threshold, labels_in_use);
+        if (labels_in_use.size() == 1 || labels_in_use.size() == ref.size()) {
+            return candidate;
+        }
+
+        while (labels_in_use.size() > 1) {
+            const auto& all_correlations = correlations(input, ref, markers);
+            scores.clear();
+            for (const auto& current : all_correlations) {
+                scores.push_back(sorted_correlations_to_score(current, quantile));
+            }
+
+            candidate = singlepp::replace_labels_in_use(scores, threshold, labels_in_use);
+            if (labels_in_use.size() == scores.size()) { // i.e., unchanged.
+                break;
+            }
+        }
+
+        return candidate;
+    }
+};
+
+}
+
+//[[export]]
+void sweep_single_reference(
+    void* mat,
+    const int32_t* subset /** numpy */,
+    void* prebuilt,
+    int32_t nquantiles,
+    const double* quantiles /** numpy */,
+    int32_t nthresholds,
+    const double* thresholds /** numpy */,
+    uint8_t use_fine_tune,
+    int32_t nthreads,
+    const uintptr_t* scores /** void_p */,
+    const uintptr_t* best /** void_p */,
+    const uintptr_t* delta /** void_p */,
+    void* monitor)
+{
+    auto mptr = reinterpret_cast<const Mattress*>(mat);
+    auto bptr = reinterpret_cast<const singlepp::BasicBuilder::Prebuilt*>(prebuilt);
+    const auto& ref = bptr->references;
+    const size_t NL = ref.size();
+    const size_t num_subset = bptr->subset.size();
+
+    // Only the nearest neighbors for the smallest quantile need to be found,
+    // as the scores for larger quantiles use a subset of those neighbors.
+    std::vector<std::vector<int> > search_k(nquantiles, std::vector<int>(NL));
+    std::vector<std::vector<std::pair<double, double> > > coeffs(nquantiles, std::vector<std::pair<double, double> >(NL));
+    std::vector<int> max_k(NL);
+    for (int32_t q = 0; q < nquantiles; ++q) {
+        for (size_t r = 0; r < NL; ++r) {
+            double denom = ref[r].index->nobs() - 1;
+            double prod = denom * (1 - quantiles[q]);
+            auto k = std::ceil(prod) + 1;
+            search_k[q][r] = k;
+            coeffs[q][r].first = static_cast<double>(k - 1) - prod;
+            coeffs[q][r].second = prod - static_cast<double>(k - 2);
+            max_k[r] = std::max(max_k[r], search_k[q][r]);
+        }
+    }
+
+    std::vector<int> subcopy(subset, subset + num_subset);
+    singlepp::SubsetSorter subsorted(subcopy);
+
+    singler::Monitor mon(monitor);
+    singler::MonitorScope scope(mon);
+
+    singler::parallelize([&](size_t, int start, int length) -> void {
+        auto wrk = tatami::consecutive_extractor<false, false>(mptr->ptr.get(), start, length, subsorted.extraction_subset());
+        singlepp::RankedVector<double, int> vec(num_subset);
+        std::vector<double> buffer(num_subset);
+
+        CachedFineTuner ft;
+        std::vector<std::vector<double> > nearest(NL);
+        std::vector<double> basescores(NL), curscores(NL);
+
+        for (int c = start, end = start + length; c < end; ++c) {
+            auto ptr = wrk->fetch(c, buffer.data());
+            subsorted.fill_ranks(ptr, vec);
+            singlepp::scaled_ranks(vec, buffer.data());
+            ft.clear();
+
+            // Correlations to the nearest neighbors, in decreasing order.
+            for (size_t r = 0; r < NL; ++r) {
+                auto current = ref[r].index->find_nearest_neighbors(buffer.data(), max_k[r]);
+                auto& cors = nearest[r];
+                cors.clear();
+                for (const auto& x : current) {
+                    cors.push_back(1 - 2 * x.second * x.second);
+                }
+            }
+
+            for (int32_t q = 0; q < nquantiles; ++q) {
+                for (size_t r = 0; r < NL; ++r) {
+                    size_t k = search_k[q][r];
+                    const auto& cors = nearest[r];
+                    if (k == 1) {
+                        basescores[r] = cors[0];
+                    } else {
+                        basescores[r] = coeffs[q][r].first * cors[k - 2] + coeffs[q][r].second * cors[k - 1];
+                    }
+
+                    auto sptr = reinterpret_cast<double*>(scores[q * NL + r]);
+                    if (sptr) {
+                        sptr[c] = basescores[r];
+                    }
+                }
+
+                for (int32_t t = 0; t < nthresholds; ++t) {
+                    auto bestptr = reinterpret_cast<int32_t*>(best[q * nthresholds + t]);
+                    auto deltaptr = reinterpret_cast<double*>(delta[q * nthresholds + t]);
+
+                    if (!use_fine_tune) {
+                        auto top = std::max_element(basescores.begin(), basescores.end());
+                        bestptr[c] = top - basescores.begin();
+                        if (NL > 1) {
+                            curscores = basescores;
+                            auto curtop = curscores.begin() + bestptr[c];
+                            *curtop = -100;
+                            deltaptr[c] = *top - *std::max_element(curscores.begin(), curscores.end());
+                        } else {
+                            deltaptr[c] = std::numeric_limits<double>::quiet_NaN();
+                        }
+                    } else {
+                        curscores = basescores;
+                        auto tuned = ft.run(vec, ref, bptr->markers, curscores, quantiles[q], thresholds[t]);
+                        bestptr[c] = tuned.first;
+                        deltaptr[c] = tuned.second;
+                    }
+                }
+            }
+        }
+    }, mptr->ptr->ncol(), nthreads);
+}
@@ -0,0 +1,41 @@
+#ifndef TOP_SCORES_H
+#define TOP_SCORES_H
+
+#include <algorithm>
+#include <cstdint>
+#include <utility>
+#include <vector>
+
+namespace singler {
+
+// Collects the indices and values of the 'k' largest scores for a cell, in
+// decreasing order of the scores. Ties are broken by the smaller index.
+struct TopScores {
+    TopScores(size_t k, size_t nlabels) : k(std::min(k, nlabels)), work(nlabels) {}
+
+    size_t k;
+    std::vector<std::pair<double, int32_t> > work;
+
+    // 'get(l)' should return the score for label 'l'.
+    template<class Get_>
+    void run(Get_ get, int32_t* labels, double* scores) {
+        size_t nlabels = work.size();
+        for (size_t l = 0; l < nlabels; ++l) {
+            work[l].first = get(l);
+            work[l].second = l;
+        }
+
+        std::partial_sort(work.begin(), work.begin() + k, work.end(), [](const auto& left, const auto& right) -> bool {
+            return left.first > right.first || (left.first == right.first && left.second < right.second);
+        });
+
+        for (size_t i = 0; i < k; ++i) {
+            labels[i] = work[i].second;
+            scores[i] = work[i].first;
+        }
+    }
+};
+
+}
+
+#endif
@@ -3,8 +3,10 @@
 
 #include "Mattress.h"
 
+#include "monitor.h"
+
 // must be before singlepp includes.
-#define SINGLEPP_CUSTOM_PARALLEL tatami::parallelize
+#define SINGLEPP_CUSTOM_PARALLEL singler::parallelize
 
 #include "singlepp/singlepp.hpp"
 
@@ -0,0 +1,195 @@
+from typing import Any, Optional, Sequence, Union
+
+from mattress import tatamize
+from numpy import arange, array, asfortranarray, int32, isnan, ndarray
+
+from . import _cpphelpers as lib
+from ._utils import (
+    _chunked_block_size,
+    _chunked_column_blocks,
+    _clean_matrix,
+    _create_map,
+    _is_chunked_array,
+    _is_compressed_sparse,
+    _mask_sparse_missing,
+    _sparse_marker_blocks,
+    _unpack_experiment,
+)
+from .build_integrated_references import IntegratedReferences
+from .build_single_reference import SinglePrebuiltReference
+from .thread_budget import _uses_thread_budget
+
+
+class RankedTestMatrix:
+    """Ranked expression values of a test dataset for the markers of one or
+    more references, typically created by
+    :py:meth:`~singler.rank_test_matrix.rank_test_matrix`. This can be used in
+    place of the test data in
+    :py:meth:`~singler.classify_single_reference.classify_single_reference` and
+    :py:meth:`~singler.classify_integrated_references.classify_integrated_references`,
+    so that each cell is only ranked once. This is intended for advanced users
+    only and should not be serialized.
+
+    Once created, the same object can be used for classification in multiple
+    Python threads at the same time.
+    """
+
+    def __init__(self, ptr, features: Sequence, mapping: Optional[dict] = None):
+        self._ptr = ptr
+        self._features = features
+        if mapping is None:
+            mapping = _create_map(features)
+        self._mapping = mapping
+
+    def __del__(self):
+        lib.free_ranked_test_matrix(self._ptr)
+
+    def num_cells(self) -> int:
+        """
+        Returns:
+            Number of cells in the test dataset.
+        """
+        return lib.get_ranked_test_matrix_ncol(self._ptr)
+
+    @property
+    def features(self) -> Sequence:
+        """
+        Returns:
+            Features for which ranks are available, usually as strings.
+        """
+        return self._features
+
+    def _subset_cells(self, cells: ndarray) -> "RankedTestMatrix":
+        cells = array(cells, dtype=int32)
+        return RankedTestMatrix(
+            lib.subset_ranked_test_matrix(self._ptr, len(cells), cells),
+            self._features,
+            mapping=self._mapping,
+        )
+
+    def _positions(self, features: Sequence) -> ndarray:
+        positions = ndarray((len(features),), dtype=int32)
+        for i, x in enumerate(features):
+            if x not in self._mapping:
+                raise KeyError("failed to find gene '" + str(x) + "' in the ranked test matrix")
+            positions[i] = self._mapping[x]
+        return positions
+
+
+@_uses_thread_budget
+def rank_test_matrix(
+    test_data: Any,
+    test_features: Sequence,
+    references: Sequence[Union[SinglePrebuiltReference, IntegratedReferences]],
+    assay_type: Union[str, int] = 0,
+    check_missing: bool = True,
+    num_threads: Optional[int] = None,
+) -> RankedTestMatrix:
+    """Rank the expression values of each cell in a test dataset, using the
+    union of markers across multiple references. The result can be re-used for
+    classification against each of those references, avoiding repeated ranking
+    of the same cells.
+
+    Args:
+        test_data:
+            A matrix-like object where each row is a feature and each column
+            is a test sample (usually a single cell), containing expression values.
+            This can be any input that is supported by
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+            Alternatively, a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`
+            containing such a matrix in one of its assays.
+
+        test_features:
+            Sequence of identifiers for each feature in the test
+            dataset, i.e., row in ``test_data``.
+
+            If ``test_data`` is a ``SummarizedExperiment``, ``test_features``
+            may be a string speciying the column name in `row_data` that contains the
+            features. Alternatively can be set to `None`, to use the `row_names` of
+            the experiment as used as features.
+
+        references:
+            Sequence of pre-built references created with
+            :py:meth:`~singler.build_single_reference.build_single_reference`
+            and/or integrated references created with
+            :py:meth:`~singler.build_integrated_references.build_integrated_references`.
+            Ranks are computed for the union of their markers.
+
+        assay_type:
+            Assay containing the expression matrix,
+            if `test_data` is a
+            :py:class:`~summarizedexperiment.SummarizedExperiment.SummarizedExperiment`.
+
+        check_missing:
+            Whether to check for and remove rows with missing (NaN) values
+            from ``test_data``.
+
+        num_threads:
+            Number of threads to use for ranking.
+            If None, threads are taken from the library-wide budget,
+            see :py:meth:`~singler.thread_budget.thread_budget`.
+
+    Returns:
+        Ranked test matrix for use in classification against any of ``references``.
+    """
+    test_data, test_features = _unpack_experiment(test_data, test_features, assay_type)
+    sparse = _is_compressed_sparse(test_data)
+    chunked = _is_chunked_array(test_data)
+
+    if sparse or chunked:
+        if test_data.shape[0] != len(test_features):
+            raise ValueError(
+                "number of rows of 'x' should be equal to the length of 'features'"
+            )
+        if check_missing and sparse:
+            test_features = _mask_sparse_missing(test_data, test_features)
+    else:
+        mat_ptr, test_features = _clean_matrix(
+            test_data,
+            test_features,
+            assay_type=assay_type,
+            check_missing=check_missing,
+            num_threads=num_threads,
+        )
+
+    mapping = _create_map(test_features)
+    rows = set()
+    for ref in references:
+        for x in ref.marker_subset():
+            if x not in mapping:
+                raise KeyError("failed to find gene '" + str(x) + "' in the test dataset")
+            rows.add(mapping[x])
+
+    rows = array(sorted(rows), dtype=int32)
+    output = RankedTestMatrix(
+        lib.create_ranked_test_matrix(len(rows)),
+        [test_features[r] for r in rows],
+    )
+
+    if not (sparse or chunked):
+        lib.add_to_ranked_test_matrix(output._ptr, mat_ptr.ptr, rows, num_threads)
+        return output
+
+    if sparse:
+        blocks = _sparse_marker_blocks(test_data, rows)
+    else:
+        blocks = (
+            (start, end, asfortranarray(block[rows, :]))
+            for start, end, block in _chunked_column_blocks(test_data, _chunked_block_size(test_data))
+        )
+
+    identity = arange(len(rows), dtype=int32)
+    for start, end, block in blocks:
+        if chunked and check_missing:
+            # Rows with NaNs would be removed, so any such marker is effectively missing.
+            missing = isnan(block).any(axis=1)
+            if missing.any():
+                x = test_features[rows[missing.argmax()]]
+                raise KeyError("failed to find gene '" + str(x) + "' in the test dataset")
+
+        block_ptr = tatamize(block)
+        lib.add_to_ranked_test_matrix(output._ptr, block_ptr.ptr, identity, num_threads)
+
+    return output
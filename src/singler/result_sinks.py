@@ -0,0 +1,260 @@
+import json
+from typing import Any, Literal, Optional
+
+import numpy
+
+
+class ResultSink:
+    """Destination for classification results that are written in chunks of
+    cells, e.g., with the ``sink`` argument of
+    :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+    The test dataset is classified ``chunk_size`` cells at a time and the
+    results for each chunk are passed to :py:meth:`~write`, so the results
+    for all cells are never held in memory at once.
+
+    Subclasses should implement :py:meth:`~write` and, if necessary,
+    :py:meth:`~close`. Sinks can be used as context managers, in which case
+    :py:meth:`~close` is called on exit.
+    """
+
+    def __init__(self, chunk_size: int = 10000):
+        """
+        Args:
+            chunk_size:
+                Number of cells to classify and write at a time.
+        """
+        if chunk_size <= 0:
+            raise ValueError("'chunk_size' should be positive")
+        self.chunk_size = chunk_size
+
+    def write(self, columns: dict, levels: dict):
+        """Write the results for the next chunk of cells.
+
+        Args:
+            columns:
+                Dictionary of the results for the current chunk of cells,
+                in the same order as the columns of the data frame that would
+                otherwise be returned. Each value is either a 1-dimensional
+                NumPy array with one entry per cell; a 2-dimensional NumPy
+                array where each row corresponds to a cell, e.g., ``top_scores``;
+                or a dictionary of 1-dimensional arrays for nested columns,
+                e.g., the ``scores`` for each label. These arrays are re-used
+                for subsequent chunks and should be copied if they need to
+                persist beyond this call.
+
+            levels:
+                Dictionary where each key is the name of a column in
+                ``columns`` containing integer codes, e.g., ``best``, and each
+                value is the list of levels for those codes. This is the same
+                for all chunks.
+        """
+        raise NotImplementedError("'write' should be implemented by subclasses")
+
+    def close(self):
+        """Finish writing the results. This is a no-op by default."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _to_arrow_table(columns: dict, levels: dict, score_layout: str):
+    import pyarrow
+
+    arrays = []
+    fields = []
+    for name, x in columns.items():
+        metadata = None
+        if isinstance(x, dict):
+            if score_layout == "wide":
+                for k, v in x.items():
+                    arrays.append(pyarrow.array(v))
+                    fields.append(pyarrow.field(name + "." + str(k), arrays[-1].type))
+                continue
+            x = numpy.column_stack(list(x.values()))
+            metadata = {"names": json.dumps([str(k) for k in columns[name]])}
+        elif name in levels:
+            metadata = {"levels": json.dumps([str(y) for y in levels[name]])}
+
+        if x.ndim == 2:
+            values = pyarrow.array(numpy.ascontiguousarray(x).ravel())
+            current = pyarrow.FixedSizeListArray.from_arrays(values, x.shape[1])
+        elif name in levels:
+            # Label codes are stored as a dictionary-encoded column.
+            current = pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array(x, type=pyarrow.int32()),
+                pyarrow.array([str(y) for y in levels[name]], type=pyarrow.string()),
+            )
+            metadata = None
+        else:
+            current = pyarrow.array(x)
+
+        arrays.append(current)
+        fields.append(pyarrow.field(name, current.type, metadata=metadata))
+
+    return pyarrow.Table.from_arrays(arrays, schema=pyarrow.schema(fields))
+
+
+class ArrowResultSink(ResultSink):
+    """Write classification results to an Arrow IPC file, with one record
+    batch per chunk of cells. Requires the **pyarrow** package.
+
+    Label codes like ``best`` are stored as dictionary-encoded string
+    columns. Other 2-dimensional results like ``top_scores`` are stored as
+    fixed-size lists, where the levels of any label codes are stored in the
+    ``levels`` metadata of the field.
+    """
+
+    def __init__(
+        self,
+        destination: Any,
+        score_layout: Literal["wide", "list"] = "wide",
+        chunk_size: int = 10000,
+    ):
+        """
+        Args:
+            destination:
+                Path to the output file, or any file-like object or
+                ``pyarrow.NativeFile`` that is supported by
+                ``pyarrow.ipc.new_file``.
+
+            score_layout:
+                How to store nested columns like ``scores``. If ``"wide"``,
+                each label (or reference) is stored in its own column, named
+                after the nested column and the label, e.g., ``scores.B cell``.
+                If ``"list"``, the scores for each cell are stored as a
+                fixed-size list, and the labels are stored in the ``names``
+                metadata of the field.
+
+            chunk_size:
+                Number of cells to classify and write at a time.
+        """
+        super().__init__(chunk_size)
+        if score_layout not in ("wide", "list"):
+            raise ValueError("'score_layout' should be either 'wide' or 'list'")
+        self._destination = destination
+        self._score_layout = score_layout
+        self._writer = None
+
+    def write(self, columns: dict, levels: dict):
+        import pyarrow.ipc
+
+        table = _to_arrow_table(columns, levels, self._score_layout)
+        if self._writer is None:
+            self._writer = pyarrow.ipc.new_file(self._destination, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ParquetResultSink(ResultSink):
+    """Write classification results to a Parquet file, with one row group
+    per chunk of cells. Requires the **pyarrow** package.
+
+    Columns are stored in the same manner as :py:class:`~ArrowResultSink`.
+    """
+
+    def __init__(
+        self,
+        destination: Any,
+        score_layout: Literal["wide", "list"] = "wide",
+        chunk_size: int = 10000,
+        **kwargs,
+    ):
+        """
+        Args:
+            destination:
+                Path to the output file, or any file-like object that is
+                supported by ``pyarrow.parquet.ParquetWriter``.
+
+            score_layout:
+                How to store nested columns like ``scores``,
+                see :py:class:`~ArrowResultSink`.
+
+            chunk_size:
+                Number of cells to classify and write at a time.
+
+            kwargs:
+                Further arguments to pass to ``pyarrow.parquet.ParquetWriter``,
+                e.g., ``compression``.
+        """
+        super().__init__(chunk_size)
+        if score_layout not in ("wide", "list"):
+            raise ValueError("'score_layout' should be either 'wide' or 'list'")
+        self._destination = destination
+        self._score_layout = score_layout
+        self._kwargs = kwargs
+        self._writer = None
+
+    def write(self, columns: dict, levels: dict):
+        import pyarrow.parquet
+
+        table = _to_arrow_table(columns, levels, self._score_layout)
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self._destination, table.schema, **self._kwargs)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ZarrResultSink(ResultSink):
+    """Write classification results to a Zarr group, where each column is
+    stored as an array that is extended with each chunk of cells. Requires
+    the **zarr** package.
+
+    Label codes like ``best`` are stored as int32 arrays with the levels in
+    the ``levels`` attribute. Nested columns like ``scores`` are stored as
+    2-dimensional arrays with one row per cell and one column per label (or
+    reference), where the labels are stored in the ``names`` attribute.
+    """
+
+    def __init__(self, store: Any, chunk_size: int = 10000):
+        """
+        Args:
+            store:
+                Path or store for the Zarr group, which is overwritten if it
+                already exists.
+
+            chunk_size:
+                Number of cells to classify and write at a time. This is also
+                used as the chunk length of the Zarr arrays.
+        """
+        super().__init__(chunk_size)
+        self._store = store
+        self._group = None
+
+    def write(self, columns: dict, levels: dict):
+        if self._group is None:
+            import zarr
+
+            self._group = zarr.open_group(self._store, mode="w")
+
+        for name, x in columns.items():
+            attrs = {}
+            if isinstance(x, dict):
+                attrs["names"] = [str(k) for k in x]
+                x = numpy.column_stack(list(x.values())) if len(x) else numpy.ndarray((0, 0))
+            if name in levels:
+                attrs["levels"] = [str(y) for y in levels[name]]
+
+            if name not in self._group:
+                arr = self._group.zeros(
+                    name=name,
+                    shape=(0,) + x.shape[1:],
+                    chunks=(self.chunk_size,) + x.shape[1:],
+                    dtype=x.dtype,
+                )
+                arr.attrs.update(attrs)
+            self._group[name].append(x, axis=0)
+
+    def close(self):
+        self._group = None
@@ -0,0 +1,296 @@
+"""Long-lived annotation server that keeps prebuilt references in memory.
+
+This can be started from the command line with::
+
+    python -m singler.serve --config references.json --port 8765
+
+or, for a UNIX domain socket::
+
+    python -m singler.serve --config references.json --socket /tmp/singler.sock
+
+The configuration file is a JSON object where each key is the name of a
+reference and each value is an object with a ``path`` to a NumPy ``.npz``
+file. Each file should contain ``data`` (a features-by-profiles matrix),
+``labels`` and ``features`` arrays. Any additional keys in the object are
+passed as arguments to
+:py:meth:`~singler.build_single_reference.build_single_reference`.
+
+Clients classify a dataset by sending a ``POST`` request to
+``/classify/<reference>`` where the body is an ``.npz`` payload containing
+``features`` and either a dense ``data`` matrix or the components of a
+:py:mod:`scipy.sparse` matrix as written by :py:func:`scipy.sparse.save_npz`.
+The response is another ``.npz`` payload containing the ``best`` label for
+each column, the ``delta``, the ``labels`` of the reference and a
+cells-by-labels matrix of ``scores``. If the classification arguments
+contain ``scores="topk"``, the ``scores`` are replaced by the ``top_labels``
+and ``top_scores`` matrices; with ``scores="none"``, they are omitted.
+``GET /references`` returns a JSON
+listing of the loaded references.
+"""
+
+import argparse
+import io
+import json
+import os
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from typing import Optional, Sequence
+from urllib.parse import unquote
+
+import numpy
+
+from .build_single_reference import SinglePrebuiltReference, build_single_reference
+from .classify_single_reference import classify_single_reference
+
+
+def load_references(config: dict, num_threads: int = 1) -> dict[str, SinglePrebuiltReference]:
+    """Build all references in a server configuration.
+
+    Args:
+        config:
+            Dictionary where each key is the name of a reference and each
+            value is a dictionary containing the ``path`` to a ``.npz`` file,
+            see the module documentation for details. Paths are interpreted
+            relative to the current working directory.
+
+        num_threads:
+            Number of threads to use for building each reference.
+
+    Returns:
+        Dictionary of prebuilt references, keyed by name.
+    """
+    output = {}
+    for name, spec in config.items():
+        args = dict(spec)
+        path = args.pop("path")
+        with numpy.load(path, allow_pickle=False) as handle:
+            ref_data = handle["data"]
+            ref_labels = [str(x) for x in handle["labels"]]
+            ref_features = [str(x) for x in handle["features"]]
+
+        output[name] = build_single_reference(
+            ref_data,
+            ref_labels=ref_labels,
+            ref_features=ref_features,
+            num_threads=num_threads,
+            **args,
+        )
+    return output
+
+
+def _decode_payload(body: bytes):
+    with numpy.load(io.BytesIO(body), allow_pickle=False) as handle:
+        features = [str(x) for x in handle["features"]]
+        if "format" in handle:
+            import scipy.sparse
+
+            fmt = handle["format"].item()
+            if isinstance(fmt, bytes):
+                fmt = fmt.decode("ascii")
+            shape = tuple(handle["shape"])
+            components = (handle["data"], handle["indices"], handle["indptr"])
+            if fmt == "csr":
+                data = scipy.sparse.csr_matrix(components, shape=shape)
+            elif fmt == "csc":
+                data = scipy.sparse.csc_matrix(components, shape=shape)
+            else:
+                raise ValueError("unsupported sparse format '" + fmt + "'")
+        else:
+            data = handle["data"]
+    return data, features
+
+
+def _encode_results(results, labels: Sequence) -> bytes:
+    payload = {
+        "best": numpy.array(results.column("best"), dtype=str),
+        "delta": results.column("delta"),
+        "labels": numpy.array(labels, dtype=str),
+    }
+
+    # Scores may be reduced or omitted via the 'scores' classification argument.
+    columns = results.column_names
+    if "scores" in columns:
+        scores = results.column("scores")
+        payload["scores"] = numpy.column_stack([scores.column(lab) for lab in labels])
+    for col in ["top_labels", "top_scores"]:
+        if col in columns:
+            payload[col] = results.column(col)
+
+    buffer = io.BytesIO()
+    numpy.savez(buffer, **payload)
+    return buffer.getvalue()
+
+
+class _AnnotationHandler(BaseHTTPRequestHandler):
+    def _reply(self, code: int, body: bytes, content_type: str):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code: int, message: str):
+        self._reply(code, json.dumps({"error": message}).encode("utf-8"), "application/json")
+
+    def address_string(self):
+        # client_address is an empty string for UNIX domain sockets.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/references":
+            self._error(404, "unknown endpoint '" + self.path + "'")
+            return
+
+        listing = {}
+        for name, ref in self.server.references.items():
+            listing[name] = {
+                "labels": list(ref.labels),
+                "num_markers": ref.num_markers(),
+            }
+        self._reply(200, json.dumps(listing).encode("utf-8"), "application/json")
+
+    def do_POST(self):
+        prefix = "/classify/"
+        if not self.path.startswith(prefix):
+            self._error(404, "unknown endpoint '" + self.path + "'")
+            return
+
+        name = unquote(self.path[len(prefix) :])
+        if name not in self.server.references:
+            self._error(404, "unknown reference '" + name + "'")
+            return
+        ref = self.server.references[name]
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        try:
+            data, features = _decode_payload(body)
+            results = classify_single_reference(
+                data,
+                test_features=features,
+                ref_prebuilt=ref,
+                num_threads=self.server.num_threads,
+                **self.server.classify_args,
+            )
+        except (KeyError, ValueError) as e:
+            self._error(400, str(e))
+            return
+        except Exception as e:
+            # Any other failure is reported to the client instead of dropping
+            # the connection, and the server continues to handle requests.
+            self.log_error("classification failed: %r", e)
+            self._error(500, str(e))
+            return
+
+        self._reply(200, _encode_results(results, ref.labels), "application/octet-stream")
+
+
+def create_server(
+    references: dict[str, SinglePrebuiltReference],
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: Optional[str] = None,
+    classify_args: dict = {},
+    num_threads: int = 1,
+    quiet: bool = False,
+    threaded: bool = False,
+) -> socketserver.BaseServer:
+    """Create a server for classification against a set of warm references.
+
+    Args:
+        references:
+            Dictionary of prebuilt references, typically created by
+            :py:meth:`~load_references`.
+
+        host:
+            Host to bind to. Only used if ``socket_path`` is None.
+
+        port:
+            Port to bind to. Only used if ``socket_path`` is None.
+            This may be zero to pick any available port.
+
+        socket_path:
+            Path to a UNIX domain socket to listen on.
+            If None, the server listens on ``host`` and ``port`` instead.
+
+        classify_args:
+            Further arguments to pass to
+            :py:meth:`~singler.classify_single_reference.classify_single_reference`.
+
+        num_threads:
+            Number of threads to use for each classification.
+
+        quiet:
+            Whether to suppress logging of each request.
+
+        threaded:
+            Whether to handle each request in a separate thread. All threads
+            share the same copy of each reference in ``references``.
+
+    Returns:
+        A server object. Requests are handled by calling its
+        ``serve_forever()`` method, and it can be stopped with ``shutdown()``.
+    """
+    if socket_path is not None:
+        if threaded:
+            server = socketserver.ThreadingUnixStreamServer(socket_path, _AnnotationHandler)
+            server.daemon_threads = True
+        else:
+            server = socketserver.UnixStreamServer(socket_path, _AnnotationHandler)
+    elif threaded:
+        server = ThreadingHTTPServer((host, port), _AnnotationHandler)
+    else:
+        server = HTTPServer((host, port), _AnnotationHandler)
+
+    server.references = references
+    server.classify_args = classify_args
+    server.num_threads = num_threads
+    server.quiet = quiet
+    return server
+
+
+def main(args: Optional[Sequence[str]] = None):
+    """Command-line entrypoint for ``python -m singler.serve``."""
+    parser = argparse.ArgumentParser(description="Serve SingleR classifications against warm references.")
+    parser.add_argument("--config", required=True, help="JSON file describing the references to load.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on.")
+    parser.add_argument("--socket", default=None, help="UNIX domain socket to listen on, instead of a port.")
+    parser.add_argument("--num-threads", type=int, default=1, help="Number of threads for building and classification.")
+    parser.add_argument("--quiet", action="store_true", help="Do not log each request.")
+    parser.add_argument("--threaded", action="store_true", help="Handle each request in a separate thread.")
+    parsed = parser.parse_args(args)
+
+    with open(parsed.config, "r") as handle:
+        config = json.load(handle)
+
+    references = load_references(config, num_threads=parsed.num_threads)
+    server = create_server(
+        references,
+        host=parsed.host,
+        port=parsed.port,
+        socket_path=parsed.socket,
+        num_threads=parsed.num_threads,
+        quiet=parsed.quiet,
+        threaded=parsed.threaded,
+    )
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if parsed.socket is not None and os.path.exists(parsed.socket):
+            os.remove(parsed.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from . import _cpphelpers as lib
+
+_INSTRUCTION_SETS = ["scalar", "avx2", "avx512", "neon"]
+
+
+def get_simd_instruction_set() -> str:
+    """Get the instruction set used by the native kernels for the distance
+    (i.e., Spearman correlation) calculations in the nearest-neighbor search
+    of :py:meth:`~singler.classify_single_reference.classify_single_reference`
+    and friends.
+
+    The best instruction set supported by the CPU is selected when the native
+    library is loaded. This can be overridden by setting the ``SINGLER_SIMD``
+    environment variable to one of the values below before ``singler``'s
+    functions are first used, or with :py:meth:`~set_simd_instruction_set`.
+
+    Returns:
+        One of ``"avx512"`` or ``"avx2"`` on x86-64 CPUs with the AVX-512F or
+        AVX2/FMA instructions, respectively; ``"neon"`` on ARM64 CPUs; or
+        ``"scalar"`` for the portable fallback.
+    """
+    return _INSTRUCTION_SETS[lib.get_simd_instruction_set()]
+
+
+def set_simd_instruction_set(instruction_set: str) -> str:
+    """Set the instruction set used by the native distance kernels. This
+    affects all subsequent calls in all threads, and is mostly useful for
+    debugging and benchmarking, e.g., to compare against ``"scalar"``.
+
+    Results may differ between instruction sets by floating-point round-off,
+    as the vectorized kernels sum the squared differences in a different
+    order. This can occasionally change the chosen label for cells with
+    near-identical scores.
+
+    Args:
+        instruction_set:
+            Name of the instruction set, see
+            :py:meth:`~get_simd_instruction_set` for possible values.
+
+    Returns:
+        The name of the previous instruction set, which can be passed to this
+        function to restore it.
+    """
+    if instruction_set not in _INSTRUCTION_SETS:
+        raise ValueError("'instruction_set' should be one of " + ", ".join(repr(x) for x in _INSTRUCTION_SETS))
+    previous = get_simd_instruction_set()
+    if not lib.set_simd_instruction_set(_INSTRUCTION_SETS.index(instruction_set)):
+        raise ValueError("instruction set '" + instruction_set + "' is not supported on this CPU")
+    return previous
@@ -0,0 +1,198 @@
+import functools
+import inspect
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+# The limit can be overridden by thread_budget(), otherwise it is determined
+# from the environment variable or the available CPUs on each request.
+_budget_lock = threading.Lock()
+_budget_released = threading.Condition(_budget_lock)
+_budget_override = None
+_budget_max_per_call = None
+_budget_in_use = 0
+_budget_leases = 0
+_budget_waiting = 0
+
+# Whether the current thread is already inside a call that holds a lease.
+_lease_holder = threading.local()
+
+
+def _cgroup_cpu_limit() -> Optional[int]:
+    # cgroup v2 reports "<quota> <period>" or "max <period>".
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as handle:
+            quota, period = handle.read().split()[:2]
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1 reports the quota and period separately, with a quota of -1 if unlimited.
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as handle:
+            quota = int(handle.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as handle:
+            period = int(handle.read())
+        if quota > 0 and period > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _available_cpus() -> int:
+    # Cached as reading the cgroup files takes longer than most small calls.
+    if hasattr(os, "sched_getaffinity"):
+        available = len(os.sched_getaffinity(0))
+    else:
+        available = os.cpu_count() or 1
+
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        available = min(available, limit)
+    return max(1, available)
+
+
+def get_thread_budget() -> int:
+    """Get the total number of threads available to all functions that are
+    called with ``num_threads = None``.
+
+    Returns:
+        The number of threads set by the innermost :py:meth:`~thread_budget`
+        context, if any. Otherwise, the value of the ``SINGLER_NUM_THREADS``
+        environment variable, if set. Otherwise, the number of CPUs that are
+        available to this process, accounting for CPU affinity and cgroup
+        quotas, e.g., in containers.
+    """
+    if _budget_override is not None:
+        return _budget_override
+
+    env = os.environ.get("SINGLER_NUM_THREADS")
+    if env is not None and env.strip() != "":
+        try:
+            value = int(env)
+        except ValueError:
+            raise ValueError("'SINGLER_NUM_THREADS' should be a positive integer")
+        if value <= 0:
+            raise ValueError("'SINGLER_NUM_THREADS' should be a positive integer")
+        return value
+
+    return _available_cpus()
+
+
+@contextmanager
+def thread_budget(num_threads: int, max_per_call: Optional[int] = None):
+    """Context manager to set the total number of threads that are shared by
+    all functions called with ``num_threads = None``. This applies to the
+    entire process, not just the current thread.
+
+    Each function call borrows threads from the budget for its duration, so
+    concurrent calls (e.g., from multiple Python threads or asynchronous
+    tasks) split the budget between them instead of each using all threads.
+    A call that runs alone borrows the entire budget. Otherwise, each call
+    borrows an even share of the budget between the calls that are running
+    or waiting for threads, and waits if no threads are left until another
+    call returns its threads. Calls with an explicit integer ``num_threads``
+    are not affected by the budget.
+
+    Args:
+        num_threads:
+            Total number of threads.
+
+        max_per_call:
+            Maximum number of threads borrowed by each call, e.g., half of
+            ``num_threads`` so that a long-running call never holds all
+            threads and later calls can start without waiting for it. If
+            None, calls are only limited by their share of the budget.
+    """
+    global _budget_override, _budget_max_per_call
+    if num_threads <= 0:
+        raise ValueError("'num_threads' should be positive")
+    if max_per_call is not None and max_per_call <= 0:
+        raise ValueError("'max_per_call' should be positive")
+
+    with _budget_lock:
+        previous = (_budget_override, _budget_max_per_call)
+        _budget_override = num_threads
+        _budget_max_per_call = max_per_call
+    try:
+        yield
+    finally:
+        with _budget_lock:
+            _budget_override, _budget_max_per_call = previous
+            _budget_released.notify_all()
+
+
+def _resolve_num_threads(num_threads: Optional[int]) -> int:
+    if num_threads is None:
+        return get_thread_budget()
+    return num_threads
+
+
+@contextmanager
+def _lease_threads(num_threads: Optional[int]):
+    global _budget_in_use, _budget_leases, _budget_waiting
+    if num_threads is not None:
+        yield num_threads
+        return
+
+    if getattr(_lease_holder, "active", False):
+        # A call from inside another leased call on the same thread, e.g., in
+        # a progress callback. Waiting here could deadlock if the outer call
+        # holds the rest of the budget, so it runs on the calling thread.
+        yield 1
+        return
+
+    with _budget_lock:
+        waiting = False
+        while True:
+            limit = get_thread_budget()
+            cap = _budget_max_per_call
+            if cap is None:
+                # Even share between this call and all others that are running or waiting.
+                others = _budget_leases + _budget_waiting - int(waiting)
+                cap = math.ceil(limit / (others + 1))
+            leased = min(cap, limit - _budget_in_use)
+            if leased > 0:
+                break
+            if not waiting:
+                waiting = True
+                _budget_waiting += 1
+            _budget_released.wait()
+        if waiting:
+            _budget_waiting -= 1
+        _budget_in_use += leased
+        _budget_leases += 1
+
+    _lease_holder.active = True
+    try:
+        yield leased
+    finally:
+        _lease_holder.active = False
+        with _budget_lock:
+            _budget_in_use -= leased
+            _budget_leases -= 1
+            _budget_released.notify_all()
+
+
+def _uses_thread_budget(fun):
+    # Replaces 'num_threads = None' with threads leased from the budget for
+    # the duration of the call. Nested calls receive an explicit number of
+    # threads from their caller and do not lease any more.
+    signature = inspect.signature(fun)
+
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        with _lease_threads(bound.arguments["num_threads"]) as num_threads:
+            bound.arguments["num_threads"] = num_threads
+            return fun(*bound.args, **bound.kwargs)
+
+    return wrapper
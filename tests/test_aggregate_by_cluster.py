@@ -0,0 +1,55 @@
+import numpy
+import pytest
+import scipy.sparse
+import singler
+
+
+def _reference_aggregate(test, clusters):
+    levels = sorted(set(clusters))
+    expected = numpy.ndarray((test.shape[0], len(levels)))
+    for i, lev in enumerate(levels):
+        keep = [c == lev for c in clusters]
+        expected[:, i] = test[:, keep].sum(axis=1)
+    return expected, levels
+
+
+def test_aggregate_by_cluster():
+    test = numpy.random.rand(1000, 200)
+    clusters = [str(i % 7) for i in range(200)]
+    expected, levels = _reference_aggregate(test, clusters)
+
+    output, out_levels = singler.aggregate_by_cluster(test, clusters)
+    assert out_levels == levels
+    assert numpy.allclose(output, expected)
+
+    output, _ = singler.aggregate_by_cluster(test, clusters, method="mean", num_threads=3)
+    assert numpy.allclose(output, expected / numpy.bincount([int(c) for c in clusters]))
+
+    sparse = scipy.sparse.random(1000, 200, density=0.1, format="csc")
+    expected, _ = _reference_aggregate(sparse.toarray(), clusters)
+    output, _ = singler.aggregate_by_cluster(sparse, clusters, num_threads=2)
+    assert numpy.allclose(output, expected)
+    output, _ = singler.aggregate_by_cluster(sparse.tocsr(), clusters)
+    assert numpy.allclose(output, expected)
+
+    with pytest.raises(ValueError, match="length of 'clusters'"):
+        singler.aggregate_by_cluster(test, clusters[1:])
+    with pytest.raises(ValueError, match="method"):
+        singler.aggregate_by_cluster(test, clusters, method="median")
+
+
+def test_aggregate_by_cluster_hdf5(tmp_path, monkeypatch):
+    h5py = pytest.importorskip("h5py")
+
+    test = numpy.random.rand(500, 300)
+    clusters = [i % 5 for i in range(300)]
+    expected, levels = _reference_aggregate(test, clusters)
+
+    with h5py.File(tmp_path / "data.h5", "w") as handle:
+        handle.create_dataset("test", data=test, chunks=(500, 16))
+
+    monkeypatch.setattr(singler._utils, "_READ_BLOCK_ELEMENTS", 500 * 50)
+    with h5py.File(tmp_path / "data.h5", "r") as handle:
+        output, out_levels = singler.aggregate_by_cluster(handle["test"], clusters)
+    assert out_levels == levels
+    assert numpy.allclose(output, expected)
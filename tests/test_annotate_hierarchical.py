@@ -0,0 +1,83 @@
+import numpy
+import pytest
+import singler
+
+
+def _mock_hierarchy():
+    # Four main labels, each with two or three fine labels. Each main label
+    # has its own block of low genes, and each fine label has a smaller block.
+    ngenes = 4000
+    main = []
+    fine = []
+    profiles = []
+    for m, nfine in enumerate([2, 3, 1, 2]):
+        for f in range(nfine):
+            for rep in range(3):
+                x = numpy.random.rand(ngenes) + 2
+                x[m * 1000 : m * 1000 + 500] = 0
+                x[m * 1000 + 500 + f * 150 : m * 1000 + 500 + (f + 1) * 150] = 1
+                profiles.append(x)
+                main.append("M" + str(m))
+                fine.append("M" + str(m) + "_F" + str(f))
+    return numpy.column_stack(profiles), main, fine
+
+
+def test_annotate_hierarchical():
+    ref, main, fine = _mock_hierarchy()
+    features = [str(i) for i in range(ref.shape[0])]
+
+    chosen = [0, 5, 7, 12, 19, 22, 3, 15, 21, 9]
+    test = ref[:, chosen] + numpy.random.rand(ref.shape[0], len(chosen)) * 0.1
+
+    output = singler.annotate_hierarchical(
+        test,
+        ref_data=ref,
+        ref_labels=[main, fine],
+        test_features=features,
+        ref_features=features,
+    )
+
+    assert output.shape[0] == len(chosen)
+    assert output.column("best") == [fine[c] for c in chosen]
+    levels = output.metadata["levels"]
+    assert len(levels) == 2
+    assert levels[0].column("best") == [main[c] for c in chosen]
+    assert levels[1] is output
+
+    # Main level is the same as a direct annotation.
+    direct = singler.annotate_single(
+        test, ref_data=ref, ref_labels=main, test_features=features, ref_features=features
+    )
+    assert direct.column("best") == levels[0].column("best")
+    assert numpy.allclose(direct.column("delta"), levels[0].column("delta"))
+
+    # Fine labels are only scored within the assigned main label.
+    scores = output.column("scores")
+    assert sorted(scores.column_names) == sorted(set(fine))
+    for i, c in enumerate(chosen):
+        for lab in scores.column_names:
+            considered = not numpy.isnan(scores.column(lab)[i])
+            assert considered == (lab.split("_")[0] == main[c] and main[c] != "M2")
+
+    # M2 has only one fine label, so there is no classification.
+    for i, c in enumerate(chosen):
+        assert numpy.isnan(output.column("delta")[i]) == (main[c] == "M2")
+
+
+def test_annotate_hierarchical_single_level():
+    ref, main, fine = _mock_hierarchy()
+    features = [str(i) for i in range(ref.shape[0])]
+    test = numpy.random.rand(ref.shape[0], 20)
+
+    output = singler.annotate_hierarchical(
+        test, ref_data=ref, ref_labels=[fine], test_features=features, ref_features=features
+    )
+    direct = singler.annotate_single(
+        test, ref_data=ref, ref_labels=fine, test_features=features, ref_features=features
+    )
+    assert output.column("best") == direct.column("best")
+
+    with pytest.raises(ValueError, match="same length"):
+        singler.annotate_hierarchical(
+            test, ref_data=ref, ref_labels=[main, fine[1:]], test_features=features, ref_features=features
+        )
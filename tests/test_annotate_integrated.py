@@ -1,3 +1,6 @@
+import os
+
+import pytest
 import singler
 import numpy
 
@@ -28,3 +31,105 @@ def test_annotate_integrated():
     assert set(single_results[0].column("best")) == set(labels1)
     assert set(single_results[1].column("best")) == set(labels2)
     assert set(integrated_results.column("best_reference")) == set([0, 1])
+
+
+def test_annotate_integrated_cache(tmp_path):
+    all_features = [str(i) for i in range(10000)]
+
+    ref1 = numpy.random.rand(8000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = [all_features[i] for i in range(8000)]
+
+    ref2 = numpy.random.rand(8000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = [all_features[i] for i in range(2000, 10000)]
+
+    test_features = [all_features[i] for i in range(0, 10000, 2)]
+    test = numpy.random.rand(len(test_features), 50)
+
+    cache = str(tmp_path / "integrated.npz")
+    args = dict(
+        test_features=test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        integrated_cache=cache,
+    )
+    _, first = singler.annotate_integrated(test, **args)
+    assert os.path.exists(cache)
+    mtime = os.path.getmtime(cache)
+
+    # Re-uses the cached references.
+    _, second = singler.annotate_integrated(test, **args)
+    assert os.path.getmtime(cache) == mtime
+    assert list(first.column("best_reference")) == list(second.column("best_reference"))
+    assert (first.column("delta") == second.column("delta")).all()
+
+    # Rebuilds the references if the inputs are different.
+    args["ref_data_list"] = [ref2, ref1]
+    args["ref_labels_list"] = [labels2, labels1]
+    args["ref_features_list"] = [features2, features1]
+    singler.annotate_integrated(test, **args)
+    reloaded = singler.IntegratedReferences.load(cache)
+    assert list(reloaded.reference_labels[0]) == ["z", "y", "x"]
+
+    # Other errors in loading the cache are not hidden by a rebuild.
+    with open(cache, "wb") as handle:
+        handle.write(b"not an npz file")
+    with pytest.raises(ValueError, match="pickled data"):
+        singler.annotate_integrated(test, **args)
+    with open(cache, "rb") as handle:
+        assert handle.read() == b"not an npz file"
+
+
+def test_annotate_integrated_hdf5_missing(tmp_path):
+    h5py = pytest.importorskip("h5py")
+
+    all_features = [str(i) for i in range(10000)]
+
+    ref1 = numpy.random.rand(8000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = [all_features[i] for i in range(8000)]
+
+    ref2 = numpy.random.rand(8000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = [all_features[i] for i in range(2000, 10000)]
+
+    test_features = [all_features[i] for i in range(0, 10000, 2)]
+    test = numpy.random.rand(len(test_features), 50)
+    test[::2, 0] = numpy.nan
+
+    args = dict(
+        test_features=test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+    )
+    expected_single, expected = singler.annotate_integrated(test, **args)
+
+    # Rows with NaNs are excluded from the references in the same way as for in-memory matrices.
+    with h5py.File(tmp_path / "test.h5", "w") as handle:
+        handle.create_dataset("test", data=test, chunks=(len(test_features), 7))
+    with h5py.File(tmp_path / "test.h5", "r") as handle:
+        single, output = singler.annotate_integrated(handle["test"], **args)
+
+    for x, y in zip(single, expected_single):
+        assert x.column("best") == y.column("best")
+    assert list(output.column("best_reference")) == list(expected.column("best_reference"))
+    assert numpy.allclose(output.column("delta"), expected.column("delta"))
+
+    # Caching works with the masked features.
+    args["integrated_cache"] = str(tmp_path / "integrated.npz")
+    with h5py.File(tmp_path / "test.h5", "r") as handle:
+        mtimes = []
+        for _ in range(2):
+            _, output = singler.annotate_integrated(handle["test"], **args)
+            assert list(output.column("best_reference")) == list(expected.column("best_reference"))
+            assert numpy.allclose(output.column("delta"), expected.column("delta"))
+            mtimes.append(os.path.getmtime(args["integrated_cache"]))
+        assert mtimes[0] == mtimes[1]
+
+    reloaded = singler.IntegratedReferences.load(args["integrated_cache"])
+    assert reloaded.test_features[0] is None
+    assert reloaded.test_features[1] == test_features[1]
+
@@ -59,3 +59,35 @@ def test_annotate_single_intersect():
         output.column("scores").column("B") == expected.column("scores").column("B")
     ).all()
 
+
+
+def test_annotate_single_clusters():
+    ref = numpy.random.rand(10000, 10) + 1
+    ref[:2000, :2] = 0
+    ref[2000:4000, 2:4] = 0
+    ref[4000:6000, 4:6] = 0
+    ref[6000:8000, 6:8] = 0
+    ref[8000:, 8:] = 0
+    labels = ["A", "A", "B", "B", "C", "C", "D", "D", "E", "E"]
+
+    test = numpy.random.rand(10000, 40) + 1
+    clusters = [i % 4 for i in range(40)]
+    for i, c in enumerate(clusters):
+        test[c * 2000 : (c + 1) * 2000, i] = 0
+
+    all_features = [str(i) for i in range(10000)]
+    output = singler.annotate_single(
+        test,
+        test_features=all_features,
+        ref_data=ref,
+        ref_features=all_features,
+        ref_labels=labels,
+        clusters=clusters,
+        per_cell=True,
+    )
+
+    assert output.shape[0] == 4
+    assert list(output.row_names) == ["0", "1", "2", "3"]
+    assert output.column("best") == ["A", "B", "C", "D"]
+    assert output.metadata["cell_labels"] == [["A", "B", "C", "D"][c] for c in clusters]
+    assert output.metadata["per_cell"].column("best") == output.metadata["cell_labels"]
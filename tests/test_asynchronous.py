@@ -0,0 +1,172 @@
+import asyncio
+import importlib
+
+import numpy
+import pytest
+import singler
+
+
+def test_classify_single_reference_async():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    test = numpy.random.rand(5000, 55)
+    expected = singler.classify_single_reference(test, features, built)
+
+    seen = []
+    output = asyncio.run(
+        singler.classify_single_reference_async(
+            test, features, built, chunk_size=20, progress=lambda done, total: seen.append((done, total))
+        )
+    )
+    assert seen == [(20, 55), (40, 55), (55, 55)]
+    assert output.column("best") == expected.column("best")
+    assert (output.column("delta") == expected.column("delta")).all()
+    assert (output.column("scores").column("D") == expected.column("scores").column("D")).all()
+
+    # Each chunk is written into the output buffers.
+    out = {"delta": numpy.zeros(55), "scores": numpy.zeros((5, 55))}
+    asyncio.run(singler.classify_single_reference_async(test, features, built, chunk_size=20, out=out))
+    assert (out["delta"] == expected.column("delta")).all()
+    assert (out["scores"][built.labels.index("D")] == expected.column("scores").column("D")).all()
+
+
+def test_classify_single_reference_async_cancel():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+    test = numpy.random.rand(5000, 100)
+
+    async def runner():
+        task = None
+        seen = []
+
+        def progress(done, total):
+            seen.append(done)
+            task.cancel()
+
+        task = asyncio.ensure_future(
+            singler.classify_single_reference_async(test, features, built, chunk_size=10, progress=progress)
+        )
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return seen
+
+    seen = asyncio.run(runner())
+    assert seen == [10]
+
+
+def test_annotate_integrated_async():
+    all_features = [str(i) for i in range(10000)]
+
+    ref1 = numpy.random.rand(8000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = [all_features[i] for i in range(8000)]
+
+    ref2 = numpy.random.rand(8000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = [all_features[i] for i in range(2000, 10000)]
+
+    test_features = [all_features[i] for i in range(0, 10000, 2)]
+    test = numpy.random.rand(len(test_features), 50)
+
+    args = dict(
+        test_features=test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+    )
+    expected_single, expected_integrated = singler.annotate_integrated(test, **args)
+    single, integrated = asyncio.run(singler.annotate_integrated_async(test, chunk_size=15, **args))
+
+    assert single[0].column("best") == expected_single[0].column("best")
+    assert single[1].column("best") == expected_single[1].column("best")
+    assert integrated.column("best_label") == expected_integrated.column("best_label")
+    assert (integrated.column("best_reference") == expected_integrated.column("best_reference")).all()
+    assert (integrated.column("delta") == expected_integrated.column("delta")).all()
+
+
+def test_annotate_integrated_async_hdf5_missing(tmp_path):
+    h5py = pytest.importorskip("h5py")
+
+    all_features = [str(i) for i in range(10000)]
+
+    ref1 = numpy.random.rand(8000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = [all_features[i] for i in range(8000)]
+
+    ref2 = numpy.random.rand(8000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = [all_features[i] for i in range(2000, 10000)]
+
+    test_features = [all_features[i] for i in range(0, 10000, 2)]
+    test = numpy.random.rand(len(test_features), 50)
+    test[::2, 0] = numpy.nan
+
+    args = dict(
+        test_features=test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+    )
+    expected_single, expected = singler.annotate_integrated(test, **args)
+
+    # On-disk data is masked and streamed in the same way as annotate_integrated(),
+    # and the integrated references are cached.
+    with h5py.File(tmp_path / "test.h5", "w") as handle:
+        handle.create_dataset("test", data=test, chunks=(len(test_features), 7))
+    args["integrated_cache"] = str(tmp_path / "integrated.npz")
+    with h5py.File(tmp_path / "test.h5", "r") as handle:
+        for _ in range(2):
+            single, output = asyncio.run(singler.annotate_integrated_async(handle["test"], chunk_size=15, **args))
+            for x, y in zip(single, expected_single):
+                assert x.column("best") == y.column("best")
+                assert x.metadata["unique_markers"] == y.metadata["unique_markers"]
+            assert list(output.column("best_reference")) == list(expected.column("best_reference"))
+            assert numpy.allclose(output.column("delta"), expected.column("delta"))
+
+    reloaded = singler.IntegratedReferences.load(args["integrated_cache"])
+    assert reloaded.test_features[0] is None
+
+
+def test_classify_single_reference_async_lease(monkeypatch):
+    ref = numpy.random.rand(1000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+    test = numpy.random.rand(1000, 20)
+
+    # The test data is cleaned with threads from the budget, not the whole machine.
+    module = importlib.import_module("singler.classify_single_reference")
+    original = module._clean_matrix
+    seen = []
+
+    def clean(*args, num_threads, **kwargs):
+        seen.append(num_threads)
+        return original(*args, num_threads=num_threads, **kwargs)
+
+    monkeypatch.setattr(module, "_clean_matrix", clean)
+    with singler.thread_budget(3):
+        asyncio.run(singler.classify_single_reference_async(test, features, built, chunk_size=7))
+    assert len(seen) > 0
+    assert all(n == 3 for n in seen)
+
+
+def test_annotate_single_async():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "A", "B", "B", "C", "C", "D", "D", "E", "E"]
+    features = [str(i) for i in range(5000)]
+    test = numpy.random.rand(5000, 30)
+
+    expected = singler.annotate_single(test, test_features=features, ref_data=ref, ref_features=features, ref_labels=labels)
+    output = asyncio.run(
+        singler.annotate_single_async(
+            test, test_features=features, ref_data=ref, ref_features=features, ref_labels=labels, chunk_size=7
+        )
+    )
+    assert output.column("best") == expected.column("best")
+    assert (output.column("delta") == expected.column("delta")).all()
+    assert output.metadata["unique_markers"] == expected.metadata["unique_markers"]
@@ -1,4 +1,5 @@
 import singler
+import pytest
 import numpy
 
 
@@ -43,3 +44,143 @@ def test_build_integrated_references():
     assert pintegrated.reference_names == ["FOO", "BAR"]
     assert pintegrated.reference_labels == integrated.reference_labels
     assert pintegrated.test_features == test_features
+
+
+def test_build_integrated_references_lazy():
+    all_features = [str(i) for i in range(10000)]
+    test_features = [all_features[i] for i in range(0, 10000, 2)]
+
+    refs = []
+    for i in range(4):
+        ref = numpy.random.rand(8000, 20)
+        labels = ["A", "B", "C", "D", "E"] * 4
+        features = [all_features[j] for j in range(i * 500, i * 500 + 8000)]
+        built = singler.build_single_reference(ref, labels, features, restrict_to=set(test_features))
+        refs.append((ref, labels, features, built))
+
+    args = dict(
+        ref_labels_list=[r[1] for r in refs],
+        ref_features_list=[r[2] for r in refs],
+        ref_prebuilt_list=[r[3] for r in refs],
+    )
+    integrated = singler.build_integrated_references(
+        test_features, ref_data_list=[r[0] for r in refs], **args
+    )
+
+    loaded = []
+    def loader(i):
+        def fun():
+            loaded.append(i)
+            return refs[i][0]
+        return fun
+
+    lazy = singler.build_integrated_references(
+        test_features, ref_data_list=[loader(i) for i in range(4)], **args
+    )
+    assert loaded == [0, 1, 2, 3]
+    assert lazy.reference_labels == integrated.reference_labels
+    assert (lazy.marker_subset(indices_only=True) == integrated.marker_subset(indices_only=True)).all()
+
+    # Only one full reference is held at a time, along with the marker rows.
+    full = refs[0][0].nbytes
+    assert lazy.peak_reference_bytes >= full
+    assert lazy.peak_reference_bytes < 4 * full
+
+    test = numpy.random.rand(len(test_features), 50)
+    results = [
+        singler.classify_single_reference(test, test_features, r[3])
+        for r in refs
+    ]
+    expected = singler.classify_integrated_references(test, results, integrated)
+    observed = singler.classify_integrated_references(test, results, lazy)
+    assert list(expected.column("best_reference")) == list(observed.column("best_reference"))
+    assert (expected.column("delta") == observed.column("delta")).all()
+
+
+def test_build_integrated_references_restricted():
+    all_features = [str(i) for i in range(5000)]
+    test_features = [all_features[i] for i in range(0, 5000, 3)]
+    test_set = set(test_features)
+
+    full = []
+    restricted = []
+    for i in range(2):
+        ref = numpy.random.rand(4000, 12)
+        labels = ["A", "B", "C"] * 4
+        features = all_features[i * 500 : i * 500 + 4000]
+        built = singler.build_single_reference(ref, labels, features, restrict_to=test_set)
+        full.append((ref, labels, features, built))
+
+        keep = [j for j, f in enumerate(features) if f in test_set]
+        restricted.append((ref[keep, :], labels, [features[j] for j in keep], built))
+
+    def build(refs):
+        return singler.build_integrated_references(
+            test_features,
+            ref_data_list=[r[0] for r in refs],
+            ref_labels_list=[r[1] for r in refs],
+            ref_features_list=[r[2] for r in refs],
+            ref_prebuilt_list=[r[3] for r in refs],
+        )
+
+    # Marker indices of the prebuilt references are respected when the
+    # reference data contains more features than were used for building.
+    expected = build(restricted)
+    observed = build(full)
+    assert (expected.marker_subset(indices_only=True) == observed.marker_subset(indices_only=True)).all()
+
+    test = numpy.random.rand(len(test_features), 50)
+    results = [singler.classify_single_reference(test, test_features, r[3]) for r in full]
+    eres = singler.classify_integrated_references(test, results, expected)
+    ores = singler.classify_integrated_references(test, results, observed)
+    assert (eres.column("delta") == ores.column("delta")).all()
+
+
+def test_build_integrated_references_save_load(tmp_path):
+    all_features = [str(i) for i in range(10000)]
+    test_features = [all_features[i] for i in range(0, 10000, 2)]
+
+    ref1 = numpy.random.rand(8000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = [all_features[i] for i in range(8000)]
+    built1 = singler.build_single_reference(ref1, labels1, features1, restrict_to=set(test_features))
+
+    ref2 = numpy.random.rand(8000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = [all_features[i] for i in range(2000, 10000)]
+    built2 = singler.build_single_reference(ref2, labels2, features2, restrict_to=set(test_features))
+
+    integrated = singler.build_integrated_references(
+        test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        ref_prebuilt_list=[built1, built2],
+        ref_names=["FOO", "BAR"],
+    )
+    assert integrated.key == singler.integrated_references_key(test_features, [built1, built2], ["FOO", "BAR"])
+
+    path = str(tmp_path / "integrated.npz")
+    integrated.save(path)
+    loaded = singler.IntegratedReferences.load(path, test_features, [built1, built2], ["FOO", "BAR"])
+    assert loaded.key == integrated.key
+    assert loaded.reference_names == ["FOO", "BAR"]
+    assert loaded.reference_labels == integrated.reference_labels
+    assert loaded.test_features == test_features
+    assert (loaded.marker_subset(indices_only=True) == integrated.marker_subset(indices_only=True)).all()
+
+    test = numpy.random.rand(len(test_features), 50)
+    results = [
+        singler.classify_single_reference(test, test_features, built1),
+        singler.classify_single_reference(test, test_features, built2),
+    ]
+    expected = singler.classify_integrated_references(test, results, integrated)
+    observed = singler.classify_integrated_references(test, results, loaded)
+    assert list(expected.column("best_reference")) == list(observed.column("best_reference"))
+    assert (expected.column("delta") == observed.column("delta")).all()
+
+    # Mismatched inputs are rejected.
+    with pytest.raises(singler.IntegratedReferencesMismatchError, match="different inputs"):
+        singler.IntegratedReferences.load(path, test_features[1:], [built1, built2], ["FOO", "BAR"])
+    with pytest.raises(singler.IntegratedReferencesMismatchError, match="different inputs"):
+        singler.IntegratedReferences.load(path, test_features, [built2, built1], ["FOO", "BAR"])
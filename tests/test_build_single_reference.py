@@ -1,3 +1,4 @@
+import pytest
 import singler
 import numpy
 
@@ -61,3 +62,117 @@ def test_build_single_reference_restricted():
     expected_output = singler.classify_single_reference(test, features, expected)
     assert (output.column("delta") == expected_output.column("delta")).all()
     assert output.column("best") == expected_output.column("best")
+
+
+def test_build_single_reference_restricted_prefix():
+    ref = numpy.random.rand(1000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+
+    # Retaining the first rows should not be ignored.
+    restricted = features[:600]
+    built = singler.build_single_reference(ref, labels, features, restrict_to=set(restricted))
+    expected = singler.build_single_reference(ref[:600, :], labels, restricted)
+    assert built.features == restricted
+    assert built.markers == expected.markers
+    assert built.marker_subset() == expected.marker_subset()
+
+    # Same for the removal of NaN rows at the end of the reference.
+    ref[600:, 0] = numpy.nan
+    cleaned = singler.build_single_reference(ref, labels, features)
+    assert cleaned.features == restricted
+    assert cleaned.markers == expected.markers
+
+
+def test_build_single_reference_specialize():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    markers = singler.get_classic_markers(ref, labels, features)
+    built = singler.build_single_reference(ref, labels, features, markers=markers, approximate=False)
+
+    test_features = features[::3]
+    test_set = set(test_features)
+    specialized = built.specialize(test_features)
+    assert built.specialize(features) is built
+    assert specialized.features == built.features
+    assert set(specialized.marker_subset()) == set(built.marker_subset()).intersection(test_set)
+    assert specialized.markers["A"]["B"] == [x for x in built.markers["A"]["B"] if x in test_set]
+
+    # Same as building a reference from the markers that are present.
+    expected = singler.build_single_reference(
+        ref, labels, features, markers=specialized.markers, restrict_to=test_set, approximate=False
+    )
+    assert sorted(expected.marker_subset()) == sorted(specialized.marker_subset())
+
+    test = numpy.random.rand(len(test_features), 50)
+    output = singler.classify_single_reference(test, test_features, specialized)
+    ref_output = singler.classify_single_reference(test, test_features, expected)
+    assert output.column("best") == ref_output.column("best")
+    assert numpy.allclose(output.column("delta"), ref_output.column("delta"))
+    assert numpy.allclose(output.column("scores").column("C"), ref_output.column("scores").column("C"))
+
+    # Also works during classification.
+    with pytest.raises(KeyError, match="failed to find"):
+        singler.classify_single_reference(test, test_features, built)
+    dropped = singler.classify_single_reference(test, test_features, built, drop_missing_markers=True)
+    assert dropped.column("best") == output.column("best")
+
+    ranked = singler.rank_test_matrix(test, test_features, [specialized])
+    dropped = singler.classify_single_reference(ranked, None, built, drop_missing_markers=True)
+    assert dropped.column("best") == output.column("best")
+
+    # Works with the approximate search.
+    approx = singler.build_single_reference(ref, labels, features, markers=markers)
+    output = singler.classify_single_reference(test, test_features, approx.specialize(test_features))
+    assert output.shape[0] == 50
+
+    with pytest.raises(ValueError, match="none of the markers"):
+        built.specialize(["foo", "bar"])
+
+
+def test_build_single_reference_approximate():
+    ref = numpy.random.rand(5000, 40)
+    labels = ["A", "B", "C", "D", "E"] * 8
+    features = [str(i) for i in range(ref.shape[0])]
+    markers = singler.get_classic_markers(ref, labels, features)
+    test = numpy.random.rand(5000, 50)
+
+    exact = singler.build_single_reference(ref, labels, features, markers=markers, approximate=False)
+    assert exact.approximate is False
+    assert exact.approximate_args == {}
+    expected = singler.classify_single_reference(test, features, exact)
+
+    default = singler.build_single_reference(ref, labels, features, markers=markers)
+    assert default.approximate == "annoy"
+    assert default.approximate_args == {"num_trees": 50, "search_mult": -1.0}
+
+    annoy = singler.build_single_reference(
+        ref, labels, features, markers=markers, approximate="annoy", approximate_args={"num_trees": 5, "search_mult": 20}
+    )
+    assert annoy.approximate_args == {"num_trees": 5, "search_mult": 20.0}
+
+    # A large enough search budget inspects all profiles, so the results are
+    # the same as the exact search, other than the single precision.
+    hnsw = singler.build_single_reference(
+        ref, labels, features, markers=markers, approximate="hnsw", approximate_args={"ef_search": 50}
+    )
+    assert hnsw.approximate == "hnsw"
+    assert hnsw.approximate_args == {"num_links": 16, "ef_construction": 200, "ef_search": 50}
+    for built in [annoy, hnsw]:
+        output = singler.classify_single_reference(test, features, built)
+        assert numpy.allclose(output.column("delta"), expected.column("delta"), atol=1e-4)
+
+    # Specialized references retain the same settings.
+    specialized = hnsw.specialize(features[::2])
+    assert specialized.approximate == "hnsw"
+    assert specialized.approximate_args == hnsw.approximate_args
+
+    with pytest.raises(ValueError, match="should be a boolean"):
+        singler.build_single_reference(ref, labels, features, markers=markers, approximate="foo")
+    with pytest.raises(ValueError, match="unknown argument"):
+        singler.build_single_reference(ref, labels, features, markers=markers, approximate_args={"ef_search": 10})
+    with pytest.raises(ValueError, match="positive"):
+        singler.build_single_reference(
+            ref, labels, features, markers=markers, approximate="hnsw", approximate_args={"num_links": 0}
+        )
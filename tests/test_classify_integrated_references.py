@@ -1,3 +1,6 @@
+import threading
+
+import pytest
 import singler
 import numpy
 
@@ -71,3 +74,162 @@ def test_classify_integrated_references():
     assert results.shape[0] == 50
     assert set(results.column("best_reference")) == set([0, 1])
     assert list(results.column("scores").column_names) == ['0', '1']
+
+
+def test_classify_integrated_references_hdf5(tmp_path, monkeypatch):
+    h5py = pytest.importorskip("h5py")
+
+    all_features = [str(i) for i in range(5000)]
+    test_features = all_features[::2]
+    test_set = set(test_features)
+
+    ref1 = numpy.random.rand(4000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = all_features[:4000]
+    built1 = singler.build_single_reference(ref1, labels1, features1, restrict_to=test_set)
+
+    ref2 = numpy.random.rand(4000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = all_features[1000:]
+    built2 = singler.build_single_reference(ref2, labels2, features2, restrict_to=test_set)
+
+    integrated = singler.build_integrated_references(
+        test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        ref_prebuilt_list=[built1, built2],
+    )
+
+    test = numpy.random.rand(len(test_features), 100)
+    results1 = singler.classify_single_reference(test, test_features, built1)
+    results2 = singler.classify_single_reference(test, test_features, built2)
+    expected = singler.classify_integrated_references(test, [results1, results2], integrated)
+
+    with h5py.File(tmp_path / "test.h5", "w") as handle:
+        handle.create_dataset("test", data=test, chunks=(len(test_features), 7))
+
+    monkeypatch.setattr(singler._utils, "_READ_BLOCK_ELEMENTS", len(test_features) * 30)
+    with h5py.File(tmp_path / "test.h5", "r") as handle:
+        output = singler.classify_integrated_references(handle["test"], [results1, results2], integrated)
+
+    assert (output.column("best_reference") == expected.column("best_reference")).all()
+    assert output.column("best_label") == expected.column("best_label")
+    assert numpy.allclose(output.column("delta"), expected.column("delta"))
+
+
+def test_classify_integrated_references_reuse_single_scores():
+    all_features = [str(i) for i in range(5000)]
+    test_features = all_features[::2]
+    test_set = set(test_features)
+
+    ref1 = numpy.random.rand(4000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = all_features[:4000]
+    built1 = singler.build_single_reference(ref1, labels1, features1, restrict_to=test_set)
+
+    ref2 = numpy.random.rand(4000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = all_features[1000:]
+    built2 = singler.build_single_reference(ref2, labels2, features2, restrict_to=test_set)
+
+    integrated = singler.build_integrated_references(
+        test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        ref_prebuilt_list=[built1, built2],
+        ref_names=["first", "second"],
+    )
+
+    test = numpy.random.rand(len(test_features), 50)
+    results1 = singler.classify_single_reference(test, test_features, built1)
+    results2 = singler.classify_single_reference(test, test_features, built2)
+
+    output = singler.classify_integrated_references(
+        None, [results1, results2], integrated, reuse_single_scores=True
+    )
+    assert output.shape[0] == 50
+
+    first = numpy.array([results1.column("scores").column(b)[i] for i, b in enumerate(results1.column("best"))])
+    second = numpy.array([results2.column("scores").column(b)[i] for i, b in enumerate(results2.column("best"))])
+    assert (output.column("scores").column("first") == first).all()
+    assert (output.column("scores").column("second") == second).all()
+    assert output.column("best_reference") == ["first" if f > s else "second" for f, s in zip(first, second)]
+    assert numpy.allclose(output.column("delta"), numpy.abs(first - second))
+
+    out = {"best": numpy.zeros(50, dtype=numpy.int32), "scores": numpy.zeros((2, 50)), "delta": numpy.zeros(50)}
+    output = singler.classify_integrated_references(
+        None, [results1, results2], integrated, reuse_single_scores=True, out=out
+    )
+    assert (out["scores"][0] == first).all()
+    assert (out["scores"][1] == second).all()
+    assert [["first", "second"][b] for b in out["best"]] == output.column("best_reference")
+    assert output.column("delta") is out["delta"]
+
+    test_out = {"scores": numpy.zeros((2, 50))}
+    output = singler.classify_integrated_references(test, [results1, results2], integrated, out=test_out)
+    assert (test_out["scores"][1] == output.column("scores").column("second")).all()
+
+    with pytest.raises(ValueError, match="unknown output"):
+        singler.classify_integrated_references(test, [results1, results2], integrated, out={"foo": None})
+
+    with pytest.raises(ValueError, match="should contain 'scores'"):
+        singler.classify_integrated_references(
+            None, [results1.column("best"), results2], integrated, reuse_single_scores=True
+        )
+
+
+def test_classify_integrated_references_concurrent():
+    all_features = [str(i) for i in range(5000)]
+    test_set = set(all_features)
+
+    ref1 = numpy.random.rand(4000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = all_features[:4000]
+    built1 = singler.build_single_reference(ref1, labels1, features1, restrict_to=test_set)
+
+    ref2 = numpy.random.rand(4000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = all_features[1000:]
+    built2 = singler.build_single_reference(ref2, labels2, features2, restrict_to=test_set)
+
+    integrated = singler.build_integrated_references(
+        all_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        ref_prebuilt_list=[built1, built2],
+    )
+
+    inputs = []
+    expected = []
+    for i in range(6):
+        test = numpy.random.rand(len(all_features), 40)
+        results = [
+            singler.classify_single_reference(test, all_features, built1, num_threads=1),
+            singler.classify_single_reference(test, all_features, built2, num_threads=1),
+        ]
+        inputs.append((test, results))
+        expected.append(singler.classify_integrated_references(test, results, integrated, num_threads=1))
+
+    errors = []
+    barrier = threading.Barrier(len(inputs))
+
+    def work(i):
+        try:
+            barrier.wait()
+            for it in range(5):
+                test, results = inputs[i]
+                output = singler.classify_integrated_references(test, results, integrated, num_threads=2)
+                assert output.column("best_label") == expected[i].column("best_label")
+                assert (output.column("delta") == expected[i].column("delta")).all()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(len(inputs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
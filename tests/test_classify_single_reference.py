@@ -1,3 +1,7 @@
+import os
+import threading
+
+import pytest
 import singler
 import numpy
 
@@ -62,3 +66,408 @@ def test_classify_single_reference_features():
     assert (
         output.column("scores").column("A") == unscrambled.column("scores").column("A")
     ).all()
+
+
+def test_classify_single_reference_progress():
+    ref = numpy.random.rand(2000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    test = numpy.random.rand(2000, 2500)
+    expected = singler.classify_single_reference(test, features, built)
+
+    seen = []
+    output = singler.classify_single_reference(
+        test, features, built, progress=lambda done, total: seen.append((done, total))
+    )
+    assert seen == [(1000, 2500), (2000, 2500), (2500, 2500)]
+    assert output.column("best") == expected.column("best")
+    assert (output.column("delta") == expected.column("delta")).all()
+    assert (output.column("scores").column("A") == expected.column("scores").column("A")).all()
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(RuntimeError, match="cancelled"):
+        singler.classify_single_reference(test, features, built, cancel=cancel)
+
+    def failer(done, total):
+        raise ValueError("oops")
+
+    with pytest.raises(ValueError, match="oops"):
+        singler.classify_single_reference(test, features, built, progress=failer, num_threads=2)
+
+
+def test_classify_single_reference_sparse(monkeypatch):
+    import scipy.sparse
+
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    test = scipy.sparse.random(5000, 300, density=0.2, format="csc")
+    expected = singler.classify_single_reference(test.toarray(), features, built)
+
+    # Forcing multiple blocks of cells.
+    monkeypatch.setattr(singler._utils, "_MARKER_BLOCK_ELEMENTS", built.num_markers() * 70)
+    for x in [test, test.tocsr()]:
+        seen = []
+        output = singler.classify_single_reference(
+            x, features, built, progress=lambda done, total: seen.append((done, total))
+        )
+        assert seen[-1] == (300, 300)
+        assert output.column("best") == expected.column("best")
+        assert numpy.allclose(output.column("delta"), expected.column("delta"))
+        assert numpy.allclose(output.column("scores").column("E"), expected.column("scores").column("E"))
+
+    # Rows with NaNs are removed, so markers in those rows cannot be found.
+    marker = built.features[built.marker_subset(indices_only=True)[0]]
+    test = test.tocsr()
+    test[int(marker), 0] = numpy.nan
+    with pytest.raises(KeyError, match="failed to find"):
+        singler.classify_single_reference(test, features, built)
+    with pytest.raises(KeyError, match="failed to find"):
+        singler.classify_single_reference(test.tocsc(), features, built)
+
+
+def test_classify_single_reference_hdf5(tmp_path, monkeypatch):
+    h5py = pytest.importorskip("h5py")
+
+    ref = numpy.random.rand(2000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+
+    test = numpy.random.rand(2000, 300)
+    with h5py.File(tmp_path / "data.h5", "w") as handle:
+        handle.create_dataset("ref", data=ref, chunks=(2000, 3))
+        handle.create_dataset("test", data=test, chunks=(2000, 16))
+
+    built = singler.build_single_reference(ref, labels, features)
+    expected = singler.classify_single_reference(test, features, built)
+
+    # Forcing multiple blocks to be read from file.
+    monkeypatch.setattr(singler._utils, "_READ_BLOCK_ELEMENTS", 2000 * 50)
+    with h5py.File(tmp_path / "data.h5", "r") as handle:
+        seen = []
+        output = singler.classify_single_reference(
+            handle["test"], features, built, progress=lambda done, total: seen.append((done, total))
+        )
+        assert [s[0] for s in seen] == [48, 96, 144, 192, 240, 288, 300]
+        assert output.column("best") == expected.column("best")
+        assert numpy.allclose(output.column("delta"), expected.column("delta"))
+
+        # Building directly from the file.
+        built2 = singler.build_single_reference(handle["ref"], labels, features)
+        assert built2.marker_subset() == built.marker_subset()
+
+
+def test_classify_single_reference_hdf5_missing(tmp_path):
+    h5py = pytest.importorskip("h5py")
+
+    ref = numpy.random.rand(2000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    # Missing value in a marker row.
+    test = numpy.random.rand(2000, 100)
+    test[built.marker_subset(indices_only=True)[0], 50] = numpy.nan
+    with h5py.File(tmp_path / "data.h5", "w") as handle:
+        handle.create_dataset("test", data=test, chunks=(2000, 16))
+
+    expected = singler.classify_single_reference(test, features, built, drop_missing_markers=True)
+    with h5py.File(tmp_path / "data.h5", "r") as handle:
+        output = singler.classify_single_reference(handle["test"], features, built, drop_missing_markers=True)
+        assert output.column("best") == expected.column("best")
+        assert numpy.allclose(output.column("delta"), expected.column("delta"))
+
+        # Same error as for in-memory matrices if the markers are not dropped.
+        with pytest.raises(KeyError, match="failed to find"):
+            singler.classify_single_reference(handle["test"], features, built)
+
+
+def test_classify_single_reference_tiled():
+    ref = numpy.random.rand(10000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    test = numpy.random.rand(10000, 100)
+    expected = singler.classify_single_reference(test, features, built)
+
+    ranked = singler.rank_test_matrix(test, features, [built])
+    for tile_size in [7, "auto", None]:
+        for pin_threads in [False, True]:
+            for num_threads in [1, 3]:
+                output = singler.classify_single_reference(
+                    test, features, built, tile_size=tile_size, pin_threads=pin_threads, num_threads=num_threads
+                )
+                assert output.column("best") == expected.column("best")
+                assert (output.column("delta") == expected.column("delta")).all()
+
+                output = singler.classify_single_reference(
+                    ranked, None, built, tile_size=tile_size, pin_threads=pin_threads, num_threads=num_threads
+                )
+                assert output.column("best") == expected.column("best")
+                assert (output.column("delta") == expected.column("delta")).all()
+
+    # Concurrent pinned calls are placed on different CPUs, without changing
+    # the affinity of the calling threads.
+    affinity = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    results = [None] * 4
+
+    def classify(i):
+        results[i] = singler.classify_single_reference(
+            test, features, built, tile_size=7, pin_threads=True, num_threads=2
+        )
+
+    workers = [threading.Thread(target=classify, args=(i,)) for i in range(len(results))]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    for output in results:
+        assert output.column("best") == expected.column("best")
+        assert (output.column("delta") == expected.column("delta")).all()
+    if affinity is not None:
+        assert os.sched_getaffinity(0) == affinity
+
+    # Works with progress reporting.
+    seen = []
+    output = singler.classify_single_reference(
+        test, features, built, tile_size=5, num_threads=2, progress=lambda done, total: seen.append(done)
+    )
+    assert output.column("best") == expected.column("best")
+    assert seen[-1] == 100
+
+    with pytest.raises(ValueError, match="tile_size"):
+        singler.classify_single_reference(test, features, built, tile_size=0)
+
+
+def test_classify_single_reference_cached_mapping():
+    ref = numpy.random.rand(10000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    test = numpy.random.rand(10000, 5)
+    test_features = features[::-1]
+    first = singler.classify_single_reference(test, test_features, built)
+    assert built._cached_test_rows[0] is test_features
+
+    second = singler.classify_single_reference(test, test_features, built)
+    assert first.column("best") == second.column("best")
+    assert (first.column("delta") == second.column("delta")).all()
+    assert (first.column("scores").column("A") == second.column("scores").column("A")).all()
+
+    # Modifying the features in place invalidates the cached mapping.
+    test_features.reverse()
+    expected = singler.classify_single_reference(test, list(test_features), built)
+    output = singler.classify_single_reference(test, test_features, built)
+    assert output.column("best") == expected.column("best")
+    assert (output.column("delta") == expected.column("delta")).all()
+
+    marker = built.marker_subset()[0]
+    test_features[test_features.index(marker)] = "foo"
+    with pytest.raises(KeyError, match="failed to find gene"):
+        singler.classify_single_reference(test, test_features, built)
+
+
+def test_classify_single_reference_concurrent():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    # Alternating between feature orderings to also exercise the cached marker mapping.
+    inputs = []
+    for i in range(8):
+        test = numpy.random.rand(5000, 50)
+        if i % 2:
+            inputs.append((numpy.array(test[::-1, :]), features[::-1]))
+        else:
+            inputs.append((test, features))
+    expected = [singler.classify_single_reference(test, feats, built, num_threads=1) for test, feats in inputs]
+    ranked = [singler.rank_test_matrix(test, feats, [built], num_threads=1) for test, feats in inputs]
+
+    errors = []
+    barrier = threading.Barrier(len(inputs))
+
+    def work(i):
+        try:
+            barrier.wait()
+            for it in range(5):
+                test, feats = inputs[i]
+                output = singler.classify_single_reference(test, feats, built, num_threads=2)
+                assert output.column("best") == expected[i].column("best")
+                assert (output.column("delta") == expected[i].column("delta")).all()
+                assert (output.column("scores").column("C") == expected[i].column("scores").column("C")).all()
+
+                output = singler.classify_single_reference(ranked[i], None, built, num_threads=2)
+                assert output.column("best") == expected[i].column("best")
+                assert (output.column("delta") == expected[i].column("delta")).all()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(len(inputs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_classify_single_reference_top_scores(monkeypatch):
+    import scipy.sparse
+
+    ref = numpy.random.rand(5000, 12)
+    labels = ["A", "B", "C", "D", "E", "F"] * 2
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    # Enough cells to be classified in multiple blocks.
+    test = numpy.random.rand(5000, 1500)
+    full = singler.classify_single_reference(test, features, built, num_threads=2)
+    mat = numpy.column_stack([full.column("scores").column(lab) for lab in built.labels])
+
+    output = singler.classify_single_reference(test, features, built, scores="topk", top_k=3, num_threads=2)
+    assert "scores" not in output.column_names
+    assert output.column("best") == full.column("best")
+    assert (output.column("delta") == full.column("delta")).all()
+
+    top_labels = output.column("top_labels")
+    top_scores = output.column("top_scores")
+    assert top_labels.shape == (1500, 3)
+    expected = numpy.argsort(-mat, axis=1, kind="stable")[:, :3]
+    assert (top_labels == expected).all()
+    assert (top_scores == numpy.take_along_axis(mat, expected, axis=1)).all()
+
+    # Capped at the number of labels.
+    output = singler.classify_single_reference(test[:, :10].copy(), features, built, scores="topk", top_k=100)
+    assert output.column("top_labels").shape == (10, 6)
+
+    output = singler.classify_single_reference(test, features, built, scores="none")
+    assert output.column_names.as_list() == ["best", "delta"]
+    assert output.column("best") == full.column("best")
+
+    # Same results for the ranked and sparse code paths.
+    ranked = singler.rank_test_matrix(test, features, [built])
+    output = singler.classify_single_reference(ranked, None, built, scores="topk", top_k=3)
+    assert (output.column("top_labels") == expected).all()
+    assert output.column("best") == full.column("best")
+    output = singler.classify_single_reference(ranked, None, built, scores="none")
+    assert output.column_names.as_list() == ["best", "delta"]
+
+    sparse = scipy.sparse.csc_matrix(test)
+    monkeypatch.setattr(singler._utils, "_MARKER_BLOCK_ELEMENTS", built.num_markers() * 70)
+    output = singler.classify_single_reference(sparse, features, built, scores="topk", top_k=3)
+    assert (output.column("top_labels") == expected).all()
+
+    with pytest.raises(ValueError, match="top_k"):
+        singler.classify_single_reference(test, features, built, scores="topk", top_k=0)
+    with pytest.raises(ValueError, match="scores"):
+        singler.classify_single_reference(test, features, built, scores="foo")
+
+
+def test_classify_single_reference_out(tmp_path):
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    # Writing each batch into the columns of a larger on-disk matrix.
+    test = numpy.random.rand(5000, 60)
+    expected = singler.classify_single_reference(test, features, built)
+    path = str(tmp_path / "scores.dat")
+    all_scores = numpy.memmap(path, dtype=numpy.float64, mode="w+", shape=(5, 60))
+    best = numpy.zeros(60, dtype=numpy.int32)
+    delta = numpy.zeros(60)
+
+    for start in range(0, 60, 25):
+        end = min(60, start + 25)
+        out = {"best": best[start:end], "delta": delta[start:end], "scores": all_scores[:, start:end]}
+        output = singler.classify_single_reference(numpy.ascontiguousarray(test[:, start:end]), features, built, out=out)
+        assert output.column("best") == expected.column("best")[start:end]
+        assert numpy.shares_memory(output.column("delta"), delta)
+
+    all_scores.flush()
+    on_disk = numpy.memmap(path, dtype=numpy.float64, mode="r", shape=(5, 60))
+    for i, lab in enumerate(built.labels):
+        assert numpy.allclose(on_disk[i], expected.column("scores").column(lab))
+    assert [built.labels[b] for b in best] == expected.column("best")
+    assert (delta == expected.column("delta")).all()
+
+    # Re-using buffers for the top scores.
+    out = {"top_labels": numpy.zeros((60, 2), dtype=numpy.int32), "top_scores": numpy.zeros((60, 2))}
+    output = singler.classify_single_reference(test, features, built, scores="topk", top_k=2, out=out)
+    assert output.column("top_labels") is out["top_labels"]
+    ref_output = singler.classify_single_reference(test, features, built, scores="topk", top_k=2)
+    assert (out["top_labels"] == ref_output.column("top_labels")).all()
+    assert (out["top_scores"] == ref_output.column("top_scores")).all()
+
+    with pytest.raises(ValueError, match="shape"):
+        singler.classify_single_reference(test, features, built, out={"delta": numpy.zeros(10)})
+    with pytest.raises(ValueError, match="contiguous"):
+        singler.classify_single_reference(test, features, built, out={"scores": numpy.zeros((60, 5)).T})
+    with pytest.raises(ValueError, match="unknown output"):
+        singler.classify_single_reference(test, features, built, scores="none", out={"scores": all_scores})
+
+
+def test_classify_single_reference_candidates():
+    # Each label has its own block of silent genes, so the centroids are informative.
+    nlabels = 8
+    ref = numpy.random.rand(8000, nlabels * 5) + 1
+    labels = []
+    for i in range(nlabels):
+        ref[i * 1000:(i + 1) * 1000, i * 5:(i + 1) * 5] = 0
+        labels += [str(i)] * 5
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features, approximate=False)
+
+    test = numpy.random.rand(8000, 100) + 1
+    truth = numpy.random.randint(nlabels, size=100)
+    for c, i in enumerate(truth):
+        test[i * 1000:(i + 1) * 1000, c] = 0
+
+    full = singler.classify_single_reference(test, features, built)
+    mat = numpy.column_stack([full.column("scores").column(lab) for lab in built.labels])
+
+    # Same as no prefiltering if all labels are candidates.
+    output = singler.classify_single_reference(test, features, built, num_candidates=nlabels)
+    assert output.column("best") == full.column("best")
+    assert (output.column("delta") == full.column("delta")).all()
+
+    output = singler.classify_single_reference(test, features, built, num_candidates=3)
+    assert output.column("best") == full.column("best")
+    prefiltered = numpy.column_stack([output.column("scores").column(lab) for lab in built.labels])
+    chosen = numpy.logical_not(numpy.isnan(prefiltered))
+    assert (chosen.sum(axis=1) == 3).all()
+    assert (prefiltered[chosen] == mat[chosen]).all()
+    assert chosen[numpy.arange(100), truth].all()
+
+    # Delta is computed from the candidates without fine-tuning.
+    output = singler.classify_single_reference(test, features, built, num_candidates=3, use_fine_tune=False)
+    ordered = -numpy.sort(-numpy.where(chosen, prefiltered, -numpy.inf), axis=1)
+    assert numpy.allclose(output.column("delta"), ordered[:, 0] - ordered[:, 1])
+    assert output.column("best") == [built.labels[i] for i in truth]
+
+    output = singler.classify_single_reference(test, features, built, num_candidates=1)
+    assert output.column("best") == [built.labels[i] for i in truth]
+    assert numpy.isnan(output.column("delta")).all()
+
+    # Same results for the ranked path, along with the top scores.
+    ranked = singler.rank_test_matrix(test, features, [built])
+    output = singler.classify_single_reference(ranked, None, built, num_candidates=3, scores="topk", top_k=4)
+    assert output.column("best") == full.column("best")
+    top_scores = output.column("top_scores")
+    assert numpy.isnan(top_scores[:, 3]).all()
+    expected = -numpy.sort(-numpy.where(chosen, prefiltered, -numpy.inf), axis=1)[:, :3]
+    assert (top_scores[:, :3] == expected).all()
+
+    output = singler.classify_single_reference(ranked, None, built, num_candidates=3)
+    ranked_scores = numpy.column_stack([output.column("scores").column(lab) for lab in built.labels])
+    assert numpy.array_equal(ranked_scores, prefiltered, equal_nan=True)
+
+    with pytest.raises(ValueError, match="num_candidates"):
+        singler.classify_single_reference(test, features, built, num_candidates=0)
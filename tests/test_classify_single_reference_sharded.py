@@ -0,0 +1,107 @@
+import functools
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy
+import pytest
+import scipy.sparse
+import singler
+from singler.classify_single_reference_sharded import _MAX_WORKER_REFERENCES, _get_worker_reference, _worker_references
+
+
+def _make_reference():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    return ref, labels, features
+
+
+def test_classify_single_reference_sharded():
+    ref, labels, features = _make_reference()
+    builder = functools.partial(singler.build_single_reference, ref, labels, features)
+    test = numpy.random.rand(5000, 55)
+    expected = singler.classify_single_reference(test, features, builder())
+
+    with ProcessPoolExecutor(2) as executor:
+        output = singler.classify_single_reference_sharded(test, features, builder, executor, shard_size=20)
+    assert output.shape[0] == 55
+    assert output.column("best") == expected.column("best")
+    assert numpy.allclose(output.column("delta"), expected.column("delta"))
+    assert numpy.allclose(output.column("scores").column("B"), expected.column("scores").column("B"))
+
+    # Works with other executors and sparse inputs.
+    with ThreadPoolExecutor(3) as executor:
+        output = singler.classify_single_reference_sharded(
+            scipy.sparse.csc_matrix(test), features, builder, executor, num_shards=3
+        )
+    assert output.column("best") == expected.column("best")
+    assert numpy.allclose(output.column("delta"), expected.column("delta"))
+
+    # The number of shards defaults to the number of available CPUs.
+    with ThreadPoolExecutor(3) as executor:
+        output = singler.classify_single_reference_sharded(test, features, builder, executor)
+    assert output.column("best") == expected.column("best")
+    assert len(_worker_references) == 0
+
+
+def test_classify_single_reference_sharded_worker_cache():
+    counts = {}
+
+    def builder(key):
+        counts[key] = counts.get(key, 0) + 1
+        return key
+
+    # Interleaved jobs do not evict each other's references.
+    for key in ["a", "b", "a", "b"]:
+        assert _get_worker_reference(key, functools.partial(builder, key)) == key
+    assert counts == {"a": 1, "b": 1}
+
+    # Only the most recently used references are kept.
+    for i in range(_MAX_WORKER_REFERENCES):
+        _get_worker_reference(str(i), functools.partial(builder, str(i)))
+    assert len(_worker_references) == _MAX_WORKER_REFERENCES
+    assert "a" not in _worker_references
+
+    # Building a reference does not block other jobs.
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(10)
+        return "slow"
+
+    thread = threading.Thread(target=_get_worker_reference, args=("slow", slow))
+    thread.start()
+    started.wait(10)
+    assert _get_worker_reference("fast", lambda: "fast") == "fast"
+    assert not release.is_set()
+    release.set()
+    thread.join()
+    assert _worker_references["slow"] == "slow"
+    _worker_references.clear()
+
+
+def test_classify_single_reference_sharded_worker_building(monkeypatch):
+    # The per-job lock is only discarded once the reference is cached.
+    cached_on_pop = []
+
+    class Building(dict):
+        def pop(self, key, *args):
+            cached_on_pop.append(key in _worker_references)
+            return super().pop(key, *args)
+
+    module = importlib.import_module("singler.classify_single_reference_sharded")
+    monkeypatch.setattr(module, "_worker_building", Building())
+    assert _get_worker_reference("x", lambda: "x") == "x"
+    assert cached_on_pop == [True]
+
+    def fail():
+        raise RuntimeError("failed to build")
+
+    with pytest.raises(RuntimeError, match="failed to build"):
+        _get_worker_reference("y", fail)
+    assert cached_on_pop == [True, False]
+    assert len(module._worker_building) == 0
+    _worker_references.clear()
@@ -0,0 +1,42 @@
+import numpy
+import pytest
+import singler
+
+
+def test_classify_single_reference_sweep():
+    ref = numpy.random.rand(5000, 20)
+    labels = ["A", "B", "C", "D", "E"] * 4
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    test = numpy.random.rand(5000, 100)
+    quantiles = [0.6, 0.8, 1]
+    thresholds = [0.01, 0.05, 0.5]
+    output = singler.classify_single_reference_sweep(test, features, built, quantiles, thresholds, num_threads=2)
+    assert len(output) == 9
+
+    for q in quantiles:
+        for t in thresholds:
+            expected = singler.classify_single_reference(
+                test, features, built, quantile=q, fine_tune_threshold=t, num_threads=2
+            )
+            observed = output[(q, t)]
+            assert observed.column("best") == expected.column("best")
+            assert numpy.allclose(observed.column("delta"), expected.column("delta"))
+            assert (observed.column("scores").column("C") == expected.column("scores").column("C")).all()
+
+    # Without fine-tuning, the thresholds are ignored.
+    output = singler.classify_single_reference_sweep(
+        test, features, built, quantiles, thresholds, use_fine_tune=False, scores="none"
+    )
+    expected = singler.classify_single_reference(test, features, built, quantile=0.6, use_fine_tune=False)
+    for t in thresholds:
+        observed = output[(0.6, t)]
+        assert observed.column_names.as_list() == ["best", "delta"]
+        assert observed.column("best") == expected.column("best")
+        assert numpy.allclose(observed.column("delta"), expected.column("delta"))
+
+    with pytest.raises(ValueError, match="at least one"):
+        singler.classify_single_reference_sweep(test, features, built, [])
+    with pytest.raises(ValueError, match="lie in"):
+        singler.classify_single_reference_sweep(test, features, built, [1.5])
@@ -0,0 +1,94 @@
+import numpy
+import pytest
+import singler
+from mattress import tatamize
+from singler import _core
+from singler._Markers import _Markers
+
+
+def _build():
+    ref = numpy.random.rand(2000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    return singler.build_single_reference(ref, labels, features), features
+
+
+def test_core_classify_single_reference():
+    built, features = _build()
+    test = numpy.random.rand(2000, 20)
+    expected = singler.classify_single_reference(test, features, built, num_threads=1)
+    mat = tatamize(test)
+    nl = built.num_labels()
+
+    def run(scores, best=None, delta=None):
+        best = numpy.ndarray(20, dtype=numpy.int32) if best is None else best
+        delta = numpy.ndarray(20, dtype=numpy.float64) if delta is None else delta
+        _core.classify_single_reference(
+            mat.ptr,
+            built.marker_subset(indices_only=True),
+            built._ptr,
+            quantile=0.8,
+            use_fine_tune=True,
+            fine_tune_threshold=0.05,
+            nthreads=1,
+            scores=scores,
+            best=best,
+            delta=delta,
+        )
+        return best, delta
+
+    # Scores can be a matrix, a view with contiguous rows, or a list of arrays (or None).
+    scores = numpy.ndarray((nl, 20))
+    best, delta = run(scores)
+    assert [built.labels[b] for b in best] == expected.column("best")
+    assert (delta == expected.column("delta")).all()
+    assert (scores[1] == expected.column("scores").column("B")).all()
+
+    wide = numpy.zeros((nl, 30))
+    run(wide[:, 5:25])
+    assert (wide[:, 5:25] == scores).all()
+    assert (wide[:, :5] == 0).all()
+
+    rows = [numpy.zeros(20) if l % 2 else None for l in range(nl)]
+    run(rows)
+    assert (rows[1] == scores[1]).all()
+    best, _ = run(None)
+    assert [built.labels[b] for b in best] == expected.column("best")
+
+    with pytest.raises(ValueError, match="best"):
+        run(None, best=numpy.ndarray(20, dtype=numpy.int64))
+    with pytest.raises(ValueError, match="delta"):
+        run(None, delta=numpy.ndarray(10))
+    with pytest.raises(ValueError, match="scores"):
+        run(numpy.ndarray((nl, 20))[:, ::-1])
+    with pytest.raises(ValueError, match="scores"):
+        run(rows[:-1])
+
+    frozen = numpy.ndarray(20)
+    frozen.flags.writeable = False
+    with pytest.raises(ValueError, match="read-only"):
+        run(None, delta=frozen)
+
+
+def test_core_markers():
+    built, features = _build()
+    labels = built.labels
+    markers = _Markers.from_dict(built.markers, labels, features)
+    assert markers.to_dict(labels, features) == built.markers
+
+    nl = len(labels)
+    counts = numpy.ndarray((nl, nl), dtype=numpy.int32)
+    _core.count_markers(markers._ptr, counts)
+    assert counts[0, 1] == len(built.markers[labels[0]][labels[1]])
+
+    markers.set(0, 1, [5, 3, 1])
+    assert list(markers.get(0, 1)) == [5, 3, 1]
+    markers.set(0, 1, [])
+    assert len(markers.get(0, 1)) == 0
+
+    with pytest.raises(IndexError, match="out of range"):
+        markers.get(0, nl)
+    with pytest.raises(IndexError, match="out of range"):
+        markers.set(-1, 0, [1])
+    with pytest.raises(ValueError, match="values"):
+        _core.set_markers(markers._ptr, counts, numpy.ndarray(0, dtype=numpy.int32))
@@ -0,0 +1,35 @@
+import numpy
+import pytest
+import singler
+
+
+def test_evaluate_approximate_search():
+    ref = numpy.random.rand(2000, 100)
+    labels = ["A", "B", "C", "D", "E"] * 20
+    features = [str(i) for i in range(ref.shape[0])]
+    test = numpy.random.rand(2000, 200)
+
+    settings = [
+        {},
+        {"approximate": "annoy", "approximate_args": {"num_trees": 2, "search_mult": 1}},
+        {"approximate": "hnsw", "approximate_args": {"ef_search": 100}},
+    ]
+    res = singler.evaluate_approximate_search(test, features, ref, labels, features, settings, num_cells=50)
+    assert res.shape[0] == 4
+    assert res.column("approximate") == [False, "annoy", "annoy", "hnsw"]
+    assert res.column("approximate_args")[2] == {"num_trees": 2, "search_mult": 1.0}
+    assert (res.column("build_time") > 0).all()
+    assert (res.column("classify_time") > 0).all()
+
+    recall = res.column("recall")
+    assert recall[0] == 1
+    assert ((recall >= 0) & (recall <= 1)).all()
+    assert ((res.column("agreement") >= 0) & (res.column("agreement") <= 1)).all()
+
+    # A search budget that covers all profiles is equivalent to an exact search.
+    assert recall[3] == 1
+    assert res.column("agreement")[3] == 1
+    assert res.column("score_error")[3] < 1e-4
+
+    with pytest.raises(ValueError, match="unknown argument"):
+        singler.evaluate_approximate_search(test, features, ref, labels, features, [{"foo": 1}])
@@ -1,4 +1,7 @@
+import threading
+
 import numpy
+import pytest
 import singler
 
 
@@ -108,3 +111,47 @@ def test_get_classic_markers_restricted():
 
     expected = singler.get_classic_markers(ref[keep, :], labels, restricted)
     assert markers == expected
+
+
+def test_get_classic_markers_prefix_features():
+    features = [str(i) for i in range(1000)]
+    labels = ["A", "B", "C", "D", "E"]
+
+    # The common features are the first rows of 'ref1', which should not be ignored.
+    ref1 = numpy.random.rand(1000, 5)
+    ref2 = numpy.random.rand(600, 5)
+    combined = singler.get_classic_markers([ref1, ref2], [labels, labels], [features, features[:600]])
+
+    averaged = (ref1[:600, :] + ref2) / 2
+    expected = singler.get_classic_markers(averaged, labels, features[:600])
+    assert combined == expected
+
+    restricted = singler.get_classic_markers(ref1, labels, features, restrict_to=features[:600])
+    assert restricted == singler.get_classic_markers(ref1[:600, :], labels, features[:600])
+
+
+def test_get_classic_markers_progress():
+    ref = numpy.random.rand(1000, 40)
+    labels = [str(i % 20) for i in range(40)]
+    features = [str(i) for i in range(ref.shape[0])]
+    expected = singler.get_classic_markers(ref, labels, features)
+
+    for nthreads in [1, 3]:
+        seen = []
+        markers = singler.get_classic_markers(
+            ref, labels, features, num_threads=nthreads, progress=lambda done, total: seen.append((done, total))
+        )
+        assert markers == expected
+        assert seen[-1] == (190, 190)
+        assert all(seen[i][0] < seen[i + 1][0] for i in range(len(seen) - 1))
+
+    cancel = threading.Event()
+    seen = []
+
+    def progress(done, total):
+        seen.append(done)
+        cancel.set()
+
+    with pytest.raises(RuntimeError, match="cancelled"):
+        singler.get_classic_markers(ref, labels, features, progress=progress, cancel=cancel)
+    assert len(seen) == 1
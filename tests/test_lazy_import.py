@@ -0,0 +1,37 @@
+import subprocess
+import sys
+
+import pytest
+import singler
+
+
+def test_lazy_import():
+    code = "; ".join(
+        [
+            "import sys",
+            "import singler",
+            "assert 'singler._cpphelpers' not in sys.modules",
+            "assert 'biocframe' not in sys.modules",
+            "assert 'singler.classify_single_reference' not in sys.modules",
+            "singler.classify_single_reference",
+            "assert 'singler._cpphelpers' in sys.modules",
+        ]
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_lazy_import_shadowing():
+    # Submodule imports should not replace the functions of the same name.
+    import singler.classify_single_reference
+    import singler.build_single_reference
+
+    assert callable(singler.classify_single_reference)
+    assert singler.classify_single_reference.__name__ == "classify_single_reference"
+    assert singler.build_single_reference.__name__ == "build_single_reference"
+    assert sys.modules["singler.classify_single_reference"] is not singler.classify_single_reference
+
+    assert "rank_test_matrix" in dir(singler)
+    assert isinstance(singler.__version__, str)
+
+    with pytest.raises(AttributeError):
+        singler.foobar
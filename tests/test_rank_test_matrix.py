@@ -0,0 +1,95 @@
+import numpy
+import pytest
+import scipy.sparse
+import singler
+
+
+def _build_references(test_features):
+    all_features = [str(i) for i in range(5000)]
+    test_set = set(test_features)
+
+    ref1 = numpy.random.rand(4000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = all_features[:4000]
+    built1 = singler.build_single_reference(ref1, labels1, features1, restrict_to=test_set)
+
+    ref2 = numpy.random.rand(4000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+    features2 = all_features[1000:]
+    built2 = singler.build_single_reference(ref2, labels2, features2, restrict_to=test_set)
+
+    integrated = singler.build_integrated_references(
+        test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        ref_prebuilt_list=[built1, built2],
+        ref_names=["first", "second"],
+    )
+
+    return built1, built2, integrated
+
+
+def test_rank_test_matrix():
+    test_features = [str(i) for i in range(5000)][::-1]
+    built1, built2, integrated = _build_references(test_features)
+
+    # Using integers to check that ties are handled correctly.
+    test = numpy.random.randint(0, 5, (len(test_features), 100)).astype(numpy.float64)
+    ranked = singler.rank_test_matrix(test, test_features, [built1, built2, integrated])
+    assert ranked.num_cells() == 100
+    assert len(ranked.features) <= len(test_features)
+
+    results = []
+    for built in [built1, built2]:
+        expected = singler.classify_single_reference(test, test_features, built)
+        output = singler.classify_single_reference(ranked, None, built)
+        assert output.column("best") == expected.column("best")
+        assert numpy.allclose(output.column("delta"), expected.column("delta"))
+        for lab in built.labels:
+            assert numpy.allclose(output.column("scores").column(lab), expected.column("scores").column(lab))
+
+        expected = singler.classify_single_reference(test, test_features, built, use_fine_tune=False)
+        output = singler.classify_single_reference(ranked, None, built, use_fine_tune=False)
+        assert output.column("best") == expected.column("best")
+        assert numpy.allclose(output.column("delta"), expected.column("delta"))
+        results.append(output)
+
+    expected = singler.classify_integrated_references(test, results, integrated)
+    output = singler.classify_integrated_references(ranked, results, integrated)
+    assert output.column("best_reference") == expected.column("best_reference")
+    assert output.column("best_label") == expected.column("best_label")
+    assert numpy.allclose(output.column("delta"), expected.column("delta"))
+    assert numpy.allclose(output.column("scores").column("first"), expected.column("scores").column("first"))
+
+    # Same results with sparse inputs.
+    sparse_ranked = singler.rank_test_matrix(scipy.sparse.csr_matrix(test), test_features, [built1])
+    output = singler.classify_single_reference(sparse_ranked, None, built1)
+    expected = singler.classify_single_reference(test, test_features, built1)
+    assert output.column("best") == expected.column("best")
+
+    # Fails for references that weren't used to create the ranked matrix.
+    with pytest.raises(KeyError, match="ranked test matrix"):
+        singler.classify_single_reference(sparse_ranked, None, built2)
+
+
+def test_rank_test_matrix_annotate_integrated():
+    test_features = [str(i) for i in range(5000)]
+    test = numpy.random.rand(len(test_features), 50)
+    ref1 = numpy.random.rand(4000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    ref2 = numpy.random.rand(4000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "z"]
+
+    single_results, integrated_results = singler.annotate_integrated(
+        test,
+        test_features=test_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[test_features[:4000], test_features[1000:]],
+    )
+
+    built = singler.build_single_reference(ref1, labels1, test_features[:4000])
+    expected = singler.classify_single_reference(test, test_features, built)
+    assert single_results[0].column("best") == expected.column("best")
+    assert integrated_results.shape[0] == 50
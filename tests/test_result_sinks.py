@@ -0,0 +1,216 @@
+import numpy
+import pytest
+import singler
+
+
+class _CollectingSink(singler.ResultSink):
+    def __init__(self, chunk_size):
+        super().__init__(chunk_size)
+        self.chunks = []
+        self.levels = None
+        self.closed = False
+
+    def write(self, columns, levels):
+        copied = {}
+        for k, v in columns.items():
+            if isinstance(v, dict):
+                copied[k] = {n: x.copy() for n, x in v.items()}
+            else:
+                copied[k] = v.copy()
+        self.chunks.append(copied)
+        self.levels = levels
+
+    def close(self):
+        self.closed = True
+
+    def combined(self, name, nested=None):
+        if nested is not None:
+            return numpy.concatenate([c[name][nested] for c in self.chunks])
+        return numpy.concatenate([c[name] for c in self.chunks])
+
+
+def _build_single():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    return singler.build_single_reference(ref, labels, features), features
+
+
+def test_result_sink_single():
+    import scipy.sparse
+
+    built, features = _build_single()
+    test = numpy.random.rand(5000, 100)
+    expected = singler.classify_single_reference(test, features, built)
+
+    ranked = singler.rank_test_matrix(test, features, [built])
+    for x in [test, scipy.sparse.csc_matrix(test), ranked]:
+        seen = []
+        with _CollectingSink(chunk_size=30) as sink:
+            output = singler.classify_single_reference(
+                x, features, built, sink=sink, progress=lambda done, total: seen.append((done, total))
+            )
+        assert output is None
+        assert sink.closed
+        assert [len(c["best"]) for c in sink.chunks] == [30, 30, 30, 10]
+        assert list(sink.chunks[0].keys()) == ["best", "scores", "delta"]
+        assert seen[-1] == (100, 100)
+
+        assert list(sink.levels["best"]) == built.labels
+        assert [built.labels[b] for b in sink.combined("best")] == expected.column("best")
+        assert numpy.allclose(sink.combined("delta"), expected.column("delta"))
+        assert numpy.allclose(sink.combined("scores", "C"), expected.column("scores").column("C"))
+
+    sink = _CollectingSink(chunk_size=40)
+    singler.classify_single_reference(test, features, built, sink=sink, scores="topk", top_k=2)
+    assert list(sink.chunks[0].keys()) == ["best", "top_labels", "top_scores", "delta"]
+    topk = singler.classify_single_reference(test, features, built, scores="topk", top_k=2)
+    assert (sink.combined("top_labels") == topk.column("top_labels")).all()
+    assert (sink.combined("top_scores") == topk.column("top_scores")).all()
+
+    with pytest.raises(ValueError, match="cannot both"):
+        singler.classify_single_reference(test, features, built, sink=sink, out={})
+    with pytest.raises(ValueError, match="chunk_size"):
+        _CollectingSink(chunk_size=0)
+
+
+
+def test_result_sink_single_hdf5_missing(tmp_path):
+    h5py = pytest.importorskip("h5py")
+
+    built, features = _build_single()
+    test = numpy.random.rand(5000, 100)
+    test[built.marker_subset(indices_only=True)[0], 70] = numpy.nan
+    with h5py.File(tmp_path / "data.h5", "w") as handle:
+        handle.create_dataset("test", data=test, chunks=(5000, 16))
+
+    # Missing markers are dropped for all blocks, not just the block with the NaN.
+    expected = singler.classify_single_reference(test, features, built, drop_missing_markers=True)
+    with h5py.File(tmp_path / "data.h5", "r") as handle:
+        with _CollectingSink(chunk_size=30) as sink:
+            singler.classify_single_reference(handle["test"], features, built, sink=sink, drop_missing_markers=True)
+    assert [built.labels[b] for b in sink.combined("best")] == expected.column("best")
+    assert numpy.allclose(sink.combined("delta"), expected.column("delta"))
+
+def test_result_sink_annotate_single():
+    ref = numpy.random.rand(5000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    test = numpy.random.rand(5000, 50)
+
+    expected = singler.annotate_single(test, ref, labels, test_features=features, ref_features=features)
+    sink = _CollectingSink(chunk_size=20)
+    output = singler.annotate_single(test, ref, labels, test_features=features, ref_features=features, sink=sink)
+    assert output is None
+    assert [sink.levels["best"][b] for b in sink.combined("best")] == expected.column("best")
+
+    with pytest.raises(ValueError, match="clusters"):
+        singler.annotate_single(
+            test, ref, labels, test_features=features, ref_features=features, sink=sink, clusters=[0] * 50
+        )
+
+
+def test_result_sink_integrated():
+    all_features = [str(i) for i in range(5000)]
+
+    ref1 = numpy.random.rand(4000, 10)
+    labels1 = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features1 = all_features[:4000]
+
+    ref2 = numpy.random.rand(4000, 6)
+    labels2 = ["z", "y", "x", "z", "y", "A"]
+    features2 = all_features[1000:]
+
+    test = numpy.random.rand(5000, 70)
+    args = dict(
+        test_features=all_features,
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        build_integrated_args={"ref_names": ["first", "second"]},
+    )
+    single, expected = singler.annotate_integrated(test, [ref1, ref2], **args)
+
+    sink = _CollectingSink(chunk_size=25)
+    single2, output = singler.annotate_integrated(test, [ref1, ref2], **args, sink=sink)
+    assert output is None
+    assert single2[0].column("best") == single[0].column("best")
+    assert not single2[0].has_column("scores")
+
+    levels = sink.levels
+    assert levels["best_reference"] == ["first", "second"]
+    assert sorted(levels["best_label"]) == ["A", "B", "C", "D", "E", "x", "y", "z"]
+    assert [levels["best_label"][b] for b in sink.combined("best_label")] == expected.column("best_label")
+    assert [levels["best_reference"][b] for b in sink.combined("best_reference")] == expected.column("best_reference")
+    assert numpy.allclose(sink.combined("scores", "second"), expected.column("scores").column("second"))
+    assert numpy.allclose(sink.combined("delta"), expected.column("delta"))
+
+    # Works with the full results as well.
+    built = [singler.build_single_reference(r, l, f) for r, l, f in [(ref1, labels1, features1), (ref2, labels2, features2)]]
+    integrated = singler.build_integrated_references(
+        all_features,
+        ref_data_list=[ref1, ref2],
+        ref_labels_list=[labels1, labels2],
+        ref_features_list=[features1, features2],
+        ref_prebuilt_list=built,
+    )
+    results = [singler.classify_single_reference(test, all_features, b) for b in built]
+    expected = singler.classify_integrated_references(None, results, integrated, reuse_single_scores=True)
+    sink = _CollectingSink(chunk_size=30)
+    singler.classify_integrated_references(None, results, integrated, reuse_single_scores=True, sink=sink)
+    assert "best_reference" not in sink.levels
+    assert (sink.combined("best_reference") == expected.column("best_reference")).all()
+    assert numpy.allclose(sink.combined("scores", "1"), expected.column("scores").column("1"))
+
+
+def test_result_sink_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    built, features = _build_single()
+    test = numpy.random.rand(5000, 60)
+    expected = singler.classify_single_reference(test, features, built)
+
+    path = str(tmp_path / "results.parquet")
+    with singler.ParquetResultSink(path, chunk_size=25) as sink:
+        singler.classify_single_reference(test, features, built, sink=sink)
+
+    handle = pyarrow.parquet.ParquetFile(path)
+    assert handle.metadata.num_row_groups == 3
+    table = handle.read()
+    assert table.column("best").to_pylist() == expected.column("best")
+    assert numpy.allclose(table.column("scores.A").to_numpy(), expected.column("scores").column("A"))
+    assert numpy.allclose(table.column("delta").to_numpy(), expected.column("delta"))
+
+    path = str(tmp_path / "results.arrow")
+    with singler.ArrowResultSink(path, score_layout="list", chunk_size=25) as sink:
+        singler.classify_single_reference(test, features, built, sink=sink)
+
+    with pyarrow.ipc.open_file(path) as reader:
+        assert reader.num_record_batches == 3
+        table = reader.read_all()
+    assert table.column("best").to_pylist() == expected.column("best")
+    field = table.schema.field("scores")
+    names = field.metadata[b"names"].decode("utf-8")
+    assert names == '["' + '", "'.join(built.labels) + '"]'
+    scores = numpy.array(table.column("scores").to_pylist())
+    assert numpy.allclose(scores[:, built.labels.index("E")], expected.column("scores").column("E"))
+
+
+def test_result_sink_zarr(tmp_path):
+    zarr = pytest.importorskip("zarr")
+
+    built, features = _build_single()
+    test = numpy.random.rand(5000, 60)
+    expected = singler.classify_single_reference(test, features, built)
+
+    path = str(tmp_path / "results.zarr")
+    with singler.ZarrResultSink(path, chunk_size=25) as sink:
+        singler.classify_single_reference(test, features, built, sink=sink)
+
+    group = zarr.open_group(path, mode="r")
+    levels = group["best"].attrs["levels"]
+    assert [levels[b] for b in group["best"][:]] == expected.column("best")
+    scores = group["scores"]
+    assert scores.shape == (60, 5)
+    assert numpy.allclose(scores[:, list(scores.attrs["names"]).index("B")], expected.column("scores").column("B"))
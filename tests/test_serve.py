@@ -0,0 +1,128 @@
+import importlib
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy
+import pytest
+import singler
+from singler.serve import create_server, load_references
+
+
+def _make_reference(path):
+    ref = numpy.random.rand(2000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    numpy.savez(path, data=ref, labels=numpy.array(labels), features=numpy.array(features))
+    return ref, labels, features
+
+
+def test_serve_classify(tmp_path):
+    ref, labels, features = _make_reference(tmp_path / "ref.npz")
+    references = load_references({"foo": {"path": str(tmp_path / "ref.npz")}})
+    assert references["foo"].labels == ["A", "B", "C", "D", "E"]
+
+    server = create_server(references, port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    try:
+        base = "http://127.0.0.1:" + str(server.server_address[1])
+        with urllib.request.urlopen(base + "/references") as res:
+            listing = json.loads(res.read())
+        assert listing["foo"]["labels"] == ["A", "B", "C", "D", "E"]
+
+        test = numpy.random.rand(2000, 20)
+        payload = io.BytesIO()
+        numpy.savez(payload, data=test, features=numpy.array(features))
+        req = urllib.request.Request(base + "/classify/foo", data=payload.getvalue(), method="POST")
+        with urllib.request.urlopen(req) as res:
+            output = numpy.load(io.BytesIO(res.read()))
+
+        expected = singler.classify_single_reference(test, features, references["foo"])
+        assert list(output["best"]) == expected.column("best")
+        assert numpy.allclose(output["delta"], expected.column("delta"))
+        assert list(output["labels"]) == ["A", "B", "C", "D", "E"]
+        assert numpy.allclose(output["scores"][:, 2], expected.column("scores").column("C"))
+
+        req = urllib.request.Request(base + "/classify/bar", data=payload.getvalue(), method="POST")
+        with pytest.raises(urllib.error.HTTPError, match="404"):
+            urllib.request.urlopen(req)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_serve_internal_error(tmp_path, monkeypatch):
+    ref, labels, features = _make_reference(tmp_path / "ref.npz")
+    references = load_references({"foo": {"path": str(tmp_path / "ref.npz")}})
+
+    module = importlib.import_module("singler.serve")
+    original = module.classify_single_reference
+    failures = [RuntimeError("out of memory")]
+
+    def classify(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(module, "classify_single_reference", classify)
+    server = create_server(references, port=0, quiet=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    try:
+        base = "http://127.0.0.1:" + str(server.server_address[1])
+        payload = io.BytesIO()
+        numpy.savez(payload, data=numpy.random.rand(2000, 5), features=numpy.array(features))
+        req = urllib.request.Request(base + "/classify/foo", data=payload.getvalue(), method="POST")
+        with pytest.raises(urllib.error.HTTPError, match="500") as err:
+            urllib.request.urlopen(req)
+        assert json.loads(err.value.read()) == {"error": "out of memory"}
+
+        # The server still handles later requests.
+        with urllib.request.urlopen(req) as res:
+            output = numpy.load(io.BytesIO(res.read()))
+        assert len(output["best"]) == 5
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+def test_serve_threaded(tmp_path):
+    ref, labels, features = _make_reference(tmp_path / "ref.npz")
+    references = load_references({"foo": {"path": str(tmp_path / "ref.npz")}})
+
+    server = create_server(references, port=0, quiet=True, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    try:
+        base = "http://127.0.0.1:" + str(server.server_address[1])
+        tests = [numpy.random.rand(2000, 20) for i in range(6)]
+        outputs = [None] * len(tests)
+
+        def request(i):
+            payload = io.BytesIO()
+            numpy.savez(payload, data=tests[i], features=numpy.array(features))
+            req = urllib.request.Request(base + "/classify/foo", data=payload.getvalue(), method="POST")
+            with urllib.request.urlopen(req) as res:
+                outputs[i] = numpy.load(io.BytesIO(res.read()))
+
+        clients = [threading.Thread(target=request, args=(i,)) for i in range(len(tests))]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+
+        for i, test in enumerate(tests):
+            expected = singler.classify_single_reference(test, features, references["foo"])
+            assert list(outputs[i]["best"]) == expected.column("best")
+            assert numpy.allclose(outputs[i]["delta"], expected.column("delta"))
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
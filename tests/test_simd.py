@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+import numpy
+import pytest
+import singler
+from singler import _cpphelpers as lib
+
+
+def test_simd_squared_distance():
+    available = []
+    original = singler.get_simd_instruction_set()
+    try:
+        for choice in ["scalar", "avx2", "avx512", "neon"]:
+            try:
+                singler.set_simd_instruction_set(choice)
+            except ValueError:
+                continue
+            available.append(choice)
+            assert singler.get_simd_instruction_set() == choice
+
+            # Checking all tail lengths for each vector width.
+            for n in [0, 1, 3, 4, 7, 8, 15, 16, 17, 31, 33, 100, 1001]:
+                x = numpy.random.rand(n)
+                y = numpy.random.rand(n)
+                expected = ((x - y) ** 2).sum()
+                assert numpy.isclose(lib.simd_squared_distance(n, x, y), expected)
+                assert numpy.isclose(lib.simd_dot(n, x, y), (x * y).sum())
+
+                x32 = x.astype(numpy.float32)
+                y32 = y.astype(numpy.float32)
+                assert numpy.isclose(lib.simd_squared_distance_float(n, x32, y32), expected, rtol=1e-4)
+                assert numpy.isclose(lib.simd_dot_float(n, x32, y32), (x * y).sum(), rtol=1e-4)
+    finally:
+        singler.set_simd_instruction_set(original)
+
+    assert "scalar" in available
+    assert original in available
+
+    with pytest.raises(ValueError, match="should be one of"):
+        singler.set_simd_instruction_set("foo")
+
+
+@pytest.mark.parametrize("approximate", [False, True])
+def test_simd_classification(approximate):
+    ref = numpy.random.rand(5000, 20)
+    labels = ["A", "B", "C", "D", "E"] * 4
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features, approximate=approximate)
+    test = numpy.random.rand(5000, 100)
+    expected = singler.classify_single_reference(test, features, built)
+
+    original = singler.set_simd_instruction_set("scalar")
+    try:
+        output = singler.classify_single_reference(test, features, built)
+    finally:
+        singler.set_simd_instruction_set(original)
+
+    # Annoy uses single precision, so the summation order has a larger effect.
+    tol = 1e-4 if approximate else 1e-8
+    assert numpy.allclose(output.column("delta"), expected.column("delta"), atol=tol)
+    for lab in built.labels:
+        assert numpy.allclose(output.column("scores").column(lab), expected.column("scores").column(lab), atol=tol)
+
+
+def test_simd_environment():
+    code = "import singler; print(singler.get_simd_instruction_set())"
+    env = dict(os.environ)
+    env["SINGLER_SIMD"] = "scalar"
+    res = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env)
+    assert res.stdout.strip() == "scalar"
@@ -0,0 +1,130 @@
+import threading
+
+import singler
+import numpy
+import pytest
+from singler.thread_budget import _lease_threads, _uses_thread_budget, _available_cpus
+
+
+def test_thread_budget_defaults(monkeypatch):
+    monkeypatch.delenv("SINGLER_NUM_THREADS", raising=False)
+    assert singler.get_thread_budget() == _available_cpus()
+    assert _available_cpus() >= 1
+
+    monkeypatch.setenv("SINGLER_NUM_THREADS", "7")
+    assert singler.get_thread_budget() == 7
+
+    with singler.thread_budget(3):
+        assert singler.get_thread_budget() == 3
+        with singler.thread_budget(2):
+            assert singler.get_thread_budget() == 2
+        assert singler.get_thread_budget() == 3
+    assert singler.get_thread_budget() == 7
+
+    monkeypatch.setenv("SINGLER_NUM_THREADS", "foo")
+    with pytest.raises(ValueError, match="positive integer"):
+        singler.get_thread_budget()
+
+    with pytest.raises(ValueError, match="positive"):
+        with singler.thread_budget(0):
+            pass
+
+
+def test_thread_budget_leases():
+    with singler.thread_budget(4):
+        with _lease_threads(None) as first:
+            assert first == 4
+            # Calls from inside a leased call on the same thread do not wait.
+            with _lease_threads(None) as nested:
+                assert nested == 1
+            # Explicit requests are not affected.
+            with _lease_threads(8) as third:
+                assert third == 8
+
+        with _lease_threads(None) as first:
+            assert first == 4
+
+    with singler.thread_budget(4, max_per_call=2):
+        with _lease_threads(None) as first:
+            assert first == 2
+
+    with pytest.raises(ValueError, match="positive"):
+        with singler.thread_budget(4, max_per_call=0):
+            pass
+
+    @_uses_thread_budget
+    def fun(x, num_threads=None):
+        return num_threads
+
+    with singler.thread_budget(5):
+        assert fun(1) == 5
+        assert fun(1, num_threads=2) == 2
+        assert fun(1, None) == 5
+
+
+def _start_leases(count):
+    leased = []
+    events = [(threading.Event(), threading.Event()) for _ in range(count)]
+
+    def lease(started, release):
+        with _lease_threads(None) as num_threads:
+            leased.append(num_threads)
+            started.set()
+            release.wait()
+
+    threads = [threading.Thread(target=lease, args=e) for e in events]
+    return leased, events, threads
+
+
+def test_thread_budget_concurrent_leases():
+    leased, events, threads = _start_leases(3)
+
+    with singler.thread_budget(5):
+        # A call that runs alone takes the entire budget.
+        threads[0].start()
+        assert events[0][0].wait(10)
+        assert leased == [5]
+
+        # The budget is exhausted, so the next calls wait for threads to be returned.
+        threads[1].start()
+        threads[2].start()
+        assert not events[1][0].wait(0.2)
+        assert not events[2][0].wait(0.01)
+
+        # The waiting calls then split the budget.
+        events[0][1].set()
+        assert events[1][0].wait(10)
+        assert events[2][0].wait(10)
+        assert sorted(leased[1:]) == [2, 3]
+
+        for _, release in events:
+            release.set()
+        for t in threads:
+            t.join()
+
+    leased, events, threads = _start_leases(2)
+    with singler.thread_budget(5, max_per_call=3):
+        for t, (started, _) in zip(threads, events):
+            t.start()
+            assert started.wait(10)
+        assert leased == [3, 2]
+
+        for _, release in events:
+            release.set()
+        for t in threads:
+            t.join()
+
+
+def test_thread_budget_classification():
+    ref = numpy.random.rand(10000, 10)
+    labels = ["A", "B", "C", "D", "E", "E", "D", "C", "B", "A"]
+    features = [str(i) for i in range(ref.shape[0])]
+    built = singler.build_single_reference(ref, labels, features)
+
+    test = numpy.random.rand(10000, 50)
+    expected = singler.classify_single_reference(test, features, built, num_threads=1)
+
+    with singler.thread_budget(3):
+        output = singler.classify_single_reference(test, features, built)
+    assert output.column("best") == expected.column("best")
+    assert (output.column("delta") == expected.column("delta")).all()
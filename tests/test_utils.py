@@ -3,6 +3,10 @@ from singler._utils import (
     _stable_intersect,
     _stable_union,
     _clean_matrix,
+    _restrict_features,
+    _column_chunks,
+    _subset_columns,
+    _subset_pointer,
 )
 import numpy as np
 from mattress import tatamize
@@ -121,3 +125,59 @@ def test_clean_matrix():
     assert feats == features
     assert (ptr.row(1) == out[1, :]).all()
     assert (ptr.column(2) == out[:, 2]).all()
+
+
+def test_restrict_features():
+    out = np.random.rand(20, 10)
+    features = [str(i) for i in range(out.shape[0])]
+    ptr = tatamize(out)
+
+    ptr2, feats = _restrict_features(ptr, features, None)
+    assert ptr2.ptr == ptr.ptr
+    assert feats == features
+
+    # Retaining the first rows should drop the rest.
+    for keep in [[0, 1, 2, 3, 4], [2, 5, 11], [0]]:
+        ptr2, feats = _restrict_features(ptr, features, set(features[i] for i in keep))
+        assert feats == [features[i] for i in keep]
+        assert ptr2.shape == (len(keep), 10)
+        assert (ptr2.column(3) == out[keep, 3]).all()
+
+
+def test_subset_columns():
+    out = np.random.rand(20, 10)
+    ptr = tatamize(out)
+    assert _subset_columns(ptr, 0, 10).ptr == ptr.ptr
+
+    for start, end in [(0, 1), (0, 4), (3, 7), (9, 10)]:
+        sub = _subset_columns(ptr, start, end)
+        assert sub.shape == (20, end - start)
+        assert (sub.column(0) == out[:, start]).all()
+        assert (sub.column(end - start - 1) == out[:, end - 1]).all()
+
+    assert _column_chunks(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert _column_chunks(10, None) == [(0, 10)]
+    assert _column_chunks(0, 4) == [(0, 0)]
+
+
+def test_subset_pointer():
+    out = np.random.rand(20, 10)
+    ptr = tatamize(out)
+    assert _subset_pointer(ptr, 0, range(20)).ptr == ptr.ptr
+
+    for sub in [[0], [0, 1, 2], [2, 0, 5], [5, 6, 7], []]:
+        rows = _subset_pointer(ptr, 0, sub)
+        assert rows.shape == (len(sub), 10)
+        if len(sub):
+            assert (rows.column(0) == out[sub, 0]).all()
+
+        cols = _subset_pointer(ptr, 1, sub)
+        assert cols.shape == (20, len(sub))
+        if len(sub):
+            assert (cols.row(0) == out[0, sub]).all()
+
+    # Removal of NaN rows at the end of the matrix.
+    out[15:, 0] = np.nan
+    cleaned, features = _clean_matrix(out, [str(i) for i in range(20)], assay_type=0, check_missing=True, num_threads=1)
+    assert cleaned.shape == (15, 10)
+    assert features == [str(i) for i in range(15)]